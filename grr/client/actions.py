@@ -13,12 +13,14 @@ import traceback
 import psutil
 
 from grr.client import client_utils
+from grr.client import vfs
 from grr.lib import config_lib
 from grr.lib import flags
 from grr.lib import rdfvalue
 from grr.lib import registry
 from grr.lib import utils
 from grr.lib.rdfvalues import flows as rdf_flows
+from grr.lib.rdfvalues import protodict as rdf_protodict
 
 # Our first response in the session is this:
 INITIAL_RESPONSE_ID = 1
@@ -79,6 +81,8 @@ class ActionPlugin(object):
 
   last_progress_time = 0
 
+  last_checkpoint_time = 0
+
   def __init__(self, grr_worker=None):
     """Initializes the action plugin.
 
@@ -97,6 +101,8 @@ class ActionPlugin(object):
     self.proc = psutil.Process()
     self.cpu_start = self.proc.cpu_times()
     self.cpu_limit = rdf_flows.GrrMessage().cpu_limit
+    self.cpu_charged = self.cpu_start.user + self.cpu_start.system
+    self.checkpoint = None
 
   def Execute(self, message):
     """This function parses the RDFValue from the server.
@@ -118,6 +124,13 @@ class ActionPlugin(object):
       self.priority = message.priority
       self.require_fastpoll = message.require_fastpoll
 
+    # The state of the last checkpoint if this action is resumed after the
+    # client was killed.
+    self.checkpoint = None
+    if message and message.HasField("checkpoint"):
+      self.checkpoint = message.checkpoint.state.ToDict()
+      self.response_id = message.checkpoint.response_id
+
     args = None
     try:
       if self.message.args_rdf_name:
@@ -139,13 +152,16 @@ class ActionPlugin(object):
                            self.message.name)
 
       self.cpu_start = self.proc.cpu_times()
+      self.cpu_charged = self.cpu_start.user + self.cpu_start.system
       self.cpu_limit = self.message.cpu_limit
 
       if getattr(flags.FLAGS, "debug_client_actions", False):
         pdb.set_trace()
 
       try:
-        self.Run(args)
+        # Directory listings are cached for the duration of the action.
+        with vfs.VFSCache():
+          self.Run(args)
 
       # Ensure we always add CPU usage even if an exception occurred.
       finally:
@@ -244,30 +260,30 @@ class ActionPlugin(object):
 
     self.response_id += 1
 
-  def Progress(self):
+  def Progress(self, bytes_read=0):
     """Indicate progress of the client action.
 
     This function should be called periodically during client actions that do
     not finish instantly. It will notify the nanny that the action is not stuck
     and avoid the timeout and it will also check if the action has reached its
-    cpu limit.
+    cpu limit. If the action uses more CPU or reads more than the client's
+    governor allows, it is paced here.
+
+    Args:
+      bytes_read: The number of bytes read from disk since the last call.
 
     Raises:
       CPUExceededError: CPU limit exceeded.
     """
+    self._Throttle(bytes_read)
+
     now = time.time()
     if now - self.last_progress_time <= 2:
       return
 
     self.last_progress_time = now
 
-    # Prevent the machine from sleeping while the action is running.
-    client_utils.KeepAlive()
-
-    if self.nanny_controller is None:
-      self.nanny_controller = client_utils.NannyController()
-
-    self.nanny_controller.Heartbeat()
+    self._Heartbeat()
 
     user_start = self.cpu_start.user
     system_start = self.cpu_start.system
@@ -281,6 +297,29 @@ class ActionPlugin(object):
       self.grr_worker.SendClientAlert("Cpu limit exceeded.")
       raise CPUExceededError("Action exceeded cpu limit.")
 
+  def _Heartbeat(self):
+    # Prevent the machine from sleeping while the action is running.
+    client_utils.KeepAlive()
+
+    if self.nanny_controller is None:
+      self.nanny_controller = client_utils.NannyController()
+
+    self.nanny_controller.Heartbeat()
+
+  def _Throttle(self, bytes_read):
+    """Charges the work done since the last call to the governor."""
+    governor = self.governor
+    if governor is None or not governor.enabled:
+      return
+
+    cpu_times = self.proc.cpu_times()
+    cpu_used = cpu_times.user + cpu_times.system
+    governor.Throttle(
+        cpu_seconds=cpu_used - self.cpu_charged,
+        bytes_read=bytes_read,
+        heartbeat=self._Heartbeat)
+    self.cpu_charged = cpu_used
+
   def SyncTransactionLog(self):
     """This flushes the transaction log.
 
@@ -293,6 +332,29 @@ class ActionPlugin(object):
       self.nanny_controller = client_utils.NannyController()
     self.nanny_controller.SyncTransactionLog()
 
+  def Checkpoint(self, state):
+    """Records the progress of the action in the transaction log.
+
+    Long running actions should call this periodically. If the client is
+    killed, the action is run again after the restart with self.checkpoint set
+    to the last recorded state and continues numbering its responses from
+    there, so the server sees a single stream of responses. Responses sent
+    before the checkpoint are not sent again.
+
+    Args:
+      state: A dict describing all the work done so far.
+    """
+    now = time.time()
+    if (now - self.last_checkpoint_time <
+        config_lib.CONFIG["Client.action_checkpoint_interval"]):
+      return
+
+    self.last_checkpoint_time = now
+
+    self.grr_worker.SaveCheckpoint(
+        rdf_flows.ActionCheckpoint(
+            state=rdf_protodict.Dict(state), response_id=self.response_id))
+
   def ChargeBytesToSession(self, length):
     self.grr_worker.ChargeBytesToSession(
         self.message.session_id, length, limit=self.network_bytes_limit)
@@ -310,6 +372,20 @@ class ActionPlugin(object):
     except AttributeError:
       return None
 
+  def ReplyBudgetExceeded(self):
+    """Returns True if too many replies of this action wait to be sent."""
+    try:
+      return self.grr_worker.ReplyBudgetExceeded(self.message.session_id)
+    except AttributeError:
+      return False
+
+  @property
+  def governor(self):
+    try:
+      return self.grr_worker.governor
+    except AttributeError:
+      return None
+
   @property
   def network_bytes_limit(self):
     try:
@@ -502,6 +578,19 @@ class SuspendableAction(ActionPlugin):
     self.SendReply(
         self.request.iterator, message_type=rdf_flows.GrrMessage.Type.ITERATOR)
 
+  def SendReply(self,
+                rdf_value=None,
+                message_type=rdf_flows.GrrMessage.Type.MESSAGE,
+                **kw):
+    super(SuspendableAction, self).SendReply(
+        rdf_value=rdf_value, message_type=message_type, **kw)
+
+    # Instead of waiting for the output queue to drain, control goes back to
+    # the server which resumes the action after the replies were sent.
+    if (message_type == rdf_flows.GrrMessage.Type.MESSAGE and
+        self.ReplyBudgetExceeded()):
+      self.Suspend()
+
   def Done(self):
     # Let the server know we finished.
     self.request.iterator.state = self.request.iterator.State.FINISHED
@@ -9,6 +9,8 @@ import os
 import platform
 import posix
 import stat
+import StringIO
+import time
 
 import mock
 import psutil
@@ -22,6 +24,7 @@ from grr.client.client_actions.linux import linux
 # pylint: enable=unused-import, g-bad-import-order
 
 from grr.client import actions
+from grr.client import client_governor
 from grr.lib import flags
 from grr.lib import test_lib
 from grr.lib import utils
@@ -145,6 +148,48 @@ class ActionTest(test_lib.EmptyActionTest):
     # Make sure the thread has been deleted.
     self.assertEqual(grr_worker.suspended_actions, {})
 
+  def testSuspendableActionSuspendsWhenOverReplyBudget(self):
+
+    class BackloggedWorker(worker_mocks.FakeClientWorker):
+
+      def ReplyBudgetExceeded(self, session_id):
+        return True
+
+    request = rdf_client.ListDirRequest()
+    request.pathspec.path = self.base_path
+    request.pathspec.pathtype = "OS"
+    request.iterator.number = 100
+
+    grr_worker = BackloggedWorker()
+    action = standard.SuspendableListDirectory(grr_worker=grr_worker)
+    filenames = []
+    rounds = 0
+    while request.iterator.state != request.iterator.State.FINISHED:
+      action.Execute(
+          rdf_flows.GrrMessage(
+              session_id="aff4:/flows/W:123456",
+              name="SuspendableListDirectory",
+              request_id=rounds + 1,
+              task_id=1234,
+              payload=request,
+              auth_state="AUTHENTICATED"))
+      rounds += 1
+
+      # Every reply hands control back to the server.
+      responses = [message.payload for message in grr_worker.Drain()]
+      stat_entries = [
+          r for r in responses if isinstance(r, rdf_client.StatEntry)
+      ]
+      self.assertLessEqual(len(stat_entries), 1)
+      filenames.extend(os.path.basename(r.pathspec.path) for r in stat_entries)
+
+      for response in responses:
+        if isinstance(response, rdf_client.Iterator):
+          request.iterator = response
+
+    self.assertItemsEqual(filenames, os.listdir(self.base_path))
+    self.assertGreater(rounds, len(filenames))
+
   def testSuspendableActionException(self):
 
     class TestActionWorker(actions.ClientActionWorker):
@@ -389,6 +434,43 @@ class ActionTest(test_lib.EmptyActionTest):
           action.Progress()
           self.assertEqual(instrument.call_count, expected_count)
 
+  def testReadsArePacedByGovernor(self):
+
+    class MockWorker(object):
+      governor = None
+
+    sleeps = []
+    with test_lib.FakeTime(100) as fake_time:
+      MockWorker.governor = client_governor.ResourceGovernor(
+          cpu_rate=0, read_rate=1024 * 1024, burst_time=1)
+
+      def Sleep(seconds):
+        sleeps.append(seconds)
+        fake_time.time += seconds
+
+      with utils.Stubber(time, "sleep", Sleep):
+        action = standard.HashFile(grr_worker=MockWorker())
+        _, bytes_read = action.HashFile(
+            ["md5"], StringIO.StringIO("x" * 5 * 1024 * 1024), 10**9)
+
+    self.assertEqual(bytes_read, 5 * 1024 * 1024)
+    # The first megabyte is read at full speed, the rest at the read rate.
+    self.assertAlmostEqual(sum(sleeps), 4)
+
+  def testHashingIsChargedToTheCallingAction(self):
+    charged = []
+    parent = standard.HashFile()
+    with utils.Stubber(parent, "Progress",
+                       lambda bytes_read=0: charged.append(bytes_read)):
+      _, bytes_read = standard.HashFile().HashFile(
+          ["md5"],
+          StringIO.StringIO("x" * 1024),
+          10**9,
+          progress=parent.Progress)
+
+    self.assertEqual(bytes_read, 1024)
+    self.assertEqual(sum(charged), 1024)
+
 
 class ActionTestLoader(test_lib.GRRTestLoader):
   base_class = test_lib.EmptyActionTest
@@ -54,7 +54,7 @@ class RecursiveComponent(Component):
     if not relative_components:
       yield new_base
     try:
-      filenames = os.listdir(new_base)
+      filenames = sorted(os.listdir(new_base))
     except OSError as e:
       if e.errno == errno.EACCES:  # permission denied.
         logging.info(e)
@@ -91,7 +91,7 @@ class RegexComponent(Component):
 
   def Generate(self, base_path):
     try:
-      for f in os.listdir(base_path):
+      for f in sorted(os.listdir(base_path)):
         if self.regex.match(f):
           yield f
     except OSError as e:
@@ -150,7 +150,15 @@ class FileFinderOS(actions.ActionPlugin):
       # Never stop at any device boundary.
       self.mountpoints_blacklist = set()
 
-    for fname in self.CollectGlobs(args.paths):
+    # The last file handled before the client was killed, the walk continues
+    # right after it.
+    last_path = ""
+    if self.checkpoint:
+      last_path = utils.SmartStr(self.checkpoint["last_path"])
+
+    for fname in self.CollectGlobsAfter(args.paths, last_path):
+      self.Checkpoint({"last_path": last_path})
+      last_path = fname
       self.Progress()
       self.conditions = self.ParseConditions(args)
 
@@ -255,8 +263,12 @@ class FileFinderOS(actions.ActionPlugin):
       return
 
     with file_obj:
+      # The hashing is charged to this action.
       hashers, bytes_read = standard_actions.HashFile().HashFile(
-          ["md5", "sha1", "sha256"], file_obj, max_hash_size)
+          ["md5", "sha1", "sha256"],
+          file_obj,
+          max_hash_size,
+          progress=self.Progress)
     result = rdf_crypto.Hash(**dict((k, v.digest())
                                     for k, v in hashers.iteritems()))
     result.num_bytes = bytes_read
@@ -277,11 +289,38 @@ class FileFinderOS(actions.ActionPlugin):
         for component in self._ConvertGlobIntoPathComponents(glob):
           node = node.setdefault(component, {})
 
-    for initial_component in component_tree:
+    # Directories are listed in sorted order and components are visited in a
+    # fixed order, so the walk always yields files in the same order.
+    for initial_component in sorted(component_tree):
       for f in self._TraverseComponentTree(component_tree[initial_component],
                                            initial_component):
         yield f
 
+  def CollectGlobsAfter(self, globs, last_path):
+    """Collects globs, skipping all files up to and including last_path.
+
+    Args:
+      globs: The globs to collect.
+      last_path: The last file handled by a previous walk. If it does not exist
+        anymore, all files are collected again.
+
+    Yields:
+      The file names which come after last_path in the walk.
+    """
+    if last_path:
+      found = False
+      for f in self.CollectGlobs(globs):
+        if found:
+          yield f
+        elif f == last_path:
+          found = True
+
+      if found:
+        return
+
+    for f in self.CollectGlobs(globs):
+      yield f
+
   def _SplitInitialPathComponent(self, path):
     r"""Splits off the initial component of the given path.
 
@@ -311,7 +350,8 @@ class FileFinderOS(actions.ActionPlugin):
 
   def _TraverseComponentTree(self, component_tree, base_path):
 
-    for component, subtree in component_tree.iteritems():
+    for component, subtree in sorted(
+        component_tree.iteritems(), key=lambda item: str(item[0])):
       for f in component.Generate(base_path):
         if subtree:
           for res in self._TraverseComponentTree(subtree,
@@ -455,6 +495,7 @@ class FileFinderOS(actions.ActionPlugin):
 
     overlap = fd.read(min(self.OVERLAP_SIZE, to_read))
     to_read -= len(overlap)
+    self.Progress(bytes_read=len(overlap))
 
     yield overlap
 
@@ -463,6 +504,7 @@ class FileFinderOS(actions.ActionPlugin):
       if not data:
         return
       to_read -= len(data)
+      self.Progress(bytes_read=len(data))
 
       combined_data = overlap + data
       yield combined_data
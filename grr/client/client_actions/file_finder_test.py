@@ -63,7 +63,7 @@ class FileFinderTest(test_lib.EmptyActionTest):
     paths = [self.base_path + "/*"]
     results = self._RunFileFinder(paths, self.stat_action)
     self.assertEqual(
-        self._GetRelativeResults(results), os.listdir(self.base_path))
+        self._GetRelativeResults(results), sorted(os.listdir(self.base_path)))
 
     profiles_path = os.path.join(self.base_path, "profiles/v1.0")
     paths = [os.path.join(self.base_path, "profiles/v1.0") + "/*"]
@@ -71,7 +71,36 @@ class FileFinderTest(test_lib.EmptyActionTest):
     self.assertEqual(
         self._GetRelativeResults(
             results, base_path=profiles_path),
-        os.listdir(profiles_path))
+        sorted(os.listdir(profiles_path)))
+
+  def _ResumeFileFinder(self, paths, last_path):
+    self.results = []
+    action = self._GetActionInstance(client_file_finder.FileFinderOS)
+    action.checkpoint = {"last_path": last_path}
+    action.Run(
+        rdf_file_finder.FileFinderArgs(
+            paths=paths,
+            action=self.stat_action,
+            process_non_regular_files=True,
+            follow_links=True))
+    return self._GetRelativeResults(self.results)
+
+  def testResumeContinuesAfterLastPath(self):
+    paths = [self.base_path + "/**2"]
+    expected = self._GetRelativeResults(
+        self._RunFileFinder(paths, self.stat_action))
+
+    self.assertGreater(len(expected), 10)
+    last_path = os.path.join(self.base_path, expected[9])
+    self.assertEqual(self._ResumeFileFinder(paths, last_path), expected[10:])
+
+  def testResumeAfterVanishedPathRestartsWalk(self):
+    paths = [self.base_path + "/*"]
+    expected = self._GetRelativeResults(
+        self._RunFileFinder(paths, self.stat_action))
+
+    last_path = os.path.join(self.base_path, "does_not_exist")
+    self.assertEqual(self._ResumeFileFinder(paths, last_path), expected)
 
   def testRecursiveGlob(self):
     paths = [self.base_path + "/**3"]
@@ -196,6 +196,12 @@ class Find(actions.IteratedAction):
         logging.debug("Processed %s entries, quitting", count)
         return
 
+      # Too many hits are waiting to be sent, the server resumes us once they
+      # were.
+      if self.ReplyBudgetExceeded():
+        logging.debug("Reply budget exceeded after %s entries", count)
+        return
+
     # End this iterator
     request.iterator.state = rdf_client.Iterator.State.FINISHED
 
@@ -359,7 +365,7 @@ class Grep(actions.ActionPlugin):
           self.SendReply(offset=0, data=msg, length=len(msg))
           return
 
-      self.Progress()
+      self.Progress(bytes_read=len(read_data))
 
       base_offset += data_size
 
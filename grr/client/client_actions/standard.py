@@ -128,7 +128,23 @@ class HashFile(actions.ActionPlugin):
       "sha256": hashlib.sha256,
   }
 
-  def HashFile(self, hash_types, file_obj, max_length):
+  def HashFile(self, hash_types, file_obj, max_length, progress=None):
+    """Hashes up to max_length bytes of file_obj.
+
+    Args:
+      hash_types: Names of the hashes to compute.
+      file_obj: The file like object to read.
+      max_length: The maximum number of bytes to read.
+      progress: Called with the bytes_read of every chunk. Actions which hash
+        files for themselves pass their own Progress, so the work is charged
+        to them. Defaults to the Progress of this action.
+
+    Returns:
+      A tuple of a dict of hashers by name and the number of bytes read.
+    """
+    if progress is None:
+      progress = self.Progress
+
     hashers = {}
     for hash_type in hash_types:
       hashers[hash_type] = self._hash_types[hash_type]()
@@ -136,7 +152,6 @@ class HashFile(actions.ActionPlugin):
     # Only read as many bytes as we were told.
     bytes_read = 0
     while bytes_read < max_length:
-      self.Progress()
       to_read = min(constants.CLIENT_MAX_BUFFER_SIZE, max_length - bytes_read)
       data = file_obj.read(to_read)
       if not data:
@@ -145,6 +160,7 @@ class HashFile(actions.ActionPlugin):
         hasher.update(data)
 
       bytes_read += len(data)
+      progress(bytes_read=len(data))
 
     return hashers, bytes_read
 
@@ -196,7 +212,7 @@ class CopyPathToFile(actions.ActionPlugin):
       written += len(data)
 
       # Send heartbeats for long files.
-      self.Progress()
+      self.Progress(bytes_read=len(data))
     return written
 
   def Run(self, args):
@@ -684,7 +700,7 @@ class SendFile(actions.ActionPlugin):
 
       self.Send(s, streaming_encryptor.Update(data))
       # Send heartbeats for long files.
-      self.Progress()
+      self.Progress(bytes_read=len(data))
 
     self.Send(s, streaming_encryptor.Finalize())
     s.close()
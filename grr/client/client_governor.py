@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+"""Pacing of the CPU and disk usage of client actions.
+
+Client actions report the CPU time they used and the bytes they read through
+ActionPlugin.Progress(). The governor charges these to a token bucket per
+resource which refills at the configured rate, and when a bucket runs dry the
+action sleeps until the debt is paid off. Long running actions are therefore
+slowed down to the configured rates instead of running flat out or being
+aborted.
+
+The CPU and I/O samples of the ClientStatsCollector are fed back to the
+governor. They cover everything the client process does, so when the client
+uses more than the configured rates in total the actions get less, and when
+the load goes down again their rates recover.
+"""
+
+
+import threading
+import time
+
+from grr.lib import config_lib
+
+
+class TokenBucket(object):
+  """A token bucket which may go into debt."""
+
+  def __init__(self, rate, burst):
+    """Constructor.
+
+    Args:
+      rate: The number of tokens added per second.
+      burst: The maximum number of tokens the bucket holds.
+    """
+    self.rate = float(rate)
+    self.burst = float(burst)
+    self.tokens = self.burst
+    self.last_refill = time.time()
+
+  def Consume(self, amount):
+    """Takes tokens from the bucket.
+
+    Args:
+      amount: The number of tokens to take. This is work which was already
+        done, so the tokens are taken even if there are not enough.
+
+    Returns:
+      The number of seconds until the bucket is out of debt again.
+    """
+    now = time.time()
+    # The clock might have been set back.
+    elapsed = max(0, now - self.last_refill)
+    self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+    self.last_refill = now
+
+    self.tokens -= amount
+    if self.tokens >= 0:
+      return 0
+    return -self.tokens / self.rate
+
+
+class ResourceGovernor(object):
+  """Paces client actions to the configured CPU and read rates."""
+
+  # Actions are never slowed down to less than this share of the configured
+  # rates, even if the rest of the client uses more.
+  MIN_RATE_FRACTION = 0.1
+
+  # The share of the configured rates by which the rates recover per sample
+  # after the client's load went down.
+  RECOVERY_STEP = 0.1
+
+  # Throttled actions sleep in steps of at most this many seconds so they can
+  # keep sending heartbeats to the nanny.
+  MAX_SLEEP = 1.0
+
+  def __init__(self, cpu_rate=None, read_rate=None, burst_time=None):
+    """Constructor.
+
+    Args:
+      cpu_rate: The share of a CPU core actions may use, 0 disables CPU
+        pacing. Defaults to Client.action_cpu_rate.
+      read_rate: The bytes per second actions may read, 0 disables I/O
+        pacing. Defaults to Client.action_read_rate.
+      burst_time: The number of seconds worth of their rates actions may use
+        at full speed. Defaults to Client.action_burst_time.
+    """
+    if cpu_rate is None:
+      cpu_rate = config_lib.CONFIG["Client.action_cpu_rate"]
+    if read_rate is None:
+      read_rate = config_lib.CONFIG["Client.action_read_rate"]
+    if burst_time is None:
+      burst_time = config_lib.CONFIG["Client.action_burst_time"]
+
+    self.cpu_rate = cpu_rate
+    self.read_rate = read_rate
+
+    self.cpu_bucket = None
+    if cpu_rate:
+      self.cpu_bucket = TokenBucket(cpu_rate, cpu_rate * burst_time)
+
+    self.read_bucket = None
+    if read_rate:
+      self.read_bucket = TokenBucket(read_rate, read_rate * burst_time)
+
+    self.lock = threading.Lock()
+
+  @property
+  def enabled(self):
+    return self.cpu_bucket is not None or self.read_bucket is not None
+
+  def Charge(self, cpu_seconds=0, bytes_read=0):
+    """Charges work done by an action.
+
+    Args:
+      cpu_seconds: The CPU time the action used since it was last charged.
+      bytes_read: The bytes the action read since it was last charged.
+
+    Returns:
+      The number of seconds the action has to wait before it continues.
+    """
+    delay = 0
+    with self.lock:
+      if self.cpu_bucket:
+        delay = max(delay, self.cpu_bucket.Consume(cpu_seconds))
+      if self.read_bucket:
+        delay = max(delay, self.read_bucket.Consume(bytes_read))
+
+    return delay
+
+  def Throttle(self, cpu_seconds=0, bytes_read=0, heartbeat=None):
+    """Charges work done by an action and waits as long as necessary.
+
+    Args:
+      cpu_seconds: The CPU time the action used since it was last charged.
+      bytes_read: The bytes the action read since it was last charged.
+      heartbeat: Called periodically while waiting.
+
+    Returns:
+      The number of seconds waited.
+    """
+    delay = self.Charge(cpu_seconds=cpu_seconds, bytes_read=bytes_read)
+
+    remaining = delay
+    while remaining > 0:
+      sleep_time = min(remaining, self.MAX_SLEEP)
+      time.sleep(sleep_time)
+      remaining -= sleep_time
+
+      if heartbeat:
+        heartbeat()
+
+    return delay
+
+  def _AdjustRate(self, bucket, rate, used):
+    if used > rate:
+      # The client as a whole uses too much, the actions get less.
+      bucket.rate = max(rate * self.MIN_RATE_FRACTION,
+                        bucket.rate * rate / used)
+    else:
+      bucket.rate = min(rate, bucket.rate + rate * self.RECOVERY_STEP)
+
+  def Adjust(self, cpu_samples, io_samples):
+    """Adjusts the rates to the measured usage of the client.
+
+    Args:
+      cpu_samples: The cpu_samples of a ClientStatsCollector.
+      io_samples: The io_samples of a ClientStatsCollector.
+    """
+    with self.lock:
+      if self.cpu_bucket and cpu_samples:
+        _, _, _, percent = cpu_samples[-1]
+        self._AdjustRate(self.cpu_bucket, self.cpu_rate, percent / 100.0)
+
+      if self.read_bucket and len(io_samples) >= 2:
+        (start, start_bytes, _), (end, end_bytes, _) = io_samples[-2:]
+        seconds = (
+            end.AsMicroSecondsFromEpoch() - start.AsMicroSecondsFromEpoch()
+        ) / 1e6
+        if seconds > 0:
+          self._AdjustRate(self.read_bucket, self.read_rate,
+                           (end_bytes - start_bytes) / seconds)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""Tests for grr.client.client_governor."""
+
+
+import time
+
+from grr.client import client_governor
+from grr.lib import flags
+from grr.lib import rdfvalue
+from grr.lib import test_lib
+from grr.lib import utils
+
+
+class ResourceGovernorTest(test_lib.GRRBaseTest):
+
+  def setUp(self):
+    super(ResourceGovernorTest, self).setUp()
+    self.fake_time = test_lib.FakeTime(1000)
+    self.fake_time.__enter__()
+    self.sleeps = []
+    self.sleep_stubber = utils.Stubber(time, "sleep", self.Sleep)
+    self.sleep_stubber.Start()
+
+  def tearDown(self):
+    self.sleep_stubber.Stop()
+    self.fake_time.__exit__(None, None, None)
+    super(ResourceGovernorTest, self).tearDown()
+
+  def Sleep(self, seconds):
+    self.sleeps.append(seconds)
+    self.fake_time.time += seconds
+
+  def _RunWorkload(self, governor, seconds, **charges):
+    """Simulates an action working flat out for the given number of seconds.
+
+    Args:
+      governor: The ResourceGovernor pacing the action.
+      seconds: The number of seconds of work the action does.
+      **charges: The work done per second of running.
+
+    Returns:
+      The number of seconds the action took.
+    """
+    start = time.time()
+    for _ in range(int(seconds * 10)):
+      self.fake_time.time += 0.1
+      governor.Throttle(
+          **dict((k, v / 10.0) for k, v in charges.iteritems()))
+
+    return time.time() - start
+
+  def testTokenBucket(self):
+    bucket = client_governor.TokenBucket(10, 20)
+    self.assertEqual(bucket.Consume(15), 0)
+    self.assertEqual(bucket.Consume(10), 0.5)
+
+    self.fake_time.time += 0.5
+    self.assertEqual(bucket.Consume(0), 0)
+
+    # The bucket never holds more than the burst.
+    self.fake_time.time += 100
+    self.assertEqual(bucket.Consume(20), 0)
+    self.assertEqual(bucket.Consume(1), 0.1)
+
+  def testDisabledGovernorDoesNotWait(self):
+    governor = client_governor.ResourceGovernor(
+        cpu_rate=0, read_rate=0, burst_time=1)
+    self.assertFalse(governor.enabled)
+
+    self.assertAlmostEqual(
+        self._RunWorkload(governor, 10, cpu_seconds=1, bytes_read=10**9), 10)
+    self.assertEqual(self.sleeps, [])
+
+  def testCPUIsPaced(self):
+    governor = client_governor.ResourceGovernor(
+        cpu_rate=0.25, read_rate=0, burst_time=4)
+
+    # The burst of one CPU second is used up after about a second, from then
+    # on the action only runs a quarter of the time.
+    duration = self._RunWorkload(governor, 20, cpu_seconds=1)
+    self.assertAlmostEqual(duration, 76, delta=1)
+
+    # The action never sleeps longer than MAX_SLEEP at once.
+    self.assertLessEqual(max(self.sleeps), governor.MAX_SLEEP)
+
+  def testReadsArePaced(self):
+    governor = client_governor.ResourceGovernor(
+        cpu_rate=0, read_rate=1024 * 1024, burst_time=1)
+
+    duration = self._RunWorkload(
+        governor, 10, bytes_read=10 * 1024 * 1024, cpu_seconds=1)
+    self.assertAlmostEqual(duration, 99, delta=1)
+
+  def testHeartbeatIsSentWhileWaiting(self):
+    governor = client_governor.ResourceGovernor(
+        cpu_rate=1, read_rate=0, burst_time=1)
+
+    heartbeats = []
+    waited = governor.Throttle(
+        cpu_seconds=6, heartbeat=lambda: heartbeats.append(time.time()))
+
+    self.assertEqual(waited, 5)
+    self.assertEqual(len(heartbeats), 5)
+
+  def _Samples(self, cpu_percent, bytes_per_second):
+    now = rdfvalue.RDFDatetime().FromSecondsFromEpoch(1000)
+    earlier = rdfvalue.RDFDatetime().FromSecondsFromEpoch(990)
+    cpu_samples = [(now, 0, 0, cpu_percent)]
+    io_samples = [(earlier, 0, 0), (now, bytes_per_second * 10, 0)]
+    return cpu_samples, io_samples
+
+  def testRatesAreAdjustedToMeasuredUsage(self):
+    governor = client_governor.ResourceGovernor(
+        cpu_rate=0.5, read_rate=1000, burst_time=1)
+
+    # The client uses twice as much as configured.
+    governor.Adjust(*self._Samples(100, 2000))
+    self.assertEqual(governor.cpu_bucket.rate, 0.25)
+    self.assertEqual(governor.read_bucket.rate, 500)
+
+    # The rates never drop below MIN_RATE_FRACTION.
+    for _ in range(10):
+      governor.Adjust(*self._Samples(400, 8000))
+    self.assertAlmostEqual(governor.cpu_bucket.rate, 0.05)
+    self.assertAlmostEqual(governor.read_bucket.rate, 100)
+
+    # Once the load is down the rates recover step by step.
+    governor.Adjust(*self._Samples(10, 0))
+    self.assertAlmostEqual(governor.cpu_bucket.rate, 0.1)
+    self.assertAlmostEqual(governor.read_bucket.rate, 200)
+
+    for _ in range(20):
+      governor.Adjust(*self._Samples(10, 0))
+    self.assertEqual(governor.cpu_bucket.rate, 0.5)
+    self.assertEqual(governor.read_bucket.rate, 1000)
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
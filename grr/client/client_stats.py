@@ -37,6 +37,10 @@ class ClientStatsCollector(threading.Thread):
       time.sleep(self.sleep_time)
 
       self.Collect()
+      # The samples include the work the client does besides the actions, the
+      # governor slows the actions down when the client uses too much overall.
+      if self.worker.governor:
+        self.worker.governor.Adjust(self.cpu_samples, self.io_samples)
       # Let the worker check if it should send back the stats.
       self.worker.CheckStats()
 
@@ -2,6 +2,8 @@
 """Tests for the client."""
 
 
+import threading
+import time
 
 # Need to import client to add the flags.
 from grr.client import actions
@@ -181,6 +183,83 @@ class BasicContextTests(test_lib.GRRBaseTest):
       result.append(item)
     self.assertEqual(result, ["C"] * 10 + ["A", "B"] * 10)
 
+  def testSizeQueueFullWakesSender(self):
+    woken = threading.Event()
+    queue = comms.SizeQueue(maxsize=10, full_callback=woken.set)
+    queue.Put("A" * 10)
+
+    put_done = threading.Event()
+
+    def Put():
+      queue.Put("B")
+      put_done.set()
+
+    thread = threading.Thread(target=Put)
+    thread.start()
+
+    # The sender is asked to drain the queue and the blocked Put() continues as
+    # soon as it does.
+    self.assertTrue(woken.wait(5))
+    start = time.time()
+    self.assertEqual(list(queue.Get()), ["A" * 10])
+    self.assertTrue(put_done.wait(5))
+    self.assertLess(time.time() - start, 0.9)
+    thread.join()
+
+    self.assertEqual(list(queue.Get()), ["B"])
+
+
+class TimerTest(test_lib.GRRBaseTest):
+  """Tests the client poll timer."""
+
+  def testWakeEndsWait(self):
+    timer = comms.Timer()
+    timer.SlowPoll()
+    timer.Wake()
+
+    start = time.time()
+    timer.Wait()
+    self.assertLess(time.time() - start, 1)
+
+  def testBacklogPacesPollsByRoundTripTime(self):
+    timer = comms.Timer()
+    timer.SlowPoll()
+    timer.RecordPost(2.0, 1000)
+    timer.Backlog()
+    self.assertEqual(timer.sleep_time, 2.0)
+
+    # A fast round trip never polls faster than poll_min.
+    timer = comms.Timer()
+    timer.RecordPost(0.001, 1000)
+    timer.Backlog()
+    self.assertEqual(timer.sleep_time, timer.poll_min)
+
+    # Backlog never slows down fast polling.
+    timer = comms.Timer()
+    timer.FastPoll()
+    timer.RecordPost(5.0, 1000)
+    timer.Backlog()
+    self.assertEqual(timer.sleep_time, timer.poll_min)
+
+  def testPostSizeFollowsThroughput(self):
+    timer = comms.Timer()
+    max_post_size = 40 * 1024 * 1024
+    self.assertEqual(timer.PostSize(max_post_size), max_post_size)
+
+    # Small posts do not measure throughput.
+    timer.RecordPost(1.0, 1000)
+    self.assertEqual(timer.PostSize(max_post_size), max_post_size)
+
+    # 100kb/s means 1mb posts.
+    timer.RecordPost(10.0, 1000 * 1000)
+    self.assertEqual(
+        timer.PostSize(max_post_size), 100 * 1000 * timer.TARGET_POST_DURATION)
+
+    # Very slow links still make reasonably large posts.
+    timer = comms.Timer()
+    timer.RecordPost(100.0, 100 * 1000)
+    self.assertEqual(timer.PostSize(max_post_size), timer.MIN_POST_SIZE)
+
 
 def main(argv):
   test_lib.main(argv)
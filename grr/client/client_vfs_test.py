@@ -658,6 +658,99 @@ class VFSTest(test_lib.GRRBaseTest):
     ])
 
 
+class VFSCacheTest(test_lib.GRRBaseTest):
+  """Tests caching of directory listings while an action runs."""
+
+  def setUp(self):
+    super(VFSCacheTest, self).setUp()
+    self.tree = os.path.join(self.temp_dir, "Tree")
+    os.makedirs(os.path.join(self.tree, "Sub", "Dir"))
+    with open(os.path.join(self.tree, "Sub", "Dir", "File.txt"), "wb") as fd:
+      fd.write("hello")
+
+    self.listed = []
+    original_listdir = os.listdir
+
+    def CountingListDir(path):
+      self.listed.append(path)
+      return original_listdir(path)
+
+    self.listdir_stubber = utils.Stubber(os, "listdir", CountingListDir)
+    self.listdir_stubber.Start()
+
+  def tearDown(self):
+    self.listdir_stubber.Stop()
+    super(VFSCacheTest, self).tearDown()
+
+  def _Open(self, path):
+    return vfs.VFSOpen(
+        rdf_paths.PathSpec(
+            path=os.path.join(self.tree, path),
+            pathtype=rdf_paths.PathSpec.PathType.OS))
+
+  def testListingsAreCached(self):
+    with vfs.VFSCache() as cache:
+      fd = self._Open("sub/dir/FILE.TXT")
+      self.assertEqual(fd.Read(100), "hello")
+      self.assertEqual(os.path.basename(fd.pathspec.last.path), "File.txt")
+      listed = len(self.listed)
+      self.assertGreater(listed, 0)
+
+      fd = self._Open("SUB/DIR/file.txt")
+      self.assertEqual(fd.Read(100), "hello")
+      self.assertEqual(len(self.listed), listed)
+      self.assertGreater(cache.hits, 0)
+
+    # The cache is gone with the action.
+    self.assertIsNone(vfs.GetVFSCache())
+    self._Open("sub/dir/FILE.TXT")
+    self.assertGreater(len(self.listed), listed)
+
+  def testWithoutCacheDirectoriesAreListedEachTime(self):
+    self._Open("sub/dir/FILE.TXT")
+    listed = len(self.listed)
+    self._Open("sub/dir/FILE.TXT")
+    self.assertEqual(len(self.listed), 2 * listed)
+
+  def testChangedDirectoriesAreListedAgain(self):
+    directory = os.path.join(self.tree, "Sub", "Dir")
+    with vfs.VFSCache():
+      self.assertEqual(self._Open("Sub/Dir").ListNames(), [u"File.txt"])
+
+      with open(os.path.join(directory, "New.txt"), "wb") as fd:
+        fd.write("new")
+      # Make sure the change is visible even on a coarse mtime resolution.
+      st = os.stat(directory)
+      os.utime(directory, (st.st_atime, st.st_mtime + 10))
+
+      self.assertEqual(
+          sorted(self._Open("Sub/Dir").ListNames()), [u"File.txt", u"New.txt"])
+      self.assertEqual(self._Open("sub/dir/new.TXT").Read(100), "new")
+
+  def testMissingComponents(self):
+    with vfs.VFSCache():
+      self.assertRaises(IOError, self._Open, "Sub/Dir/Missing.txt")
+      self.assertRaises(IOError, self._Open, "Sub/Dir/Missing.txt")
+
+  def testTSKPathsAreOpenedByInode(self):
+    path = os.path.join(self.base_path, "test_img.dd")
+    ps = rdf_paths.PathSpec(path=path, pathtype=rdf_paths.PathSpec.PathType.OS)
+    ps.Append(
+        path="test directory/NuMbErS.TxT",
+        pathtype=rdf_paths.PathSpec.PathType.TSK)
+
+    with vfs.VFSCache() as cache:
+      fd = vfs.VFSOpen(ps.Copy())
+      data = fd.Read(100)
+      hits = cache.hits
+
+      fd = vfs.VFSOpen(ps.Copy())
+      self.assertEqual(fd.Read(100), data)
+      self.assertEqual(fd.pathspec.last.path, u"/Test Directory/numbers.txt")
+      self.assertGreater(cache.hits, hits)
+      self.assertGreater(len(cache.inodes), 0)
+
+
 def main(argv):
   vfs.VFSInit()
   test_lib.main(argv)
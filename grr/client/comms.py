@@ -49,6 +49,9 @@ The client goes through a state machine:
 5) When not in FAST POLL mode, the polling frequency is controlled by the
    Timer() object. It is currently a geometrically decreasing function which
    starts at the Client.poll_min and approaches the Client.poll_max setting.
+   As long as there is more data queued for the server than was sent in the
+   last post, the client polls again after one measured round trip time. A
+   full output queue wakes the client up immediately.
 
 6) If a 500 error occurs in the CONNECTED state, the client will assume that the
    server is temporarily down. The client will switch to the RETRY state and
@@ -85,6 +88,7 @@ import sys
 import threading
 import time
 import traceback
+import zlib
 
 
 import psutil
@@ -93,6 +97,7 @@ import requests
 import logging
 
 from grr.client import actions
+from grr.client import client_governor
 from grr.client import client_stats
 from grr.client import client_utils
 from grr.lib import communicator
@@ -432,14 +437,35 @@ class Timer(object):
 
   External code simply calls our Wait() method without regard to the exact
   timing policy.
+
+  While the client has more data to send than fits into one post, polls are
+  paced by the measured round trip time instead of backing off, and posts are
+  sized by the measured throughput. Wake() ends a wait early, e.g. when the
+  output queue has filled up.
   """
 
+  # Posts are sized to take about this many seconds at the measured throughput.
+  TARGET_POST_DURATION = 10
+
+  # Posts are never made smaller than this.
+  MIN_POST_SIZE = 512 * 1024
+
+  # Smaller posts are dominated by latency and say nothing about throughput.
+  MIN_THROUGHPUT_SAMPLE = 64 * 1024
+
+  # Weight of the latest measurement in the moving averages.
+  SMOOTHING = 0.3
+
   def __init__(self, heart_beat_cb=None):
     self.heart_beat_cb = heart_beat_cb
     self.poll_min = config_lib.CONFIG["Client.poll_min"]
     self.sleep_time = self.poll_max = config_lib.CONFIG["Client.poll_max"]
     self.poll_slew = config_lib.CONFIG["Client.poll_slew"]
 
+    self.round_trip_time = None
+    self.throughput = None
+    self._wakeup = threading.Event()
+
   def FastPoll(self):
     """Switch to fast poll mode."""
     self.sleep_time = self.poll_min
@@ -448,17 +474,56 @@ class Timer(object):
     """Switch to slow poll mode."""
     self.sleep_time = self.poll_max
 
+  def _Smooth(self, average, value):
+    if average is None:
+      return value
+    return average + self.SMOOTHING * (value - average)
+
+  def RecordPost(self, duration, size):
+    """Records how long a successful post of size bytes took."""
+    if duration <= 0:
+      return
+
+    self.round_trip_time = self._Smooth(self.round_trip_time, duration)
+    if size >= self.MIN_THROUGHPUT_SAMPLE:
+      self.throughput = self._Smooth(self.throughput, size / float(duration))
+
+  def PostSize(self, max_post_size):
+    """Returns how many bytes the next post should carry at most."""
+    if not self.throughput:
+      return max_post_size
+
+    size = max(self.MIN_POST_SIZE,
+               int(self.throughput * self.TARGET_POST_DURATION))
+    return min(max_post_size, size)
+
+  def Backlog(self):
+    """Poll again after a round trip since there is more data to send."""
+    pace = max(self.poll_min, self.round_trip_time or 0)
+    self.sleep_time = min(self.sleep_time, pace)
+
+  def Wake(self):
+    """Ends the current or next Wait() early."""
+    self._wakeup.set()
+
   def Wait(self):
     """Wait until the next action is needed."""
-    time.sleep(self.sleep_time - int(self.sleep_time))
+    if not self._wakeup.is_set():
+      time.sleep(self.sleep_time - int(self.sleep_time))
 
-    # Split a long sleep interval into 1 second intervals so we can heartbeat.
+    # Split a long sleep interval into 1 second intervals so we can heartbeat
+    # and notice when we are woken up.
     for _ in xrange(int(self.sleep_time)):
+      if self._wakeup.is_set():
+        break
+
       time.sleep(1)
 
       if self.heart_beat_cb:
         self.heart_beat_cb()
 
+    self._wakeup.clear()
+
     # Back off slowly at first and fast if no answer.
     self.sleep_time = min(self.poll_max,
                           max(self.poll_min, self.sleep_time) * self.poll_slew)
@@ -507,6 +572,9 @@ class GRRClientWorker(object):
 
   stats_collector = None
 
+  # Paces the CPU and disk usage of the client actions.
+  governor = None
+
   IDLE_THRESHOLD = 0.3
 
   sent_bytes_per_flow = {}
@@ -551,9 +619,20 @@ class GRRClientWorker(object):
     # client action from here if needed.
     self.suspended_actions = {}
 
+    # The request the running action works on, the ids of its responses the
+    # server did not receive yet and a checkpoint waiting for them.
+    self._checkpoint_request = None
+    self._undelivered_responses = set()
+    self._pending_checkpoint = None
+
+    # Task ids of requests resumed from a checkpoint after a restart.
+    self._resumed_tasks = set()
+
     # Use this to control the nanny transaction log.
     self.nanny_controller = client_utils.NannyController()
     self.nanny_controller.StartNanny()
+    if not GRRClientWorker.governor:
+      GRRClientWorker.governor = client_governor.ResourceGovernor()
     if not GRRClientWorker.stats_collector:
       GRRClientWorker.stats_collector = client_stats.ClientStatsCollector(self)
       GRRClientWorker.stats_collector.start()
@@ -670,6 +749,12 @@ class GRRClientWorker(object):
     if rdf_value:
       message.payload = rdf_value
 
+    with self.lock:
+      request = self._checkpoint_request
+      if (request is not None and request.session_id == session_id and
+          request.request_id == request_id):
+        self._undelivered_responses.add(response_id)
+
     serialized_message = message.SerializeToString()
 
     self.ChargeBytesToSession(session_id, len(serialized_message))
@@ -691,6 +776,53 @@ class GRRClientWorker(object):
       # keep going.
       logging.info("Queue is full, dropping messages.")
 
+  def SaveCheckpoint(self, checkpoint):
+    """Keeps a checkpoint of the running action in the transaction log.
+
+    The checkpoint is only written once the server received all responses sent
+    before it, so resuming from it never leaves a gap in the responses.
+
+    Args:
+      checkpoint: An ActionCheckpoint instance.
+    """
+    with self.lock:
+      if self._checkpoint_request is None:
+        return
+
+      self._pending_checkpoint = checkpoint
+      self._WriteCheckpoint()
+
+  def _WriteCheckpoint(self):
+    checkpoint = self._pending_checkpoint
+    if checkpoint is None:
+      return
+
+    for response_id in self._undelivered_responses:
+      if response_id < checkpoint.response_id:
+        return
+
+    message = self._checkpoint_request.Copy()
+    if message.HasField("checkpoint"):
+      checkpoint.resume_count = message.checkpoint.resume_count
+    message.checkpoint = checkpoint
+    self.nanny_controller.WriteTransactionLog(message)
+    self.nanny_controller.SyncTransactionLog()
+    self._pending_checkpoint = None
+
+  def MessagesDelivered(self, messages):
+    """Called once the server received the given messages."""
+    with self.lock:
+      request = self._checkpoint_request
+      if request is None:
+        return
+
+      for message in messages:
+        if (message.session_id == request.session_id and
+            message.request_id == request.request_id):
+          self._undelivered_responses.discard(message.response_id)
+
+      self._WriteCheckpoint()
+
   def UploadFile(self,
                  file_fd,
                  upload_token,
@@ -709,7 +841,7 @@ class GRRClientWorker(object):
 
         # Ensure we heartbeat while the upload is happening.
         if progress_callback:
-          progress_callback()
+          progress_callback(bytes_read=len(data))
 
         yield data
 
@@ -792,6 +924,19 @@ class GRRClientWorker(object):
 
         action = action_cls(grr_worker=self)
 
+      # The server sends requests again if it does not hear back in time, this
+      # might happen while an action resumed after a restart is still running.
+      if (message.task_id in self._resumed_tasks and
+          not message.HasField("checkpoint")):
+        logging.info("Ignoring retransmission of resumed request %s/%s.",
+                     message.session_id, message.request_id)
+        return
+
+      with self.lock:
+        self._checkpoint_request = message
+        self._undelivered_responses = set()
+        self._pending_checkpoint = None
+
       # Write the message to the transaction log.
       self.nanny_controller.WriteTransactionLog(message)
 
@@ -800,7 +945,10 @@ class GRRClientWorker(object):
       action.Execute(message)
 
       # If we get here without exception, we can remove the transaction.
-      self.nanny_controller.CleanTransactionLog()
+      with self.lock:
+        self._checkpoint_request = None
+        self._pending_checkpoint = None
+        self.nanny_controller.CleanTransactionLog()
     finally:
       self._is_active = False
       # We want to send ClientStats when client action is complete.
@@ -851,6 +999,11 @@ class GRRClientWorker(object):
         if flags.FLAGS.debug:
           pdb.post_mortem()
 
+  def ReplyBudgetExceeded(self, session_id):
+    """Returns True if the session has too many replies waiting to be sent."""
+    _ = session_id
+    return False
+
   def MemoryExceeded(self):
     """Returns True if our memory footprint is too large."""
     rss_size = self.proc.memory_info().rss
@@ -930,13 +1083,17 @@ class SizeQueue(object):
   """
   total_size = 0
 
-  def __init__(self, maxsize=1024, nanny=None):
+  def __init__(self, maxsize=1024, nanny=None, full_callback=None):
     self.lock = threading.RLock()
+    # Notified when items are removed from the queue.
+    self.not_full = threading.Condition(self.lock)
     self.queue = []
     self._reversed = []
     self.total_size = 0
     self.maxsize = maxsize
     self.nanny = nanny
+    # Called when Put() has to wait, so the queue can be drained right away.
+    self.full_callback = full_callback
 
   def Put(self,
           item,
@@ -971,15 +1128,20 @@ class SizeQueue(object):
 
     else:
       count = 0
-      # Wait until the queue has more space. We do not hold the lock here to
-      # ensure that the posting thread can drain this queue while we block here.
-      while self.total_size >= self.maxsize:
-        time.sleep(1)
-        self.nanny.Heartbeat()
-        count += 1
+      # Wait until the queue has more space. Waiting on the condition releases
+      # the lock so the posting thread can drain this queue while we block here.
+      with self.not_full:
+        while self.total_size >= self.maxsize:
+          if self.full_callback:
+            self.full_callback()
 
-        if timeout and count > timeout:
-          raise Queue.Full
+          self.not_full.wait(1)
+          if self.nanny:
+            self.nanny.Heartbeat()
+          count += 1
+
+          if timeout and count > timeout:
+            raise Queue.Full
 
     with self.lock:
       self.queue.append((-1 * priority, item))
@@ -1000,6 +1162,7 @@ class SizeQueue(object):
       while self._reversed:
         item = self._reversed.pop()[1]
         self.total_size -= len(item)
+        self.not_full.notify_all()
         yield item
 
   def Size(self):
@@ -1009,6 +1172,139 @@ class SizeQueue(object):
     return self.total_size >= self.maxsize
 
 
+class MessageBatch(object):
+  """Compressed replies of a client action waiting to be sent."""
+
+  def __init__(self, messages, session_id=None):
+    self.session_id = session_id
+    self.count = len(messages)
+
+    data = rdf_flows.MessageList(job=messages).SerializeToString()
+    self.raw_size = len(data)
+    # The batch is only kept in memory, so speed matters more than size.
+    self.data = zlib.compress(data, 1)
+
+  def __len__(self):
+    return len(self.data)
+
+  def Unpack(self):
+    """Returns the GrrMessages in this batch."""
+    return rdf_flows.MessageList.FromSerializedString(
+        zlib.decompress(self.data)).job
+
+
+class ReplyBatcher(object):
+  """Packs the replies of client actions into compressed batches.
+
+  Replies to a request are collected until they reach the batch size or the
+  request is answered with a status or an iterator, and are then put on the
+  output queue as a single MessageBatch. Replies still collected when the
+  client posts to the server are sent along.
+
+  The compressed size of the batches of each session which were not sent yet
+  is tracked, so actions can give control back to the server when too many of
+  their replies are waiting.
+  """
+
+  def __init__(self, out_queue, batch_size=None, budget=None):
+    """Constructor.
+
+    Args:
+      out_queue: The SizeQueue the batches are put on.
+      batch_size: The uncompressed size of a batch. Defaults to
+        Client.reply_batch_size.
+      budget: The compressed bytes a session may have waiting to be sent.
+        Defaults to Client.action_reply_budget.
+    """
+    if batch_size is None:
+      batch_size = config_lib.CONFIG["Client.reply_batch_size"]
+    if budget is None:
+      budget = config_lib.CONFIG["Client.action_reply_budget"]
+
+    self.out_queue = out_queue
+    self.batch_size = batch_size
+    self.budget = budget
+    self.lock = threading.RLock()
+
+    # The priority, replies and their size by (session_id, request_id).
+    self.pending = {}
+    # The compressed size of the queued batches by session_id.
+    self.queued_sizes = {}
+
+  def Put(self, message, priority, block=True):
+    """Queues a message for sending.
+
+    Args:
+      message: The GrrMessage to send.
+      priority: The priority of the message.
+      block: If the output queue is full, block until there is space.
+
+    Raises:
+      Queue.Full: if the queue is full and block is False, or it stayed full
+        for too long.
+    """
+    key = (message.session_id, message.request_id)
+    if (message.type != rdf_flows.GrrMessage.Type.MESSAGE or
+        priority >= rdf_flows.GrrMessage.Priority.HIGH_PRIORITY):
+      # The replies to a request go out before its status.
+      self.Flush(key, block=block)
+      self.out_queue.Put(message, priority=priority, block=block)
+      return
+
+    size = len(message.SerializeToString())
+    with self.lock:
+      _, messages, pending_size = self.pending.get(key, (priority, [], 0))
+      messages.append(message)
+      pending_size += size
+      self.pending[key] = (priority, messages, pending_size)
+
+    if pending_size >= self.batch_size:
+      self.Flush(key, block=block)
+
+  def Flush(self, key, block=True):
+    """Queues the pending replies to a (session_id, request_id) as a batch."""
+    with self.lock:
+      try:
+        priority, messages, _ = self.pending.pop(key)
+      except KeyError:
+        return
+
+      batch = MessageBatch(messages, session_id=key[0])
+      self.queued_sizes[batch.session_id] = self.queued_sizes.get(
+          batch.session_id, 0) + len(batch)
+
+    try:
+      self.out_queue.Put(batch, priority=priority, block=block)
+    except Queue.Full:
+      self.Sent(batch)
+      raise
+
+  def TakePending(self):
+    """Returns the replies which were not put on the queue yet."""
+    with self.lock:
+      pending, self.pending = self.pending, {}
+
+    messages = []
+    for _, key_messages, _ in pending.itervalues():
+      messages.extend(key_messages)
+
+    return messages
+
+  def Sent(self, batch):
+    """Called once a batch was taken off the output queue."""
+    with self.lock:
+      size = self.queued_sizes.get(batch.session_id, 0) - len(batch)
+      if size > 0:
+        self.queued_sizes[batch.session_id] = size
+      else:
+        self.queued_sizes.pop(batch.session_id, None)
+
+  def BudgetExceeded(self, session_id):
+    """Returns True if the session has too many replies waiting."""
+    with self.lock:
+      return self.queued_sizes.get(session_id, 0) > self.budget
+
+
 class GRRThreadedWorker(GRRClientWorker, threading.Thread):
   """This client worker runs the main loop in another thread.
 
@@ -1032,7 +1328,9 @@ class GRRThreadedWorker(GRRClientWorker, threading.Thread):
     # is too large, the worker thread will block until the queue is drained.
     self._out_queue = SizeQueue(
         maxsize=config_lib.CONFIG["Client.max_out_queue"],
-        nanny=self.nanny_controller)
+        nanny=self.nanny_controller,
+        full_callback=self._WakeClient)
+    self._reply_batcher = ReplyBatcher(self._out_queue)
 
     self.daemon = True
 
@@ -1040,6 +1338,11 @@ class GRRThreadedWorker(GRRClientWorker, threading.Thread):
     if start_worker_thread:
       self.start()
 
+  def _WakeClient(self):
+    """Lets the client post right away instead of waiting for the next poll."""
+    if self.client is not None:
+      self.client.timer.Wake()
+
   def Sleep(self, timeout):
     """Sleeps the calling thread with heartbeat."""
     self.nanny_controller.Heartbeat()
@@ -1071,14 +1374,28 @@ class GRRThreadedWorker(GRRClientWorker, threading.Thread):
     queue = rdf_flows.MessageList()
     length = 0
 
-    for message in self._out_queue.Get():
-      queue.job.Append(rdf_flows.GrrMessage.FromSerializedString(message))
-      stats.STATS.IncrementCounter("grr_client_sent_messages")
-      length += len(message)
+    for item in self._out_queue.Get():
+      if isinstance(item, MessageBatch):
+        self._reply_batcher.Sent(item)
+        for message in item.Unpack():
+          queue.job.Append(message)
+        stats.STATS.IncrementCounter("grr_client_sent_messages", item.count)
+        length += item.raw_size
+      else:
+        queue.job.Append(rdf_flows.GrrMessage.FromSerializedString(item))
+        stats.STATS.IncrementCounter("grr_client_sent_messages")
+        length += len(item)
 
       if length > max_size:
         break
 
+    else:
+      # Replies which did not fill a batch yet are sent right away as well,
+      # otherwise they would wait for the action to produce more.
+      for message in self._reply_batcher.TakePending():
+        queue.job.Append(message)
+        stats.STATS.IncrementCounter("grr_client_sent_messages")
+
     return queue
 
   def QueueResponse(self,
@@ -1086,7 +1403,10 @@ class GRRThreadedWorker(GRRClientWorker, threading.Thread):
                     priority=rdf_flows.GrrMessage.Priority.MEDIUM_PRIORITY,
                     blocking=True):
     """Push the Serialized Message on the output queue."""
-    self._out_queue.Put(message, priority=priority, block=blocking)
+    self._reply_batcher.Put(message, priority, block=blocking)
+
+  def ReplyBudgetExceeded(self, session_id):
+    return self._reply_batcher.BudgetExceeded(session_id)
 
   def QueueMessages(self, messages):
     """Push the message to the input queue."""
@@ -1113,25 +1433,39 @@ class GRRThreadedWorker(GRRClientWorker, threading.Thread):
     """A handler that is called on client startup."""
     # We read the transaction log and fail any requests that are in it. If there
     # is anything in the transaction log we assume its there because we crashed
-    # last time and let the server know.
+    # last time and let the server know. Actions which left a checkpoint are
+    # resumed instead.
 
     last_request = self.nanny_controller.GetTransactionLog()
-    if last_request:
-      status = rdf_flows.GrrStatus(
-          status=rdf_flows.GrrStatus.ReturnedStatus.CLIENT_KILLED,
-          error_message="Client killed during transaction")
-      nanny_status = self.nanny_controller.GetNannyStatus()
-      if nanny_status:
-        status.nanny_status = nanny_status
+    if last_request and self._CanResume(last_request):
+      # The action left a checkpoint so it continues where it was killed. The
+      # incremented resume count is logged right away in case we are killed
+      # again before the action starts.
+      logging.info("Resuming request %s/%s from its checkpoint.",
+                   last_request.session_id, last_request.request_id)
+      last_request.checkpoint.resume_count += 1
+      self.nanny_controller.WriteTransactionLog(last_request)
+      if last_request.task_id:
+        self._resumed_tasks.add(last_request.task_id)
+      self.QueueMessages([last_request])
 
-      self.SendReply(
-          status,
-          request_id=last_request.request_id,
-          response_id=1,
-          session_id=last_request.session_id,
-          message_type=rdf_flows.GrrMessage.Type.STATUS)
+    else:
+      if last_request:
+        status = rdf_flows.GrrStatus(
+            status=rdf_flows.GrrStatus.ReturnedStatus.CLIENT_KILLED,
+            error_message="Client killed during transaction")
+        nanny_status = self.nanny_controller.GetNannyStatus()
+        if nanny_status:
+          status.nanny_status = nanny_status
 
-    self.nanny_controller.CleanTransactionLog()
+        self.SendReply(
+            status,
+            request_id=last_request.request_id,
+            response_id=1,
+            session_id=last_request.session_id,
+            message_type=rdf_flows.GrrMessage.Type.STATUS)
+
+      self.nanny_controller.CleanTransactionLog()
 
     # Inform the server that we started.
     action_cls = actions.ActionPlugin.classes.get("SendStartupInfo",
@@ -1139,6 +1473,11 @@ class GRRThreadedWorker(GRRClientWorker, threading.Thread):
     action = action_cls(grr_worker=self)
     action.Run(None, ttl=1)
 
+  def _CanResume(self, request):
+    return (request.HasField("checkpoint") and
+            request.checkpoint.resume_count <
+            config_lib.CONFIG["Client.max_action_resumes"])
+
   def run(self):
     """Main thread for processing messages."""
 
@@ -1350,8 +1689,8 @@ class GRRHTTPClient(object):
     # back so we don't expire our messages too fast.
     if self.http_manager.consecutive_connection_errors == 0:
       # Grab some messages to send
-      message_list = self.client_worker.Drain(
-          max_size=config_lib.CONFIG["Client.max_post_size"])
+      message_list = self.client_worker.Drain(max_size=self.timer.PostSize(
+          config_lib.CONFIG["Client.max_post_size"]))
     else:
       message_list = rdf_flows.MessageList()
 
@@ -1419,6 +1758,10 @@ class GRRHTTPClient(object):
       response.code = 500
       return response
 
+    # The server has the responses now, checkpoints waiting for them can be
+    # written.
+    self.client_worker.MessagesDelivered(message_list.job)
+
     # Check to see if any inbound messages want us to fastpoll. This means we
     # drop to fastpoll immediately on a new request rather than waiting for the
     # next beacon to report results.
@@ -1427,6 +1770,12 @@ class GRRHTTPClient(object):
         self.timer.FastPoll()
         break
 
+    # Keep posting at the pace the connection allows while there is more data
+    # waiting to be sent, rather than backing off.
+    self.timer.RecordPost(response.duration, len(payload_data))
+    if self.client_worker.OutQueueSize():
+      self.timer.Backlog()
+
     # Process all messages. Messages can be processed by clients in
     # any order since clients do not have state.
     self.client_worker.QueueMessages(response.messages)
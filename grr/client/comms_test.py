@@ -2,14 +2,22 @@
 """Test for client comms."""
 
 
+import os
 import time
 
 import requests
 
+# pylint: disable=unused-import,g-bad-import-order
+from grr.client import client_plugins
+# pylint: enable=unused-import,g-bad-import-order
+
+from grr.client import actions
 from grr.client import comms
 from grr.lib import flags
 from grr.lib import test_lib
 from grr.lib import utils
+from grr.lib.rdfvalues import client as rdf_client
+from grr.lib.rdfvalues import flows as rdf_flows
 
 
 def _make_http_response(code=200):
@@ -234,6 +242,213 @@ class HTTPManagerTest(test_lib.GRRBaseTest):
     self.assertEqual(result.data, "Good")
 
 
+class FakeKill(BaseException):
+  """Stops an action like a client being killed would."""
+
+
+class CheckpointAction(actions.ActionPlugin):
+  """A mock action which counts to five and checkpoints its progress."""
+  in_rdfvalue = rdf_client.LogMessage
+  out_rdfvalues = [rdf_client.LogMessage]
+
+  kill_at = None
+
+  def Run(self, unused_args):
+    start = self.checkpoint["count"] if self.checkpoint else 0
+    for i in range(start, 5):
+      if i == self.kill_at:
+        raise FakeKill()
+
+      self.Checkpoint({"count": i})
+      self.SendReply(rdf_client.LogMessage(data=str(i)))
+
+
+class ActionCheckpointTest(test_lib.GRRBaseTest):
+  """Tests resuming client actions from checkpoints."""
+
+  def setUp(self):
+    super(ActionCheckpointTest, self).setUp()
+    self.config_overrider = test_lib.ConfigOverrider({
+        "Client.action_checkpoint_interval": 0,
+        "Nanny.logfile": os.path.join(self.temp_dir, "nanny.log")
+    })
+    self.config_overrider.Start()
+
+    self.request = rdf_flows.GrrMessage(
+        session_id="aff4:/flows/W:123456",
+        name="CheckpointAction",
+        request_id=3,
+        task_id=1234,
+        auth_state=rdf_flows.GrrMessage.AuthorizationState.AUTHENTICATED,
+        payload=rdf_client.LogMessage())
+
+  def tearDown(self):
+    self.config_overrider.Stop()
+    CheckpointAction.kill_at = None
+    super(ActionCheckpointTest, self).tearDown()
+
+  def _Responses(self, worker):
+    return [(msg.response_id, msg.payload)
+            for msg in worker.Drain(max_size=1024 * 1024).job
+            if msg.session_id == self.request.session_id]
+
+  def _RunUntilKilled(self, worker, kill_at):
+    CheckpointAction.kill_at = kill_at
+    with self.assertRaises(FakeKill):
+      worker.HandleMessage(self.request)
+    CheckpointAction.kill_at = None
+
+  def testCheckpointsWaitForTheServer(self):
+    worker = comms.GRRThreadedWorker(start_worker_thread=False)
+    self._RunUntilKilled(worker, 3)
+
+    # None of the responses reached the server, so only the checkpoint taken
+    # before the first response is usable.
+    checkpoint = worker.nanny_controller.GetTransactionLog().checkpoint
+    self.assertEqual(checkpoint.state.ToDict(), {"count": 0})
+    self.assertEqual(checkpoint.response_id, 1)
+
+    worker.MessagesDelivered(worker.Drain(max_size=1024 * 1024).job)
+
+    checkpoint = worker.nanny_controller.GetTransactionLog().checkpoint
+    self.assertEqual(checkpoint.state.ToDict(), {"count": 2})
+    self.assertEqual(checkpoint.response_id, 3)
+
+  def testActionsResumeAfterRestart(self):
+    worker = comms.GRRThreadedWorker(start_worker_thread=False)
+    self._RunUntilKilled(worker, 3)
+    worker.MessagesDelivered(worker.Drain(max_size=1024 * 1024).job)
+
+    worker = comms.GRRThreadedWorker(start_worker_thread=False)
+    worker.OnStartup()
+    self.assertEqual(worker.InQueueSize(), 1)
+    request = worker._in_queue.get()
+    self.assertEqual(request.checkpoint.resume_count, 1)
+
+    worker.HandleMessage(request)
+    responses = self._Responses(worker)
+
+    # The responses continue where the server left off.
+    self.assertEqual([(response_id, payload.data)
+                      for response_id, payload in responses[:-1]],
+                     [(3, "2"), (4, "3"), (5, "4")])
+    self.assertEqual(responses[-1][0], 6)
+    self.assertEqual(responses[-1][1].status,
+                     rdf_flows.GrrStatus.ReturnedStatus.OK)
+    self.assertIsNone(worker.nanny_controller.GetTransactionLog())
+
+    # The server sending the request again does not start it from scratch.
+    worker.HandleMessage(self.request)
+    self.assertEqual(self._Responses(worker), [])
+
+  def testResumesAreLimited(self):
+    worker = comms.GRRThreadedWorker(start_worker_thread=False)
+    self._RunUntilKilled(worker, 3)
+    worker.MessagesDelivered(worker.Drain(max_size=1024 * 1024).job)
+
+    request = worker.nanny_controller.GetTransactionLog()
+    request.checkpoint.resume_count = 3
+    worker.nanny_controller.WriteTransactionLog(request)
+
+    worker = comms.GRRThreadedWorker(start_worker_thread=False)
+    worker.OnStartup()
+    self.assertEqual(worker.InQueueSize(), 0)
+
+    responses = self._Responses(worker)
+    self.assertEqual(len(responses), 1)
+    self.assertEqual(responses[0][1].status,
+                     rdf_flows.GrrStatus.ReturnedStatus.CLIENT_KILLED)
+    self.assertIsNone(worker.nanny_controller.GetTransactionLog())
+
+
+class ReplyBatcherTest(test_lib.GRRBaseTest):
+  """Tests packing client action replies into batches."""
+
+  def setUp(self):
+    super(ReplyBatcherTest, self).setUp()
+    self.config_overrider = test_lib.ConfigOverrider({
+        "Client.reply_batch_size": 1000,
+        "Client.action_reply_budget": 2000
+    })
+    self.config_overrider.Start()
+    self.worker = comms.GRRThreadedWorker(start_worker_thread=False)
+
+  def tearDown(self):
+    self.config_overrider.Stop()
+    super(ReplyBatcherTest, self).tearDown()
+
+  def _SendReplies(self, count, request_id=1):
+    for i in range(count):
+      self.worker.SendReply(
+          rdf_client.LogMessage(data="%d %s" % (i, "x" * 100)),
+          session_id="aff4:/flows/W:123456",
+          request_id=request_id,
+          response_id=i,
+          message_type=rdf_flows.GrrMessage.Type.MESSAGE)
+
+  def _SendStatus(self, request_id=1):
+    self.worker.SendReply(
+        rdf_flows.GrrStatus(),
+        session_id="aff4:/flows/W:123456",
+        request_id=request_id,
+        response_id=1000,
+        message_type=rdf_flows.GrrMessage.Type.STATUS)
+
+  def testRepliesArePackedIntoCompressedBatches(self):
+    self._SendReplies(100)
+    self._SendStatus()
+
+    items = list(self.worker._out_queue.queue)
+    self.assertLess(len(items), 20)
+    self.assertIsInstance(items[0][1], comms.MessageBatch)
+    # The status is not batched.
+    self.assertIsInstance(items[-1][1], str)
+
+    # The replies compress well.
+    self.assertLess(self.worker.OutQueueSize(), 100 * 100 / 2)
+
+    messages = self.worker.Drain(max_size=1024 * 1024).job
+    self.assertEqual([m.response_id for m in messages], range(100) + [1000])
+    self.assertEqual(messages[5].payload.data, "5 " + "x" * 100)
+
+  def testStatusSendsIncompleteBatch(self):
+    self._SendReplies(3, request_id=1)
+    self._SendReplies(3, request_id=2)
+    self._SendStatus(request_id=1)
+
+    # Only the replies to the finished request are queued.
+    items = [item for _, item in self.worker._out_queue.queue]
+    self.assertEqual(len(items), 2)
+    self.assertEqual(items[0].count, 3)
+
+    # Replies which are still collected are sent when the client posts.
+    messages = self.worker.Drain(max_size=1024 * 1024).job
+    self.assertEqual([(m.request_id, m.response_id) for m in messages],
+                     [(1, 0), (1, 1), (1, 2), (1, 1000), (2, 0), (2, 1),
+                      (2, 2)])
+
+  def testReplyBudget(self):
+    session_id = rdf_client.ClientURN("C.1000000000000000").Add("flows/W:1")
+    queue = comms.SizeQueue(maxsize=1024 * 1024)
+    batcher = comms.ReplyBatcher(queue, batch_size=100, budget=300)
+
+    for i in range(10):
+      batcher.Put(
+          rdf_flows.GrrMessage(
+              session_id=session_id,
+              request_id=1,
+              response_id=i,
+              payload=rdf_client.LogMessage(data=os.urandom(50).encode("hex"))),
+          rdf_flows.GrrMessage.Priority.MEDIUM_PRIORITY)
+
+    self.assertTrue(batcher.BudgetExceeded(session_id))
+    self.assertFalse(batcher.BudgetExceeded(session_id.Add("other")))
+
+    for batch in queue.Get():
+      batcher.Sent(batch)
+    self.assertFalse(batcher.BudgetExceeded(session_id))
+
+
 def main(argv):
   test_lib.main(argv)
 
@@ -7,6 +7,7 @@ This module loads and registers all the GRR library tests.
 
 # These need to register plugins so, pylint: disable=unused-import
 from grr.client import client_build_test
+from grr.client import client_governor_test
 from grr.client import client_test
 from grr.client import client_utils_test
 from grr.client import client_vfs_test
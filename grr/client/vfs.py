@@ -2,6 +2,11 @@
 """This file implements a VFS abstraction on the client."""
 
 
+import errno
+import os
+import stat
+import threading
+
 from grr.client import client_utils
 from grr.lib import config_lib
 from grr.lib import registry
@@ -12,6 +17,123 @@ from grr.lib.rdfvalues import paths as rdf_paths
 # for a limited time.
 DEVICE_CACHE = utils.TimeBasedCache()
 
+# The VFSCache of the client action running in the current thread.
+_CURRENT_CACHE = threading.local()
+
+
+class DirectoryListing(object):
+  """The names in a directory, with a case insensitive index built on demand."""
+
+  def __init__(self, names, version=None):
+    self.names = names
+    self.version = version
+    self._name_set = None
+    self._lower_names = None
+
+  def MatchName(self, component):
+    """Returns the name in this listing which matches component best."""
+    if self._name_set is None:
+      self._name_set = set(self.names)
+      self._lower_names = {}
+      for name in self.names:
+        self._lower_names.setdefault(name.lower(), name)
+
+    if component in self._name_set:
+      return component
+
+    return self._lower_names.get(component.lower(), component)
+
+
+class VFSCache(object):
+  """Caches directory listings and path resolution while an action runs.
+
+  Opening a deep path lists every directory along the way to correct the
+  casing of each component, so actions touching many files in the same tree
+  list the same directories over and over. The cache is bounded and only
+  active in the thread running the action it was entered for (see
+  ActionPlugin.Execute), so nothing outlives the request it was made for.
+
+  Local directory listings are also validated against the directory's mtime,
+  so a directory changing while the action runs is listed again.
+  """
+
+  def __init__(self, max_size=1000):
+    self.listings = utils.FastStore(max_size=max_size)
+    self.components = utils.FastStore(max_size=max_size * 10)
+    self.inodes = utils.FastStore(max_size=max_size * 10)
+
+    self.hits = 0
+    self.misses = 0
+    self._previous_cache = None
+
+  def __enter__(self):
+    self._previous_cache = getattr(_CURRENT_CACHE, "cache", None)
+    _CURRENT_CACHE.cache = self
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    _CURRENT_CACHE.cache = self._previous_cache
+    self.listings.Flush()
+    self.components.Flush()
+    self.inodes.Flush()
+
+  def ListDirectory(self, local_path):
+    """Lists a local directory, reusing the last listing if it is unchanged.
+
+    Args:
+      local_path: The directory to list, in the local path conventions.
+
+    Returns:
+      A DirectoryListing.
+
+    Raises:
+      OSError: If local_path is not a directory, just like os.listdir.
+    """
+    st = os.stat(local_path)
+    if not stat.S_ISDIR(st.st_mode):
+      # This is what os.listdir raises for files.
+      raise OSError(errno.ENOTDIR, "Not a directory", local_path)
+
+    version = (st.st_dev, st.st_ino, st.st_mtime)
+    try:
+      listing = self.listings.Get(local_path)
+      if listing.version == version:
+        self.hits += 1
+        return listing
+    except KeyError:
+      pass
+
+    self.misses += 1
+    listing = DirectoryListing(
+        [utils.SmartUnicode(entry) for entry in os.listdir(local_path)],
+        version=version)
+    self.listings.Put(local_path, listing)
+    return listing
+
+  def Get(self, store, key, default=None):
+    try:
+      value = store.Get(key)
+      self.hits += 1
+      return value
+    except KeyError:
+      self.misses += 1
+      return default
+
+
+def GetVFSCache():
+  """Returns the VFSCache of the running action or None."""
+  return getattr(_CURRENT_CACHE, "cache", None)
+
+
+def ListDirectory(local_path):
+  """Lists a local directory through the current VFSCache if there is one."""
+  cache = GetVFSCache()
+  if cache is not None:
+    return cache.ListDirectory(local_path)
+
+  return DirectoryListing(
+      [utils.SmartUnicode(entry) for entry in os.listdir(local_path)])
+
 
 class VFSHandler(object):
   """Base class for handling objects in the VFS."""
@@ -128,16 +250,7 @@ class VFSHandler(object):
     fd = self.OpenAsContainer()
 
     # Adjust the component casing
-    file_listing = set(fd.ListNames())
-
-    # First try an exact match
-    if component not in file_listing:
-      # Now try to match lower case
-      lower_component = component.lower()
-      for x in file_listing:
-        if lower_component == x.lower():
-          component = x
-          break
+    component = fd.MatchName(component)
 
     if fd.supported_pathtype != self.pathspec.pathtype:
       new_pathspec = rdf_paths.PathSpec(
@@ -148,6 +261,33 @@ class VFSHandler(object):
 
     return new_pathspec
 
+  def MatchName(self, component):
+    """Returns the name in this directory which matches component best.
+
+    An exact match is preferred over a case insensitive one. Matches are
+    remembered by the current VFSCache.
+
+    Args:
+      component: A component name which should be present in this directory.
+
+    Returns:
+      The name as it is listed, or component if nothing matches.
+    """
+    cache = GetVFSCache()
+    if cache is not None:
+      key = (self.supported_pathtype, self.pathspec.SerializeToString(),
+             component)
+      name = cache.Get(cache.components, key)
+      if name is not None:
+        return name
+
+    name = DirectoryListing(list(self.ListNames())).MatchName(component)
+
+    if cache is not None:
+      cache.components.Put(key, name)
+
+    return name
+
   def ListFiles(self):
     """An iterator over all VFS files contained in this directory.
 
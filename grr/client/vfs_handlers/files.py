@@ -101,6 +101,7 @@ class File(vfs.VFSHandler):
   auto_register = True
 
   files = None
+  listing = None
 
   # Directories do not have a size.
   size = None
@@ -148,9 +149,8 @@ class File(vfs.VFSHandler):
       if not self.files:
         # Note that the encoding of local path is system specific
         local_path = client_utils.CanonicalPathToLocalPath(self.path + "/")
-        self.files = [
-            utils.SmartUnicode(entry) for entry in os.listdir(local_path)
-        ]
+        self.listing = vfs.ListDirectory(local_path)
+        self.files = self.listing.names
     # Some filesystems do not support unicode properly
     except UnicodeEncodeError as e:
       raise IOError(str(e))
@@ -266,6 +266,13 @@ class File(vfs.VFSHandler):
   def ListNames(self):
     return self.files or []
 
+  def MatchName(self, component):
+    # The listing is already there and validated, no need to cache the match.
+    if self.listing is not None:
+      return self.listing.MatchName(component)
+
+    return super(File, self).MatchName(component)
+
   def Read(self, length):
     """Read from the file."""
     if self.progress_callback:
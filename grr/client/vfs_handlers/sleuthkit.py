@@ -164,8 +164,21 @@ class TSKFile(vfs.VFSHandler):
         self.size = self.fd.info.meta.size
 
     else:
-      # Does the filename exist in the image?
-      self.fd = self.fs.open(utils.SmartStr(self.pathspec.last.path))
+      # Paths already resolved by this action are opened by their inode.
+      cache = vfs.GetVFSCache()
+      inode_key = (fd_hash, self.pathspec.last.path)
+      inode = None
+      if cache is not None:
+        inode = cache.Get(cache.inodes, inode_key)
+
+      if inode is not None:
+        self.fd = self.fs.open_meta(inode)
+      else:
+        # Does the filename exist in the image?
+        self.fd = self.fs.open(utils.SmartStr(self.pathspec.last.path))
+        if cache is not None:
+          cache.inodes.Put(inode_key, self.fd.info.meta.addr)
+
       self.size = self.fd.info.meta.size
       self.pathspec.last.inode = self.fd.info.meta.addr
 
@@ -125,6 +125,41 @@ config_lib.DEFINE_integer("Client.max_post_size", 40000000,
 config_lib.DEFINE_integer("Client.max_out_queue", 51200000,
                           "Maximum size of the output queue.")
 
+config_lib.DEFINE_integer("Client.reply_batch_size", 64 * 1024,
+                          "Replies of a client action are packed into "
+                          "compressed batches of about this many bytes before "
+                          "they are queued for sending.")
+
+config_lib.DEFINE_integer("Client.action_reply_budget", 8 * 1024 * 1024,
+                          "The number of compressed bytes of replies a client "
+                          "action may have waiting to be sent. Iterated and "
+                          "suspendable actions exceeding it return control to "
+                          "the server until the replies were sent.")
+
+config_lib.DEFINE_float("Client.action_checkpoint_interval", 10,
+                        "Minimum time in seconds between two checkpoints of "
+                        "a client action written to the transaction log.")
+
+config_lib.DEFINE_integer("Client.max_action_resumes", 3,
+                          "How often a client action is resumed from its "
+                          "checkpoint after the client was killed. After "
+                          "that the server is told the client was killed.")
+
+config_lib.DEFINE_float("Client.action_cpu_rate", 0,
+                        "The share of a CPU core client actions may use on "
+                        "average, e.g. 0.5 for half a core. Actions exceeding "
+                        "it are slowed down. 0 disables CPU pacing.")
+
+config_lib.DEFINE_integer("Client.action_read_rate", 0,
+                          "The number of bytes per second client actions may "
+                          "read from disk on average. Actions exceeding it are "
+                          "slowed down. 0 disables I/O pacing.")
+
+config_lib.DEFINE_float("Client.action_burst_time", 5,
+                        "Client actions may run at full speed for this many "
+                        "seconds worth of their CPU and I/O rates before "
+                        "they are paced.")
+
 config_lib.DEFINE_integer("Client.foreman_check_frequency", 1800,
                           "The minimum number of seconds before checking with "
                           "the foreman for new work.")
@@ -109,3 +109,8 @@ config_lib.DEFINE_string(
     "NOTE: for debugging purposes only! If set, every request AdminUI gets "
     "will be attributed to the specified user. Useful for checking how AdminUI "
     "looks like for an access-restricted user.")
+
+config_lib.DEFINE_integer(
+    "AdminUI.archive_compression_threads", 4,
+    "Number of threads compressing the files of archive downloads. If 0, "
+    "files are compressed by the thread serving the download.")
@@ -62,6 +62,7 @@ config_lib.DEFINE_option(
 config_lib.DEFINE_integer("Monitoring.http_port", 0,
                           "Port for stats monitoring server.")
 
-config_lib.DEFINE_integer("Logging.aff4_audit_log_rollover", 60 * 60 * 24 * 14,
-                          "Audit log rollover interval in seconds. "
-                          "Default is 2 weeks")
+config_lib.DEFINE_integer("Logging.aff4_audit_log_rollover", 60 * 60 * 24,
+                          "Audit log rollover interval in seconds. Reading "
+                          "the events of a timespan reads all logs it "
+                          "overlaps. Default is 1 day")
@@ -41,6 +41,43 @@ config_lib.DEFINE_integer("Worker.well_known_flow_lease_time", 600,
                           "Duration of a well known flow lease time in "
                           "seconds.")
 
+config_lib.DEFINE_integer("Worker.membership_lease_time", 60,
+                          "Workers renew their membership in the data store "
+                          "every third of this many seconds. Workers which "
+                          "did not renew it for this long are considered "
+                          "gone and their flows are routed to other workers.")
+
+config_lib.DEFINE_integer("Worker.affinity_group_size", 1,
+                          "Notifications of each flow are routed to this many "
+                          "workers, chosen by consistent hashing of the "
+                          "flow's session id.")
+
+config_lib.DEFINE_integer("Worker.flow_cache_size", 100,
+                          "The number of recently processed flows and hunts "
+                          "each worker keeps in memory, so they do not have "
+                          "to be read again when they are notified next.")
+
+config_lib.DEFINE_integer("Worker.flow_cache_age", 600,
+                          "Flows kept in memory by a worker are dropped when "
+                          "they were not processed for this many seconds.")
+
+config_lib.DEFINE_float("Worker.interactive_flow_weight", 4,
+                        "Share of the worker threads given to the flows of "
+                        "each analyst, relative to the other weights.")
+
+config_lib.DEFINE_float("Worker.hunt_flow_weight", 1,
+                        "Share of the worker threads given to the flows of "
+                        "each hunt, relative to the other weights.")
+
+config_lib.DEFINE_float("Worker.system_flow_weight", 2,
+                        "Share of the worker threads given to cron jobs and "
+                        "well known flows, relative to the other weights.")
+
+config_lib.DEFINE_float("Worker.interactive_reserved_share", 0.25,
+                        "Share of the worker threads which only processes "
+                        "flows started by analysts, so hunts can not starve "
+                        "them.")
+
 config_lib.DEFINE_integer("Worker.compaction_lease_time", 3600,
                           "Duration of collections lease time for compaction "
                           "in seconds.")
@@ -51,6 +88,10 @@ config_lib.DEFINE_bool("Worker.enable_packed_versioned_collection_journaling",
                        "journaled so that these collections can be later "
                        "checked for integrity.")
 
+config_lib.DEFINE_integer("Worker.event_buffer_size", 1000,
+                          "Number of buffered events after which the event "
+                          "buffer is written to the listener queues.")
+
 config_lib.DEFINE_integer("Worker.queue_shards", 5,
                           "Queue notifications will be sharded across "
                           "this number of datastore subjects.")
@@ -74,6 +115,41 @@ config_lib.DEFINE_list("Frontend.well_known_flows", ["TransferStore", "Stats"],
                        "Allow these well known flows to run directly on the "
                        "frontend. Other flows are scheduled as normal.")
 
+config_lib.DEFINE_list("Frontend.asynchronous_well_known_flows", ["Stats"],
+                       "Well known flows running on the frontend whose "
+                       "messages are queued and the client is answered "
+                       "before they are processed. Queued messages are lost "
+                       "if the frontend dies, so only flows which can afford "
+                       "to lose messages should be listed. Messages to all "
+                       "other well known flows are processed while the "
+                       "client waits.")
+
+config_lib.DEFINE_integer("Frontend.well_known_flow_queue_size", 10000,
+                          "The maximum number of messages for well known "
+                          "flows queued on a frontend. When the queue is "
+                          "full, clients are asked to send their messages "
+                          "again later. Queued messages are processed when "
+                          "the frontend is stopped, but up to this many are "
+                          "lost if it crashes. 0 processes all messages while "
+                          "the client waits.")
+
+config_lib.DEFINE_integer("Frontend.well_known_flow_batch_size", 100,
+                          "The maximum number of messages handed to a well "
+                          "known flow at once.")
+
+config_lib.DEFINE_integer("Frontend.well_known_flow_processors", 4,
+                          "The number of threads processing queued messages "
+                          "for well known flows.")
+
+config_lib.DEFINE_integer("Frontend.pending_work_shards", 16,
+                          "The summary of clients with queued tasks is "
+                          "sharded across this number of datastore subjects.")
+
+config_lib.DEFINE_integer("Frontend.pending_work_cache_ttl", 1,
+                          "Frontends cache shards of the summary of clients "
+                          "with queued tasks for this many seconds. If 0, the "
+                          "summary is read on every client poll.")
+
 config_lib.DEFINE_list("Frontend.DEBUG_well_known_flows_blacklist", [],
                        "Drop these well known flows requests without "
                        "processing. Useful as an emergency tool to reduce "
@@ -124,6 +200,10 @@ config_lib.DEFINE_semantic(
 config_lib.DEFINE_bool("Cron.active", False,
                        "Set to true to run a cron thread on this binary.")
 
+config_lib.DEFINE_integer("Cron.max_threads", 10,
+                          "Maximum number of cron jobs checked and started "
+                          "in parallel by a cron thread.")
+
 config_lib.DEFINE_list("Cron.enabled_system_jobs", [],
                        "DEPRECATED: Use Cron.disabled_system_jobs instead. "
                        "If Cron.enabled_system_jobs is set, only the listed "
@@ -159,7 +239,13 @@ config_lib.DEFINE_integer("Frontend.message_expiry_time", 600,
                           "system.")
 
 config_lib.DEFINE_string("Frontend.upload_store", "FileUploadFileStore",
-                         "The implementation of the upload file store.")
+                         "The implementation of the upload file store. "
+                         "BlobUploadFileStore stores uploads in the blob "
+                         "store and deduplicates them by content.")
+
+config_lib.DEFINE_integer("Frontend.upload_public_key_cache_age", 600,
+                          "How many seconds the public key of a client "
+                          "uploading files is cached for.")
 
 config_lib.DEFINE_string("FileUploadFileStore.root_dir", "/tmp/",
                          "Where to store files uploaded.")
@@ -310,3 +396,15 @@ config_lib.DEFINE_string(
     default="retain",
     help="Inactive clients marked with "
     "this label will be retained forever.")
+
+config_lib.DEFINE_integer(
+    "DataRetention.batch_size",
+    1000,
+    help="Number of objects data retention cron jobs check and delete "
+    "at once.")
+
+config_lib.DEFINE_integer(
+    "DataRetention.max_deletions_per_second",
+    1000,
+    help="Maximum number of data store subjects deleted per second by each "
+    "data retention cron job. 0 means no limit.")
@@ -3,11 +3,15 @@
 
 
 
+import collections
 import cStringIO
 import itertools
+from multiprocessing import pool as multiprocessing_pool
 import os
+import Queue
 import re
 import sys
+import threading
 import zipfile
 
 
@@ -16,6 +20,7 @@ import yaml
 import logging
 
 from grr.lib import aff4
+from grr.lib import config_lib
 from grr.lib import rdfvalue
 from grr.lib import utils
 from grr.lib.flows.general import export as flow_export
@@ -24,6 +29,241 @@ from grr.lib.rdfvalues import structs as rdf_structs
 from grr.proto import api_pb2
 
 
+# Compression pools shared by all archive downloads, keyed by their size.
+_COMPRESSION_POOLS = {}
+_COMPRESSION_POOLS_LOCK = threading.Lock()
+
+
+def GetCompressionPool(threads):
+  """Returns the process-wide compression pool with the given size.
+
+  The pool is created on first use and then kept for the lifetime of the
+  process, so that downloads do not start new threads every time. zlib
+  releases the GIL while compressing, so the threads compress in parallel.
+
+  Args:
+    threads: Number of threads in the pool.
+
+  Returns:
+    A multiprocessing.pool.ThreadPool.
+  """
+  with _COMPRESSION_POOLS_LOCK:
+    pool = _COMPRESSION_POOLS.get(threads)
+    if pool is None:
+      pool = multiprocessing_pool.ThreadPool(threads)
+      _COMPRESSION_POOLS[threads] = pool
+    return pool
+
+
+class ArchiveCompressionPipeline(object):
+  """Reads and compresses the files of an archive ahead of the archive writer.
+
+  File chunks are read from the data store by a background thread and
+  compressed by the shared pool of compression threads, each chunk
+  independently. At most max_pending chunks are in flight and the results are
+  returned in the order the chunks were read, so the archive framing around
+  them is still streamed in order.
+
+  Files which are compressed already are stored as they are.
+  """
+
+  # Extensions of file formats which are compressed already.
+  COMPRESSED_EXTENSIONS = frozenset([
+      ".7z", ".bz2", ".cab", ".deb", ".docx", ".gif", ".gz", ".jar", ".jpeg",
+      ".jpg", ".mp3", ".mp4", ".png", ".rar", ".rpm", ".tgz", ".xlsx", ".xz",
+      ".zip"
+  ])
+
+  # Size of the blocks a tar stream is split into for compression.
+  GZIP_BLOCK_SIZE = 1024 * 1024
+
+  _END = object()
+
+  def __init__(self, threads=None, max_pending=None, store_only=False):
+    """Constructor.
+
+    Args:
+      threads: Number of compression threads. Defaults to
+        AdminUI.archive_compression_threads. If 0, chunks are compressed in
+        the calling thread.
+      max_pending: Maximum number of chunks read or compressed ahead of the
+        writer.
+      store_only: If True, no file is compressed.
+    """
+    if threads is None:
+      threads = config_lib.CONFIG["AdminUI.archive_compression_threads"]
+    self.threads = threads
+    self.max_pending = max_pending or 2 * max(threads, 1)
+    self.store_only = store_only
+    self._pool = None
+
+  def __enter__(self):
+    if self.threads:
+      self._pool = GetCompressionPool(self.threads)
+    return self
+
+  def __exit__(self, unused_type, unused_value, unused_traceback):
+    # The pool is shared with other downloads so it is left running.
+    self._pool = None
+
+  def IsStoredAsIs(self, fd):
+    """Returns True if the content of fd should not be compressed."""
+    if self.store_only:
+      return True
+
+    _, extension = os.path.splitext(fd.urn.Basename())
+    return extension.lower() in self.COMPRESSED_EXTENSIONS
+
+  def Prefetch(self, iterable):
+    """Iterates over iterable in a background thread, ahead of the caller."""
+    queue = Queue.Queue(maxsize=self.max_pending)
+    stopped = threading.Event()
+
+    def Put(item):
+      while not stopped.is_set():
+        try:
+          queue.put(item, timeout=1)
+          return True
+        except Queue.Full:
+          pass
+      return False
+
+    def Produce():
+      try:
+        for item in iterable:
+          if not Put((item, None)):
+            return
+        Put((self._END, None))
+      except Exception as e:  # pylint: disable=broad-except
+        Put((self._END, e))
+
+    thread = threading.Thread(target=Produce, name="ArchivePrefetch")
+    thread.daemon = True
+    thread.start()
+    try:
+      while True:
+        item, error = queue.get()
+        if error is not None:
+          raise error
+        if item is self._END:
+          return
+        yield item
+    finally:
+      stopped.set()
+
+  def Map(self, function, items, argument=lambda item: item):
+    """Applies function to items in the compression threads, keeping order.
+
+    Args:
+      function: A module level function taking a single argument.
+      items: An iterable of items.
+      argument: Returns the argument for function for an item, or None if
+        function does not have to be applied to it.
+
+    Yields:
+      Tuples (item, result), result is None if function was not applied.
+    """
+    pending = collections.deque()
+    for item in items:
+      arg = argument(item)
+      if arg is None:
+        pending.append((item, None, None))
+      elif self._pool:
+        pending.append((item, self._pool.apply_async(function, (arg,)), None))
+      else:
+        pending.append((item, None, function(arg)))
+
+      while len(pending) > self.max_pending:
+        yield self._PopResult(pending)
+
+    while pending:
+      yield self._PopResult(pending)
+
+  def _PopResult(self, pending):
+    item, async_result, result = pending.popleft()
+    if async_result is not None:
+      result = async_result.get()
+    return item, result
+
+  def StreamFiles(self, archive_generator, fds, error_callback=None):
+    """Writes the content of AFF4 streams into an archive.
+
+    Args:
+      archive_generator: A StreamingZipGenerator or StreamingTarGenerator.
+      fds: A dict mapping opened AFF4Streams to (archive path, stat) tuples.
+      error_callback: Called with the fd and the exception for files which
+        can not be read.
+
+    Yields:
+      Binary chunks of the archive.
+    """
+    is_zip = isinstance(archive_generator, utils.StreamingZipGenerator)
+
+    def ChunkToDeflate(item):
+      fd, chunk, exception = item
+      if not is_zip or exception or self.IsStoredAsIs(fd):
+        return None
+      return chunk
+
+    chunks = self.Prefetch(aff4.AFF4Stream.MultiStream(fds))
+    prev_fd = None
+    for (fd, chunk, exception), deflated_chunk in self.Map(
+        utils.DeflateBlock, chunks, argument=ChunkToDeflate):
+      if exception:
+        logging.exception(exception)
+        if error_callback:
+          error_callback(fd, exception)
+        continue
+
+      if prev_fd != fd:
+        if prev_fd:
+          yield archive_generator.WriteFileFooter()
+        prev_fd = fd
+
+        content_path, st = fds[fd]
+        if is_zip:
+          stored = self.IsStoredAsIs(fd)
+          yield archive_generator.WriteFileHeader(
+              content_path,
+              st=st,
+              compress_type=zipfile.ZIP_STORED
+              if stored else zipfile.ZIP_DEFLATED,
+              precompressed=not stored)
+        else:
+          yield archive_generator.WriteFileHeader(content_path, st=st)
+
+      if deflated_chunk is None:
+        yield archive_generator.WriteFileChunk(chunk)
+      else:
+        yield archive_generator.WriteFileChunk(
+            chunk, compressed_chunk=deflated_chunk)
+
+    if archive_generator.is_file_write_in_progress:
+      yield archive_generator.WriteFileFooter()
+
+  def _Blocks(self, chunks):
+    buf = []
+    size = 0
+    for chunk in chunks:
+      if not chunk:
+        continue
+
+      buf.append(chunk)
+      size += len(chunk)
+      if size >= self.GZIP_BLOCK_SIZE:
+        yield "".join(buf)
+        buf = []
+        size = 0
+
+    if buf:
+      yield "".join(buf)
+
+  def GzipStream(self, chunks):
+    """Compresses a stream into a sequence of gzip members."""
+    for _, member in self.Map(utils.GzipBlock, self._Blocks(chunks)):
+      yield member
+
+
 class CollectionArchiveGenerator(object):
   """Class that generates downloaded files archive from a collection."""
 
@@ -42,7 +282,8 @@ class CollectionArchiveGenerator(object):
                prefix=None,
                description=None,
                predicate=None,
-               client_id=None):
+               client_id=None,
+               store_only=False):
     """CollectionArchiveGenerator constructor.
 
     Args:
@@ -56,6 +297,8 @@ class CollectionArchiveGenerator(object):
       predicate: If not None, only the files matching the predicate will be
           archived, all others will be skipped.
       client_id: The client_id to use when exporting a flow results collection.
+      store_only: If True, files are archived without compressing them.
+          A TAR_GZ archive is then written as a plain, uncompressed tar.
     Raises:
       ValueError: if prefix is None.
     """
@@ -65,9 +308,13 @@ class CollectionArchiveGenerator(object):
       self.archive_generator = utils.StreamingZipGenerator(
           compression=zipfile.ZIP_DEFLATED)
     elif archive_format == self.TAR_GZ:
-      self.archive_generator = utils.StreamingTarGenerator()
+      # The tar stream is gzipped block by block by the compression pipeline.
+      self.archive_generator = utils.StreamingTarGenerator(compress=False)
     else:
       raise ValueError("Unknown archive format: %s" % archive_format)
+    self.archive_format = archive_format
+    self.store_only = store_only
+    self._output_size = 0
 
     if not prefix:
       raise ValueError("Prefix can't be None.")
@@ -85,7 +332,7 @@ class CollectionArchiveGenerator(object):
 
   @property
   def output_size(self):
-    return self.archive_generator.output_size
+    return self._output_size
 
   def _ItemsToUrns(self, items):
     """Converts collection items to aff4 urns suitable for downloading."""
@@ -136,6 +383,20 @@ class CollectionArchiveGenerator(object):
     Yields:
       Binary chunks comprising the generated archive.
     """
+    with ArchiveCompressionPipeline(store_only=self.store_only) as pipeline:
+      output = self._GenerateArchive(collection, pipeline, token=token)
+      if self.archive_format == self.TAR_GZ and not self.store_only:
+        output = pipeline.GzipStream(output)
+
+      for chunk in output:
+        self._output_size += len(chunk)
+        yield chunk
+
+  def _FileFailed(self, fd, unused_exception):
+    self.archived_files -= 1
+    self.failed_files.append(utils.SmartUnicode(fd.urn))
+
+  def _GenerateArchive(self, collection, pipeline, token=None):
     hashes = set()
     for fd_urn_batch in utils.Grouper(
         self._ItemsToUrns(collection), self.BATCH_SIZE):
@@ -170,27 +431,11 @@ class CollectionArchiveGenerator(object):
                                                     archive_path)
 
       if fds_to_write:
-        prev_fd = None
-        for fd, chunk, exception in aff4.AFF4Stream.MultiStream(fds_to_write):
-          if exception:
-            logging.exception(exception)
-
-            self.archived_files -= 1
-            self.failed_files.append(utils.SmartUnicode(fd.urn))
-            continue
-
-          if prev_fd != fd:
-            if prev_fd:
-              yield self.archive_generator.WriteFileFooter()
-            prev_fd = fd
-
-            content_path, st = fds_to_write[fd]
-            yield self.archive_generator.WriteFileHeader(content_path, st=st)
-
-          yield self.archive_generator.WriteFileChunk(chunk)
-
-        if self.archive_generator.is_file_write_in_progress:
-          yield self.archive_generator.WriteFileFooter()
+        for chunk in pipeline.StreamFiles(
+            self.archive_generator,
+            fds_to_write,
+            error_callback=self._FileFailed):
+          yield chunk
 
     for chunk in self._WriteDescription():
       yield chunk
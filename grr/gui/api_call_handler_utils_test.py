@@ -17,6 +17,7 @@ from grr.gui import api_call_handler_utils
 from grr.lib import aff4
 from grr.lib import flags
 from grr.lib import test_lib
+from grr.lib import utils
 from grr.lib.aff4_objects import collects
 from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import crypto as rdf_crypto
@@ -57,7 +58,8 @@ class CollectionArchiveGeneratorTest(test_lib.GRRBaseTest):
       self,
       collection,
       archive_format=api_call_handler_utils.CollectionArchiveGenerator.ZIP,
-      predicate=None):
+      predicate=None,
+      store_only=False):
 
     self.fd_path = os.path.join(self.temp_dir, "archive")
     archive_generator = api_call_handler_utils.CollectionArchiveGenerator(
@@ -65,7 +67,8 @@ class CollectionArchiveGeneratorTest(test_lib.GRRBaseTest):
         predicate=predicate,
         prefix="test_prefix",
         description="Test description",
-        client_id=self.client_id)
+        client_id=self.client_id,
+        store_only=store_only)
     with open(self.fd_path, "wb") as out_fd:
       for chunk in archive_generator.Generate(collection, token=self.token):
         out_fd.write(chunk)
@@ -161,6 +164,29 @@ class CollectionArchiveGeneratorTest(test_lib.GRRBaseTest):
         "failed_files": 0
     })
 
+  def testStoreOnlyZipDoesNotCompressFiles(self):
+    _, fd_path = self._GenerateArchive(
+        self.stat_entries,
+        archive_format=api_call_handler_utils.CollectionArchiveGenerator.ZIP,
+        store_only=True)
+
+    zip_fd = zipfile.ZipFile(fd_path)
+    dest = ("test_prefix/hashes/91e9240f415223982edc345532630710"
+            "e94a7f52cd5f48f5ee1afc555078f0ab")
+    self.assertEqual(zip_fd.getinfo(dest).compress_type, zipfile.ZIP_STORED)
+    self.assertEqual(zip_fd.read(dest), "hello1")
+
+  def testStoreOnlyTarGzWritesPlainTar(self):
+    _, fd_path = self._GenerateArchive(
+        self.stat_entries,
+        archive_format=api_call_handler_utils.CollectionArchiveGenerator.TAR_GZ,
+        store_only=True)
+
+    with tarfile.open(fd_path, "r:") as tar_fd:
+      dest = ("test_prefix/hashes/91e9240f415223982edc345532630710"
+              "e94a7f52cd5f48f5ee1afc555078f0ab")
+      self.assertEqual(tar_fd.extractfile(dest).read(), "hello1")
+
   def testCreatesTarContainingDeduplicatedCollectionFilesAndReadme(self):
     _, fd_path = self._GenerateArchive(
         self.stat_entries,
@@ -318,6 +344,61 @@ class FilterCollectionTest(test_lib.GRRBaseTest):
     self.assertEqual(data[0].path, "/var/os/tmp-8")
 
 
+class ArchiveCompressionPipelineTest(test_lib.GRRBaseTest):
+  """Test for ArchiveCompressionPipeline."""
+
+  def testMapKeepsOrder(self):
+    items = ["item %d" % i * 100 for i in range(50)]
+    for threads in [0, 2]:
+      with api_call_handler_utils.ArchiveCompressionPipeline(
+          threads=threads, max_pending=4) as pipeline:
+        results = list(pipeline.Map(utils.DeflateBlock, iter(items)))
+
+      self.assertEqual([item for item, _ in results], items)
+      for item, result in results:
+        self.assertEqual(result, utils.DeflateBlock(item))
+
+  def testPipelinesShareTheCompressionPool(self):
+    with api_call_handler_utils.ArchiveCompressionPipeline(
+        threads=2) as pipeline:
+      pool = pipeline._pool
+    with api_call_handler_utils.ArchiveCompressionPipeline(
+        threads=2) as pipeline:
+      self.assertIs(pipeline._pool, pool)
+      results = list(pipeline.Map(utils.DeflateBlock, ["a"]))
+
+    self.assertEqual(results, [("a", utils.DeflateBlock("a"))])
+
+  def testMapSkipsItemsWithoutArgument(self):
+    with api_call_handler_utils.ArchiveCompressionPipeline(
+        threads=0) as pipeline:
+      results = list(
+          pipeline.Map(
+              utils.DeflateBlock, ["a", "", "b"], argument=lambda x: x or None))
+
+    self.assertEqual(results, [("a", utils.DeflateBlock("a")), ("", None),
+                               ("b", utils.DeflateBlock("b"))])
+
+  def testPrefetchPropagatesErrors(self):
+
+    def Items():
+      yield 1
+      raise IOError("read failed")
+
+    pipeline = api_call_handler_utils.ArchiveCompressionPipeline(threads=0)
+    prefetched = pipeline.Prefetch(Items())
+    self.assertEqual(next(prefetched), 1)
+    with self.assertRaises(IOError):
+      next(prefetched)
+
+  def testCompressedFilesAreStored(self):
+    pipeline = api_call_handler_utils.ArchiveCompressionPipeline(threads=0)
+    for name, stored in [("a.txt", False), ("a.ZIP", True), ("a.jpg", True)]:
+      fd = aff4.FACTORY.Create(
+          "aff4:/tmp/" + name, aff4.AFF4MemoryStream, token=self.token)
+      self.assertEqual(pipeline.IsStoredAsIs(fd), stored)
+
+
 def main(argv):
   test_lib.main(argv)
 
@@ -181,20 +181,37 @@ class ApiLabelsRestrictedSearchClientsHandler(
       label_filter = ["label:" + label] + keywords
       all_urns.update(index.LookupClients(label_filter))
 
+    # Only the labels are needed to filter the clients, the clients on the
+    # requested page are read in full afterwards.
     all_objs = aff4.FACTORY.MultiOpen(
-        sorted(all_urns, key=str), aff4_type=aff4_grr.VFSGRRClient, token=token)
+        sorted(all_urns, key=str),
+        mode="r",
+        aff4_type=aff4_grr.VFSGRRClient,
+        attributes=[aff4_grr.VFSGRRClient.SchemaCls.LABELS],
+        token=token)
 
-    api_clients = []
+    page_urns = []
     index = 0
     for client_obj in all_objs:
       if self._CheckClientLabels(client_obj):
         if index >= args.offset and index < end:
-          api_clients.append(ApiClient().InitFromAff4Object(client_obj))
+          page_urns.append(client_obj.urn)
 
         index += 1
         if index >= end:
           break
 
+    client_objs = dict((client_obj.urn, client_obj)
+                       for client_obj in aff4.FACTORY.MultiOpen(
+                           page_urns,
+                           aff4_type=aff4_grr.VFSGRRClient,
+                           token=token))
+
+    api_clients = []
+    for urn in page_urns:
+      if urn in client_objs:
+        api_clients.append(ApiClient().InitFromAff4Object(client_objs[urn]))
+
     return ApiSearchClientsResult(items=api_clients)
 
 
@@ -494,7 +494,8 @@ class ApiGetFlowFilesArchiveHandler(api_call_handler_base.ApiCallHandler):
       file_extension = ".zip"
     elif args.archive_format == args.ArchiveFormat.TAR_GZ:
       archive_format = api_call_handler_utils.CollectionArchiveGenerator.TAR_GZ
-      file_extension = ".tar.gz"
+      # With store_only the tar stream is not gzipped.
+      file_extension = ".tar" if args.store_only else ".tar.gz"
     else:
       raise ValueError("Unknown archive format: %s" % args.archive_format)
 
@@ -503,7 +504,8 @@ class ApiGetFlowFilesArchiveHandler(api_call_handler_base.ApiCallHandler):
         description=description,
         archive_format=archive_format,
         predicate=self._BuildPredicate(args.client_id, token=token),
-        client_id=args.client_id.ToClientURN())
+        client_id=args.client_id.ToClientURN(),
+        store_only=args.store_only)
     content_generator = self._WrapContentGenerator(
         generator, collection, args, token=token)
     return api_call_handler_base.ApiBinaryStream(
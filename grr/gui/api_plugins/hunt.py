@@ -275,29 +275,40 @@ class ApiListHuntsHandler(api_call_handler_base.ApiCallHandler):
       else:
         break
 
-    index = 0
-    hunt_list = []
-    active_children_map = {}
-    for hunt in fd.OpenChildren(children=active_children):
+    # The filters only look at the hunt context and runner args, so only these
+    # and the other attributes read by GRRHunt.Initialize() are read for all
+    # active hunts. The hunts on the requested page are read in full
+    # afterwards.
+    schema = implementation.GRRHunt.SchemaCls
+    matching_urns = set()
+    for hunt in aff4.FACTORY.MultiOpen(
+        active_children,
+        mode="r",
+        attributes=[
+            schema.HUNT_CONTEXT, schema.HUNT_RUNNER_ARGS, schema.HUNT_ARGS,
+            schema.CLIENT_COUNT, schema.STATE_VERSION
+        ],
+        token=token):
       # Legacy hunts may have hunt.context == None: we just want to skip them.
       if (not isinstance(hunt, hunts.GRRHunt) or not hunt.context or
           not filter_func(hunt)):
         continue
-      active_children_map[hunt.urn] = hunt
+      matching_urns.add(hunt.urn)
 
+    index = 0
+    page_urns = []
     for urn in active_children:
-      try:
-        hunt = active_children_map[urn]
-      except KeyError:
+      if urn not in matching_urns:
         continue
 
       if index >= args.offset:
-        hunt_list.append(hunt)
+        page_urns.append(urn)
 
       index += 1
-      if args.count and len(hunt_list) >= args.count:
+      if args.count and len(page_urns) >= args.count:
         break
 
+    hunt_list = list(fd.OpenChildren(children=page_urns))
     return ApiListHuntsResult(items=self._BuildHuntList(hunt_list))
 
   def Handle(self, args, token=None):
@@ -779,14 +790,16 @@ class ApiGetHuntFilesArchiveHandler(api_call_handler_base.ApiCallHandler):
       file_extension = ".zip"
     elif args.archive_format == args.ArchiveFormat.TAR_GZ:
       archive_format = api_call_handler_utils.CollectionArchiveGenerator.TAR_GZ
-      file_extension = ".tar.gz"
+      # With store_only the tar stream is not gzipped.
+      file_extension = ".tar" if args.store_only else ".tar.gz"
     else:
       raise ValueError("Unknown archive format: %s" % args.archive_format)
 
     generator = api_call_handler_utils.CollectionArchiveGenerator(
         prefix=target_file_prefix,
         description=description,
-        archive_format=archive_format)
+        archive_format=archive_format,
+        store_only=args.store_only)
     content_generator = self._WrapContentGenerator(
         generator, collection, args, token=token)
     return api_call_handler_base.ApiBinaryStream(
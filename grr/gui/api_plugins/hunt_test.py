@@ -313,6 +313,24 @@ class ApiGetHuntFilesArchiveHandlerTest(api_test_lib.ApiCallHandlerTest,
         self.assertEqual(manifest["processed_files"], 10)
         self.assertEqual(manifest["ignored_files"], 0)
 
+  def testStoreOnlyGeneratesPlainTarArchive(self):
+    result = self.handler.Handle(
+        hunt_plugin.ApiGetHuntFilesArchiveArgs(
+            hunt_id=self.hunt.urn.Basename(),
+            archive_format="TAR_GZ",
+            store_only=True),
+        token=self.token)
+    self.assertTrue(result.filename.endswith(".tar"))
+
+    out_fd = StringIO.StringIO()
+    for chunk in result.GenerateContent():
+      out_fd.write(chunk)
+    out_fd.seek(0)
+
+    with tarfile.open(fileobj=out_fd, mode="r:") as tar_fd:
+      self.assertTrue(
+          [name for name in tar_fd.getnames() if name.endswith("MANIFEST")])
+
 
 class ApiGetHuntFileHandlerTest(api_test_lib.ApiCallHandlerTest,
                                 standard_test.StandardHuntTestMixin):
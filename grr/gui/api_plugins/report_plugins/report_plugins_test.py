@@ -11,15 +11,18 @@ from grr.gui.api_plugins.report_plugins import filestore_report_plugins
 from grr.gui.api_plugins.report_plugins import rdf_report_plugins
 from grr.gui.api_plugins.report_plugins import report_plugins
 from grr.gui.api_plugins.report_plugins import report_plugins_test_mocks
+from grr.gui.api_plugins.report_plugins import report_utils
 from grr.gui.api_plugins.report_plugins import server_report_plugins
 
 from grr.lib import aff4
 from grr.lib import client_fixture
+from grr.lib import data_store
 from grr.lib import events
 from grr.lib import flags
 from grr.lib import rdfvalue
 from grr.lib import test_lib
 from grr.lib.aff4_objects import filestore_test_lib
+from grr.lib.data_stores import sqlite_data_store_test
 from grr.lib.flows.cron import filestore_stats
 from grr.lib.flows.cron import system as cron_system
 from grr.lib.flows.general import audit
@@ -95,6 +98,163 @@ class ReportUtilsTest(test_lib.GRRBaseTest):
     self.assertIn("Fake audit description bar.", audit_events)
     self.assertNotIn("Fake outdated audit log.", audit_events)
 
+  def testAuditLogsForTimespanFindsLogsOfOlderRollovers(self):
+    # Logs written with a longer rollover before it was recorded in the logs.
+    with test_lib.ConfigOverrider({
+        "Logging.aff4_audit_log_rollover": 60 * 60 * 24 * 14
+    }):
+      with test_lib.FakeTime(
+          rdfvalue.RDFDatetime.Now() - rdfvalue.Duration("12h")):
+        AddFakeAuditLog("Fake audit description old.", token=self.token)
+        log_urn = aff4.CurrentAuditLog()
+    data_store.DB.DeleteAttributes(
+        log_urn, [audit.AUDIT_LOG_ROLLOVER_ATTRIBUTE], token=self.token)
+
+    audit_events = {
+        ev.description: ev
+        for fd in audit.AuditLogsForTimespan(
+            rdfvalue.RDFDatetime.Now() - rdfvalue.Duration("1d"),
+            rdfvalue.RDFDatetime.Now(),
+            token=self.token) for ev in fd.GenerateItems()
+    }
+
+    self.assertIn("Fake audit description old.", audit_events)
+
+  def testBuildAuditAggregates(self):
+    with test_lib.FakeTime(
+        rdfvalue.RDFDatetime.FromHumanReadable("2012/12/14")):
+      AddFakeAuditLog(user="User123", token=self.token)
+
+    with test_lib.FakeTime(
+        rdfvalue.RDFDatetime.FromHumanReadable("2012/12/22"), increment=1):
+      for _ in xrange(3):
+        AddFakeAuditLog(
+            action=events.AuditEvent.Action.RUN_FLOW,
+            user="User123",
+            flow_name="Flow123",
+            token=self.token)
+
+    now = rdfvalue.RDFDatetime.FromHumanReadable("2012/12/31")
+    expected = report_utils.GetAuditEventCounts(
+        rdfvalue.Duration("30d"), now, token=self.token)
+    self.assertEqual(len(expected), 2)
+
+    # This is how the counts look for events written before the counters.
+    for day, _, _, _, _ in expected:
+      data_store.DB.DeleteSubject(
+          audit.AuditAggregatesBase().Add(str(day.AsSecondsFromEpoch())),
+          token=self.token)
+    self.assertFalse(
+        report_utils.GetAuditEventCounts(
+            rdfvalue.Duration("30d"), now, token=self.token))
+    self.assertFalse(audit.AuditAggregatesBuilt(token=self.token))
+
+    # Building the counts again does not count any event twice.
+    for _ in range(2):
+      self.assertEqual(audit.BuildAuditAggregates(token=self.token), 4)
+      self.assertItemsEqual(
+          report_utils.GetAuditEventCounts(
+              rdfvalue.Duration("30d"), now, token=self.token), expected)
+
+    self.assertTrue(audit.AuditAggregatesBuilt(token=self.token))
+
+  def testUpdateAuditAggregatesCountsEventsOnce(self):
+    day = rdfvalue.RDFDatetime.FromHumanReadable("2012/12/22")
+    with test_lib.FakeTime(day, increment=1):
+      audit_events = [
+          events.AuditEvent(
+              action=events.AuditEvent.Action.RUN_FLOW,
+              user="User123",
+              flow_name="Flow123") for _ in xrange(3)
+      ]
+    audit.UpdateAuditAggregates(audit_events[:2], token=self.token)
+
+    # A retried batch, a late event and counting the logs meanwhile.
+    audit.UpdateAuditAggregates(audit_events, token=self.token)
+    audit.BuildAuditAggregates(token=self.token)
+    audit.UpdateAuditAggregates(audit_events[2:], token=self.token)
+
+    counts = report_utils.GetAuditEventCounts(
+        rdfvalue.Duration("16d"),
+        rdfvalue.RDFDatetime.FromHumanReadable("2012/12/31"),
+        token=self.token)
+    self.assertEqual(
+        counts,
+        [(day, events.AuditEvent.Action.RUN_FLOW, "Flow123", "User123", 3)])
+
+
+class SqliteReportUtilsTest(sqlite_data_store_test.SqliteTestMixin,
+                            test_lib.GRRBaseTest):
+  """Tests the audit event counts with a data store that decodes values."""
+
+  def setUp(self):
+    self.fake_db = data_store.DB
+    super(SqliteReportUtilsTest, self).setUp()
+    self.InitDatastore()
+    audit.AuditEventListener.created_logs.clear()
+
+  def tearDown(self):
+    self.DestroyDatastore()
+    data_store.DB = self.fake_db
+    super(SqliteReportUtilsTest, self).tearDown()
+
+  def testGetAuditEventCounts(self):
+    with test_lib.FakeTime(
+        rdfvalue.RDFDatetime.FromHumanReadable("2012/12/22"), increment=1):
+      for _ in xrange(3):
+        AddFakeAuditLog(
+            action=events.AuditEvent.Action.RUN_FLOW,
+            user="User123",
+            flow_name="Flow123",
+            token=self.token)
+
+    now = rdfvalue.RDFDatetime.FromHumanReadable("2012/12/31")
+    self.assertEqual(audit.BuildAuditAggregates(token=self.token), 3)
+
+    day = rdfvalue.RDFDatetime.FromHumanReadable("2012/12/22")
+    self.assertEqual(
+        report_utils.GetAuditEventCounts(
+            rdfvalue.Duration("16d"), now, token=self.token),
+        [(day, events.AuditEvent.Action.RUN_FLOW, "Flow123", "User123", 3)])
+
+  def testGetAuditEventCounts(self):
+    with test_lib.FakeTime(
+        rdfvalue.RDFDatetime.FromHumanReadable("2012/12/14")):
+      AddFakeAuditLog(user="User123", token=self.token)
+
+    with test_lib.FakeTime(
+        rdfvalue.RDFDatetime.FromHumanReadable("2012/12/22"), increment=1):
+      for _ in xrange(3):
+        AddFakeAuditLog(
+            action=events.AuditEvent.Action.RUN_FLOW,
+            user="User123",
+            flow_name="Flow123",
+            token=self.token)
+      AddFakeAuditLog(
+          action=events.AuditEvent.Action.RUN_FLOW,
+          user="domain:User456",
+          flow_name="Flow123",
+          token=self.token)
+
+    counts = report_utils.GetAuditEventCounts(
+        rdfvalue.Duration("16d"),
+        rdfvalue.RDFDatetime.FromHumanReadable("2012/12/31"),
+        token=self.token)
+
+    day = rdfvalue.RDFDatetime.FromHumanReadable("2012/12/22")
+    self.assertItemsEqual(counts, [
+        (day, events.AuditEvent.Action.RUN_FLOW, "Flow123", "User123", 3),
+        (day, events.AuditEvent.Action.RUN_FLOW, "Flow123", "domain:User456",
+         1)
+    ])
+
+    # The counts are kept per day, the whole first day is included.
+    counts = report_utils.GetAuditEventCounts(
+        rdfvalue.Duration("16d") + rdfvalue.Duration("1h"),
+        rdfvalue.RDFDatetime.FromHumanReadable("2012/12/31"),
+        token=self.token)
+    self.assertEqual(sum(count for _, _, _, _, count in counts), 5)
+
 
 class ClientReportPluginsTest(test_lib.GRRBaseTest):
 
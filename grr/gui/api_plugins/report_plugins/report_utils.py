@@ -1,8 +1,6 @@
 #!/usr/bin/env python
 """UI report handling helper utils."""
 
-from grr.lib import config_lib
-from grr.lib import rdfvalue
 from grr.lib.flows.general import audit
 
 
@@ -18,8 +16,7 @@ def GetAuditLogEntries(offset, now, token):
   Yields:
     AuditEvents created during the time range
   """
-  start_time = now - offset - rdfvalue.Duration(
-      config_lib.CONFIG["Logging.aff4_audit_log_rollover"])
+  start_time = now - offset
 
   logs_found = False
   for fd in audit.AuditLogsForTimespan(start_time, now, token):
@@ -31,3 +28,17 @@ def GetAuditLogEntries(offset, now, token):
   if not logs_found:
     raise ValueError("Couldn't find any logs in aff4:/audit/logs "
                      "between %s and %s" % (start_time, now))
+
+
+def GetAuditEventCounts(offset, now, token):
+  """Return the per day audit event counts between now-offset and now.
+
+  Args:
+    offset: rdfvalue.Duration how far back to look in time
+    now: rdfvalue.RDFDatetime for current time
+    token: GRR access token
+  Returns:
+    A list of (day, action, flow_name, user, count) tuples for all days
+    overlapping the time range.
+  """
+  return list(audit.AuditEventCounts(now - offset, now, token=token))
@@ -7,11 +7,9 @@ from grr.gui.api_plugins.report_plugins import rdf_report_plugins
 from grr.gui.api_plugins.report_plugins import report_plugin_base
 from grr.gui.api_plugins.report_plugins import report_utils
 
-from grr.lib import config_lib
 from grr.lib import events
 from grr.lib import rdfvalue
 from grr.lib.aff4_objects import users as aff4_users
-from grr.lib.flows.general import audit
 
 TYPE = rdf_report_plugins.ApiReportDescriptor.ReportType.SERVER
 
@@ -221,13 +219,9 @@ class MostActiveUsersReportPlugin(report_plugin_base.ReportPluginBase):
       timerange_end = get_report_args.start_time + timerange_offset
 
       counts = {}
-      try:
-        for event in report_utils.GetAuditLogEntries(timerange_offset,
-                                                     timerange_end, token):
-          counts.setdefault(event.user, 0)
-          counts[event.user] += 1
-      except ValueError:  # Couldn't find any logs..
-        pass
+      for _, _, _, user, count in report_utils.GetAuditEventCounts(
+          timerange_offset, timerange_end, token):
+        counts[user] = counts.get(user, 0) + count
 
       ret.pie_chart.data = sorted(
           (rdf_report_plugins.ApiReportDataPoint1D(x=count, label=user)
@@ -259,25 +253,20 @@ class SystemFlowsReportPlugin(report_plugin_base.ReportPluginBase):
         STACK_CHART,
         stack_chart=rdf_report_plugins.ApiStackChartReportData(x_ticks=[]))
 
-    # TODO(user): move the calculation to a cronjob and store results in
-    # AFF4.
     try:
       timerange_offset = get_report_args.duration
       timerange_end = get_report_args.start_time + timerange_offset
 
       # Store run count total and per-user
       counts = {}
-      try:
-        for event in report_utils.GetAuditLogEntries(timerange_offset,
-                                                     timerange_end, token):
-          if (event.action == events.AuditEvent.Action.RUN_FLOW and
-              self.UserFilter(event.user)):
-            counts.setdefault(event.flow_name, {"total": 0, event.user: 0})
-            counts[event.flow_name]["total"] += 1
-            counts[event.flow_name].setdefault(event.user, 0)
-            counts[event.flow_name][event.user] += 1
-      except ValueError:  # Couldn't find any logs..
-        pass
+      for _, action, flow_name, user, count in (
+          report_utils.GetAuditEventCounts(timerange_offset, timerange_end,
+                                           token)):
+        if (action == events.AuditEvent.Action.RUN_FLOW and
+            self.UserFilter(user)):
+          countdict = counts.setdefault(flow_name, {"total": 0})
+          countdict["total"] += count
+          countdict[user] = countdict.get(user, 0) + count
 
       for i, (flow, countdict) in enumerate(
           sorted(counts.iteritems(), key=lambda x: x[1]["total"],
@@ -324,21 +313,16 @@ class UserActivityReportPlugin(report_plugin_base.ReportPluginBase):
       week_duration = rdfvalue.Duration("7d")
       offset = rdfvalue.Duration("%dw" % self.WEEKS)
       now = rdfvalue.RDFDatetime.Now()
-      # TODO(user): Why is the rollover not a duration?
-      start_time = now - offset - rdfvalue.Duration(
-          config_lib.CONFIG["Logging.aff4_audit_log_rollover"])
-      try:
-        for fd in audit.AuditLogsForTimespan(start_time, now, token):
-          for event in fd.GenerateItems():
-            for week in xrange(self.__class__.WEEKS):
-              start = now - week * week_duration
-              if start < event.timestamp < (start + week_duration):
-                weekly_activity = user_activity.setdefault(
-                    event.user, [[x, 0]
-                                 for x in xrange(-self.__class__.WEEKS, 0, 1)])
-                weekly_activity[-week][1] += 1
-      except ValueError:  # Couldn't find any logs..
-        pass
+      for day, _, _, user, count in report_utils.GetAuditEventCounts(
+          offset, now, token):
+        # Week 1 is the last seven days.
+        week = (now - day).seconds // week_duration.seconds + 1
+        if week > self.__class__.WEEKS:
+          continue
+
+        weekly_activity = user_activity.setdefault(
+            user, [[x, 0] for x in xrange(-self.__class__.WEEKS, 0, 1)])
+        weekly_activity[-week][1] += count
 
       ret.stack_chart.data = sorted(
           (rdf_report_plugins.ApiReportDataSeries2D(
@@ -373,25 +357,20 @@ class UserFlowsReportPlugin(report_plugin_base.ReportPluginBase):
         STACK_CHART,
         stack_chart=rdf_report_plugins.ApiStackChartReportData(x_ticks=[]))
 
-    # TODO(user): move the calculation to a cronjob and store results in
-    # AFF4.
     try:
       timerange_offset = get_report_args.duration
       timerange_end = get_report_args.start_time + timerange_offset
 
       # Store run count total and per-user
       counts = {}
-      try:
-        for event in report_utils.GetAuditLogEntries(timerange_offset,
-                                                     timerange_end, token):
-          if (event.action == events.AuditEvent.Action.RUN_FLOW and
-              self.UserFilter(event.user)):
-            counts.setdefault(event.flow_name, {"total": 0, event.user: 0})
-            counts[event.flow_name]["total"] += 1
-            counts[event.flow_name].setdefault(event.user, 0)
-            counts[event.flow_name][event.user] += 1
-      except ValueError:  # Couldn't find any logs..
-        pass
+      for _, action, flow_name, user, count in (
+          report_utils.GetAuditEventCounts(timerange_offset, timerange_end,
+                                           token)):
+        if (action == events.AuditEvent.Action.RUN_FLOW and
+            self.UserFilter(user)):
+          countdict = counts.setdefault(flow_name, {"total": 0})
+          countdict["total"] += count
+          countdict[user] = countdict.get(user, 0) + count
 
       for i, (flow, countdict) in enumerate(
           sorted(counts.iteritems(), key=lambda x: x[1]["total"],
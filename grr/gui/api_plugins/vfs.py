@@ -2,6 +2,7 @@
 """API handlers for dealing with files in a client's virtual file system."""
 
 import csv
+import itertools
 import os
 import re
 import StringIO
@@ -10,11 +11,12 @@ import zipfile
 import logging
 
 from grr.gui import api_call_handler_base
+from grr.gui import api_call_handler_utils
 
 from grr.lib import aff4
 from grr.lib import config_lib
-from grr.lib import data_store
 from grr.lib import flow
+from grr.lib import mactime_index
 from grr.lib import rdfvalue
 from grr.lib import utils
 from grr.lib.aff4_objects import aff4_grr
@@ -61,6 +63,10 @@ class VfsFileContentUpdateNotFoundError(
   """Raised when a file content update operation could not be found."""
 
 
+class VfsTimelineNotBuiltError(api_call_handler_base.ResourceNotFoundError):
+  """Raised when the timeline of a client is not indexed yet."""
+
+
 class ApiFile(rdf_structs.RDFProtoStruct):
   protobuf = api_pb2.ApiFile
 
@@ -631,60 +637,98 @@ class ApiGetVfsTimelineHandler(api_call_handler_base.ApiCallHandler):
   def Handle(self, args, token=None):
     ValidateVfsPath(args.file_path)
 
-    folder_urn = args.client_id.ToClientURN().Add(args.file_path)
-    items = self.GetTimelineItems(folder_urn, token=token)
-    return ApiGetVfsTimelineResult(items=items)
+    client_urn = args.client_id.ToClientURN()
+    if not self.IndexIsBuilt(client_urn, token=token):
+      return ApiGetVfsTimelineResult(
+          state=ApiGetVfsTimelineResult.State.BUILDING)
+
+    folder_urn = client_urn.Add(args.file_path)
+    items = self.GetTimelineItems(
+        folder_urn,
+        start_time=args.start_time,
+        end_time=args.end_time,
+        token=token)
+
+    stop = None
+    if args.count:
+      stop = args.offset + args.count
+
+    return ApiGetVfsTimelineResult(
+        items=list(itertools.islice(items, args.offset, stop)))
 
   @staticmethod
-  def GetTimelineItems(folder_urn, token=None):
+  def IndexIsBuilt(client_urn, token=None):
+    """Checks that the MAC time index of a client holds all its files.
+
+    Clients with files written before the index existed are indexed by a
+    BuildMACTimeIndex flow, which is started here unless one is running.
+
+    Args:
+      client_urn: The urn of the client.
+      token: The user token.
+
+    Returns:
+      True if the timeline of the client can be read.
+    """
+    index = mactime_index.MACTimeIndex(client_urn, token=token)
+    if index.IsBuilt():
+      return True
+
+    flow_urn = index.GetBuildFlow()
+    if flow_urn:
+      try:
+        flow_obj = aff4.FACTORY.Open(
+            flow_urn, aff4_type=filesystem.BuildMACTimeIndex, token=token)
+        if flow_obj.GetRunner().IsRunning():
+          return False
+      except aff4.InstantiationError:
+        pass
+
+    flow_urn = flow.GRRFlow.StartFlow(
+        client_id=client_urn,
+        flow_name=filesystem.BuildMACTimeIndex.__name__,
+        sync=False,
+        notify_to_user=False,
+        token=token)
+    index.SetBuildFlow(flow_urn)
+    return False
+
+  @staticmethod
+  def GetTimelineItems(folder_urn, start_time=None, end_time=None, token=None):
     """Retrieves the timeline items for a given folder.
 
     The timeline consists of items indicating a state change of a file. To
     construct the timeline, MAC times are used. Whenever a timestamp on a
     file changes, a corresponding timeline item is created.
 
+    The items are read from the client's MAC time index, newest first, so
+    they can be consumed one by one without collecting the whole timeline.
+
     Args:
       folder_urn: The urn of the target folder.
+      start_time: If set, only items at or after this RDFDatetime are
+        returned.
+      end_time: If set, only items at or before this RDFDatetime are returned.
       token: The user token.
 
-    Returns:
-      A list of timeline items, each consisting of a file path, a timestamp
-      and an action describing the nature of the file change.
+    Yields:
+      Timeline items, each consisting of a file path, a timestamp and an
+      action describing the nature of the file change.
     """
-    child_urns = []
-    for _, children in aff4.FACTORY.RecursiveMultiListChildren(
-        folder_urn, token=token):
-      child_urns.extend(children)
-
-    # Get the stats attributes for all clients.
-    attribute = aff4.Attribute.GetAttributeByName("stat")
-
-    items = []
-    for subject, values in data_store.DB.MultiResolvePrefix(
-        child_urns, attribute.predicate, token=token):
-      for _, serialized, _ in values:
-        stat = rdf_client.StatEntry.FromSerializedString(serialized)
-
-        # Add a new event for each MAC time if it exists.
-        for c in "mac":
-          timestamp = getattr(stat, "st_%stime" % c)
-          if timestamp is not None:
-            item = ApiVfsTimelineItem()
-            item.timestamp = timestamp * 1000000
-
-            # Remove aff4:/<client_id> to have a more concise path to the
-            # subject.
-            item.file_path = "/".join(str(subject).split("/")[2:])
-            if c == "m":
-              item.action = ApiVfsTimelineItem.FileActionType.MODIFICATION
-            elif c == "a":
-              item.action = ApiVfsTimelineItem.FileActionType.ACCESS
-            elif c == "c":
-              item.action = ApiVfsTimelineItem.FileActionType.METADATA_CHANGED
-
-            items.append(item)
-
-    return sorted(items, key=lambda x: x.timestamp, reverse=True)
+    client_id, folder_path = folder_urn.Path().lstrip("/").split("/", 1)
+    index = mactime_index.MACTimeIndex(client_id, token=token)
+
+    actions = {
+        "m": ApiVfsTimelineItem.FileActionType.MODIFICATION,
+        "a": ApiVfsTimelineItem.FileActionType.ACCESS,
+        "c": ApiVfsTimelineItem.FileActionType.METADATA_CHANGED,
+    }
+    for timestamp, file_path, action in index.ReadTimeline(
+        path_prefix=folder_path.rstrip("/") + "/",
+        start_time=start_time,
+        end_time=end_time):
+      yield ApiVfsTimelineItem(
+          timestamp=timestamp, file_path=file_path, action=actions[action])
 
 
 class ApiGetVfsTimelineAsCsvArgs(rdf_structs.RDFProtoStruct):
@@ -705,8 +749,8 @@ class ApiGetVfsTimelineAsCsvHandler(api_call_handler_base.ApiCallHandler):
     # can export a format suited for TimeSketch import.
     writer.writerow(["Timestamp", "Datetime", "Message", "Timestamp_desc"])
 
-    for start in range(0, len(items), self.CHUNK_SIZE):
-      for item in items[start:start + self.CHUNK_SIZE]:
+    for chunk in utils.Grouper(items, self.CHUNK_SIZE):
+      for item in chunk:
         writer.writerow([
             item.timestamp.AsMicroSecondsFromEpoch(), item.timestamp,
             utils.SmartStr(item.file_path), item.action
@@ -718,8 +762,18 @@ class ApiGetVfsTimelineAsCsvHandler(api_call_handler_base.ApiCallHandler):
   def Handle(self, args, token=None):
     ValidateVfsPath(args.file_path)
 
-    folder_urn = args.client_id.ToClientURN().Add(args.file_path)
-    items = ApiGetVfsTimelineHandler.GetTimelineItems(folder_urn, token=token)
+    client_urn = args.client_id.ToClientURN()
+    if not ApiGetVfsTimelineHandler.IndexIsBuilt(client_urn, token=token):
+      raise VfsTimelineNotBuiltError(
+          "The timeline of %s is being built, please try again later." %
+          args.client_id)
+
+    folder_urn = client_urn.Add(args.file_path)
+    items = ApiGetVfsTimelineHandler.GetTimelineItems(
+        folder_urn,
+        start_time=args.start_time,
+        end_time=args.end_time,
+        token=token)
 
     return api_call_handler_base.ApiBinaryStream(
         "%s_%s_timeline" % (args.client_id,
@@ -803,54 +857,37 @@ class ApiGetVfsFilesArchiveHandler(api_call_handler_base.ApiCallHandler):
 
   args_type = ApiGetVfsFilesArchiveArgs
 
-  def _StreamFds(self, archive_generator, prefix, fds, token=None):
-    prev_fd = None
-    for fd, chunk, exception in aff4.AFF4Stream.MultiStream(fds):
-      if exception:
-        logging.exception(exception)
-        continue
-
-      if prev_fd != fd:
-        if prev_fd:
-          yield archive_generator.WriteFileFooter()
-        prev_fd = fd
-
-        components = fd.urn.Split()
-        # Skipping first component: client id.
-        content_path = os.path.join(prefix, *components[1:])
-        # TODO(user): Export meaningful file metadata.
-        st = os.stat_result((0644, 0, 0, 0, 0, 0, fd.size, 0, 0, 0))
-        yield archive_generator.WriteFileHeader(content_path, st=st)
-
-      yield archive_generator.WriteFileChunk(chunk)
-
-    if prev_fd:
-      yield archive_generator.WriteFileFooter()
-
-  def _GenerateContent(self, start_urns, prefix, token=None):
+  def _GenerateContent(self, start_urns, prefix, store_only=False,
+                       token=None):
     archive_generator = utils.StreamingZipGenerator(
         compression=zipfile.ZIP_DEFLATED)
     folders_urns = set(start_urns)
 
-    while folders_urns:
-      next_urns = set()
-      for _, children in aff4.FACTORY.MultiListChildren(
-          folders_urns, token=token):
-        for urn in children:
-          next_urns.add(urn)
-
-      download_fds = set()
-      folders_urns = set()
-      for fd in aff4.FACTORY.MultiOpen(next_urns, token=token):
-        if isinstance(fd, aff4.AFF4Stream):
-          download_fds.add(fd)
-        elif "Container" in fd.behaviours:
-          folders_urns.add(fd.urn)
-
-      if download_fds:
-        for chunk in self._StreamFds(
-            archive_generator, prefix, download_fds, token=token):
-          yield chunk
+    with api_call_handler_utils.ArchiveCompressionPipeline(
+        store_only=store_only) as pipeline:
+      while folders_urns:
+        next_urns = set()
+        for _, children in aff4.FACTORY.MultiListChildren(
+            folders_urns, token=token):
+          for urn in children:
+            next_urns.add(urn)
+
+        download_fds = {}
+        folders_urns = set()
+        for fd in aff4.FACTORY.MultiOpen(next_urns, token=token):
+          if isinstance(fd, aff4.AFF4Stream):
+            components = fd.urn.Split()
+            # Skipping first component: client id.
+            content_path = os.path.join(prefix, *components[1:])
+            # TODO(user): Export meaningful file metadata.
+            st = os.stat_result((0644, 0, 0, 0, 0, 0, fd.size, 0, 0, 0))
+            download_fds[fd] = (content_path, st)
+          elif "Container" in fd.behaviours:
+            folders_urns.add(fd.urn)
+
+        if download_fds:
+          for chunk in pipeline.StreamFiles(archive_generator, download_fds):
+            yield chunk
 
     yield archive_generator.Close()
 
@@ -867,6 +904,7 @@ class ApiGetVfsFilesArchiveHandler(api_call_handler_base.ApiCallHandler):
       prefix = "vfs_" + re.sub("[^0-9a-zA-Z]", "_",
                                start_urns[0].Path()).strip("_")
 
-    content_generator = self._GenerateContent(start_urns, prefix, token=token)
+    content_generator = self._GenerateContent(
+        start_urns, prefix, store_only=args.store_only, token=token)
     return api_call_handler_base.ApiBinaryStream(
         prefix + ".zip", content_generator=content_generator)
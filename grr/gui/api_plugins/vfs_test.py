@@ -15,8 +15,10 @@ from grr.lib import action_mocks
 from grr.lib import aff4
 from grr.lib import flags
 from grr.lib import flow
+from grr.lib import mactime_index
 from grr.lib import rdfvalue
 from grr.lib import test_lib
+from grr.lib import utils
 from grr.lib.aff4_objects import aff4_grr
 from grr.lib.aff4_objects import users as aff4_users
 from grr.lib.flows.general import filesystem
@@ -646,6 +648,8 @@ class VfsTimelineTestMixin(object):
               st_mtime=rdfvalue.RDFDatetimeSeconds().Now())
           fd.Set(fd.Schema.STAT, stats)
 
+    mactime_index.MACTimeIndex(self.client_id, token=self.token).Rebuild()
+
 
 class ApiGetVfsTimelineAsCsvHandlerTest(api_test_lib.ApiCallHandlerTest,
                                         VfsTimelineTestMixin):
@@ -734,6 +738,64 @@ class ApiGetVfsTimelineHandlerTest(api_test_lib.ApiCallHandlerTest,
     with self.assertRaises(ValueError):
       self.handler.Handle(args, token=self.token)
 
+  def testTimelineIsPaginated(self):
+    args = vfs_plugin.ApiGetVfsTimelineArgs(
+        client_id=self.client_id,
+        file_path=self.folder_path,
+        offset=1,
+        count=2)
+    result = self.handler.Handle(args, token=self.token)
+
+    self.assertEqual(
+        [item.timestamp.AsSecondsFromEpoch() for item in result.items], [3, 2])
+    for item in result.items:
+      self.assertEqual(item.file_path, self.file_path.decode("utf-8"))
+      self.assertEqual(
+          item.action,
+          vfs_plugin.ApiVfsTimelineItem.FileActionType.MODIFICATION)
+
+  def testTimelineIsFilteredByTime(self):
+    args = vfs_plugin.ApiGetVfsTimelineArgs(
+        client_id=self.client_id,
+        file_path=self.folder_path,
+        start_time=rdfvalue.RDFDatetime().FromSecondsFromEpoch(1),
+        end_time=rdfvalue.RDFDatetime().FromSecondsFromEpoch(2))
+    result = self.handler.Handle(args, token=self.token)
+
+    self.assertEqual(
+        [item.timestamp.AsSecondsFromEpoch() for item in result.items], [2, 1])
+
+  def testTimelineIndexIsBuiltByFlow(self):
+    client_id = self.SetupClients(2)[1]
+    file_urn = client_id.Add(self.file_path)
+    # A file written before the index existed.
+    with utils.Stubber(mactime_index, "IndexStatEntries", lambda *_, **__: 0):
+      with aff4.FACTORY.Create(
+          file_urn, aff4_grr.VFSAnalysisFile, mode="w",
+          token=self.token) as fd:
+        fd.Set(fd.Schema.STAT, rdf_client.StatEntry(st_mtime=42))
+
+    args = vfs_plugin.ApiGetVfsTimelineArgs(
+        client_id=client_id, file_path=self.folder_path)
+    result = self.handler.Handle(args, token=self.token)
+    self.assertEqual(result.state,
+                     vfs_plugin.ApiGetVfsTimelineResult.State.BUILDING)
+    self.assertFalse(result.items)
+
+    index = mactime_index.MACTimeIndex(client_id, token=self.token)
+    flow_urn = index.GetBuildFlow()
+    # A running build is not started again.
+    self.handler.Handle(args, token=self.token)
+    self.assertEqual(index.GetBuildFlow(), flow_urn)
+
+    for _ in test_lib.TestFlowHelper(flow_urn, token=self.token):
+      pass
+
+    result = self.handler.Handle(args, token=self.token)
+    self.assertEqual(result.state,
+                     vfs_plugin.ApiGetVfsTimelineResult.State.READY)
+    self.assertEqual(
+        [item.timestamp.AsSecondsFromEpoch() for item in result.items], [42])
 
 class ApiGetVfsFilesArchiveHandlerTest(api_test_lib.ApiCallHandlerTest,
                                        VfsTestMixin):
@@ -788,6 +850,23 @@ class ApiGetVfsFilesArchiveHandlerTest(api_test_lib.ApiCallHandlerTest,
     contents = zip_fd.read(archive_path)
     self.assertEqual(contents, "Goodbye World")
 
+  def testStoreOnlyGeneratesUncompressedArchive(self):
+    archive_path = "vfs_C_1000000000000000/fs/os/c/b.txt"
+
+    result = self.handler.Handle(
+        vfs_plugin.ApiGetVfsFilesArchiveArgs(
+            client_id=self.client_id, store_only=True),
+        token=self.token)
+
+    out_fd = StringIO.StringIO()
+    for chunk in result.GenerateContent():
+      out_fd.write(chunk)
+
+    zip_fd = zipfile.ZipFile(out_fd, "r")
+    self.assertEqual(
+        zip_fd.getinfo(archive_path).compress_type, zipfile.ZIP_STORED)
+    self.assertEqual(zip_fd.read(archive_path), "Goodbye World")
+
   def testNonExistentPathGeneratesEmptyArchive(self):
     result = self.handler.Handle(
         vfs_plugin.ApiGetVfsFilesArchiveArgs(
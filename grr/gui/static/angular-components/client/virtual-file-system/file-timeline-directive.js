@@ -46,6 +46,15 @@ grrUi.client.virtualFileSystem.fileTimelineDirective.FileTimelineController = fu
   /** @type {boolean} */
   this.inProgress;
 
+  /**
+   * True while the server builds the timeline index of the client.
+   * @type {boolean}
+   */
+  this.indexBuilding;
+
+  /** @private {angular.$q.Promise} */
+  this.pollPromise_;
+
   /** @type {string} */
   this.currentFolder;
 
@@ -62,6 +71,11 @@ grrUi.client.virtualFileSystem.fileTimelineDirective.FileTimelineController = fu
 
   this.scope_.$watch('controller.fileContext.clientId', this.refreshTimeline_.bind(this));
   this.scope_.$watch('controller.fileContext.selectedFilePath', this.onFilePathChange_.bind(this));
+  this.scope_.$on('$destroy', function() {
+    if (this.pollPromise_) {
+      this.grrApiService_.cancelPoll(this.pollPromise_);
+    }
+  }.bind(this));
 };
 
 var FileTimelineController =
@@ -108,11 +122,21 @@ FileTimelineController.prototype.refreshTimeline_ = function() {
   }
 
   this.inProgress = true;
+  if (this.pollPromise_) {
+    this.grrApiService_.cancelPoll(this.pollPromise_);
+  }
 
+  // The timeline is not available while the server builds the index of the
+  // client, it is polled until the index is ready.
   var url = 'clients/' + clientId + '/vfs-timeline/' + selectedFolderPath;
-  this.grrApiService_.get(url).then(this.onTimelineFetched_.bind(this))
+  this.pollPromise_ = this.grrApiService_.poll(url, undefined, function(response) {
+    this.indexBuilding = response['data']['state'] === 'BUILDING';
+    return !this.indexBuilding;
+  }.bind(this));
+  this.pollPromise_.then(this.onTimelineFetched_.bind(this))
       .finally(function() {
         this.inProgress = false;
+        this.indexBuilding = false;
       }.bind(this));
 };
 
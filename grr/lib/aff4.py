@@ -66,6 +66,10 @@ class BadGetAttributeError(Exception):
   pass
 
 
+class AttributeNotLoadedError(BadGetAttributeError):
+  """Raised when reading an attribute which was not loaded by a projection."""
+
+
 class MissingChunksError(Exception):
 
   def __init__(self, message, missing_chunks=None):
@@ -309,20 +313,41 @@ class Factory(object):
 
     raise RuntimeError("Unknown age specification: %s" % age)
 
-  def GetAttributes(self, urns, token=None, age=NEWEST_TIME):
-    """Retrieves all the attributes for all the urns."""
+  def GetAttributes(self, urns, token=None, age=NEWEST_TIME, predicates=None):
+    """Retrieves all the attributes for all the urns.
+
+    Args:
+      urns: The urns to read.
+      token: The security token used for reading.
+      age: The age policy of the values to read.
+      predicates: If set, only the attributes with these predicates are read.
+
+    Yields:
+      (subject, values) tuples with values sorted newest first.
+    """
     urns = set([utils.SmartUnicode(u) for u in urns])
     to_read = {urn: self._MakeCacheInvariant(urn, token, age) for urn in urns}
 
+    if predicates is None:
+      prefixes = AFF4_PREFIXES
+    else:
+      predicates = set(utils.SmartStr(p) for p in predicates)
+      prefixes = sorted(predicates)
+
     # Urns not present in the cache we need to get from the database.
     if to_read:
       for subject, values in data_store.DB.MultiResolvePrefix(
           to_read,
-          AFF4_PREFIXES,
+          prefixes,
           timestamp=self.ParseAgeSpecification(age),
           token=token,
           limit=None):
 
+        # The data store matches columns by prefix, so longer predicates which
+        # share a prefix with a requested one have to be dropped.
+        if predicates is not None:
+          values = [v for v in values if v[0] in predicates]
+
         # Ensure the values are sorted.
         values.sort(key=lambda x: x[-1], reverse=True)
 
@@ -576,6 +601,47 @@ class Factory(object):
         follow_symlinks=False,
         transaction=transaction)
 
+  def RelockObject(self,
+                   obj,
+                   blocking=True,
+                   blocking_lock_timeout=10,
+                   blocking_sleep_interval=1,
+                   lease_time=100):
+    """Locks an object which was opened with lock and closed again.
+
+    This allows keeping an object in memory across lock cycles instead of
+    reading it again every time. The object is returned in "rw" mode holding
+    the attribute values it had when it was closed - it is up to the caller to
+    make sure nobody else changed it in the meantime.
+
+    Args:
+      obj: An AFF4Object which was opened with OpenWithLock() and closed.
+      blocking: When True, wait and repeatedly try to grab the lock.
+      blocking_lock_timeout: Maximum wait time when sync is True.
+      blocking_sleep_interval: Sleep time between lock grabbing attempts. Used
+          when blocking is True.
+      lease_time: Maximum time the object stays locked.
+
+    Returns:
+      The locked object.
+
+    Raises:
+      LockError: If the lock could not be acquired.
+    """
+    transaction = self._AcquireLock(
+        obj.urn,
+        token=obj.token,
+        blocking=blocking,
+        blocking_lock_timeout=blocking_lock_timeout,
+        blocking_sleep_interval=blocking_sleep_interval,
+        lease_time=lease_time)
+
+    # The attributes written by Close() are now the ones in the data store.
+    obj._SyncAttributes()  # pylint: disable=protected-access
+    obj.transaction = transaction
+    obj.mode = "rw"
+    return obj
+
   def _AcquireLock(self,
                    urn,
                    token=None,
@@ -639,6 +705,37 @@ class Factory(object):
 
       self._UpdateChildIndex(new_urn, token)
 
+  def _ProjectionPredicates(self, attributes, mode):
+    """Returns the predicates to read for an attribute projection.
+
+    Args:
+      attributes: A list of Attribute instances or None.
+      mode: The mode the objects are opened with.
+
+    Returns:
+      A frozenset of predicates or None if all attributes should be read.
+
+    Raises:
+      ValueError: If the objects are opened for writing.
+    """
+    if attributes is None:
+      return None
+
+    if mode != "r":
+      raise ValueError("Objects opened with an attribute projection are read "
+                       "only, mode %s is not supported." % mode)
+
+    # The type is needed to instantiate the right class and the symlink target
+    # to follow symlinks.
+    predicates = set([
+        AFF4Object.SchemaCls.TYPE.predicate,
+        AFF4Symlink.SchemaCls.SYMLINK_TARGET.predicate
+    ])
+    for attribute in attributes:
+      predicates.add(attribute.predicate)
+
+    return frozenset(predicates)
+
   def Open(self,
            urn,
            aff4_type=None,
@@ -647,7 +744,8 @@ class Factory(object):
            local_cache=None,
            age=NEWEST_TIME,
            follow_symlinks=True,
-           transaction=None):
+           transaction=None,
+           attributes=None):
     """Opens the named object.
 
     This instantiates the object from the AFF4 data store.
@@ -681,6 +779,10 @@ class Factory(object):
 
       follow_symlinks: If object opened is a symlink, follow it.
       transaction: A lock in case this object is opened under lock.
+      attributes: If set, only these attributes (and the object's type) are
+          read from the data store. The object is read only and raises
+          AttributeNotLoadedError when any other attribute is accessed, so
+          the attributes read by its Initialize() have to be listed as well.
 
     Returns:
       An AFF4Object instance.
@@ -688,12 +790,15 @@ class Factory(object):
     Raises:
       IOError: If the object is not of the required type.
       AttributeError: If the requested mode is incorrect.
+      ValueError: If attributes are given for an object opened for writing.
     """
     aff4_type = _ValidateAFF4Type(aff4_type)
 
     if mode not in ["w", "r", "rw"]:
       raise AttributeError("Invalid mode %s" % mode)
 
+    predicates = self._ProjectionPredicates(attributes, mode)
+
     if mode == "w":
       if aff4_type is None:
         raise AttributeError("Need a type to open in write only mode.")
@@ -712,7 +817,9 @@ class Factory(object):
       token = data_store.default_token
 
     if "r" in mode and (local_cache is None or urn not in local_cache):
-      local_cache = dict(self.GetAttributes([urn], age=age, token=token))
+      local_cache = dict(
+          self.GetAttributes(
+              [urn], age=age, token=token, predicates=predicates))
 
     # Read the row from the table. We know the object already exists if there is
     # some data in the local_cache already for this object.
@@ -724,7 +831,8 @@ class Factory(object):
         age=age,
         follow_symlinks=follow_symlinks,
         object_exists=bool(local_cache.get(urn)),
-        transaction=transaction)
+        transaction=transaction,
+        loaded_attributes=predicates)
 
     result.aff4_type = aff4_type
 
@@ -752,8 +860,25 @@ class Factory(object):
                 token=None,
                 aff4_type=None,
                 age=NEWEST_TIME,
-                follow_symlinks=True):
-    """Opens a bunch of urns efficiently."""
+                follow_symlinks=True,
+                attributes=None):
+    """Opens a bunch of urns efficiently.
+
+    Args:
+      urns: The urns to open.
+      mode: The mode to open the objects with.
+      token: The Security Token to use for opening the objects.
+      aff4_type: If set, only objects of this type are returned.
+      age: The age policy used to build the objects.
+      follow_symlinks: If an object is a symlink, return its target instead.
+      attributes: If set, only these attributes are read, see Open().
+
+    Yields:
+      AFF4Object instances.
+
+    Raises:
+      RuntimeError: If the requested mode is incorrect.
+    """
 
     if token is None:
       token = data_store.default_token
@@ -764,8 +889,10 @@ class Factory(object):
     symlinks = {}
 
     aff4_type = _ValidateAFF4Type(aff4_type)
+    predicates = self._ProjectionPredicates(attributes, mode)
 
-    for urn, values in self.GetAttributes(urns, token=token, age=age):
+    for urn, values in self.GetAttributes(
+        urns, token=token, age=age, predicates=predicates):
       try:
         obj = self.Open(
             urn,
@@ -773,7 +900,8 @@ class Factory(object):
             token=token,
             local_cache={urn: values},
             age=age,
-            follow_symlinks=False)
+            follow_symlinks=False,
+            attributes=attributes)
         # We can't pass aff4_type to Open since it will raise on AFF4Symlinks.
         # Setting it here, if needed, so that BadGetAttributeError checking
         # works.
@@ -794,7 +922,12 @@ class Factory(object):
 
     if symlinks:
       for obj in self.MultiOpen(
-          symlinks, mode=mode, token=token, aff4_type=aff4_type, age=age):
+          symlinks,
+          mode=mode,
+          token=token,
+          aff4_type=aff4_type,
+          age=age,
+          attributes=attributes):
         to_link = symlinks[obj.urn]
         for additional_symlink in to_link[1:]:
           clone = obj.__class__(obj.urn, clone=obj)
@@ -1005,6 +1138,8 @@ class Factory(object):
     Args:
       urns: Urns of objects to remove.
       token: The Security Token to use for opening this item.
+    Returns:
+      The number of subjects deleted.
     Raises:
       RuntimeError: If one of the urns is too short. This is a safety check to
       ensure the root is not removed.
@@ -1052,6 +1187,7 @@ class Factory(object):
     self.Flush()
 
     logging.debug("Removed %d objects", len(marked_urns))
+    return len(marked_urns)
 
   def Delete(self, urn, token=None):
     """Drop all the information about this object.
@@ -1627,7 +1763,8 @@ class AFF4Object(object):
                aff4_type=None,
                object_exists=False,
                mutation_pool=None,
-               transaction=None):
+               transaction=None,
+               loaded_attributes=None):
     if urn is not None:
       urn = rdfvalue.RDFURN(urn)
     self.urn = urn
@@ -1662,6 +1799,14 @@ class AFF4Object(object):
     # verify aff4 attributes exist in the schema at Get() time.
     self.aff4_type = aff4_type
 
+    # The predicates of the attributes read from the data store if the object
+    # was opened with an attribute projection, None if all were read. This is
+    # enforced in Initialize() as well, so attributes it needs have to be part
+    # of the projection instead of silently reading as unset.
+    if isinstance(clone, AFF4Object):
+      loaded_attributes = loaded_attributes or clone.loaded_attributes
+    self.loaded_attributes = loaded_attributes
+
     # We maintain two attribute caches - self.synced_attributes reflects the
     # attributes which are synced with the data_store, while self.new_attributes
     # are new attributes which still need to be flushed to the data_store. When
@@ -1696,7 +1841,7 @@ class AFF4Object(object):
         else:
           # Populate the caches from the data store.
           for urn, values in FACTORY.GetAttributes(
-              [urn], age=age, token=self.token):
+              [urn], age=age, token=self.token, predicates=loaded_attributes):
             for attribute_name, value, ts in values:
               self.DecodeValueFromAttribute(attribute_name, value, ts)
 
@@ -2042,9 +2187,20 @@ class AFF4Object(object):
     Checking Get against None doesn't work as Get will return a default
     attribute value. This determines if the attribute has been manually set.
     """
+    self._CheckAttributeLoaded(attribute)
     return (attribute in self.synced_attributes or
             attribute in self.new_attributes)
 
+  def _CheckAttributeLoaded(self, attribute):
+    """Raises if the attribute was left out by an attribute projection."""
+    if (self.loaded_attributes is not None and
+        attribute.predicate not in self.loaded_attributes and
+        not isinstance(attribute, SubjectAttribute)):
+      raise AttributeNotLoadedError(
+          "Attribute %s was not loaded for %s, it has to be listed in the "
+          "attributes this object is opened with." % (attribute.predicate,
+                                                      self.urn))
+
   def Get(self, attribute, default=None):
     """Gets the attribute from this object."""
     if attribute is None:
@@ -2086,6 +2242,7 @@ class AFF4Object(object):
     elif isinstance(attribute, basestring):
       attribute = Attribute.GetAttributeByName(attribute)
 
+    self._CheckAttributeLoaded(attribute)
     return attribute.GetValues(self)
 
   def Update(self, attribute=None, user=None, priority=None):
@@ -13,9 +13,11 @@ from grr.lib import aff4
 from grr.lib import data_store
 from grr.lib import flow
 from grr.lib import grr_collections
+from grr.lib import mactime_index
 from grr.lib import queue_manager
 from grr.lib import rdfvalue
 from grr.lib import registry
+from grr.lib import utils
 from grr.lib.aff4_objects import standard
 from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import cloud
@@ -42,6 +44,11 @@ class VFSGRRClient(standard.VFSDirectory):
   # URN of the index for client labels.
   labels_index_urn = rdfvalue.RDFURN("aff4:/index/labels/clients")
 
+  def OnDelete(self, deletion_pool=None):
+    super(VFSGRRClient, self).OnDelete(deletion_pool=deletion_pool)
+    mactime_index.MACTimeIndex(
+        self.urn, token=self.token).MarkForDeletion(deletion_pool)
+
   class SchemaCls(standard.VFSDirectory.SchemaCls):
     """The schema for the client."""
     client_index = rdfvalue.RDFURN("aff4:/index/client")
@@ -372,6 +379,22 @@ class UpdateVFSFile(flow.GRRFlow):
 class VFSAnalysisFile(aff4.AFF4Image):
   """A file object in the VFS space."""
 
+  @utils.Synchronized
+  def _WriteAttributes(self, sync=True):
+    """Adds new MAC times to the client's MAC time index before writing."""
+    if "w" in self.mode and self.Schema.STAT in self.new_attributes:
+      mactime_index.IndexStatEntries(
+          self.urn,
+          self.new_attributes[self.Schema.STAT],
+          mutation_pool=self.mutation_pool,
+          token=self.token)
+
+    super(VFSAnalysisFile, self)._WriteAttributes(sync=sync)
+
+  def OnDelete(self, deletion_pool=None):
+    super(VFSAnalysisFile, self).OnDelete(deletion_pool=deletion_pool)
+    mactime_index.RemoveFromIndex(self.urn, deletion_pool, token=self.token)
+
   class SchemaCls(aff4.AFF4Image.SchemaCls):
     """The schema for AFF4 files in the GRR VFS."""
     STAT = standard.VFSDirectory.SchemaCls.STAT
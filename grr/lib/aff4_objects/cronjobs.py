@@ -2,6 +2,7 @@
 """Cron management classes."""
 
 
+import heapq
 import random
 import threading
 import time
@@ -18,6 +19,7 @@ from grr.lib import queue_manager
 from grr.lib import rdfvalue
 from grr.lib import registry
 from grr.lib import stats
+from grr.lib import threadpool
 from grr.lib import utils
 
 from grr.lib.rdfvalues import cronjobs as rdf_cronjobs
@@ -51,6 +53,22 @@ class CronManager(object):
 
   CRON_JOBS_PATH = rdfvalue.RDFURN("aff4:/cron")
 
+  # Set to a new random value whenever a job is added, changed or removed, so
+  # that schedulers know when to reload the jobs.
+  JOBS_CHANGED_ATTRIBUTE = "cron:jobs_changed"
+
+  def _NotifyJobsChanged(self, token=None):
+    data_store.DB.Set(
+        self.CRON_JOBS_PATH,
+        self.JOBS_CHANGED_ATTRIBUTE,
+        utils.PRNG.GetULong(),
+        token=token)
+
+  def GetJobsVersion(self, token=None):
+    value, _ = data_store.DB.Resolve(
+        self.CRON_JOBS_PATH, self.JOBS_CHANGED_ATTRIBUTE, token=token)
+    return value
+
   def ScheduleFlow(self,
                    cron_args=None,
                    job_name=None,
@@ -96,6 +114,7 @@ class CronManager(object):
       if disabled != cron_job.Get(cron_job.Schema.DISABLED):
         cron_job.Set(cron_job.Schema.DISABLED(disabled))
 
+    self._NotifyJobsChanged(token=token)
     return cron_job_urn
 
   def ListJobs(self, token=None):
@@ -108,6 +127,7 @@ class CronManager(object):
         job_urn, mode="rw", aff4_type=CronJob, token=token)
     cron_job.Set(cron_job.Schema.DISABLED(0))
     cron_job.Close()
+    self._NotifyJobsChanged(token=token)
 
   def DisableJob(self, job_urn, token=None):
     """Disable cron job with the given URN."""
@@ -115,10 +135,12 @@ class CronManager(object):
         job_urn, mode="rw", aff4_type=CronJob, token=token)
     cron_job.Set(cron_job.Schema.DISABLED(1))
     cron_job.Close()
+    self._NotifyJobsChanged(token=token)
 
   def DeleteJob(self, job_urn, token=None):
     """Deletes cron job with the given URN."""
     aff4.FACTORY.Delete(job_urn, token=token)
+    self._NotifyJobsChanged(token=token)
 
   def RunOnce(self, token=None, force=False, urns=None):
     """Tries to lock and run cron jobs.
@@ -288,6 +310,154 @@ def ScheduleSystemCronFlows(names=None, token=None):
           cron_args=cron_args, job_name=name, token=token, disabled=disabled)
 
 
+class CronScheduler(object):
+  """Runs cron jobs at their due times.
+
+  The due times of all jobs are kept in a heap, which is loaded once and
+  reloaded when CronManager reports a change to the jobs. Due jobs are handed
+  to a thread pool owned by the scheduler.
+
+  Several schedulers, possibly in different processes, can run at the same
+  time. A job is only run while holding a lease on it, and CronJob.Run checks
+  whether it is due once the lease is taken. A due job is therefore started by
+  exactly one scheduler.
+  """
+
+  # Lease taken on a cron job while it is checked and started. This is the
+  # lease CronManager.RunOnce takes as well, it has to cover slow data stores
+  # and flows which take long to start.
+  LEASE_TIME = 600
+
+  # Reload all jobs at least this often, even if no change was reported.
+  RELOAD_INTERVAL = 600
+
+  def __init__(self, name="CronScheduler", max_threads=None, token=None):
+    self.token = token
+    self.lock = threading.RLock()
+
+    # A heap of (due time, job urn) tuples. Entries whose due time is not the
+    # one in self.due_times are outdated and skipped.
+    self.queue = []
+    self.due_times = {}
+
+    # Jobs currently handled by the thread pool.
+    self.in_flight = set()
+
+    self.jobs_version = None
+    self.last_reload = 0
+
+    # The pool is not shared through ThreadPool.Factory, so other users of
+    # the name can not change its size or stop it.
+    self.pool = threadpool.ThreadPool(
+        name,
+        min_threads=1,
+        max_threads=max_threads or config_lib.CONFIG["Cron.max_threads"])
+
+  def Start(self):
+    self.pool.Start()
+
+  def Stop(self):
+    self.pool.Stop()
+
+  def _Schedule(self, job_urn, due_time):
+    with self.lock:
+      self.due_times[job_urn] = due_time
+      heapq.heappush(self.queue, (due_time, job_urn))
+
+  def Reload(self):
+    """Reads the due times of all jobs."""
+    with self.lock:
+      self.queue = []
+      self.due_times = {}
+
+    job_urns = list(CRON_MANAGER.ListJobs(token=self.token))
+    for cron_job in aff4.FACTORY.MultiOpen(
+        job_urns, aff4_type=CronJob, mode="r", token=self.token):
+      due_time = cron_job.NextDueTime()
+      if due_time is not None:
+        self._Schedule(cron_job.urn, due_time)
+
+    self.last_reload = time.time()
+
+  def RunOnce(self):
+    """Starts all jobs which are due.
+
+    Returns:
+      The number of seconds until the next job is due.
+    """
+    jobs_version = CRON_MANAGER.GetJobsVersion(token=self.token)
+    if (jobs_version != self.jobs_version or
+        time.time() - self.last_reload > self.RELOAD_INTERVAL):
+      self.jobs_version = jobs_version
+      self.Reload()
+
+    now = time.time()
+    due_jobs = []
+    with self.lock:
+      while self.queue and self.queue[0][0] <= now:
+        due_time, job_urn = heapq.heappop(self.queue)
+        if self.due_times.get(job_urn) != due_time or job_urn in self.in_flight:
+          continue
+
+        del self.due_times[job_urn]
+        self.in_flight.add(job_urn)
+        due_jobs.append((job_urn, due_time))
+
+    for job_urn, due_time in due_jobs:
+      self.pool.AddTask(
+          target=self._RunJob,
+          args=(job_urn, due_time),
+          name="cron_%s" % job_urn.Basename())
+
+    with self.lock:
+      if self.queue:
+        next_due_time = self.queue[0][0]
+      else:
+        next_due_time = self.last_reload + self.RELOAD_INTERVAL
+
+    return max(0, next_due_time - time.time())
+
+  def _RunJob(self, job_urn, due_time):
+    """Runs a job if it is still due and schedules its next check."""
+    stats.STATS.RecordEvent(
+        "cron_scheduling_lag",
+        max(0, time.time() - due_time),
+        fields=[job_urn.Basename()])
+
+    next_due_time = None
+    try:
+      with aff4.FACTORY.OpenWithLock(
+          job_urn,
+          aff4_type=CronJob,
+          blocking=False,
+          lease_time=self.LEASE_TIME,
+          token=self.token) as cron_job:
+        cron_job.Run()
+        next_due_time = cron_job.NextDueTime()
+
+    except aff4.LockError:
+      # Another scheduler is handling the job. It is usually done long before
+      # the lease runs out, so the job is checked again like a running one.
+      stats.STATS.IncrementCounter(
+          "cron_lock_contention", fields=[job_urn.Basename()])
+      next_due_time = time.time() + CronJob.RUNNING_JOB_CHECK_INTERVAL
+
+    except aff4.InstantiationError:
+      # The job was deleted.
+      pass
+
+    except Exception as e:  # pylint: disable=broad-except
+      logging.exception("Error processing cron job %s: %s", job_urn, e)
+      stats.STATS.IncrementCounter("cron_internal_error")
+      next_due_time = time.time() + CronJob.RUNNING_JOB_CHECK_INTERVAL
+
+    finally:
+      with self.lock:
+        self.in_flight.discard(job_urn)
+        if next_due_time is not None:
+          self._Schedule(job_urn, next_due_time)
+
+
 class CronWorker(object):
   """CronWorker runs a thread that periodically executes cron jobs."""
 
@@ -302,16 +472,21 @@ class CronWorker(object):
   def _RunLoop(self):
     ScheduleSystemCronFlows(token=self.token)
 
+    scheduler = CronScheduler(token=self.token)
+    scheduler.Start()
+
     while True:
       if not master.MASTER_WATCHER.IsMaster():
         time.sleep(self.sleep)
         continue
+
+      wait = self.sleep
       try:
-        CRON_MANAGER.RunOnce(token=self.token)
+        wait = min(wait, scheduler.RunOnce())
       except Exception as e:  # pylint: disable=broad-except
         logging.error("CronWorker uncaught exception: %s", e)
 
-      time.sleep(self.sleep)
+      time.sleep(wait)
 
   def Run(self):
     """Runs a working thread and waits for it to finish."""
@@ -369,6 +544,10 @@ class CreateCronJobFlow(flow.GRRFlow):
 class CronJob(aff4.AFF4Volume):
   """AFF4 object corresponding to cron jobs."""
 
+  # While a flow of the job is running, the job is checked this often to notice
+  # when the flow finishes or exceeds its lifetime.
+  RUNNING_JOB_CHECK_INTERVAL = 60
+
   class SchemaCls(aff4.AFF4Volume.SchemaCls):
     """Schema for CronJob AFF4 object."""
     CRON_ARGS = aff4.Attribute("aff4:cron/args", CreateCronJobFlowArgs,
@@ -468,6 +647,33 @@ class CronJob(aff4.AFF4Volume):
 
     return False
 
+  def NextDueTime(self):
+    """Returns when Run() has something to do next.
+
+    Returns:
+      Seconds since epoch, or None if the job is disabled.
+    """
+    if self.Get(self.Schema.DISABLED):
+      return None
+
+    cron_args = self.Get(self.Schema.CRON_ARGS)
+    due_time = cron_args.start_time.AsSecondsFromEpoch()
+
+    last_run_time = self.Get(self.Schema.LAST_RUN_TIME)
+    if last_run_time is not None:
+      due_time = max(due_time,
+                     cron_args.periodicity.Expiry(last_run_time)
+                     .AsSecondsFromEpoch())
+
+    if self.Get(self.Schema.CURRENT_FLOW_URN) is not None:
+      check_time = time.time() + self.RUNNING_JOB_CHECK_INTERVAL
+      if cron_args.allow_overruns:
+        due_time = min(due_time, check_time)
+      else:
+        due_time = check_time
+
+    return due_time
+
   def StopCurrentRun(self, reason="Cron lifetime exceeded.", force=True):
     current_flow_urn = self.Get(self.Schema.CURRENT_FLOW_URN)
     if current_flow_urn:
@@ -574,6 +780,10 @@ class CronHook(registry.InitHook):
         "cron_job_timeout", fields=[("cron_job_name", str)])
     stats.STATS.RegisterEventMetric(
         "cron_job_latency", fields=[("cron_job_name", str)])
+    stats.STATS.RegisterEventMetric(
+        "cron_scheduling_lag", fields=[("cron_job_name", str)])
+    stats.STATS.RegisterCounterMetric(
+        "cron_lock_contention", fields=[("cron_job_name", str)])
 
     # Start the cron thread if configured to.
     if config_lib.CONFIG["Cron.active"]:
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 import random
+import threading
 import time
 
 
@@ -11,6 +12,7 @@ from grr.lib import flow
 from grr.lib import rdfvalue
 from grr.lib import stats
 from grr.lib import test_lib
+from grr.lib import threadpool
 from grr.lib.aff4_objects import cronjobs
 from grr.lib.rdfvalues import cronjobs as rdf_cronjobs
 from grr.lib.rdfvalues import paths as rdf_paths
@@ -715,6 +717,121 @@ class CronTest(test_lib.AFF4ObjectTest):
       self.assertRaises(
           KeyError, cronjobs.ScheduleSystemCronFlows, token=self.token)
 
+  def _ScheduleFakeCronJobs(self, count, start_time=None):
+    job_urns = []
+    for _ in range(count):
+      cron_args = cronjobs.CreateCronJobFlowArgs(
+          periodicity="1h", start_time=start_time)
+      cron_args.flow_runner_args.flow_name = "FakeCronJob"
+      job_urns.append(
+          cronjobs.CRON_MANAGER.ScheduleFlow(
+              cron_args=cron_args, token=self.token))
+    return job_urns
+
+  def testNextDueTime(self):
+    with test_lib.FakeTime(100):
+      job_urn, = self._ScheduleFakeCronJobs(1)
+      cron_job = aff4.FACTORY.Open(job_urn, token=self.token)
+      # Never ran and has no start time, so it is due right away.
+      self.assertEqual(cron_job.NextDueTime(), 0)
+
+      cronjobs.CRON_MANAGER.RunOnce(token=self.token)
+      cron_job = aff4.FACTORY.Open(job_urn, token=self.token)
+      # While the flow runs, the job is checked regularly.
+      self.assertEqual(cron_job.NextDueTime(),
+                       100 + cronjobs.CronJob.RUNNING_JOB_CHECK_INTERVAL)
+
+      cronjobs.CRON_MANAGER.DisableJob(job_urn, token=self.token)
+      cron_job = aff4.FACTORY.Open(job_urn, token=self.token)
+      self.assertIsNone(cron_job.NextDueTime())
+
+  def testSchedulerReloadsChangedJobs(self):
+    scheduler = cronjobs.CronScheduler(
+        name="CronSchedulerReloadTest", token=self.token)
+    scheduler.Start()
+    try:
+      with test_lib.FakeTime(100):
+        job_urn, = self._ScheduleFakeCronJobs(1)
+        scheduler.RunOnce()
+        scheduler.pool.Join()
+        self.assertEqual(scheduler.due_times[job_urn],
+                         100 + cronjobs.CronJob.RUNNING_JOB_CHECK_INTERVAL)
+
+        new_job_urn, = self._ScheduleFakeCronJobs(1)
+        # The new job is picked up and started right away.
+        scheduler.RunOnce()
+        scheduler.pool.Join()
+        cron_job = aff4.FACTORY.Open(new_job_urn, token=self.token)
+        self.assertTrue(cron_job.IsRunning())
+
+        cronjobs.CRON_MANAGER.DeleteJob(new_job_urn, token=self.token)
+        self.assertEqual(scheduler.RunOnce(),
+                         cronjobs.CronJob.RUNNING_JOB_CHECK_INTERVAL)
+        self.assertNotIn(new_job_urn, scheduler.due_times)
+    finally:
+      scheduler.Stop()
+
+  def testSchedulersOwnTheirThreadPools(self):
+    scheduler = cronjobs.CronScheduler(
+        name="CronSchedulerPoolTest", max_threads=3, token=self.token)
+    other_scheduler = cronjobs.CronScheduler(
+        name="CronSchedulerPoolTest", max_threads=7, token=self.token)
+
+    self.assertIsNot(scheduler.pool, other_scheduler.pool)
+    self.assertEqual(scheduler.pool.max_threads, 3)
+    self.assertEqual(other_scheduler.pool.max_threads, 7)
+    self.assertNotIn("CronSchedulerPoolTest", threadpool.ThreadPool.POOLS)
+
+  def testSchedulersRunEachJobOnce(self):
+    schedulers = [
+        cronjobs.CronScheduler(
+            name="CronSchedulerTest%d" % i, max_threads=5, token=self.token)
+        for i in range(3)
+    ]
+    for scheduler in schedulers:
+      scheduler.Start()
+
+    try:
+      with test_lib.FakeTime(100):
+        job_urns = self._ScheduleFakeCronJobs(
+            10, start_time=rdfvalue.RDFDatetime.Now())
+
+        threads = [
+            threading.Thread(target=scheduler.RunOnce)
+            for scheduler in schedulers
+        ]
+        for thread in threads:
+          thread.start()
+        for thread in threads:
+          thread.join()
+        for scheduler in schedulers:
+          scheduler.pool.Join()
+
+        # Every job was started exactly once by one of the schedulers.
+        for job_urn in job_urns:
+          cron_job = aff4.FACTORY.Open(job_urn, token=self.token)
+          self.assertEqual(len(list(cron_job.ListChildren())), 1)
+
+        lag = contention = 0
+        for job_urn in job_urns:
+          fields = [job_urn.Basename()]
+          lag_distribution = stats.STATS.GetMetricValue(
+              "cron_scheduling_lag", fields=fields)
+          # Schedulers which loaded the job after it was started don't try.
+          self.assertGreaterEqual(lag_distribution.count, 1)
+          self.assertLessEqual(lag_distribution.count, len(schedulers))
+          lag += lag_distribution.sum
+          contention += stats.STATS.GetMetricValue(
+              "cron_lock_contention", fields=fields)
+
+        # Time stands still, so the jobs were picked up without delay.
+        self.assertEqual(lag, 0)
+        # At most all schedulers but one found each job locked.
+        self.assertLessEqual(contention, len(job_urns) * (len(schedulers) - 1))
+    finally:
+      for scheduler in schedulers:
+        scheduler.Stop()
+
   def testStatefulSystemCronFlowRaisesWhenRunningWithoutCronJob(self):
     self.assertRaises(
         cronjobs.StateReadError,
@@ -610,8 +610,16 @@ class NSRLFileStore(HashFileStore):
     for metadata in aff4.FACTORY.Stat(list(hash_map), token=self.token):
       yield metadata["urn"], hash_map[metadata["urn"]]
 
-  def AddHash(self, sha1, md5, crc, file_name, file_size, product_code_list,
-              op_system_code_list, special_code):
+  def AddHash(self,
+              sha1,
+              md5,
+              crc,
+              file_name,
+              file_size,
+              product_code_list,
+              op_system_code_list,
+              special_code,
+              mutation_pool=None):
     """Adds a new file from the NSRL hash database.
 
     We create a new subject in:
@@ -627,13 +635,19 @@ class NSRLFileStore(HashFileStore):
       product_code_list: List of products this file is part of.
       op_system_code_list: List of operating systems this file is part of.
       special_code: Special code (malicious/special/normal file).
+      mutation_pool: An optional MutationPool object to write to. If not given,
+                     the data_store is used directly.
     """
     file_store_urn = self.PATH.Add(sha1)
 
     special_code = self.FILE_TYPES.get(special_code, self.FILE_TYPES[""])
 
     with aff4.FACTORY.Create(
-        file_store_urn, NSRLFile, mode="w", token=self.token) as fd:
+        file_store_urn,
+        NSRLFile,
+        mode="w",
+        mutation_pool=mutation_pool,
+        token=self.token) as fd:
       fd.Set(
           fd.Schema.NSRL(
               sha1=sha1.decode("hex"),
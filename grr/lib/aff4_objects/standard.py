@@ -7,6 +7,7 @@ import StringIO
 from grr.lib import aff4
 from grr.lib import data_store
 from grr.lib import flow
+from grr.lib import mactime_index
 from grr.lib import rdfvalue
 from grr.lib import utils
 from grr.lib.rdfvalues import client as rdf_client
@@ -63,6 +64,22 @@ class VFSDirectory(aff4.AFF4Volume):
 
       return flow_id
 
+  @utils.Synchronized
+  def _WriteAttributes(self, sync=True):
+    """Adds new MAC times to the client's MAC time index before writing."""
+    if "w" in self.mode and self.Schema.STAT in self.new_attributes:
+      mactime_index.IndexStatEntries(
+          self.urn,
+          self.new_attributes[self.Schema.STAT],
+          mutation_pool=self.mutation_pool,
+          token=self.token)
+
+    super(VFSDirectory, self)._WriteAttributes(sync=sync)
+
+  def OnDelete(self, deletion_pool=None):
+    super(VFSDirectory, self).OnDelete(deletion_pool=deletion_pool)
+    mactime_index.RemoveFromIndex(self.urn, deletion_pool, token=self.token)
+
   class SchemaCls(aff4.AFF4Volume.SchemaCls):
     """Attributes specific to VFSDirectory."""
     STAT = aff4.Attribute("aff4:stat", rdf_client.StatEntry,
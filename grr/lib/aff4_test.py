@@ -1301,6 +1301,86 @@ class AFF4Tests(test_lib.AFF4ObjectTest):
         sorted([x.urn for x in all_children]),
         [root_urn.Add("some1"), root_urn.Add("some2")])
 
+  def testMultiOpenWithAttributesReadsOnlyThoseAttributes(self):
+    client_id = self.SetupClients(1)[0]
+    with aff4.FACTORY.Open(client_id, mode="rw", token=self.token) as fd:
+      fd.Set(fd.Schema.HARDWARE_INFO(serial_number="123"))
+
+    read_prefixes = []
+    original_multi_resolve_prefix = data_store.DB.MultiResolvePrefix
+
+    def MultiResolvePrefix(subjects, attribute_prefix, **kwargs):
+      read_prefixes.extend(attribute_prefix)
+      return original_multi_resolve_prefix(subjects, attribute_prefix,
+                                           **kwargs)
+
+    schema = aff4_grr.VFSGRRClient.SchemaCls
+    with utils.Stubber(data_store.DB, "MultiResolvePrefix", MultiResolvePrefix):
+      clients = list(
+          aff4.FACTORY.MultiOpen(
+              [client_id],
+              mode="r",
+              attributes=[schema.HOSTNAME],
+              token=self.token))
+
+    self.assertEqual(len(clients), 1)
+    self.assertTrue(isinstance(clients[0], aff4_grr.VFSGRRClient))
+    self.assertEqual(clients[0].Get(schema.HOSTNAME), "Host-0")
+    self.assertIn(schema.HOSTNAME.predicate, read_prefixes)
+    self.assertNotIn(schema.HARDWARE_INFO.predicate, read_prefixes)
+    self.assertNotIn("metadata:", read_prefixes)
+
+    self.assertRaises(aff4.AttributeNotLoadedError, clients[0].Get,
+                      schema.HARDWARE_INFO)
+    self.assertRaises(aff4.AttributeNotLoadedError, clients[0].IsAttributeSet,
+                      schema.HARDWARE_INFO)
+
+  def testAttributesReadByInitializeHaveToBeProjected(self):
+    client_id = self.SetupClients(1)[0]
+    flow_urn = flow.GRRFlow.StartFlow(
+        client_id=client_id, flow_name="FlowOrderTest", token=self.token)
+
+    # GRRFlow.Initialize() reads the flow state, which is left out here.
+    self.assertRaises(
+        aff4.AttributeNotLoadedError,
+        aff4.FACTORY.Open,
+        flow_urn,
+        mode="r",
+        attributes=[flow.GRRFlow.SchemaCls.FLOW_CONTEXT],
+        token=self.token)
+
+    schema = flow.GRRFlow.SchemaCls
+    flow_obj = aff4.FACTORY.Open(
+        flow_urn,
+        mode="r",
+        attributes=[
+            schema.FLOW_CONTEXT, schema.FLOW_STATE_DICT,
+            schema.FLOW_RUNNER_ARGS, schema.FLOW_ARGS, schema.STATE_VERSION
+        ],
+        token=self.token)
+
+    self.assertTrue(isinstance(flow_obj, flow.GRRFlow))
+    self.assertEqual(flow_obj.context.creator, self.token.username)
+    self.assertRaises(aff4.AttributeNotLoadedError, flow_obj.Get,
+                      flow_obj.Schema.NOTIFICATION)
+
+  def testObjectsOpenedWithAttributesAreReadOnly(self):
+    client_id = self.SetupClients(1)[0]
+    attributes = [aff4_grr.VFSGRRClient.SchemaCls.HOSTNAME]
+
+    self.assertRaises(
+        ValueError,
+        aff4.FACTORY.Open,
+        client_id,
+        mode="rw",
+        attributes=attributes,
+        token=self.token)
+    self.assertRaises(
+        ValueError,
+        list,
+        aff4.FACTORY.MultiOpen(
+            [client_id], attributes=attributes, token=self.token))
+
   def testObjectListChildren(self):
     root_urn = aff4.ROOT_URN.Add("path")
 
@@ -1789,6 +1869,22 @@ class AFF4SymlinkTest(test_lib.AFF4ObjectTest):
     self.assertEqual(symlink_obj.urn, self.symlink_target_urn)
     self.assertEqual(symlink_obj.symlink_urn, self.symlink_source_urn)
 
+  def testMultiOpenWithAttributesFollowsSymlinks(self):
+    self.CreateAndOpenObjectAndSymlink()
+
+    fds = list(
+        aff4.FACTORY.MultiOpen(
+            [self.symlink_source_urn],
+            mode="r",
+            attributes=[AFF4SymlinkTestSubject.SchemaCls.SOME_STRING],
+            token=self.token))
+
+    self.assertEqual(len(fds), 1)
+    self.assertTrue(isinstance(fds[0], AFF4SymlinkTestSubject))
+    self.assertEqual(fds[0].symlink_urn, self.symlink_source_urn)
+    self.assertEqual(
+        fds[0].Get(fds[0].Schema.SOME_STRING), rdfvalue.RDFString("the_string"))
+
   def testMultiOpenMixedObjects(self):
     """Test symlinks are correct when using multiopen with other objects."""
     fd, _ = self.CreateAndOpenObjectAndSymlink()
@@ -276,14 +276,32 @@ class Communicator(object):
     # A cache for encrypted ciphers
     self.encrypted_cipher_cache = utils.FastStore(max_size=50000)
 
+  # Payloads smaller than this do not gain anything from compression.
+  COMPRESSION_MIN_SIZE = 256
+
+  # Payloads larger than this are compressed with the fastest level and only if
+  # a sample of them compresses well. They usually carry file contents which
+  # the client has compressed already.
+  COMPRESSION_FAST_SIZE = 1024 * 1024
+  COMPRESSION_SAMPLE_SIZE = 64 * 1024
+
   def EncodeMessageList(self, message_list, signed_message_list):
     """Encode the MessageList into the signed_message_list rdfvalue."""
     # By default uncompress
     uncompressed_data = message_list.SerializeToString()
     signed_message_list.message_list = uncompressed_data
 
-    if config_lib.CONFIG["Network.compression"] == "ZCOMPRESS":
-      compressed_data = zlib.compress(uncompressed_data)
+    if (config_lib.CONFIG["Network.compression"] == "ZCOMPRESS" and
+        len(uncompressed_data) >= self.COMPRESSION_MIN_SIZE):
+      level = 6
+      if len(uncompressed_data) > self.COMPRESSION_FAST_SIZE:
+        sample = uncompressed_data[:self.COMPRESSION_SAMPLE_SIZE]
+        if len(zlib.compress(sample, 1)) > len(sample) * 0.9:
+          return
+
+        level = 1
+
+      compressed_data = zlib.compress(uncompressed_data, level)
 
       # Only compress if it buys us something.
       if len(compressed_data) < len(uncompressed_data):
@@ -3,6 +3,7 @@
 
 
 import array
+import os
 import pdb
 import time
 
@@ -240,6 +241,29 @@ class ClientCommsTest(test_lib.GRRBaseTest):
 
       self.assertEqual(compressed_len, uncompressed_len)
 
+  def testCompressionDependsOnContent(self):
+    """Small and incompressible payloads are sent uncompressed."""
+    compression_type = rdf_flows.SignedMessageList.CompressionType
+
+    def Encode(data):
+      message_list = rdf_flows.MessageList(
+          job=[rdf_flows.GrrMessage(payload=rdfvalue.RDFBytes(data))])
+      signed_message_list = rdf_flows.SignedMessageList()
+      self.client_communicator.EncodeMessageList(message_list,
+                                                 signed_message_list)
+      self.assertEqual(
+          self.server_communicator.DecompressMessageList(signed_message_list),
+          message_list)
+      return signed_message_list.compression
+
+    with test_lib.ConfigOverrider({"Network.compression": "ZCOMPRESS"}):
+      self.assertEqual(Encode("A" * 10), compression_type.UNCOMPRESSED)
+      self.assertEqual(Encode("A" * 10000), compression_type.ZCOMPRESSION)
+      self.assertEqual(
+          Encode("A" * 2 * 1024 * 1024), compression_type.ZCOMPRESSION)
+      self.assertEqual(
+          Encode(os.urandom(2 * 1024 * 1024)), compression_type.UNCOMPRESSED)
+
   def testX509Verify(self):
     """X509 Verify can have several failure paths."""
 
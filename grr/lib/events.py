@@ -5,7 +5,9 @@ import functools
 
 
 import logging
+import threading
 
+from grr.lib import config_lib
 from grr.lib import queue_manager
 from grr.lib import rdfvalue
 from grr.lib import registry
@@ -87,11 +89,77 @@ def EventHandler(source_restriction=False,
   return Decorator
 
 
+class EventBuffer(object):
+  """Buffers published events of a process and writes them in batches.
+
+  Events published with buffered=True are kept in memory until Flush() is
+  called or Worker.event_buffer_size events have been collected. All buffered
+  events are then written through a single queue manager, so each listener
+  gets one data store write and one notification for the whole batch.
+
+  Processes publishing buffered events need to call Flush() regularly. The
+  worker does this after each processing round and flow runners before they
+  remove the processed requests from the queue, so no event is lost when the
+  worker crashes. The buffer of the process is therefore only enabled while
+  the worker runs. Other processes, like the AdminUI or the console, never
+  flush it and write events right away.
+  """
+
+  def __init__(self, max_size=None, enabled=True):
+    self.max_size = max_size
+    self.enabled = enabled
+    self.lock = threading.RLock()
+    # Maps serialized tokens to (token, {event_name: [messages]}).
+    self._events = {}
+    self._size = 0
+
+  def __len__(self):
+    return self._size
+
+  def Publish(self, event_name, msg, token=None):
+    """Buffers a message for all listeners of the event."""
+    if not isinstance(msg, rdfvalue.RDFValue):
+      raise ValueError("Can only publish RDFValue instances.")
+
+    if not self.enabled:
+      Events.PublishMultipleEvents({event_name: [msg]}, token=token)
+      return
+
+    with self.lock:
+      key = token.SerializeToString() if token else None
+      _, events = self._events.setdefault(key, (token, {}))
+      events.setdefault(event_name, []).append(msg)
+      self._size += 1
+
+      max_size = self.max_size or config_lib.CONFIG["Worker.event_buffer_size"]
+      if self._size >= max_size:
+        self.Flush()
+
+  def Flush(self):
+    """Writes all buffered events to the queues of their listeners."""
+    with self.lock:
+      buffered = self._events
+      self._events = {}
+      self._size = 0
+
+      for token, events in buffered.itervalues():
+        Events.PublishMultipleEvents(events, token=token)
+
+
 class Events(object):
   """A class that provides event publishing methods."""
 
+  # The buffer of this process for events published with buffered=True. The
+  # worker enables it while it runs.
+  BUFFER = EventBuffer(enabled=False)
+
   @classmethod
-  def PublishEvent(cls, event_name, msg, delay=None, token=None):
+  def PublishEvent(cls,
+                   event_name,
+                   msg,
+                   delay=None,
+                   buffered=False,
+                   token=None):
     """Publish the message into all listeners of the event.
 
     If event_name is a string, we send the message to all event handlers which
@@ -104,14 +172,26 @@ class Events(object):
       msg: The message to send to the event handler.
       delay: An rdfvalue.Duration object. If given, the event will be published
              after the indicated time.
+      buffered: If True and the event buffer of this process is enabled, the
+                event is only written together with other events when the
+                buffer is flushed. Delayed events are never buffered.
       token: ACL token.
 
     Raises:
       ValueError: If the message is invalid. The message must be a Semantic
         Value (instance of RDFValue) or a full GrrMessage.
     """
+    if buffered and not delay:
+      cls.BUFFER.Publish(event_name, msg, token=token)
+      return
+
     cls.PublishMultipleEvents({event_name: [msg]}, delay=delay, token=token)
 
+  @classmethod
+  def FlushBufferedEvents(cls):
+    """Writes out all events buffered by this process."""
+    cls.BUFFER.Flush()
+
   @classmethod
   def PublishMultipleEvents(cls, events, delay=None, token=None):
     """Publish the message into all listeners of the event.
@@ -195,4 +275,7 @@ class Events(object):
     for event_cls in event_name_map.get(event_name, []):
       event_obj = event_cls(
           event_cls.well_known_session_id, mode="rw", token=token)
-      event_obj.ProcessMessage(msg)
+      if event_obj.accepts_batches:
+        event_obj.ProcessMessages([msg])
+      else:
+        event_obj.ProcessMessage(msg)
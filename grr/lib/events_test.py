@@ -7,8 +7,10 @@ from grr.lib import events
 from grr.lib import flags
 from grr.lib import flow
 from grr.lib import maintenance_utils
+from grr.lib import queue_manager
 from grr.lib import rdfvalue
 from grr.lib import test_lib
+from grr.lib import utils
 from grr.lib.flows.general import audit
 from grr.lib.rdfvalues import flows as rdf_flows
 from grr.lib.rdfvalues import paths as rdf_paths
@@ -51,6 +53,31 @@ class FlowDoneListener(flow.EventListener):
     FlowDoneListener.received_events.append(message)
 
 
+class BatchListener(flow.EventListener):
+  well_known_session_id = rdfvalue.SessionID(flow_name="test4")
+  EVENTS = ["TestBatchEvent"]
+  accepts_batches = True
+
+  received_batches = []
+
+  @flow.BatchEventHandler(auth_required=True)
+  def ProcessMessages(self, messages=None, events=None):
+    # Store the results for later inspection.
+    self.__class__.received_batches.append(zip(messages, events))
+
+
+class PublishingFlow(flow.GRRFlow):
+  """Publishes an event from a state run by the worker."""
+
+  @flow.StateHandler()
+  def Start(self):
+    self.CallState(next_state="SendEvent")
+
+  @flow.StateHandler()
+  def SendEvent(self):
+    self.Publish("TestBatchEvent", rdf_paths.PathSpec(path="foobar"))
+
+
 class GeneralFlowsTest(test_lib.FlowTestsBaseclass):
 
   def testClientEventNotification(self):
@@ -162,6 +189,108 @@ class GeneralFlowsTest(test_lib.FlowTestsBaseclass):
                        "aff4:/Source%d" % i)
       self.assertEqual(NoClientListener.received_events[i][1].path, "foobar")
 
+  def _MakeBatchEvent(self, source):
+    return rdf_flows.GrrMessage(
+        payload=rdf_paths.PathSpec(path="foobar"),
+        source=source,
+        auth_state=rdf_flows.GrrMessage.AuthorizationState.AUTHENTICATED)
+
+  def testBufferedEventsAreDeliveredAsBatch(self):
+    BatchListener.received_batches = []
+    with utils.Stubber(events.Events.BUFFER, "enabled", True):
+      for i in xrange(10):
+        events.Events.PublishEvent(
+            "TestBatchEvent",
+            self._MakeBatchEvent("Source%d" % i),
+            buffered=True,
+            token=self.token)
+
+    # Nothing is written before the buffer is flushed.
+    self.assertEqual(len(events.Events.BUFFER), 10)
+    with queue_manager.WellKnownQueueManager(token=self.token) as manager:
+      self.assertFalse(
+          list(
+              manager.FetchRequestsAndResponses(
+                  BatchListener.well_known_session_id)))
+
+    events.Events.FlushBufferedEvents()
+    self.assertEqual(len(events.Events.BUFFER), 0)
+    test_lib.MockWorker(token=self.token).Simulate()
+
+    self.assertEqual(len(BatchListener.received_batches), 1)
+    batch = BatchListener.received_batches[0]
+    self.assertEqual(
+        sorted(message.source for message, _ in batch),
+        ["aff4:/Source%d" % i for i in xrange(10)])
+    for _, event in batch:
+      self.assertEqual(event.path, "foobar")
+
+  def testEventsAreNotBufferedOutsideOfTheWorker(self):
+    BatchListener.received_batches = []
+    events.Events.PublishEvent(
+        "TestBatchEvent",
+        self._MakeBatchEvent("Source"),
+        buffered=True,
+        token=self.token)
+
+    # Nobody would flush the buffer, the event is written right away.
+    self.assertEqual(len(events.Events.BUFFER), 0)
+    test_lib.MockWorker(token=self.token).Simulate()
+    self.assertEqual(len(BatchListener.received_batches), 1)
+
+  def testBufferedEventsAreWrittenBeforeRequestsAreRemoved(self):
+    buffered_on_flush = []
+    original_flush = queue_manager.QueueManager.Flush
+
+    def RecordingFlush(manager):
+      buffered_on_flush.append(len(events.Events.BUFFER))
+      return original_flush(manager)
+
+    with utils.MultiStubber(
+        (events.Events.BUFFER, "enabled", True),
+        (queue_manager.QueueManager, "Flush", RecordingFlush)):
+      flow.GRRFlow.StartFlow(flow_name="PublishingFlow", token=self.token)
+      test_lib.MockWorker(token=self.token).Simulate()
+
+    # The event published by the flow never waits in the buffer while the
+    # request that caused it is removed from the queue.
+    self.assertTrue(buffered_on_flush)
+    self.assertEqual(max(buffered_on_flush), 0)
+
+  def testBatchHandlerDropsUnauthenticatedMessages(self):
+    BatchListener.received_batches = []
+    unauthenticated = self._MakeBatchEvent("Unauthenticated")
+    unauthenticated.auth_state = (
+        rdf_flows.GrrMessage.AuthorizationState.UNAUTHENTICATED)
+
+    events.Events.PublishMultipleEvents(
+        {
+            "TestBatchEvent":
+                [unauthenticated, self._MakeBatchEvent("Authenticated")]
+        },
+        token=self.token)
+    test_lib.MockWorker(token=self.token).Simulate()
+
+    self.assertEqual(len(BatchListener.received_batches), 1)
+    self.assertEqual(
+        [message.source for message, _ in BatchListener.received_batches[0]],
+        ["aff4:/Authenticated"])
+
+  def testEventBufferFlushesWhenFull(self):
+    BatchListener.received_batches = []
+    event_buffer = events.EventBuffer(max_size=3)
+    for i in xrange(4):
+      event_buffer.Publish(
+          "TestBatchEvent",
+          self._MakeBatchEvent("Source%d" % i),
+          token=self.token)
+
+    # The first three events were written when the buffer got full.
+    self.assertEqual(len(event_buffer), 1)
+    test_lib.MockWorker(token=self.token).Simulate()
+    self.assertEqual(len(BatchListener.received_batches), 1)
+    self.assertEqual(len(BatchListener.received_batches[0]), 3)
+
   def testUserModificationAudit(self):
     audit.AuditEventListener.created_logs.clear()
     worker = test_lib.MockWorker(token=self.token)
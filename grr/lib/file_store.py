@@ -8,8 +8,11 @@ import shutil
 
 from grr.lib import aff4
 from grr.lib import config_lib
+from grr.lib import data_store
 from grr.lib import rdfvalue
 from grr.lib import registry
+from grr.lib import stats
+from grr.lib import utils
 from grr.lib.aff4_objects import standard
 
 
@@ -21,6 +24,16 @@ class UploadFileStore(object):
   def CreateFileStoreFile(self):
     """Creates a new file for writing."""
 
+  def OpenForReading(self, file_id):
+    """Returns a file like object to read the file with the given id."""
+
+  def Aff4ObjectForFileId(self, urn, file_id, token=None):
+    """Returns an AFF4 object backed by the file store."""
+    result = aff4.FACTORY.Create(
+        urn, FileStoreAFF4Object, mode="w", token=token)
+    result.Set(result.Schema.FILE_ID(file_id))
+    return result
+
 
 class FileStoreAFF4Object(aff4.AFF4Stream):
   """An AFF4 object which allows to read the files in the filestore."""
@@ -122,9 +135,126 @@ class FileUploadFileStore(UploadFileStore):
     path = self.PathForId(file_id)
     return open(path, "rb")
 
-  def Aff4ObjectForFileId(self, urn, file_id, token=None):
-    """Returns an AFF4 object backed by the file store."""
-    result = aff4.FACTORY.Create(
-        urn, FileStoreAFF4Object, mode="w", token=token)
-    result.Set(result.Schema.FILE_ID(file_id))
-    return result
+
+class BlobStoreFDCreator(object):
+  """A handle writing an upload to the blob store while it is received.
+
+  The data is hashed as it is written and split into chunks which are stored
+  as content addressed blobs. Blobs which already exist are not written again,
+  so uploading the same file many times mostly costs blob existence checks.
+  """
+
+  def __init__(self, store):
+    self.store = store
+    self.hasher = hashlib.sha256()
+    self.buffer = ""
+    # The (digest, length) of all chunks written so far.
+    self.chunks = []
+    # Chunks which still have to be written to the blob store by digest.
+    self.pending = {}
+
+  def Write(self, data):
+    self.hasher.update(data)
+    self.buffer += data
+    chunk_size = self.store.CHUNK_SIZE
+    while len(self.buffer) >= chunk_size:
+      self._AddChunk(self.buffer[:chunk_size])
+      self.buffer = self.buffer[chunk_size:]
+
+  def _AddChunk(self, chunk):
+    digest = hashlib.sha256(chunk).hexdigest()
+    self.chunks.append((digest, len(chunk)))
+    self.pending[digest] = chunk
+    if len(self.pending) >= self.store.BLOBS_PER_BATCH:
+      self._StorePending()
+
+  def _StorePending(self):
+    """Writes the pending chunks which are not in the blob store yet."""
+    if not self.pending:
+      return
+
+    existing = data_store.DB.BlobsExist(
+        self.pending.keys(), token=self.store.token)
+    new_blobs = [
+        chunk for digest, chunk in self.pending.iteritems()
+        if not existing[digest]
+    ]
+    if new_blobs:
+      data_store.DB.StoreBlobs(new_blobs, token=self.store.token)
+
+    stats.STATS.IncrementCounter(
+        "upload_store_blobs", len(self.pending) - len(new_blobs),
+        fields=["existing"])
+    stats.STATS.IncrementCounter(
+        "upload_store_blobs", len(new_blobs), fields=["new"])
+    self.pending = {}
+
+  def Flush(self):
+    pass
+
+  def Close(self):
+    pass
+
+  write = Write
+  flush = Flush
+  close = Close
+
+  def Finalize(self):
+    """Writes the remaining data and the index and returns the file id."""
+    if self.buffer:
+      self._AddChunk(self.buffer)
+      self.buffer = ""
+    self._StorePending()
+
+    final_id = self.hasher.hexdigest()
+    urn = self.store.URNForId(final_id)
+
+    # The same file was uploaded before, its index is already there.
+    if list(
+        aff4.FACTORY.MultiOpen(
+            [urn], aff4_type=standard.BlobImage, token=self.store.token)):
+      return final_id
+
+    with aff4.FACTORY.Create(
+        urn, standard.BlobImage, mode="w", token=self.store.token) as fd:
+      fd.SetChunksize(self.store.CHUNK_SIZE)
+      for digest, length in self.chunks:
+        fd.AddBlob(digest.decode("hex"), length)
+
+    return final_id
+
+
+class BlobUploadFileStore(UploadFileStore):
+  """An implementation of upload server based on the blob store.
+
+  Each uploaded file is stored as a BlobImage named by the sha256 of its
+  content, which references the chunks of the file in the blob store.
+  """
+
+  ROOT_URN = rdfvalue.RDFURN("aff4:/files/uploads")
+
+  CHUNK_SIZE = 512 * 1024
+
+  # The number of chunks checked for existence and written at once.
+  BLOBS_PER_BATCH = 10
+
+  def __init__(self, token=None):
+    self.token = token or aff4.FACTORY.root_token
+
+  @classmethod
+  def URNForId(cls, file_id):
+    return cls.ROOT_URN.Add(utils.SmartStr(file_id))
+
+  def CreateFileStoreFile(self):
+    return BlobStoreFDCreator(self)
+
+  def OpenForReading(self, file_id):
+    return aff4.FACTORY.Open(
+        self.URNForId(file_id), aff4_type=standard.BlobImage, token=self.token)
+
+
+class UploadFileStoreInit(registry.InitHook):
+
+  def RunOnce(self):
+    stats.STATS.RegisterCounterMetric(
+        "upload_store_blobs", fields=[("type", str)])
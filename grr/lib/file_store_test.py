@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""Tests for grr.lib.file_store."""
+
+
+import hashlib
+
+from grr.lib import aff4
+from grr.lib import data_store
+from grr.lib import file_store
+from grr.lib import flags
+from grr.lib import test_lib
+from grr.lib import utils
+
+
+class BlobUploadFileStoreTest(test_lib.GRRBaseTest):
+
+  def setUp(self):
+    super(BlobUploadFileStoreTest, self).setUp()
+    self.store = file_store.BlobUploadFileStore(token=self.token)
+    self.store.CHUNK_SIZE = 100
+    self.store.BLOBS_PER_BATCH = 2
+
+  def _Upload(self, data, write_size=30):
+    fd = self.store.CreateFileStoreFile()
+    for i in range(0, len(data), write_size):
+      fd.write(data[i:i + write_size])
+    return fd.Finalize()
+
+  def _CountStoredBlobs(self):
+    stored = []
+    original_store_blobs = data_store.DB.StoreBlobs
+
+    def StoreBlobs(contents, token=None):
+      stored.extend(contents)
+      return original_store_blobs(contents, token=token)
+
+    return stored, utils.Stubber(data_store.DB, "StoreBlobs", StoreBlobs)
+
+  def testUploadsAreStoredAsBlobs(self):
+    data = "".join(chr(i % 256) for i in range(550))
+
+    file_id = self._Upload(data)
+
+    self.assertEqual(file_id, hashlib.sha256(data).hexdigest())
+    fd = self.store.OpenForReading(file_id)
+    self.assertEqual(fd.size, 550)
+    self.assertEqual(fd.read(), data)
+    fd.seek(120)
+    self.assertEqual(fd.read(10), data[120:130])
+
+  def testExistingBlobsAreNotWrittenAgain(self):
+    data = "A" * 100 + "B" * 100 + "C" * 50
+    self._Upload(data)
+
+    stored, stubber = self._CountStoredBlobs()
+    with stubber:
+      self.assertEqual(self._Upload(data), hashlib.sha256(data).hexdigest())
+    self.assertEqual(stored, [])
+
+    # Only the chunks a new file does not share with stored ones are written.
+    with stubber:
+      self._Upload("A" * 100 + "D" * 100 + "B" * 100)
+    self.assertEqual(stored, ["D" * 100])
+
+  def testEmptyUpload(self):
+    file_id = self._Upload("")
+
+    self.assertEqual(file_id, hashlib.sha256("").hexdigest())
+    self.assertEqual(self.store.OpenForReading(file_id).read(), "")
+
+  def testFileStoreAFF4ObjectReadsFromBlobs(self):
+    data = "X" * 250
+    file_id = self._Upload(data)
+
+    with test_lib.ConfigOverrider({
+        "Frontend.upload_store": "BlobUploadFileStore"
+    }):
+      with self.store.Aff4ObjectForFileId(
+          "aff4:/C.1000000000000000/fs/os/file", file_id,
+          token=self.token) as fd:
+        fd.Set(fd.Schema.SIZE(len(data)))
+
+      fd = aff4.FACTORY.Open(
+          "aff4:/C.1000000000000000/fs/os/file", token=self.token)
+      self.assertTrue(isinstance(fd, file_store.FileStoreAFF4Object))
+      self.assertEqual(fd.Read(1000), data)
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
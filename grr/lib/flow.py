@@ -64,6 +64,7 @@ from grr.lib import registry
 from grr.lib import sequential_collection
 from grr.lib import server_stubs
 from grr.lib import stats
+from grr.lib import throttle
 from grr.lib import type_info
 from grr.lib import utils
 from grr.lib.rdfvalues import client as rdf_client
@@ -417,10 +418,25 @@ LOGS_SUFFIX = "Logs"
 class FlowBase(aff4.AFF4Volume):
   """The base class for Flows and Hunts."""
 
+  class SchemaCls(aff4.AFF4Volume.SchemaCls):
+    """Attributes shared by flows and hunts."""
+
+    STATE_VERSION = aff4.Attribute(
+        "aff4:flow_state_version",
+        rdfvalue.RDFInteger,
+        "A random id set whenever the object is written, so copies kept in "
+        "memory can be checked for changes.",
+        versioned=False,
+        creates_new_object_version=False)
+
   # Alternatively we can specify a single semantic protobuf that will be used to
   # provide the args.
   args_type = EmptyFlowArgs
 
+  # Attributes which are written without holding the lock on the object. They
+  # are reread when a copy kept in memory is reused, see Revalidate().
+  lock_free_attributes = []
+
   def Initialize(self):
     # This will be set to the state. Flows and Hunts can store
     # information in the state object which will be serialized between
@@ -432,6 +448,14 @@ class FlowBase(aff4.AFF4Volume):
 
     self.args = None
 
+    # The serialized state attributes as last written by WriteState(), so
+    # unchanged ones are not written again.
+    self._written_state = {}
+
+    self.state_version = 0
+    if "r" in self.mode:
+      self.state_version = int(self.Get(self.Schema.STATE_VERSION, 0))
+
   @classmethod
   def FilterArgsFromSemanticProtobuf(cls, protobuf, kwargs):
     """Assign kwargs to the protobuf, and remove them from the kwargs dict."""
@@ -458,6 +482,7 @@ class FlowBase(aff4.AFF4Volume):
     self.CheckLease()
     self.Save()
     self.WriteState()
+    self._WriteStateVersion()
     self.Load()
     super(FlowBase, self).Flush(sync=sync)
     # Writing the messages queued in the queue_manager of the runner always has
@@ -470,6 +495,7 @@ class FlowBase(aff4.AFF4Volume):
     self.CheckLease()
     self.Save()
     self.WriteState()
+    self._WriteStateVersion()
     super(FlowBase, self).Close(sync=sync)
     # Writing the messages queued in the queue_manager of the runner always has
     # to be the last thing that happens or we will have a race condition.
@@ -479,6 +505,69 @@ class FlowBase(aff4.AFF4Volume):
     """Write all the messages queued in the queue manager."""
     self.GetRunner().FlushMessages()
 
+  def _SetChangedState(self, values):
+    """Sets the state attributes which changed since they were last written.
+
+    Args:
+      values: A list of attribute values, as returned by calling the
+        attributes of the schema.
+    """
+    for value in values:
+      predicate = value.attribute_instance.predicate
+      serialized = value.SerializeToString()
+      if self._written_state.get(predicate) != serialized:
+        self.Set(value)
+        self._written_state[predicate] = serialized
+
+  def _WriteStateVersion(self):
+    # Any write invalidates the copies of this object other workers keep. Some
+    # writers do not hold the lock, so two writes starting from the same
+    # version must not store the same new one.
+    if "w" in self.mode and self._dirty:
+      self.state_version = utils.PRNG.GetULong()
+      self.Set(self.Schema.STATE_VERSION(self.state_version))
+
+  def Revalidate(self):
+    """Brings an object kept in memory across lock cycles up to date.
+
+    This must be called after the object was locked again with
+    aff4.FACTORY.RelockObject(). The lock free attributes are reread. All other
+    attributes are only current if nobody else wrote the object since it was
+    closed, which is detected by comparing the state version. Every write stores
+    a new random version, also writes of objects opened without the lock.
+
+    Returns:
+      True if the object can be used, False if it has changed in the data
+      store and has to be opened again.
+    """
+    attributes = [self.Schema.STATE_VERSION] + list(self.lock_free_attributes)
+    values = data_store.DB.ResolveMulti(
+        self.urn, [attribute.predicate for attribute in attributes],
+        timestamp=data_store.DB.NEWEST_TIMESTAMP,
+        token=self.token)
+
+    stored_version = 0
+    lock_free_values = []
+    for predicate, value, timestamp in values:
+      if predicate == self.Schema.STATE_VERSION.predicate:
+        stored_version = int(
+            self.Schema.STATE_VERSION.attribute_type.FromDatastoreValue(value))
+      else:
+        lock_free_values.append((predicate, value, timestamp))
+
+    if stored_version != self.state_version:
+      return False
+
+    for attribute in self.lock_free_attributes:
+      self.synced_attributes.pop(attribute, None)
+    for predicate, value, timestamp in lock_free_values:
+      self.DecodeValueFromAttribute(predicate, value, timestamp)
+
+    # The runner of the last lock cycle has already flushed its messages.
+    self.runner = None
+    self.Load()
+    return True
+
   def NotifyAboutEnd(self):
     """Send out a final notification about the end of this flow."""
     self.Notify("FlowStatus", self.urn,
@@ -649,6 +738,8 @@ class FlowBase(aff4.AFF4Volume):
 
     # Publish an audit event, only for top level flows.
     if parent_flow is None:
+      throttle.RecordFlowStart(flow_obj, token=token)
+
       events.Events.PublishEvent(
           "Audit",
           events.AuditEvent(
@@ -659,6 +750,10 @@ class FlowBase(aff4.AFF4Volume):
               client=runner_args.client_id),
           token=token)
 
+      # Top level flows can be started outside of the worker, so events
+      # published by their first state are written out right away.
+      events.Events.FlushBufferedEvents()
+
     return flow_obj.urn
 
   @property
@@ -776,7 +871,7 @@ class GRRFlow(FlowBase):
 
   """
 
-  class SchemaCls(aff4.AFF4Volume.SchemaCls):
+  class SchemaCls(FlowBase.SchemaCls):
     """Attributes specific to GRRFlow."""
 
     FLOW_STATE_DICT = aff4.Attribute(
@@ -829,6 +924,8 @@ class GRRFlow(FlowBase):
         "states are called.",
         creates_new_object_version=False)
 
+  lock_free_attributes = [SchemaCls.PENDING_TERMINATION]
+
   # This is used to arrange flows into a tree view
   category = ""
   friendly_name = None
@@ -908,11 +1005,13 @@ class GRRFlow(FlowBase):
   def WriteState(self):
     if "w" in self.mode:
       self._ValidateState()
-      self.Set(self.Schema.FLOW_ARGS(self.args))
-      self.Set(self.Schema.FLOW_CONTEXT(self.context))
-      self.Set(self.Schema.FLOW_RUNNER_ARGS(self.runner_args))
       protodict = rdf_protodict.AttributedDict().FromDict(self.state)
-      self.Set(self.Schema.FLOW_STATE_DICT(protodict))
+      self._SetChangedState([
+          self.Schema.FLOW_ARGS(self.args),
+          self.Schema.FLOW_CONTEXT(self.context),
+          self.Schema.FLOW_RUNNER_ARGS(self.runner_args),
+          self.Schema.FLOW_STATE_DICT(protodict)
+      ])
 
   def Status(self, format_str, *args):
     """Flows can call this method to set a status message visible to users."""
@@ -1203,6 +1302,10 @@ class WellKnownFlow(GRRFlow):
   # Well known flows are not browsable.
   category = None
 
+  # If True, all messages fetched from the queue are passed to
+  # ProcessMessages() in one go instead of calling ProcessMessage() for each.
+  accepts_batches = False
+
   @classmethod
   def GetAllWellKnownFlows(cls, token=None):
     """Get instances of all well known flows."""
@@ -1250,8 +1353,24 @@ class WellKnownFlow(GRRFlow):
 
     return messages
 
+  def _SafeProcessMessages(self, *args, **kwargs):
+    try:
+      self.ProcessMessages(*args, **kwargs)
+    except Exception as e:  # pylint: disable=broad-except
+      logging.exception("Error in WellKnownFlow.ProcessMessages: %s", e)
+      stats.STATS.IncrementCounter(
+          "well_known_flow_errors", fields=[str(self.session_id)])
+
   def ProcessResponses(self, responses, thread_pool):
     """For WellKnownFlows we receive these messages directly."""
+    if self.accepts_batches:
+      if responses:
+        thread_pool.AddTask(
+            target=self._SafeProcessMessages,
+            args=(responses,),
+            name=self.__class__.__name__)
+      return
+
     for response in responses:
       thread_pool.AddTask(
           target=self._SafeProcessMessage,
@@ -1381,6 +1500,66 @@ def EventHandler(source_restriction=False,
   return Decorator
 
 
+def BatchEventHandler(source_restriction=False,
+                      auth_required=True,
+                      allow_client_access=False):
+  """A decorator for event handlers which process a batch of messages.
+
+  This is the batch version of EventHandler for listeners setting
+  accepts_batches. Messages failing the checks are logged and dropped, the
+  remaining ones are passed to the handler together.
+
+  Args:
+    source_restriction: If True, the source of each message is passed to the
+      "CheckSource" method of the event listener.
+    auth_required: Do we require messages to be authenticated?
+    allow_client_access: If True this event is allowed to handle published
+      events from clients.
+
+  Returns:
+    A decorator which injects the following keyword args to the handler:
+
+     messages: A list of the original raw messages.
+     events: A list of the decoded RDFValues, in the same order.
+  """
+
+  def Decorator(f):
+    """Initialised Decorator."""
+
+    @functools.wraps(f)
+    def Decorated(self, msgs):
+      """Filters out the messages violating the EventListener restrictions."""
+      messages = []
+      for msg in msgs:
+        if (auth_required and
+            msg.auth_state != msg.AuthorizationState.AUTHENTICATED):
+          logging.error("Message from %s not authenticated.", msg.source)
+          continue
+
+        if (not allow_client_access and msg.source and
+            rdf_client.ClientURN.Validate(msg.source)):
+          logging.error("Event does not support clients.")
+          continue
+
+        if source_restriction and not self.CheckSource(msg.source):
+          logging.error("Message source %s invalid.", msg.source)
+          continue
+
+        messages.append(rdf_flows.GrrMessage(msg))
+
+      if not messages:
+        return
+
+      stats.STATS.IncrementCounter("grr_worker_states_run")
+      return f(self,
+               messages=messages,
+               events=[message.payload for message in messages])
+
+    return Decorated
+
+  return Decorator
+
+
 class EventListener(WellKnownFlow):
   """Base Class for all Event Listeners.
 
@@ -1390,6 +1569,11 @@ class EventListener(WellKnownFlow):
 
   We will process any messages which are sent to any of the events
   specified. Events are just string names.
+
+  Listeners receiving many events can set accepts_batches and implement
+  ProcessMessages() decorated with BatchEventHandler instead of
+  ProcessMessage(), all messages fetched from the queue are then handled in
+  a single call.
   """
   EVENTS = []
 
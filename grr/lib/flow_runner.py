@@ -726,8 +726,20 @@ class FlowRunner(object):
     self.QueueRequest(state, timestamp=start_time)
 
   def Publish(self, event_name, msg, delay=0):
-    """Sends the message to event listeners."""
-    events.Events.PublishEvent(event_name, msg, delay=delay, token=self.token)
+    """Sends the message to event listeners.
+
+    When this runs in the worker, events without a delay are buffered and
+    written together with the other events published by the worker, at the
+    latest before the processed requests are removed from the queue.
+    Everywhere else they are written right away.
+
+    Args:
+      event_name: The name of the event.
+      msg: The message to send to the event listeners.
+      delay: An optional delay in seconds.
+    """
+    events.Events.PublishEvent(
+        event_name, msg, delay=delay, buffered=True, token=self.token)
 
   def CallFlow(self,
                flow_name=None,
@@ -874,6 +886,9 @@ class FlowRunner(object):
     """Flushes the messages that were queued."""
     # Only flush queues if we are the top level runner.
     if self.parent_runner is None:
+      # Flushing the queues removes the processed requests, events published
+      # while processing them must be written first or a crash loses them.
+      events.Events.FlushBufferedEvents()
       self.queue_manager.Flush()
 
     if self.queued_replies:
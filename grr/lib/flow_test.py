@@ -178,6 +178,64 @@ class FlowCreationTest(BasicFlowTest):
     types = list(flow_obj.GetValuesForAttribute(flow_obj.Schema.TYPE))
     self.assertEqual(len(types), 1)
 
+  def testUnchangedStateIsNotWrittenAgain(self):
+    session_id = flow.GRRFlow.StartFlow(
+        client_id=self.client_id, flow_name="FlowOrderTest", token=self.token)
+
+    flow_obj = aff4.FACTORY.OpenWithLock(session_id, token=self.token)
+    flow_obj.Close()
+    version = flow_obj.state_version
+
+    flow_obj = aff4.FACTORY.RelockObject(flow_obj)
+    self.assertTrue(flow_obj.Revalidate())
+    flow_obj.Close()
+    self.assertEqual(flow_obj.state_version, version)
+
+    flow_obj = aff4.FACTORY.RelockObject(flow_obj)
+    self.assertTrue(flow_obj.Revalidate())
+    flow_obj.state.changed = True
+    flow_obj.Close()
+
+    stored_obj = aff4.FACTORY.Open(session_id, token=self.token)
+    self.assertNotEqual(stored_obj.state_version, version)
+    self.assertTrue(stored_obj.state.changed)
+
+  def testChangedFlowsAreNotRevalidated(self):
+    session_id = flow.GRRFlow.StartFlow(
+        client_id=self.client_id, flow_name="FlowOrderTest", token=self.token)
+
+    flow_obj = aff4.FACTORY.OpenWithLock(session_id, token=self.token)
+    flow_obj.Close()
+
+    with aff4.FACTORY.OpenWithLock(session_id, token=self.token) as other_obj:
+      other_obj.state.changed = True
+
+    flow_obj = aff4.FACTORY.RelockObject(flow_obj)
+    self.assertFalse(flow_obj.Revalidate())
+    flow_obj.transaction.Release()
+
+  def testFlowsWrittenWithoutLockAreNotRevalidated(self):
+    session_id = flow.GRRFlow.StartFlow(
+        client_id=self.client_id, flow_name="FlowOrderTest", token=self.token)
+
+    flow_obj = aff4.FACTORY.OpenWithLock(session_id, token=self.token)
+    flow_obj.Close()
+
+    # Both writers start from the same stored version.
+    other_obj = aff4.FACTORY.Open(session_id, mode="rw", token=self.token)
+
+    flow_obj = aff4.FACTORY.RelockObject(flow_obj)
+    self.assertTrue(flow_obj.Revalidate())
+    flow_obj.state.changed = True
+    flow_obj.Close()
+
+    other_obj.state.changed = False
+    other_obj.Close()
+
+    flow_obj = aff4.FACTORY.RelockObject(flow_obj)
+    self.assertFalse(flow_obj.Revalidate())
+    flow_obj.transaction.Release()
+
   def testFlowSerialization(self):
     """Check that we can serialize flows."""
     session_id = flow.GRRFlow.StartFlow(
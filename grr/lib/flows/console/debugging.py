@@ -176,6 +176,7 @@ def StartFlowAndWorker(client_id, flow_name, **kwargs):
 
   # Terminate the worker threads
   worker_thrd.thread_pool.Join()
+  worker_thrd.membership.Leave()
 
   return session_id
 
@@ -2,12 +2,15 @@
 """These cron flows do the datastore cleanup."""
 
 
+import time
 
 from grr.lib import aff4
-from grr.lib import client_index
 from grr.lib import config_lib
+from grr.lib import data_store
 from grr.lib import flow
+from grr.lib import queue_manager
 from grr.lib import rdfvalue
+from grr.lib import sequential_collection
 from grr.lib import utils
 
 from grr.lib.aff4_objects import aff4_grr
@@ -16,130 +19,326 @@ from grr.lib.aff4_objects import cronjobs
 from grr.lib.hunts import implementation
 
 
-class CleanHunts(cronjobs.SystemCronFlow):
-  """Cleaner that deletes old hunts."""
+class DataRetentionCronFlow(cronjobs.StatefulSystemCronFlow):
+  """Base class for cron flows which delete expired objects.
+
+  Candidate urns are scanned page by page in sorted order and processed in
+  batches. Whether an object has expired is decided from the few attributes
+  listed in self.attributes, which are read straight from the data store
+  instead of opening the objects. Expired objects are deleted together with
+  all subjects below them by scanning their subtrees, and the number of
+  deleted subjects per second is limited by
+  DataRetention.max_deletions_per_second.
+
+  The last processed urn is kept in the cron job state, so a run which is
+  stopped before it went through all candidates is continued by the next one.
+  """
 
   frequency = rdfvalue.Duration("1d")
   lifetime = rdfvalue.Duration("1d")
 
+  # Config options holding the TTL and the label exempting objects from it.
+  ttl_option = None
+  exception_label_option = None
+
+  # Attributes needed by IsExpired().
+  attributes = []
+
+  # Every subject below a deleted object has at least one of these: AFF4
+  # objects have a type and collection items their value.
+  SUBTREE_ATTRIBUTES = [
+      aff4.AFF4Object.SchemaCls.TYPE.predicate,
+      sequential_collection.SequentialCollection.ATTRIBUTE
+  ]
+
+  # Share of the lifetime after which a run stops and leaves the remaining
+  # candidates to the next run.
+  TIME_BUDGET = 0.9
+
+  __abstract = True  # pylint: disable=g-bad-name
+
+  def ListCandidates(self, deadline, after_urn=None):
+    """Yields the urns of all objects which might have expired, in order.
+
+    Args:
+      deadline: Objects last used before this RDFDatetime are expired.
+      after_urn: If set, only urns sorting after this one are yielded.
+    """
+    raise NotImplementedError()
+
+  def IsExpired(self, unused_urn, unused_values, unused_deadline):
+    """Decides whether an object expired based on its attribute values.
+
+    Args:
+      unused_urn: The urn of the object.
+      unused_values: A dict mapping the attributes in self.attributes to their
+        values. Attributes which are not set are missing.
+      unused_deadline: Objects last used before this RDFDatetime are expired.
+
+    Returns:
+      True if the object should be deleted.
+    """
+    return True
+
+  def _ScanSubjects(self, prefix, attributes, after_urn=None):
+    """Yields the subjects below prefix having one of attributes, in order.
+
+    The data store is scanned one page at a time, so the subjects are never
+    all held in memory.
+
+    Args:
+      prefix: The urn to scan below.
+      attributes: Names of the attributes to scan for.
+      after_urn: If set, only subjects sorting after this one are yielded.
+    """
+    page_size = config_lib.CONFIG["DataRetention.batch_size"]
+    while True:
+      subjects = [
+          subject
+          for subject, _ in data_store.DB.ScanAttributes(
+              prefix,
+              attributes,
+              after_urn=after_urn,
+              max_records=page_size,
+              token=self.token)
+      ]
+      for subject in subjects:
+        yield utils.SmartUnicode(subject)
+
+      if len(subjects) < page_size:
+        return
+      after_urn = subjects[-1]
+
+  def ScanChildren(self, root, attribute, after_urn=None):
+    """Yields the children of root which have attribute, in sorted order."""
+    root = rdfvalue.RDFURN(root)
+    for subject in self._ScanSubjects(root, [attribute], after_urn=after_urn):
+      # Objects further down may have the attribute as well.
+      if rdfvalue.RDFURN(rdfvalue.RDFURN(subject).Dirname()) == root:
+        yield subject
+
+  def DeleteObjects(self, urns):
+    """Deletes objects and their children, returns the number of subjects."""
+    # Only the deleted objects themselves are opened, their OnDelete() may
+    # mark dependent objects elsewhere for deletion.
+    deletion_pool = aff4.DeletionPool(token=self.token)
+    for obj in deletion_pool.MultiOpen(urns):
+      obj.OnDelete(deletion_pool=deletion_pool)
+
+    deleted = 0
+    for urn in list(urns) + list(deletion_pool.root_urns_for_deletion):
+      subjects = [utils.SmartUnicode(urn)]
+      for subject in self._ScanSubjects(urn, self.SUBTREE_ATTRIBUTES):
+        subjects.append(subject)
+        if len(subjects) >= config_lib.CONFIG["DataRetention.batch_size"]:
+          deleted += self._DeleteSubjects(subjects)
+          subjects = []
+      deleted += self._DeleteSubjects(subjects)
+
+    # Only the index of the parent has to be updated, everything below the
+    # deleted objects is gone.
+    with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
+      for urn in list(urns) + list(deletion_pool.root_urns_for_deletion):
+        urn = rdfvalue.RDFURN(urn)
+        mutation_pool.DeleteAttributes(
+            rdfvalue.RDFURN(urn.Dirname()),
+            ["index:dir/%s" % utils.SmartStr(urn.Basename())])
+
+    aff4.FACTORY.Flush()
+    return deleted
+
+  def _DeleteSubjects(self, subjects):
+    for subject in subjects:
+      try:
+        aff4.FACTORY.intermediate_cache.ExpireObject(
+            rdfvalue.RDFURN(subject).Path())
+      except KeyError:
+        pass
+
+    data_store.DB.DeleteSubjects(subjects, sync=True, token=self.token)
+    return len(subjects)
+
+  def _ReadCheckpoint(self):
+    try:
+      return self.ReadCronState().get("last_urn")
+    except cronjobs.StateReadError:
+      # Not running as a scheduled cron job, so there is nothing to resume.
+      return None
+
+  def _WriteCheckpoint(self, last_urn):
+    try:
+      state = self.ReadCronState()
+      state["last_urn"] = last_urn
+      self.WriteCronState(state)
+    except (cronjobs.StateReadError, cronjobs.StateWriteError):
+      pass
+
+  def _ReadAttributes(self, urns, attributes):
+    """Reads the newest values of attributes for all urns."""
+    result = dict((urn, {}) for urn in urns)
+    if not attributes:
+      return result
+
+    by_name = dict((attribute.predicate, attribute) for attribute in attributes)
+    for subject, values in data_store.DB.MultiResolvePrefix(
+        urns,
+        by_name.keys(),
+        timestamp=data_store.DB.NEWEST_TIMESTAMP,
+        token=self.token):
+      subject_values = result[utils.SmartUnicode(subject)]
+      for name, value, _ in values:
+        attribute = by_name.get(name)
+        if attribute is not None:
+          subject_values[attribute] = (
+              attribute.attribute_type.FromDatastoreValue(value))
+
+    return result
+
+  def _Throttle(self, deleted, start_time):
+    max_rate = config_lib.CONFIG["DataRetention.max_deletions_per_second"]
+    if not max_rate:
+      return
+
+    delay = float(deleted) / max_rate - (time.time() - start_time)
+    if delay > 0:
+      time.sleep(delay)
+
   @flow.StateHandler()
   def Start(self):
-    hunts_ttl = config_lib.CONFIG["DataRetention.hunts_ttl"]
-    if not hunts_ttl:
+    ttl = config_lib.CONFIG[self.ttl_option]
+    if not ttl:
       self.Log("TTL not set - nothing to do...")
       return
 
-    exception_label = config_lib.CONFIG[
-        "DataRetention.hunts_ttl_exception_label"]
+    attributes = list(self.attributes)
+    exception_label = None
+    if self.exception_label_option:
+      exception_label = config_lib.CONFIG[self.exception_label_option]
+      attributes.append(aff4.AFF4Object.SchemaCls.LABELS)
 
-    hunts_root = aff4.FACTORY.Open("aff4:/hunts", token=self.token)
-    hunts_urns = list(hunts_root.ListChildren())
+    deadline = rdfvalue.RDFDatetime.Now() - ttl
+    start_time = time.time()
+    stop_time = start_time + self.lifetime.seconds * self.TIME_BUDGET
 
-    deadline = rdfvalue.RDFDatetime.Now() - hunts_ttl
+    candidates = self.ListCandidates(
+        deadline, after_urn=self._ReadCheckpoint())
 
-    hunts = aff4.FACTORY.MultiOpen(
-        hunts_urns, aff4_type=implementation.GRRHunt, token=self.token)
-    for hunt in hunts:
-      if exception_label in hunt.GetLabelsNames():
-        continue
+    checked = deleted = 0
+    for batch in utils.Grouper(candidates, config_lib.CONFIG[
+        "DataRetention.batch_size"]):
+      values = self._ReadAttributes(batch, attributes)
 
-      runner = hunt.GetRunner()
-      if runner.context.expires < deadline:
-        aff4.FACTORY.Delete(hunt.urn, token=self.token)
-        self.HeartBeat()
+      expired_urns = []
+      for urn in batch:
+        labels = values[urn].get(aff4.AFF4Object.SchemaCls.LABELS)
+        if labels and exception_label in labels.GetLabelNames():
+          continue
 
+        if self.IsExpired(urn, values[urn], deadline):
+          expired_urns.append(rdfvalue.RDFURN(urn))
 
-class CleanCronJobs(cronjobs.SystemCronFlow):
-  """Cleaner that deletes old finished cron flows."""
+      if expired_urns:
+        deleted += self.DeleteObjects(expired_urns)
+      checked += len(batch)
 
-  frequency = rdfvalue.Duration("1d")
-  lifetime = rdfvalue.Duration("1d")
+      self._WriteCheckpoint(batch[-1])
+      self.HeartBeat()
+      self._Throttle(deleted, start_time)
 
-  @flow.StateHandler()
-  def Start(self):
-    cron_jobs_ttl = config_lib.CONFIG["DataRetention.cron_jobs_flows_ttl"]
-    if not cron_jobs_ttl:
-      self.Log("TTL not set - nothing to do...")
-      return
+      if time.time() >= stop_time:
+        self.Log("Checked %d objects and deleted %d subjects, stopping at %s.",
+                 checked, deleted, batch[-1])
+        return
 
-    jobs = cronjobs.CRON_MANAGER.ListJobs(token=self.token)
-    jobs_objs = aff4.FACTORY.MultiOpen(
-        jobs, aff4_type=cronjobs.CronJob, mode="r", token=self.token)
+    # All candidates were checked, the next run starts from the beginning.
+    self._WriteCheckpoint(None)
+    self.Log("Checked %d objects and deleted %d subjects.", checked, deleted)
 
-    for obj in jobs_objs:
-      age = rdfvalue.RDFDatetime.Now() - cron_jobs_ttl
-      obj.DeleteJobFlows(age)
-      self.HeartBeat()
 
+class CleanHunts(DataRetentionCronFlow):
+  """Cleaner that deletes old hunts."""
 
-class CleanTemp(cronjobs.SystemCronFlow):
-  """Cleaner that deletes temp objects."""
+  ttl_option = "DataRetention.hunts_ttl"
+  exception_label_option = "DataRetention.hunts_ttl_exception_label"
+  attributes = [implementation.GRRHunt.SchemaCls.HUNT_CONTEXT]
 
-  frequency = rdfvalue.Duration("1d")
-  lifetime = rdfvalue.Duration("1d")
+  def ListCandidates(self, deadline, after_urn=None):
+    return self.ScanChildren(
+        "aff4:/hunts",
+        implementation.GRRHunt.SchemaCls.HUNT_CONTEXT.predicate,
+        after_urn=after_urn)
 
-  @flow.StateHandler()
-  def Start(self):
-    tmp_ttl = config_lib.CONFIG["DataRetention.tmp_ttl"]
-    if not tmp_ttl:
-      self.Log("TTL not set - nothing to do...")
-      return
+  def IsExpired(self, urn, values, deadline):
+    context = values.get(implementation.GRRHunt.SchemaCls.HUNT_CONTEXT)
+    return context is not None and context.expires < deadline
 
-    exception_label = config_lib.CONFIG["DataRetention.tmp_ttl_exception_label"]
 
-    tmp_root = aff4.FACTORY.Open("aff4:/tmp", mode="r", token=self.token)
-    tmp_urns = list(tmp_root.ListChildren())
+class CleanCronJobs(DataRetentionCronFlow):
+  """Cleaner that deletes old finished cron flows."""
 
-    deadline = rdfvalue.RDFDatetime.Now() - tmp_ttl
+  ttl_option = "DataRetention.cron_jobs_flows_ttl"
+  attributes = [flow.GRRFlow.SchemaCls.FLOW_CONTEXT]
 
-    for tmp_group in utils.Grouper(tmp_urns, 10000):
-      expired_tmp_urns = []
-      for tmp_obj in aff4.FACTORY.MultiOpen(
-          tmp_group, mode="r", token=self.token):
-        if exception_label in tmp_obj.GetLabelsNames():
-          continue
+  def ListCandidates(self, deadline, after_urn=None):
+    jobs = cronjobs.CRON_MANAGER.ListJobs(token=self.token)
+    for job_urn in sorted(utils.SmartUnicode(urn) for urn in jobs):
+      job_prefix = job_urn + u"/"
+      if after_urn and after_urn.startswith(job_prefix):
+        job_after_urn = after_urn
+      elif after_urn and after_urn > job_prefix:
+        # All flows of this job were checked already.
+        continue
+      else:
+        job_after_urn = None
 
-        if tmp_obj.Get(tmp_obj.Schema.LAST) < deadline:
-          expired_tmp_urns.append(tmp_obj.urn)
+      for flow_urn in self.ScanChildren(
+          job_urn,
+          flow.GRRFlow.SchemaCls.FLOW_CONTEXT.predicate,
+          after_urn=job_after_urn):
+        yield flow_urn
 
-      aff4.FACTORY.MultiDelete(expired_tmp_urns, token=self.token)
-      self.HeartBeat()
+  def IsExpired(self, urn, values, deadline):
+    context = values.get(flow.GRRFlow.SchemaCls.FLOW_CONTEXT)
+    return context is not None and context.create_time < deadline
 
+  def DeleteObjects(self, urns):
+    with queue_manager.QueueManager(token=self.token) as manager:
+      manager.MultiDestroyFlowStates(urns)
 
-class CleanInactiveClients(cronjobs.SystemCronFlow):
-  """Cleaner that deletes inactive clients."""
+    return super(CleanCronJobs, self).DeleteObjects(urns)
 
-  frequency = rdfvalue.Duration("1d")
-  lifetime = rdfvalue.Duration("1d")
 
-  @flow.StateHandler()
-  def Start(self):
-    inactive_client_ttl = config_lib.CONFIG["DataRetention.inactive_client_ttl"]
-    if not inactive_client_ttl:
-      self.Log("TTL not set - nothing to do...")
-      return
+class CleanTemp(DataRetentionCronFlow):
+  """Cleaner that deletes temp objects."""
 
-    exception_label = config_lib.CONFIG[
-        "DataRetention.inactive_client_ttl_exception_label"]
+  ttl_option = "DataRetention.tmp_ttl"
+  exception_label_option = "DataRetention.tmp_ttl_exception_label"
+  attributes = [aff4.AFF4Object.SchemaCls.LAST]
 
-    index = client_index.CreateClientIndex(token=self.token)
+  def ListCandidates(self, deadline, after_urn=None):
+    return self.ScanChildren(
+        "aff4:/tmp",
+        aff4.AFF4Object.SchemaCls.TYPE.predicate,
+        after_urn=after_urn)
 
-    client_urns = index.LookupClients(["."])
+  def IsExpired(self, urn, values, deadline):
+    return values.get(aff4.AFF4Object.SchemaCls.LAST) < deadline
 
-    deadline = rdfvalue.RDFDatetime.Now() - inactive_client_ttl
 
-    for client_group in utils.Grouper(client_urns, 1000):
-      inactive_client_urns = []
-      for client in aff4.FACTORY.MultiOpen(
-          client_group,
-          mode="r",
-          aff4_type=aff4_grr.VFSGRRClient,
-          token=self.token):
-        if exception_label in client.GetLabelsNames():
-          continue
+class CleanInactiveClients(DataRetentionCronFlow):
+  """Cleaner that deletes inactive clients."""
 
-        if client.Get(client.Schema.LAST) < deadline:
-          inactive_client_urns.append(client.urn)
+  ttl_option = "DataRetention.inactive_client_ttl"
+  exception_label_option = (
+      "DataRetention.inactive_client_ttl_exception_label")
+  attributes = [aff4.AFF4Object.SchemaCls.LAST]
 
-      aff4.FACTORY.MultiDelete(inactive_client_urns, token=self.token)
-      self.HeartBeat()
+  def ListCandidates(self, deadline, after_urn=None):
+    # Only the client objects themselves have a certificate.
+    return self.ScanChildren(
+        "aff4:/",
+        aff4_grr.VFSGRRClient.SchemaCls.CERT.predicate,
+        after_urn=after_urn)
+
+  def IsExpired(self, urn, values, deadline):
+    return values.get(aff4.AFF4Object.SchemaCls.LAST) < deadline
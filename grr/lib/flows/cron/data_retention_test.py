@@ -12,12 +12,14 @@ from grr.lib import flags
 from grr.lib import flow
 from grr.lib import hunts
 from grr.lib import rdfvalue
+from grr.lib import sequential_collection
 from grr.lib import test_lib
 from grr.lib import utils
 from grr.lib.aff4_objects import cronjobs
 from grr.lib.aff4_objects import standard as aff4_standard
 from grr.lib.flows.cron import data_retention
 from grr.lib.hunts import standard
+from grr.lib.rdfvalues import flows as rdf_flows
 
 
 class CleanHuntsTest(test_lib.FlowTestsBaseclass):
@@ -102,6 +104,29 @@ class CleanHuntsTest(test_lib.FlowTestsBaseclass):
             for value, _ in values:
               self.assertNotIn(hunt_id, utils.SmartUnicode(value))
 
+  def testDeletesCollectionItemsOfDeletedHunts(self):
+    for hunt_urn in self.hunts_urns:
+      for i in range(5):
+        sequential_collection.GrrMessageCollection.StaticAdd(
+            hunt_urn.Add("Results"), self.token,
+            rdf_flows.GrrMessage(request_id=i))
+
+    # Subtrees are scanned and deleted in pages of two subjects.
+    with test_lib.ConfigOverrider({
+        "DataRetention.hunts_ttl": rdfvalue.Duration("1s"),
+        "DataRetention.batch_size": 2
+    }):
+      with test_lib.FakeTime(40 + 60 * self.NUM_HUNTS):
+        flow.GRRFlow.StartFlow(
+            flow_name=data_retention.CleanHunts.__name__,
+            sync=True,
+            token=self.token)
+
+    for hunt_urn in self.hunts_urns:
+      prefix = utils.SmartUnicode(hunt_urn)
+      for subject in data_store.DB.subjects:
+        self.assertFalse(subject.startswith(prefix))
+
   def testKeepsHuntsWithRetainLabel(self):
     exception_label_name = config_lib.CONFIG[
         "DataRetention.hunts_ttl_exception_label"]
@@ -297,6 +322,69 @@ class CleanTempTest(test_lib.FlowTestsBaseclass):
               "aff4:/tmp", token=self.token).ListChildren())
       self.assertEqual(len(tmp_urns), 3)
 
+  def _ListTemp(self):
+    return list(
+        aff4.FACTORY.Open(
+            "aff4:/tmp", token=self.token).ListChildren())
+
+  def testResumesFromCheckpoint(self):
+    # The cron job is needed to keep the checkpoint in.
+    cronjobs.ScheduleSystemCronFlows(
+        names=[data_retention.CleanTemp.__name__], token=self.token)
+
+    with test_lib.ConfigOverrider({
+        "DataRetention.tmp_ttl": rdfvalue.Duration("10s"),
+        "DataRetention.batch_size": 3
+    }):
+      # Every run stops after the first batch.
+      with utils.Stubber(data_retention.CleanTemp, "TIME_BUDGET", 0):
+        with test_lib.FakeTime(40 + 60 * self.NUM_TMP):
+          flow.GRRFlow.StartFlow(
+              flow_name=data_retention.CleanTemp.__name__,
+              sync=True,
+              token=self.token)
+          self.assertEqual(len(self._ListTemp()), 7)
+
+          flow.GRRFlow.StartFlow(
+              flow_name=data_retention.CleanTemp.__name__,
+              sync=True,
+              token=self.token)
+          self.assertEqual(len(self._ListTemp()), 4)
+
+      with test_lib.FakeTime(40 + 60 * self.NUM_TMP):
+        flow.GRRFlow.StartFlow(
+            flow_name=data_retention.CleanTemp.__name__,
+            sync=True,
+            token=self.token)
+      self.assertEqual(len(self._ListTemp()), 0)
+
+    cron_job = aff4.FACTORY.Open(
+        cronjobs.CRON_MANAGER.CRON_JOBS_PATH.Add(
+            data_retention.CleanTemp.__name__),
+        token=self.token)
+    # A finished run resets the checkpoint.
+    state = cron_job.Get(cron_job.Schema.STATE_DICT).ToDict()
+    self.assertIsNone(state["last_urn"])
+
+  def testDeletionRateIsLimited(self):
+    sleeps = []
+    with test_lib.ConfigOverrider({
+        "DataRetention.tmp_ttl": rdfvalue.Duration("10s"),
+        "DataRetention.batch_size": 5,
+        "DataRetention.max_deletions_per_second": 2
+    }):
+      with utils.Stubber(data_retention.time, "sleep", sleeps.append):
+        with test_lib.FakeTime(40 + 60 * self.NUM_TMP):
+          flow.GRRFlow.StartFlow(
+              flow_name=data_retention.CleanTemp.__name__,
+              sync=True,
+              token=self.token)
+
+    self.assertEqual(len(self._ListTemp()), 0)
+    # Time stands still, so the run waits for 5 deletions at 2 per second
+    # after each batch.
+    self.assertEqual(sleeps, [2.5, 5.0])
+
 
 class CleanInactiveClientsTest(test_lib.FlowTestsBaseclass):
   """Test the CleanTemp flow."""
@@ -10,16 +10,19 @@ import logging
 from grr.endtoend_tests import base
 from grr.lib import access_control
 from grr.lib import aff4
+from grr.lib import client_index
 from grr.lib import config_lib
 from grr.lib import data_store
 from grr.lib import export_utils
 from grr.lib import flow
 from grr.lib import hunts
+from grr.lib import queue_manager
 from grr.lib import rdfvalue
 from grr.lib import utils
 from grr.lib.aff4_objects import aff4_grr
 from grr.lib.aff4_objects import cronjobs
 from grr.lib.aff4_objects import stats as aff4_stats
+from grr.lib.flows.general import audit
 from grr.lib.flows.general import discovery as flows_discovery
 from grr.lib.flows.general import endtoend as flows_endtoend
 from grr.lib.hunts import standard as hunts_standard
@@ -328,6 +331,58 @@ class PurgeClientStats(cronjobs.SystemCronFlow):
       self.HeartBeat()
 
 
+class CompactClientIndex(cronjobs.SystemCronFlow):
+  """Merges recent client index changes into compressed posting blocks."""
+
+  frequency = rdfvalue.Duration("1h")
+  lifetime = rdfvalue.Duration("50m")
+
+  @flow.StateHandler()
+  def Start(self):
+    index = client_index.CreateClientIndex(token=self.token)
+    compacted = index.CompactPendingPostingLists()
+    self.Log("Compacted %d client index keywords.", compacted)
+
+
+class BackfillPendingClientWork(cronjobs.SystemCronFlow):
+  """Marks clients whose tasks were queued before the pending work summary.
+
+  Frontends drain every client's queue until this has run once, afterwards
+  the job only checks that all shards are done.
+  """
+
+  frequency = rdfvalue.Duration("1d")
+  start_time_randomization = False
+
+  @flow.StateHandler()
+  def Start(self):
+    pending_work = queue_manager.PendingClientWork(token=self.token)
+    if pending_work.IsBackfilled():
+      return
+
+    marked = pending_work.Backfill(export_utils.GetAllClients(token=self.token))
+    self.Log("Marked %d clients with queued tasks.", marked)
+
+
+class BuildAuditAggregates(cronjobs.SystemCronFlow):
+  """Counts the audit events written before the per day counters existed.
+
+  The counting reports only show the days counted here or by the audit
+  listener. Once the old logs were counted, the job only checks that.
+  """
+
+  frequency = rdfvalue.Duration("1d")
+  start_time_randomization = False
+
+  @flow.StateHandler()
+  def Start(self):
+    if audit.AuditAggregatesBuilt(token=self.token):
+      return
+
+    counted = audit.BuildAuditAggregates(token=self.token)
+    self.Log("Counted %d audit events.", counted)
+
+
 class EndToEndTests(cronjobs.SystemCronFlow):
   """Runs end-to-end tests on designated clients.
 
@@ -7,13 +7,17 @@ from grr.endtoend_tests import endtoend_mocks
 from grr.lib import action_mocks
 from grr.lib import aff4
 from grr.lib import client_fixture
+from grr.lib import client_index
+from grr.lib import data_store
 from grr.lib import flags
 from grr.lib import flow
+from grr.lib import queue_manager
 from grr.lib import test_lib
 from grr.lib import utils
 from grr.lib.aff4_objects import aff4_grr
 from grr.lib.aff4_objects import stats as aff4_stats
 from grr.lib.flows.cron import system
+from grr.lib.flows.general import audit
 from grr.lib.flows.general import endtoend as endtoend_flows
 from grr.lib.rdfvalues import client as client_rdf
 from grr.lib.rdfvalues import flows
@@ -205,6 +209,57 @@ class SystemCronFlowTest(test_lib.FlowTestsBaseclass):
     self.assertEqual(len(stat_entries), 1)
     self.assertTrue(max_age not in [e.RSS_size for e in stat_entries])
 
+  def testCompactClientIndex(self):
+    index = client_index.CreateClientIndex(token=self.token)
+    before = index.LookupClients(["."])
+    self.assertEqual(len(before), 20)
+
+    for _ in test_lib.TestFlowHelper(
+        "CompactClientIndex", None, client_id=self.client_id, token=self.token):
+      pass
+
+    # Nothing is left to compact and the results are unchanged.
+    self.assertEqual(index.CompactPendingPostingLists(), 0)
+    self.assertEqual(sorted(index.LookupClients(["."])), sorted(before))
+
+  def testBackfillPendingClientWork(self):
+    client_id = client_rdf.ClientURN("C.1000000000000001")
+    other_client_id = client_rdf.ClientURN("C.1000000000000002")
+    # Tasks queued before the summary existed have no marks.
+    queue_manager.QueueManager(token=self.token).Schedule([
+        flows.GrrMessage(
+            queue=client_id.Queue(),
+            session_id="aff4:/Test",
+            generate_task_id=True)
+    ])
+    for shard in queue_manager.PendingClientWork.Shards():
+      data_store.DB.DeleteSubject(shard, token=self.token)
+
+    pending_work = queue_manager.PendingClientWork(
+        cache_ttl=0, token=self.token)
+    self.assertTrue(pending_work.HasPendingWork(other_client_id))
+
+    for _ in test_lib.TestFlowHelper(
+        "BackfillPendingClientWork",
+        None,
+        client_id=self.client_id,
+        token=self.token):
+      pass
+
+    self.assertTrue(pending_work.IsBackfilled())
+    self.assertTrue(pending_work.HasPendingWork(client_id))
+    self.assertFalse(pending_work.HasPendingWork(other_client_id))
+
+  def testBuildAuditAggregates(self):
+    self.assertFalse(audit.AuditAggregatesBuilt(token=self.token))
+
+    for _ in test_lib.TestFlowHelper(
+        "BuildAuditAggregates", None, client_id=self.client_id,
+        token=self.token):
+      pass
+
+    self.assertTrue(audit.AuditAggregatesBuilt(token=self.token))
+
   def _SetSummaries(self, client_id):
     client = aff4.FACTORY.Create(
         client_id, aff4_grr.VFSGRRClient, mode="rw", token=self.token)
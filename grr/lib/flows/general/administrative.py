@@ -91,12 +91,16 @@ class ClientCrashEventListener(flow.EventListener):
 class GetClientStatsProcessResponseMixin(object):
   """Mixin defining ProcessReponse() that writes client stats to datastore."""
 
-  def ProcessResponse(self, client_id, response):
+  def ProcessResponse(self, client_id, response, mutation_pool=None):
     """Actually processes the contents of the response."""
     urn = client_id.Add("stats")
 
     with aff4.FACTORY.Create(
-        urn, aff4_stats.ClientStats, token=self.token, mode="w") as stats_fd:
+        urn,
+        aff4_stats.ClientStats,
+        token=self.token,
+        mode="w",
+        mutation_pool=mutation_pool) as stats_fd:
       # Only keep the average of all values that fall within one minute.
       stats_fd.AddAttribute(stats_fd.Schema.STATS, response.DownSample())
 
@@ -131,10 +135,17 @@ class GetClientStatsAuto(flow.WellKnownFlow,
   well_known_session_id = rdfvalue.SessionID(
       flow_name="Stats", queue=queues.STATS)
 
+  def ProcessMessages(self, msgs):
+    """Writes the stats of a batch of messages in one go."""
+    with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
+      for message in msgs:
+        client_stats = rdf_client.ClientStats(message.payload)
+        self.ProcessResponse(
+            message.source, client_stats, mutation_pool=mutation_pool)
+
   def ProcessMessage(self, message):
     """Processes a stats response from the client."""
-    client_stats = rdf_client.ClientStats(message.payload)
-    self.ProcessResponse(message.source, client_stats)
+    self.ProcessMessages([message])
 
 
 class DeleteGRRTempFilesArgs(rdf_structs.RDFProtoStruct):
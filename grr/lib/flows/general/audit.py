@@ -8,10 +8,21 @@ execution etc) generate events to notify listeners about the event.
 
 The audit system consists of a group of event listeners which receive these
 events and act upon them.
+
+The events are stored in audit logs which each cover one
+Logging.aff4_audit_log_rollover period, so reading the events of a timespan
+only touches the logs of that timespan. In addition the number of events per
+day, action, flow and user is counted as the events are written, reports
+which only need these numbers never have to read the events themselves.
+Every event is counted in a column of its own, so counting it again never
+changes the numbers. The events written before the counters existed are
+counted once by the BuildAuditAggregates cron job.
 """
 
 
 from grr.lib import aff4
+from grr.lib import config_lib
+from grr.lib import data_store
 from grr.lib import events
 from grr.lib import flow
 from grr.lib import queues
@@ -20,6 +31,20 @@ from grr.lib import sequential_collection
 
 AUDIT_EVENT = "Audit"
 
+# The events are counted per day.
+AGGREGATE_PERIOD = 60 * 60 * 24
+
+AGGREGATE_PREFIX = "aggregate:"
+
+# The number of events BuildAuditAggregates() counts at once.
+BUILD_BATCH_SIZE = 1000
+
+# Set on the aggregates once they include the events of older logs.
+AGGREGATES_BUILT_ATTRIBUTE = "metadata:aggregates_built"
+
+# The rollover an audit log was written with.
+AUDIT_LOG_ROLLOVER_ATTRIBUTE = "metadata:audit_log_rollover"
+
 
 class AuditEventCollection(sequential_collection.IndexedSequentialCollection):
   RDF_TYPE = events.AuditEvent
@@ -32,10 +57,168 @@ def AllAuditLogs(token=None):
 
 
 def AuditLogsForTimespan(start_time, end_time, token=None):
-  # TODO(user): This is not great, we should store this differently.
-  for log in aff4.FACTORY.Open(
-      "aff4:/audit/logs", token=token).ListChildren(age=(start_time, end_time)):
-    yield AuditEventCollection(log, token=token)
+  """Yields the audit logs with the events written in the given timespan.
+
+  Logs are named after the time they start at and record the rollover they
+  were written with. Logs written before the rollover was recorded, e.g. with
+  an older default or an operator set rollover, are taken to last until the
+  next log starts.
+
+  Args:
+    start_time: An RDFDatetime.
+    end_time: An RDFDatetime.
+    token: The datastore access token.
+
+  Yields:
+    AuditEventCollections in the order of time.
+  """
+  start_sec = start_time.AsSecondsFromEpoch()
+  end_sec = end_time.AsSecondsFromEpoch()
+
+  # Only the names of the logs are listed, none of them is read here.
+  log_starts = sorted(
+      int(urn.Basename())
+      for urn in aff4.FACTORY.ListChildren(aff4.AuditLogBase(), token=token)
+      if urn.Basename().isdigit())
+
+  candidates = {}
+  for i, log_start in enumerate(log_starts):
+    if log_start > end_sec:
+      break
+
+    next_start = log_starts[i + 1] if i + 1 < len(log_starts) else None
+    if next_start is None or next_start > start_sec:
+      candidates[aff4.AuditLogBase().Add(str(log_start))] = (log_start,
+                                                              next_start)
+
+  rollovers = dict(
+      (rdfvalue.RDFURN(subject), int(values[0][1]))
+      for subject, values in data_store.DB.MultiResolvePrefix(
+          candidates.keys(),
+          AUDIT_LOG_ROLLOVER_ATTRIBUTE,
+          timestamp=data_store.DB.NEWEST_TIMESTAMP,
+          token=token))
+
+  for urn, (log_start, _) in sorted(
+      candidates.iteritems(), key=lambda item: item[1][0]):
+    rollover = rollovers.get(urn)
+    if rollover is not None and log_start + rollover <= start_sec:
+      continue
+
+    yield AuditEventCollection(urn, token=token)
+
+
+def AuditAggregatesBase():
+  return aff4.ROOT_URN.Add("audit").Add("aggregates")
+
+
+def _AggregateDay(timestamp):
+  seconds = timestamp.AsSecondsFromEpoch()
+  return seconds // AGGREGATE_PERIOD * AGGREGATE_PERIOD
+
+
+def _AggregateAttribute(event):
+  # Every event has a column of its own, user names are last, they might
+  # contain the separator.
+  return "%s%d:%s:%d:%s" % (AGGREGATE_PREFIX, event.action, event.flow_name,
+                            event.id, event.user)
+
+
+def UpdateAuditAggregates(audit_events, token=None):
+  """Adds audit events to the per day event counts.
+
+  Each event is counted in a column named after its id, so writing an event
+  again, e.g. when a batch is retried or the old logs are counted, does not
+  count it twice and no lock or read is needed.
+
+  Args:
+    audit_events: A list of AuditEvents.
+    token: The datastore access token.
+  """
+  with data_store.DB.GetMutationPool(token=token) as mutation_pool:
+    for event in audit_events:
+      mutation_pool.Set(
+          AuditAggregatesBase().Add(str(_AggregateDay(event.timestamp))),
+          _AggregateAttribute(event), 1)
+
+
+def AuditAggregatesBuilt(token=None):
+  """Returns True if BuildAuditAggregates() has completed."""
+  return bool(
+      list(
+          data_store.DB.ResolveMulti(
+              AuditAggregatesBase(), [AGGREGATES_BUILT_ATTRIBUTE],
+              timestamp=data_store.DB.NEWEST_TIMESTAMP,
+              token=token)))
+
+
+def BuildAuditAggregates(token=None):
+  """Counts the events of all audit logs.
+
+  Events which are already counted are not counted again, so this includes the
+  events written before the counters existed and can run while the audit
+  listener writes new events.
+
+  Args:
+    token: The datastore access token.
+
+  Returns:
+    The number of events counted.
+  """
+  total = 0
+  for log in AllAuditLogs(token=token):
+    batch = []
+    for event in log.GenerateItems():
+      batch.append(event)
+      if len(batch) >= BUILD_BATCH_SIZE:
+        UpdateAuditAggregates(batch, token=token)
+        total += len(batch)
+        batch = []
+
+    UpdateAuditAggregates(batch, token=token)
+    total += len(batch)
+
+  data_store.DB.Set(
+      AuditAggregatesBase(), AGGREGATES_BUILT_ATTRIBUTE, "", token=token)
+  return total
+
+
+def AuditEventCounts(start_time, end_time, token=None):
+  """Yields the number of audit events per day in the given timespan.
+
+  The counts are kept per day, so the timespan is extended to whole days.
+
+  Args:
+    start_time: An RDFDatetime.
+    end_time: An RDFDatetime, exclusive.
+    token: The datastore access token.
+
+  Yields:
+    Tuples (day, action, flow_name, user, count), day is an RDFDatetime.
+  """
+  first = _AggregateDay(start_time)
+  subjects = [
+      AuditAggregatesBase().Add(str(day))
+      for day in xrange(first, max(end_time.AsSecondsFromEpoch(), first + 1),
+                        AGGREGATE_PERIOD)
+  ]
+
+  for subject, values in data_store.DB.MultiResolvePrefix(
+      subjects,
+      AGGREGATE_PREFIX,
+      timestamp=data_store.DB.NEWEST_TIMESTAMP,
+      token=token):
+    day = rdfvalue.RDFDatetime().FromSecondsFromEpoch(
+        int(rdfvalue.RDFURN(subject).Basename()))
+    counts = {}
+    for attribute, _, _ in values:
+      action, flow_name, _, user = attribute[len(AGGREGATE_PREFIX):].split(
+          ":", 3)
+      key = (int(action), flow_name, user)
+      counts[key] = counts.get(key, 0) + 1
+
+    for (action, flow_name, user), count in counts.iteritems():
+      yield day, action, flow_name, user, count
 
 
 class AuditEventListener(flow.EventListener):
@@ -52,12 +235,25 @@ class AuditEventListener(flow.EventListener):
       # which audit logs exist easily.
       aff4.FACTORY.Create(
           log_urn, aff4.AFF4Volume, mode="w", token=self.token).Close()
+      # Readers need the rollover to know which time the log covers.
+      data_store.DB.Set(
+          log_urn,
+          AUDIT_LOG_ROLLOVER_ATTRIBUTE,
+          config_lib.CONFIG["Logging.aff4_audit_log_rollover"],
+          token=self.token)
       self.created_logs.add(log_urn)
     return log_urn
 
-  @flow.EventHandler(auth_required=False)
-  def ProcessMessage(self, message=None, event=None):
-    _ = message
+  accepts_batches = True
+
+  @flow.BatchEventHandler(auth_required=False)
+  def ProcessMessages(self, messages=None, events=None):
+    _ = messages
     log_urn = aff4.CurrentAuditLog()
     self.EnsureLogIsIndexed(log_urn)
-    AuditEventCollection.StaticAdd(log_urn, self.token, event)
+    with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
+      for event in events:
+        AuditEventCollection.StaticAdd(
+            log_urn, self.token, event, mutation_pool=mutation_pool)
+
+    UpdateAuditAggregates(events, token=self.token)
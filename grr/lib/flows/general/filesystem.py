@@ -8,6 +8,7 @@ import stat
 from grr.lib import aff4
 from grr.lib import artifact_utils
 from grr.lib import flow
+from grr.lib import mactime_index
 from grr.lib import server_stubs
 from grr.lib.aff4_objects import aff4_grr
 from grr.lib.aff4_objects import standard
@@ -286,6 +287,22 @@ class RecursiveListDirectory(flow.GRRFlow):
     self.Status(status_text, self.state.file_count, self.state.dir_count)
 
 
+class BuildMACTimeIndex(flow.GRRFlow):
+  """Adds the files written before the MAC time index existed to the index.
+
+  The VFS timeline starts this flow the first time a client's timeline is
+  requested. It only reads the data store, the client is not contacted.
+  """
+
+  category = None
+
+  @flow.StateHandler()
+  def Start(self):
+    index = mactime_index.MACTimeIndex(self.client_id, token=self.token)
+    if not index.IsBuilt():
+      index.Rebuild()
+
+
 class UpdateSparseImageChunksArgs(rdf_structs.RDFProtoStruct):
   protobuf = flows_pb2.UpdateSparseImageChunksArgs
 
@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 """The GRR frontend server."""
 
+import collections
 import operator
+import threading
 import time
 
 
@@ -152,6 +154,125 @@ class ServerCommunicator(communicator.Communicator):
     return rdf_flows.GrrMessage.AuthorizationState.AUTHENTICATED
 
 
+class FrontEndOverloadedError(Exception):
+  """Raised when the front end can not take any more messages right now."""
+
+
+class WellKnownFlowQueue(object):
+  """A bounded queue of messages for well known flows run on the front end.
+
+  Messages sent by many clients are grouped by flow and handed to the flows in
+  batches by a few processor threads. Clients therefore do not wait for the
+  data store writes of well known flows, and flows which process their
+  messages together can share the writes of a whole batch.
+
+  Clients are answered before their queued messages are processed. Stop()
+  processes what is left when the frontend shuts down, but queued messages
+  are lost if the frontend dies.
+  """
+
+  def __init__(self, well_known_flows, max_size, batch_size, processors,
+               name="wkf_processor"):
+    self.well_known_flows = well_known_flows
+    self.max_size = max_size
+    self.batch_size = batch_size
+
+    self.condition = threading.Condition()
+    # Lists of queued messages by flow name, the flow queued first goes first.
+    self.messages = collections.OrderedDict()
+    self.queued = 0
+    self.in_progress = 0
+    self.stopped = False
+
+    self.threads = []
+    for i in range(processors):
+      thread = threading.Thread(target=self._Run, name="%s-%d" % (name, i))
+      thread.daemon = True
+      thread.start()
+      self.threads.append(thread)
+
+  def Put(self, msgs_by_flow):
+    """Queues the messages of one client request.
+
+    Args:
+      msgs_by_flow: A dict mapping flow names to lists of messages.
+
+    Raises:
+      FrontEndOverloadedError: If the messages do not fit in the queue. None
+        of them are queued in this case.
+    """
+    count = sum(len(msgs) for msgs in msgs_by_flow.itervalues())
+    with self.condition:
+      if self.stopped:
+        raise FrontEndOverloadedError("Well known flow queue is stopped.")
+
+      if self.queued + count > self.max_size:
+        stats.STATS.IncrementCounter("frontend_well_known_flow_queue_rejected")
+        raise FrontEndOverloadedError(
+            "Well known flow queue is full (%d messages)." % self.queued)
+
+      for flow_name, msgs in msgs_by_flow.iteritems():
+        self.messages.setdefault(flow_name, []).extend(msgs)
+      self.queued += count
+      stats.STATS.SetGaugeValue("frontend_well_known_flow_queue_size",
+                                self.queued)
+      self.condition.notify_all()
+
+  def _NextBatch(self):
+    """Returns the next (flow name, messages) batch, None once stopped."""
+    with self.condition:
+      while not self.queued:
+        if self.stopped:
+          return None
+        self.condition.wait()
+
+      flow_name, msgs = self.messages.popitem(last=False)
+      batch = msgs[:self.batch_size]
+      if len(msgs) > self.batch_size:
+        # Other flows get their turn before the rest of this one.
+        self.messages[flow_name] = msgs[self.batch_size:]
+
+      self.queued -= len(batch)
+      self.in_progress += len(batch)
+      stats.STATS.SetGaugeValue("frontend_well_known_flow_queue_size",
+                                self.queued)
+      return flow_name, batch
+
+  def _Run(self):
+    while True:
+      next_batch = self._NextBatch()
+      if next_batch is None:
+        return
+
+      flow_name, batch = next_batch
+      try:
+        self.well_known_flows[flow_name].ProcessMessages(batch)
+        stats.STATS.RecordEvent("frontend_well_known_flow_batch_size",
+                                len(batch))
+      except Exception as e:  # pylint: disable=broad-except
+        logging.exception("Error processing %d messages for %s: %s",
+                          len(batch), flow_name, e)
+      finally:
+        with self.condition:
+          self.in_progress -= len(batch)
+          self.condition.notify_all()
+
+  def Join(self):
+    """Waits until all queued messages were processed."""
+    with self.condition:
+      while self.queued or self.in_progress:
+        self.condition.wait()
+
+  def Stop(self):
+    """Stops taking messages and waits until the queued ones are processed."""
+    with self.condition:
+      self.stopped = True
+      self.condition.notify_all()
+
+    for thread in self.threads:
+      thread.join()
+
+
 class FrontEndServer(object):
   """This is the front end server.
 
@@ -188,6 +309,8 @@ class FrontEndServer(object):
     self.message_expiry_time = message_expiry_time
     self.max_retransmission_time = max_retransmission_time
     self.max_queue_size = max_queue_size
+    self.pending_work = queue_manager.PendingClientWork(
+        store=self.data_store, token=self.token)
     self.thread_pool = threadpool.ThreadPool.Factory(
         threadpool_prefix,
         min_threads=2,
@@ -205,6 +328,30 @@ class FrontEndServer(object):
     self.well_known_flows_blacklist = set(config_lib.CONFIG[
         "Frontend.DEBUG_well_known_flows_blacklist"])
 
+    # Only messages to these well known flows are queued, all others are
+    # processed while the client waits.
+    self.asynchronous_well_known_flows = set(config_lib.CONFIG[
+        "Frontend.asynchronous_well_known_flows"])
+    self.well_known_flow_queue = None
+    if config_lib.CONFIG["Frontend.well_known_flow_queue_size"]:
+      self.well_known_flow_queue = WellKnownFlowQueue(
+          self.well_known_flows,
+          max_size=config_lib.CONFIG["Frontend.well_known_flow_queue_size"],
+          batch_size=config_lib.CONFIG["Frontend.well_known_flow_batch_size"],
+          processors=config_lib.CONFIG["Frontend.well_known_flow_processors"],
+          name="%s_wkf" % threadpool_prefix)
+
+    # The public keys of clients uploading files. Keys expire so that a
+    # changed client certificate is picked up eventually.
+    self.upload_public_keys = utils.TimeBasedCache(
+        max_size=10000,
+        max_age=config_lib.CONFIG["Frontend.upload_public_key_cache_age"])
+
+  def Stop(self):
+    """Processes the queued well known flow messages before shutting down."""
+    if self.well_known_flow_queue is not None:
+      self.well_known_flow_queue.Stop()
+
   @stats.Counted("grr_frontendserver_handle_num")
   @stats.Timed("grr_frontendserver_handle_time")
   def HandleMessageBundles(self, request_comms, response_comms):
@@ -264,6 +411,7 @@ class FrontEndServer(object):
   def DrainTaskSchedulerQueueForClient(self, client, max_count):
     """Drains the client's Task Scheduler queue.
 
+    0) Check the pending work summary, idle clients end here.
     1) Get all messages in the client queue.
     2) Sort these into a set of session_ids.
     3) Use data_store.DB.ResolvePrefix() to query all requests.
@@ -284,13 +432,20 @@ class FrontEndServer(object):
 
     client = rdf_client.ClientURN(client)
 
+    if not self.pending_work.HasPendingWork(client):
+      return []
+
     start_time = time.time()
+    drain_start = rdfvalue.RDFDatetime.Now()
     # Drain the queue for this client
     new_tasks = queue_manager.QueueManager(token=self.token).QueryAndOwn(
         queue=client.Queue(),
         limit=max_count,
         lease_seconds=self.message_expiry_time)
 
+    if not new_tasks:
+      self.pending_work.ClearIfIdle(client, drain_start)
+
     initial_ttl = rdf_flows.GrrMessage().task_ttl
     check_before_sending = []
     result = []
@@ -329,19 +484,22 @@ class FrontEndServer(object):
     Args:
       client_id: The client which sent the messages.
       messages: A list of GrrMessage RDFValues.
+
+    Raises:
+      FrontEndOverloadedError: If the messages for well known flows can not be
+        queued. Nothing the client sent is stored in this case, so it can
+        simply send the messages again.
     """
     now = time.time()
+
+    # Remove and handle messages to WellKnownFlows
+    worker_msgs = self.HandleWellKnownFlows(messages)
+
     with queue_manager.QueueManager(
         token=self.token, store=self.data_store) as manager:
       sessions_handled = []
-      for session_id, msgs in utils.GroupBy(
-          messages, operator.attrgetter("session_id")).iteritems():
-
-        # Remove and handle messages to WellKnownFlows
-        unprocessed_msgs = self.HandleWellKnownFlows(msgs)
-
-        if not unprocessed_msgs:
-          continue
+      for session_id, unprocessed_msgs in utils.GroupBy(
+          worker_msgs, operator.attrgetter("session_id")).iteritems():
 
         # Keep track of all the flows we handled in this request.
         sessions_handled.append(session_id)
@@ -381,7 +539,17 @@ class FrontEndServer(object):
                   len(messages), client_id, time.time() - now)
 
   def HandleWellKnownFlows(self, messages):
-    """Hands off messages to well known flows."""
+    """Hands off messages to well known flows.
+
+    Args:
+      messages: A list of GrrMessage RDFValues.
+
+    Returns:
+      The messages which have to be queued for the workers.
+
+    Raises:
+      FrontEndOverloadedError: If the well known flow queue is full.
+    """
     msgs_by_wkf = {}
     result = []
     for msg in messages:
@@ -416,6 +584,15 @@ class FrontEndServer(object):
         # Queue the message in the data store.
         result.append(msg)
 
+    if self.well_known_flow_queue is not None:
+      queued_msgs = dict((flow_name, msg_list)
+                         for flow_name, msg_list in msgs_by_wkf.iteritems()
+                         if flow_name in self.asynchronous_well_known_flows)
+      if queued_msgs:
+        self.well_known_flow_queue.Put(queued_msgs)
+        for flow_name in queued_msgs:
+          del msgs_by_wkf[flow_name]
+
     for flow_name, msg_list in msgs_by_wkf.iteritems():
       wkf = self.well_known_flows[flow_name]
       wkf.ProcessMessages(msg_list)
@@ -423,8 +600,19 @@ class FrontEndServer(object):
     return result
 
   def _GetClientPublicKey(self, client_id):
-    client_obj = aff4.FACTORY.Open(client_id, token=aff4.FACTORY.root_token)
-    return client_obj.Get(client_obj.Schema.CERT).GetPublicKey()
+    try:
+      return self.upload_public_keys.Get(str(client_id))
+    except KeyError:
+      pass
+
+    client_cls = aff4.AFF4Object.classes["VFSGRRClient"]
+    client_obj = aff4.FACTORY.Open(
+        client_id,
+        attributes=[client_cls.SchemaCls.CERT],
+        token=aff4.FACTORY.root_token)
+    public_key = client_obj.Get(client_obj.Schema.CERT).GetPublicKey()
+    self.upload_public_keys.Put(str(client_id), public_key)
+    return public_key
 
   def HandleUpload(self, encoding_header, encoded_upload_token, data_generator):
     """Handles the upload of a file."""
@@ -491,6 +679,10 @@ class FrontendInit(registry.InitHook):
     stats.STATS.RegisterEventMetric(
         "frontend_request_latency", fields=[("source", str)])
 
+    stats.STATS.RegisterGaugeMetric("frontend_well_known_flow_queue_size", int)
+    stats.STATS.RegisterCounterMetric("frontend_well_known_flow_queue_rejected")
+    stats.STATS.RegisterEventMetric("frontend_well_known_flow_batch_size")
+
     stats.STATS.RegisterEventMetric("grr_frontendserver_handle_time")
     stats.STATS.RegisterCounterMetric("grr_frontendserver_handle_num")
     stats.STATS.RegisterGaugeMetric("grr_frontendserver_client_cache_size", int)
@@ -4,6 +4,7 @@
 
 
 
+from grr.lib import aff4
 from grr.lib import communicator
 from grr.lib import config_lib
 from grr.lib import data_store
@@ -231,6 +232,104 @@ class GRRFEServerTest(test_lib.FlowTestsBaseclass):
           data_store.DB.ResolvePrefix(
               self.client_id, "task:", token=self.token))
 
+  def _WellKnownFlowMessages(self, count):
+    session_id = test_lib.WellKnownSessionTest.well_known_session_id
+    return [
+        rdf_flows.GrrMessage(
+            request_id=0,
+            response_id=0,
+            session_id=session_id,
+            payload=rdfvalue.RDFInteger(i)) for i in range(1, count + 1)
+    ]
+
+  def testWellKnownFlowsAreQueued(self):
+    with test_lib.ConfigOverrider({
+        "Frontend.well_known_flow_queue_size": 100,
+        "Frontend.well_known_flow_batch_size": 4,
+        "Frontend.asynchronous_well_known_flows": [
+            utils.SmartStr(
+                test_lib.WellKnownSessionTest.well_known_session_id.FlowName())
+        ]
+    }):
+      self.InitTestServer()
+
+      test_lib.WellKnownSessionTest.messages = []
+      self.server.ReceiveMessages(self.client_id,
+                                  self._WellKnownFlowMessages(9))
+      self.server.well_known_flow_queue.Join()
+
+      test_lib.WellKnownSessionTest.messages.sort()
+      self.assertEqual(test_lib.WellKnownSessionTest.messages,
+                       list(range(1, 10)))
+
+  def testFullWellKnownFlowQueueRejectsMessages(self):
+    with test_lib.ConfigOverrider({
+        "Frontend.well_known_flow_queue_size": 5,
+        # Nothing is taken off the queue.
+        "Frontend.well_known_flow_processors": 0,
+        "Frontend.asynchronous_well_known_flows": [
+            utils.SmartStr(
+                test_lib.WellKnownSessionTest.well_known_session_id.FlowName())
+        ]
+    }):
+      self.InitTestServer()
+
+      test_lib.WellKnownSessionTest.messages = []
+      self.server.ReceiveMessages(self.client_id,
+                                  self._WellKnownFlowMessages(3))
+      self.assertEqual(self.server.well_known_flow_queue.queued, 3)
+
+      with self.assertRaises(front_end.FrontEndOverloadedError):
+        self.server.ReceiveMessages(self.client_id,
+                                    self._WellKnownFlowMessages(3))
+
+      # None of the rejected messages were queued.
+      self.assertEqual(self.server.well_known_flow_queue.queued, 3)
+      self.assertFalse(test_lib.WellKnownSessionTest.messages)
+
+  def testOnlyAsynchronousWellKnownFlowsAreQueued(self):
+    with test_lib.ConfigOverrider({
+        "Frontend.well_known_flow_queue_size": 5,
+        "Frontend.well_known_flow_processors": 0,
+        "Frontend.asynchronous_well_known_flows": ["Stats"]
+    }):
+      self.InitTestServer()
+
+      test_lib.WellKnownSessionTest.messages = []
+      self.server.ReceiveMessages(self.client_id,
+                                  self._WellKnownFlowMessages(9))
+
+      test_lib.WellKnownSessionTest.messages.sort()
+      self.assertEqual(test_lib.WellKnownSessionTest.messages,
+                       list(range(1, 10)))
+      self.assertEqual(self.server.well_known_flow_queue.queued, 0)
+
+  def testStopProcessesQueuedMessages(self):
+    with test_lib.ConfigOverrider({
+        "Frontend.well_known_flow_queue_size": 100,
+        "Frontend.asynchronous_well_known_flows": [
+            utils.SmartStr(
+                test_lib.WellKnownSessionTest.well_known_session_id.FlowName())
+        ]
+    }):
+      self.InitTestServer()
+
+      test_lib.WellKnownSessionTest.messages = []
+      self.server.ReceiveMessages(self.client_id,
+                                  self._WellKnownFlowMessages(9))
+      self.server.Stop()
+
+      test_lib.WellKnownSessionTest.messages.sort()
+      self.assertEqual(test_lib.WellKnownSessionTest.messages,
+                       list(range(1, 10)))
+      for thread in self.server.well_known_flow_queue.threads:
+        self.assertFalse(thread.is_alive())
+
+      # A stopped frontend does not take any more messages.
+      with self.assertRaises(front_end.FrontEndOverloadedError):
+        self.server.ReceiveMessages(self.client_id,
+                                    self._WellKnownFlowMessages(1))
+
   def testWellKnownFlowsRemote(self):
     """Make sure that flows that do not exist on the front end get scheduled."""
     test_lib.WellKnownSessionTest.messages = []
@@ -365,6 +464,61 @@ class GRRFEServerTest(test_lib.FlowTestsBaseclass):
       self.assertEqual(response.job[i].session_id, session_id)
       self.assertEqual(response.job[i].name, "Test")
 
+  def testIdleClientsDoNotTouchTheirQueue(self):
+    client_id = self.SetupClients(1)[0]
+    self.server.pending_work.Backfill([client_id])
+    drained_queues = []
+    original_query_and_own = queue_manager.QueueManager.QueryAndOwn
+
+    def QueryAndOwn(manager, queue, **kwargs):
+      drained_queues.append(queue)
+      return original_query_and_own(manager, queue, **kwargs)
+
+    with utils.Stubber(queue_manager.QueueManager, "QueryAndOwn", QueryAndOwn):
+      self.assertEqual(
+          self.server.DrainTaskSchedulerQueueForClient(client_id, 100), [])
+      self.assertEqual(drained_queues, [])
+
+      flow.GRRFlow.StartFlow(
+          client_id=client_id,
+          flow_name="SendingFlow",
+          message_count=1,
+          token=self.token)
+      self.assertEqual(
+          len(self.server.DrainTaskSchedulerQueueForClient(client_id, 100)), 1)
+      self.assertEqual(drained_queues, [client_id.Queue()])
+
+      # The client acknowledges the message, so the next drain finds the queue
+      # empty and clears the summary.
+      queue_manager.QueueManager(token=self.token).DropQueue(client_id.Queue())
+      self.assertEqual(
+          self.server.DrainTaskSchedulerQueueForClient(client_id, 100), [])
+      self.assertEqual(
+          self.server.DrainTaskSchedulerQueueForClient(client_id, 100), [])
+      self.assertEqual(len(drained_queues), 2)
+
+  def testUploadPublicKeysAreCached(self):
+    opened = []
+    original_open = aff4.FACTORY.Open
+
+    def Open(urn, *args, **kwargs):
+      opened.append(urn)
+      return original_open(urn, *args, **kwargs)
+
+    with utils.Stubber(aff4.FACTORY, "Open", Open):
+      with test_lib.FakeTime(1000):
+        public_key = self.server._GetClientPublicKey(self.client_id)
+        self.assertEqual(
+            self.server._GetClientPublicKey(self.client_id).SerializeToString(),
+            public_key.SerializeToString())
+      self.assertEqual(len(opened), 1)
+
+      # The cached key expires eventually.
+      with test_lib.FakeTime(1000 + config_lib.CONFIG[
+          "Frontend.upload_public_key_cache_age"] + 1):
+        self.server._GetClientPublicKey(self.client_id)
+      self.assertEqual(len(opened), 2)
+
   def testHandleMessageBundle(self):
     """Check that HandleMessageBundles() requeues messages if it failed.
 
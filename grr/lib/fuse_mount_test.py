@@ -185,6 +185,126 @@ class GRRFuseDatastoreOnlyTest(GRRFuseTestBase):
       self.passthrough.Read(existing_dir)
 
 
+class FuseCacheTest(GRRFuseTestBase):
+  """Tests the handle and chunk caching of the FUSE layer."""
+
+  def setUp(self):
+    super(FuseCacheTest, self).setUp()
+
+    self.chunksize = 1024
+    self.data = "".join(chr(i % 256) * self.chunksize for i in range(20))
+    self.urn = rdfvalue.RDFURN("aff4:/foo/bigfile")
+    with test_lib.FakeTime(100):
+      self._WriteImage(self.data)
+
+    self.cache = fuse_mount.FuseCache(max_chunks=100, read_ahead=4)
+    self.passthrough = fuse_mount.GRRFuseDatastoreOnly(
+        "/", token=self.token, cache=self.cache)
+
+    self.open_count = 0
+    original_open = aff4.FACTORY.Open
+
+    def CountingOpen(*args, **kwargs):
+      # MultiOpen opens objects it already read through Open as well.
+      if "local_cache" not in kwargs:
+        self.open_count += 1
+      return original_open(*args, **kwargs)
+
+    self.open_stubber = utils.Stubber(aff4.FACTORY, "Open", CountingOpen)
+    self.open_stubber.Start()
+
+  def tearDown(self):
+    self.open_stubber.Stop()
+    super(FuseCacheTest, self).tearDown()
+
+  def _WriteImage(self, data):
+    with aff4.FACTORY.Create(
+        self.urn, aff4.AFF4Image, mode="w", token=self.token) as fd:
+      fd.SetChunksize(self.chunksize)
+      fd.Write(data)
+
+  def _ReadSequentially(self, fh, block_size):
+    result = []
+    for offset in range(0, len(self.data), block_size):
+      result.append(
+          self.passthrough.read(self.urn.Path(), block_size, offset, fh))
+    return "".join(result)
+
+  def testSequentialReadOpensObjectOnce(self):
+    fh = self.passthrough.open(self.urn.Path(), 0)
+    self.open_count = 0
+
+    self.assertEqual(self._ReadSequentially(fh, 512), self.data)
+    self.assertEqual(self.open_count, 0)
+
+    self.passthrough.release(self.urn.Path(), fh)
+
+  def testReadAheadServesChunksFromCache(self):
+    fh = self.passthrough.open(self.urn.Path(), 0)
+    self.assertEqual(self._ReadSequentially(fh, self.chunksize), self.data)
+
+    # The first two reads fetch one chunk each, after that the data is read
+    # in windows of one chunk plus four read ahead chunks.
+    self.assertEqual(self.cache.chunk_fetches, 2 + 18 / 5 + 1)
+    self.assertEqual(self.cache.chunk_misses, 20)
+
+  def testRandomReads(self):
+    fh = self.passthrough.open(self.urn.Path(), 0)
+    for offset, length in [(5000, 3000), (0, 1), (19000, 5000), (1023, 2)]:
+      self.assertEqual(
+          self.passthrough.read(self.urn.Path(), length, offset, fh),
+          self.data[offset:offset + length])
+
+  def testGetattrIsCached(self):
+    path = self.urn.Path()
+    self.passthrough.getattr(path)
+    self.open_count = 0
+    for _ in range(10):
+      self.passthrough.getattr(path)
+    self.assertEqual(self.open_count, 0)
+
+  def testInvalidateDropsStaleData(self):
+    path = self.urn.Path()
+    self.assertEqual(self.passthrough.read(path, 10, 0), self.data[:10])
+
+    new_data = "X" * len(self.data)
+    with test_lib.FakeTime(200):
+      self._WriteImage(new_data)
+    # Cached data is served until the cache is told about the new version.
+    self.assertEqual(self.passthrough.read(path, 10, 0), self.data[:10])
+
+    self.cache.Invalidate(self.urn.Dirname())
+    self.assertEqual(self.passthrough.read(path, 10, 0), new_data[:10])
+
+  def testObjectOpenedDuringInvalidationIsNotCached(self):
+    path = self.urn.Path()
+    original_open = aff4.FACTORY.Open
+
+    def RefreshingOpen(*args, **kwargs):
+      fd = original_open(*args, **kwargs)
+      # A refresh finishes after the old version was read from the data store.
+      stubber.Stop()
+      with test_lib.FakeTime(200):
+        self._WriteImage("X" * 10)
+      self.cache.Invalidate(self.urn)
+      return fd
+
+    stubber = utils.Stubber(aff4.FACTORY, "Open", RefreshingOpen)
+    with stubber:
+      self.assertEqual(
+          self.passthrough.getattr(path)["st_size"], len(self.data))
+
+    self.assertEqual(self.passthrough.getattr(path)["st_size"], 10)
+
+  def testReleaseDropsHandle(self):
+    fh = self.passthrough.open(self.urn.Path(), 0)
+    self.passthrough.release(self.urn.Path(), fh)
+
+    self.open_count = 0
+    self.passthrough.read(self.urn.Path(), 10, 0, fh)
+    self.assertEqual(self.open_count, 1)
+
+
 class GRRFuseTest(GRRFuseTestBase):
 
   # Whether the tests are done and the fake server can stop running.
@@ -407,6 +527,19 @@ class GRRFuseTest(GRRFuseTestBase):
     contents = self.grr_fuse.Readdir(self.ClientPathToAFF4Path(self.temp_dir))
     self.assertIn("password.txt", contents)
 
+  def testRefreshInvalidatesCachedStat(self):
+    filename = self.WriteFileAndList("password.txt", "password1")
+    aff4path = self.ClientPathToAFF4Path(filename)
+    self.assertEqual(self.grr_fuse.Getattr(aff4path)["st_size"], 9)
+
+    with open(filename, "wb") as f:
+      f.write("hunter2" * 5)
+
+    # The listing refreshes the stats of the children, the open object of the
+    # file must not be served from the cache afterwards.
+    self.grr_fuse.Readdir(self.ClientPathToAFF4Path(self.temp_dir))
+    self.assertEqual(self.grr_fuse.Getattr(aff4path)["st_size"], 35)
+
   def testClientSideUpdateFileContents(self):
 
     new_contents = "hunter2" * 5
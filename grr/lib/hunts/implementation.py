@@ -868,6 +868,8 @@ class GRRHunt(flow.FlowBase):
 
   args_type = None
 
+  lock_free_attributes = [SchemaCls.STATE]
+
   def Initialize(self):
     super(GRRHunt, self).Initialize()
     # Hunts run in multiple threads so we need to protect access.
@@ -1455,9 +1457,11 @@ class GRRHunt(flow.FlowBase):
   def WriteState(self):
     if "w" in self.mode:
       self._ValidateState()
-      self.Set(self.Schema.HUNT_ARGS(self.args))
-      self.Set(self.Schema.HUNT_CONTEXT(self.context))
-      self.Set(self.Schema.HUNT_RUNNER_ARGS(self.runner_args))
+      self._SetChangedState([
+          self.Schema.HUNT_ARGS(self.args),
+          self.Schema.HUNT_CONTEXT(self.context),
+          self.Schema.HUNT_RUNNER_ARGS(self.runner_args)
+      ])
 
 
 class HuntInitHook(registry.InitHook):
@@ -4,12 +4,210 @@
 An aff4 keyword index class which associates keywords with names and makes it
 possible to search for those names which match all keywords.
 
+Every keyword has its own row. New associations are written as one column per
+name (the write buffer). A compaction step periodically merges the buffer into
+posting blocks: sorted lists of names which are front coded, carry delta
+encoded timestamps and are compressed. Next to every block a small skip entry
+holds the first and last name, the number of names and the time range of the
+block. Like the buffer, which only keeps the latest write of every name, blocks
+only store the time a name was last seen.
+
+Lookups only read the buffer and the skip entries of each keyword. The keyword
+with the fewest candidates is read in full and the others are probed for those
+candidates only, fetching just the blocks which can contain them and overlap
+the requested time range. The cost of a lookup thus depends on the size of the
+result rather than on the size of the posting lists of common keywords.
 """
 
 
+import bisect
+import zlib
+
+import logging
+
 from grr.lib import aff4
 from grr.lib import data_store
 from grr.lib import rdfvalue
+from grr.lib import utils
+from grr.lib.rdfvalues import structs
+
+
+def _EncodePostingBlock(entries):
+  """Encodes a list of (name, timestamp) tuples sorted by name."""
+  result = [structs.VarintEncode(len(entries))]
+  previous = ""
+  for name, timestamp in entries:
+    name = utils.SmartStr(name)
+    shared = 0
+    for a, b in zip(previous, name):
+      if a != b:
+        break
+      shared += 1
+
+    result.append(structs.VarintEncode(shared))
+    result.append(structs.VarintEncode(len(name) - shared))
+    result.append(name[shared:])
+    result.append(structs.VarintEncode(timestamp))
+
+    previous = name
+
+  return zlib.compress("".join(result))
+
+
+def _DecodePostingBlock(data):
+  """Decodes a posting block into a dict mapping names to timestamps."""
+  buf = zlib.decompress(data)
+  result = {}
+  count, pos = structs.VarintReader(buf, 0)
+  previous = ""
+  for _ in xrange(count):
+    shared, pos = structs.VarintReader(buf, pos)
+    suffix_len, pos = structs.VarintReader(buf, pos)
+    name = previous[:shared] + buf[pos:pos + suffix_len]
+    pos += suffix_len
+    timestamp, pos = structs.VarintReader(buf, pos)
+
+    result[utils.SmartUnicode(name)] = timestamp
+    previous = name
+
+  return result
+
+
+class PostingBlockInfo(object):
+  """The skip metadata of a single posting block."""
+
+  def __init__(self, first_name, last_name, count, min_ts, max_ts):
+    self.first_name = first_name
+    self.last_name = last_name
+    self.count = count
+    self.min_ts = min_ts
+    self.max_ts = max_ts
+
+  @classmethod
+  def FromEntries(cls, entries):
+    timestamps = [ts for _, ts in entries]
+    return cls(entries[0][0], entries[-1][0], len(entries), min(timestamps),
+               max(timestamps))
+
+  @classmethod
+  def FromSerialized(cls, first_name, data):
+    count, pos = structs.VarintReader(data, 0)
+    min_ts, pos = structs.VarintReader(data, pos)
+    max_ts, pos = structs.VarintReader(data, pos)
+    return cls(first_name, utils.SmartUnicode(data[pos:]), count, min_ts,
+               max_ts)
+
+  def SerializeToString(self):
+    return "".join([
+        structs.VarintEncode(self.count), structs.VarintEncode(self.min_ts),
+        structs.VarintEncode(self.max_ts), utils.SmartStr(self.last_name)
+    ])
+
+  def Overlaps(self, start_time, end_time):
+    return self.max_ts >= start_time and self.min_ts <= end_time
+
+
+class PostingList(object):
+  """The posting list of one keyword, restricted to a time range.
+
+  Holds the write buffer, the tombstones and the skip entries of the keyword.
+  Posting blocks are only fetched when names are looked up in them.
+  """
+
+  def __init__(self, index, keyword, keyword_urn, start_time, end_time):
+    self.index = index
+    self.keyword = keyword
+    self.keyword_urn = keyword_urn
+    self.start_time = start_time
+    self.end_time = end_time
+
+    # Maps names to the timestamps found in the write buffer.
+    self.buffer = {}
+    # Maps names to the time they were last removed from the keyword.
+    self.tombstones = {}
+    # The skip entries of all blocks overlapping the time range, by first name.
+    self.blocks = []
+
+  def _BlocksSorted(self):
+    self.blocks.sort(key=lambda block: block.first_name)
+    self.first_names = [block.first_name for block in self.blocks]
+
+  def AddSkipEntry(self, first_name, data):
+    block = PostingBlockInfo.FromSerialized(first_name, data)
+    if block.Overlaps(self.start_time, self.end_time):
+      self.blocks.append(block)
+
+  def EstimateSize(self):
+    """An upper bound of the number of names in the time range."""
+    return sum(block.count for block in self.blocks) + len(self.buffer)
+
+  def _LastSeen(self, name, block_timestamp):
+    """Returns the last timestamp of name within the time range or None."""
+    last_seen = None
+    if (block_timestamp is not None and
+        block_timestamp > self.tombstones.get(name, -1) and
+        self.start_time <= block_timestamp <= self.end_time):
+      last_seen = block_timestamp
+
+    for ts in self.buffer.get(name, ()):
+      last_seen = max(last_seen, ts)
+
+    return last_seen
+
+  def _ReadBlocks(self, blocks):
+    """Fetches and decodes blocks, returns a merged name->timestamp dict."""
+    if not blocks:
+      return {}
+
+    result = {}
+    for _, value, _ in data_store.DB.ResolveMulti(
+        self.keyword_urn,
+        [self.index.BLOCK_COLUMN_FORMAT % block.first_name for block in blocks],
+        timestamp=data_store.DB.NEWEST_TIMESTAMP,
+        token=self.index.token):
+      result.update(_DecodePostingBlock(value))
+
+    return result
+
+  def Read(self):
+    """Returns a dict mapping all names to the time they were last seen."""
+    block_entries = self._ReadBlocks(self.blocks)
+
+    result = {}
+    for name in set(block_entries).union(self.buffer):
+      last_seen = self._LastSeen(name, block_entries.get(name))
+      if last_seen is not None:
+        result[name] = last_seen
+
+    return result
+
+  def Seek(self, names):
+    """Looks up the given names only.
+
+    Args:
+      names: A sorted list of names.
+
+    Returns:
+      A dict mapping the names present in this posting list to the time they
+      were last seen.
+    """
+    self._BlocksSorted()
+
+    needed = set()
+    for name in names:
+      idx = bisect.bisect_right(self.first_names, name) - 1
+      if idx >= 0 and name <= self.blocks[idx].last_name:
+        needed.add(idx)
+
+    block_entries = self._ReadBlocks([self.blocks[idx] for idx in needed])
+
+    result = {}
+    for name in names:
+      last_seen = self._LastSeen(name, block_entries.get(name))
+      if last_seen is not None:
+        result[name] = last_seen
+
+    return result
 
 
 class AFF4KeywordIndex(aff4.AFF4Object):
@@ -19,6 +217,23 @@ class AFF4KeywordIndex(aff4.AFF4Object):
   INDEX_PREFIX_LEN = len(INDEX_PREFIX)
   INDEX_COLUMN_FORMAT = INDEX_PREFIX + "%s"
 
+  # Compacted posting blocks, by the first name in the block.
+  BLOCK_PREFIX = "kw_block:"
+  BLOCK_COLUMN_FORMAT = BLOCK_PREFIX + "%s"
+
+  # Skip entries of the posting blocks, tombstones of removed names and the
+  # marker of keywords which need compaction share a column family so they can
+  # be read in one go.
+  META_PREFIX = "kw_meta:"
+  SKIP_PREFIX = META_PREFIX + "skip:"
+  SKIP_COLUMN_FORMAT = SKIP_PREFIX + "%s"
+  REMOVED_PREFIX = META_PREFIX + "removed:"
+  REMOVED_COLUMN_FORMAT = REMOVED_PREFIX + "%s"
+  PENDING_COLUMN = META_PREFIX + "pending"
+
+  # The number of names in a posting block.
+  BLOCK_SIZE = 512
+
   # The lowest and highest legal timestamps.
   FIRST_TIMESTAMP = 0
   LAST_TIMESTAMP = (2**63) - 2  # maxint64 - 1
@@ -26,30 +241,80 @@ class AFF4KeywordIndex(aff4.AFF4Object):
   def _KeywordToURN(self, keyword):
     return self.urn.Add(keyword)
 
-  def Lookup(self, keywords, **kwargs):
+  def _OpenPostingLists(self, keywords, start_time, end_time):
+    """Reads buffers and skip entries of keywords, returns PostingLists."""
+    keyword_urns = {self._KeywordToURN(k): k for k in keywords}
+    posting_lists = {}
+    for keyword_urn, keyword in keyword_urns.iteritems():
+      posting_lists[keyword_urn] = PostingList(self, keyword, keyword_urn,
+                                               start_time, end_time)
+
+    for keyword_urn, value in data_store.DB.MultiResolvePrefix(
+        keyword_urns.keys(),
+        self.INDEX_PREFIX,
+        timestamp=(start_time, end_time + 1),
+        token=self.token):
+      buf = posting_lists[keyword_urn].buffer
+      for column, _, ts in value:
+        buf.setdefault(column[self.INDEX_PREFIX_LEN:], []).append(ts)
+
+    for keyword_urn, value in data_store.DB.MultiResolvePrefix(
+        keyword_urns.keys(),
+        self.META_PREFIX,
+        timestamp=data_store.DB.ALL_TIMESTAMPS,
+        token=self.token):
+      posting_list = posting_lists[keyword_urn]
+      for column, data, ts in value:
+        if column.startswith(self.SKIP_PREFIX):
+          posting_list.AddSkipEntry(column[len(self.SKIP_PREFIX):], data)
+        elif column.startswith(self.REMOVED_PREFIX):
+          name = column[len(self.REMOVED_PREFIX):]
+          posting_list.tombstones[name] = max(
+              posting_list.tombstones.get(name, -1), ts)
+
+    return posting_lists.values()
+
+  def Lookup(self,
+             keywords,
+             start_time=FIRST_TIMESTAMP,
+             end_time=LAST_TIMESTAMP,
+             last_seen_map=None):
     """Finds objects associated with keywords.
 
-    Find the names related to all keywords.
+    Find the names related to all keywords. The keyword with the fewest
+    candidates is read first, the remaining keywords are only searched for the
+    names found so far.
 
     Args:
       keywords: A collection of keywords that we are interested in.
-      **kwargs: Additional arguments to be passed to the underlying call to
-        ReadPostingLists
+      start_time: Only considers keywords added at or after this point in time.
+      end_time: Only considers keywords at or before this point in time.
+      last_seen_map: If present, is treated as a dict and populated to map pairs
+        (keyword, name) to the timestamp of the latest connection found, for
+        all names returned.
     Returns:
       A set of potentially relevant names.
 
     """
+    posting_lists = sorted(
+        self._OpenPostingLists(keywords, start_time, end_time),
+        key=lambda posting_list: posting_list.EstimateSize())
 
-    posting_lists = self.ReadPostingLists(keywords, **kwargs)
-
-    results = posting_lists.values()
-    relevant_set = results[0]
+    found = {posting_lists[0].keyword: posting_lists[0].Read()}
+    names = sorted(found[posting_lists[0].keyword])
+    for posting_list in posting_lists[1:]:
+      if not names:
+        break
 
-    for hits in results:
-      relevant_set &= hits
+      hits = posting_list.Seek(names)
+      found[posting_list.keyword] = hits
+      names = [name for name in names if name in hits]
 
-      if not relevant_set:
-        return relevant_set
+    relevant_set = set(names)
+    if last_seen_map is not None:
+      for keyword, hits in found.iteritems():
+        for name in relevant_set:
+          last_seen_map[(keyword, name)] = hits[name]
 
     return relevant_set
 
@@ -70,19 +335,13 @@ class AFF4KeywordIndex(aff4.AFF4Object):
       A dict mapping each keyword to a set of relevant names.
 
     """
-    keyword_urns = {self._KeywordToURN(k): k for k in keywords}
     result = {}
     for kw in keywords:
       result[kw] = set()
 
-    for keyword_urn, value in data_store.DB.MultiResolvePrefix(
-        keyword_urns.keys(),
-        self.INDEX_PREFIX,
-        timestamp=(start_time, end_time + 1),
-        token=self.token):
-      for column, _, ts in value:
-        kw = keyword_urns[keyword_urn]
-        name = column[self.INDEX_PREFIX_LEN:]
+    for posting_list in self._OpenPostingLists(keywords, start_time, end_time):
+      kw = posting_list.keyword
+      for name, ts in posting_list.Read().iteritems():
         result[kw].add(name)
         if last_seen_map is not None:
           last_seen_map[(kw, name)] = max(last_seen_map.get((kw, name), -1), ts)
@@ -111,20 +370,24 @@ class AFF4KeywordIndex(aff4.AFF4Object):
     if sync:
       with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
         for keyword in set(keywords):
-          mutation_pool.Set(self._KeywordToURN(keyword),
-                            self.INDEX_COLUMN_FORMAT % name,
-                            "",
-                            timestamp=timestamp,
-                            **kwargs)
+          mutation_pool.MultiSet(
+              self._KeywordToURN(keyword), {
+                  self.INDEX_COLUMN_FORMAT % name: [""],
+                  self.PENDING_COLUMN: [""]
+              },
+              timestamp=timestamp,
+              **kwargs)
     else:
       for keyword in set(keywords):
-        data_store.DB.Set(self._KeywordToURN(keyword),
-                          self.INDEX_COLUMN_FORMAT % name,
-                          "",
-                          token=self.token,
-                          sync=False,
-                          timestamp=timestamp,
-                          **kwargs)
+        data_store.DB.MultiSet(
+            self._KeywordToURN(keyword), {
+                self.INDEX_COLUMN_FORMAT % name: [""],
+                self.PENDING_COLUMN: [""]
+            },
+            token=self.token,
+            sync=False,
+            timestamp=timestamp,
+            **kwargs)
 
   def RemoveKeywordsForName(self, name, keywords, sync=True):
     """Removes keywords for a name.
@@ -134,14 +397,134 @@ class AFF4KeywordIndex(aff4.AFF4Object):
       keywords: A collection of keywords.
       sync: Sync to data store immediately.
     """
+    # Compacted blocks are not rewritten here, a tombstone hides the name in
+    # them until the next compaction.
+    now = rdfvalue.RDFDatetime.Now().AsMicroSecondsFromEpoch()
     if sync:
       with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
         for keyword in set(keywords):
-          mutation_pool.DeleteAttributes(
-              self._KeywordToURN(keyword), [self.INDEX_COLUMN_FORMAT % name])
+          keyword_urn = self._KeywordToURN(keyword)
+          mutation_pool.DeleteAttributes(keyword_urn,
+                                         [self.INDEX_COLUMN_FORMAT % name])
+          mutation_pool.MultiSet(keyword_urn, {
+              self.REMOVED_COLUMN_FORMAT % name: [""],
+              self.PENDING_COLUMN: [""]
+          },
+                                 timestamp=now)
     else:
       for keyword in set(keywords):
+        keyword_urn = self._KeywordToURN(keyword)
         data_store.DB.DeleteAttributes(
-            self._KeywordToURN(keyword), [self.INDEX_COLUMN_FORMAT % name],
+            keyword_urn, [self.INDEX_COLUMN_FORMAT % name],
             token=self.token,
             sync=False)
+        data_store.DB.MultiSet(
+            keyword_urn, {
+                self.REMOVED_COLUMN_FORMAT % name: [""],
+                self.PENDING_COLUMN: [""]
+            },
+            timestamp=now,
+            token=self.token,
+            sync=False)
+
+  def _CompactPostingList(self, keyword_urn):
+    """Merges the write buffer and tombstones of a keyword into its blocks."""
+    cutoff = rdfvalue.RDFDatetime.Now().AsMicroSecondsFromEpoch()
+
+    with data_store.DB.DBSubjectLock(
+        keyword_urn, lease_time=600, token=self.token):
+      tombstones = {}
+      meta_columns = set()
+      for column, _, ts in data_store.DB.ResolvePrefix(
+          keyword_urn,
+          self.META_PREFIX,
+          timestamp=data_store.DB.ALL_TIMESTAMPS,
+          token=self.token):
+        meta_columns.add(column)
+        if column.startswith(self.REMOVED_PREFIX):
+          name = column[len(self.REMOVED_PREFIX):]
+          tombstones[name] = max(tombstones.get(name, -1), ts)
+
+      entries = {}
+      old_blocks = {}
+      for column, value, _ in data_store.DB.ResolvePrefix(
+          keyword_urn,
+          self.BLOCK_PREFIX,
+          timestamp=data_store.DB.NEWEST_TIMESTAMP,
+          token=self.token):
+        old_blocks[column] = value
+        for name, ts in _DecodePostingBlock(value).iteritems():
+          if ts > tombstones.get(name, -1):
+            entries[name] = max(entries.get(name, -1), ts)
+
+      buffer_columns = set()
+      for column, _, ts in data_store.DB.ResolvePrefix(
+          keyword_urn,
+          self.INDEX_PREFIX,
+          timestamp=(self.FIRST_TIMESTAMP, cutoff),
+          token=self.token):
+        buffer_columns.add(column)
+        name = column[self.INDEX_PREFIX_LEN:]
+        entries[name] = max(entries.get(name, -1), ts)
+
+      # Only the time each name was last seen is kept.
+      entries = sorted(entries.iteritems())
+
+      new_columns = {}
+      for i in xrange(0, len(entries), self.BLOCK_SIZE):
+        block_entries = entries[i:i + self.BLOCK_SIZE]
+        block = PostingBlockInfo.FromEntries(block_entries)
+        block_column = self.BLOCK_COLUMN_FORMAT % block.first_name
+        data = _EncodePostingBlock(block_entries)
+        if old_blocks.get(block_column) != data:
+          new_columns[block_column] = [data]
+          new_columns[self.SKIP_COLUMN_FORMAT % block.first_name] = [
+              block.SerializeToString()
+          ]
+        old_blocks.pop(block_column, None)
+
+      to_delete = []
+      for block_column in old_blocks:
+        first_name = block_column[len(self.BLOCK_PREFIX):]
+        to_delete.append(block_column)
+        to_delete.append(self.SKIP_COLUMN_FORMAT % first_name)
+
+      if new_columns or to_delete:
+        data_store.DB.MultiSet(
+            keyword_urn,
+            new_columns,
+            to_delete=to_delete,
+            replace=True,
+            sync=True,
+            token=self.token)
+
+      # Anything written after the cutoff is merged by the next compaction.
+      obsolete = list(buffer_columns) + [
+          c for c in meta_columns if not c.startswith(self.SKIP_PREFIX)
+      ]
+      if obsolete:
+        data_store.DB.DeleteAttributes(
+            keyword_urn, obsolete, end=cutoff, sync=True, token=self.token)
+
+  def CompactPostingLists(self, keywords):
+    """Merges the write buffers of keywords into compressed posting blocks."""
+    for keyword in keywords:
+      self._CompactPostingList(self._KeywordToURN(keyword))
+
+  def CompactPendingPostingLists(self):
+    """Compacts all keywords which were changed since their last compaction.
+
+    Returns:
+      The number of keywords compacted.
+    """
+    compacted = 0
+    for keyword_urn, _, _ in data_store.DB.ScanAttribute(
+        self.urn, self.PENDING_COLUMN, token=self.token):
+      try:
+        self._CompactPostingList(keyword_urn)
+        compacted += 1
+      except data_store.DBSubjectLockError:
+        logging.info("Posting list %s is being compacted already.",
+                     keyword_urn)
+
+    return compacted
@@ -3,9 +3,11 @@
 
 
 from grr.lib import aff4
+from grr.lib import data_store
 from grr.lib import flags
 from grr.lib import keyword_index
 from grr.lib import test_lib
+from grr.lib import utils
 
 
 class KeywordIndexTest(test_lib.AFF4ObjectTest):
@@ -90,6 +92,116 @@ class KeywordIndexTest(test_lib.AFF4ObjectTest):
     self.assertEqual(2004 * 1000000, ls_map[("popular_keyword1", "C.000000")])
     self.assertEqual(1009 * 1000000, ls_map[("popular_keyword2", "C.000000")])
 
+  def _CreateCompactedIndex(self):
+    index = aff4.FACTORY.Create(
+        "aff4:/index3/",
+        aff4_type=keyword_index.AFF4KeywordIndex,
+        mode="rw",
+        token=self.token)
+    for i in range(100):
+      with test_lib.FakeTime(1000 + i):
+        index.AddKeywordsForName(
+            "C.%03X" % i, ["common_keyword"] + (["rare_keyword"] if i % 10 == 0
+                                                 else []),
+            sync=self.sync)
+    index.CompactPostingLists(["common_keyword", "rare_keyword"])
+    return index
+
+  def testCompactionKeepsResults(self):
+    with utils.Stubber(keyword_index.AFF4KeywordIndex, "BLOCK_SIZE", 16):
+      index = self._CreateCompactedIndex()
+
+    # The write buffer is gone, all names are in blocks.
+    self.assertFalse(
+        list(
+            data_store.DB.ResolvePrefix(
+                index.urn.Add("common_keyword"),
+                index.INDEX_PREFIX,
+                token=self.token)))
+
+    self.assertEqual(len(index.Lookup(["common_keyword"])), 100)
+    self.assertEqual(
+        index.Lookup(["common_keyword", "rare_keyword"]),
+        set("C.%03X" % i for i in range(0, 100, 10)))
+    self.assertEqual(
+        len(index.Lookup(["common_keyword"], start_time=1050 * 1000000)), 50)
+
+    ls_map = {}
+    index.Lookup(["common_keyword", "rare_keyword"], last_seen_map=ls_map)
+    self.assertEqual(ls_map[("common_keyword", "C.014")], 1020 * 1000000)
+
+    # New names end up in the write buffer and are found next to the blocks.
+    index.AddKeywordsForName("C.FFF", ["common_keyword"], sync=self.sync)
+    self.assertEqual(len(index.Lookup(["common_keyword"])), 101)
+
+  def testLookupSeeksOnlyNeededBlocks(self):
+    with utils.Stubber(keyword_index.AFF4KeywordIndex, "BLOCK_SIZE", 16):
+      index = self._CreateCompactedIndex()
+
+    read_blocks = []
+    original_read_blocks = keyword_index.PostingList._ReadBlocks
+
+    def RecordingReadBlocks(posting_list, blocks):
+      read_blocks.append((posting_list.keyword, len(blocks)))
+      return original_read_blocks(posting_list, blocks)
+
+    with utils.Stubber(keyword_index.PostingList, "_ReadBlocks",
+                       RecordingReadBlocks):
+      results = index.Lookup(
+          ["common_keyword", "rare_keyword"], start_time=1060 * 1000000)
+
+    self.assertEqual(results, set(["C.03C", "C.046", "C.050", "C.05A"]))
+    # The rare keyword is read first, only the blocks of the common keyword
+    # which overlap the time range and hold candidates are fetched.
+    self.assertEqual(read_blocks[0], ("rare_keyword", 1))
+    self.assertEqual(read_blocks[1], ("common_keyword", 3))
+
+  def testRemoveHidesCompactedNames(self):
+    index = self._CreateCompactedIndex()
+    index.RemoveKeywordsForName("C.00A", ["rare_keyword"], sync=self.sync)
+    self.assertEqual(len(index.Lookup(["rare_keyword"])), 9)
+
+    index.CompactPostingLists(["rare_keyword"])
+    self.assertEqual(len(index.Lookup(["rare_keyword"])), 9)
+
+    # The name can be added back after the removal.
+    index.AddKeywordsForName("C.00A", ["rare_keyword"], sync=self.sync)
+    self.assertEqual(len(index.Lookup(["rare_keyword"])), 10)
+
+  def testCompactionKeepsLastTimestampOnly(self):
+    index = aff4.FACTORY.Create(
+        "aff4:/index4/",
+        aff4_type=keyword_index.AFF4KeywordIndex,
+        mode="rw",
+        token=self.token)
+    for i in range(3):
+      with test_lib.FakeTime(1000 + i):
+        index.AddKeywordsForName("C.000", ["keyword"], sync=self.sync)
+      index.CompactPostingLists(["keyword"])
+
+    blocks = list(
+        data_store.DB.ResolvePrefix(
+            index.urn.Add("keyword"), index.BLOCK_PREFIX,
+            token=self.token))
+    self.assertEqual(len(blocks), 1)
+    self.assertEqual(
+        keyword_index._DecodePostingBlock(blocks[0][1]),
+        {"C.000": 1002 * 1000000})
+
+    # Like the write buffer, compacted blocks only know the last time a name
+    # was seen.
+    self.assertEqual(index.Lookup(["keyword"], end_time=1001 * 1000000),
+                     set())
+    self.assertEqual(index.Lookup(["keyword"]), set(["C.000"]))
+
+  def testCompactPendingPostingLists(self):
+    index = self._CreateCompactedIndex()
+    self.assertEqual(index.CompactPendingPostingLists(), 0)
+
+    index.AddKeywordsForName("C.FFF", ["rare_keyword"], sync=self.sync)
+    self.assertEqual(index.CompactPendingPostingLists(), 1)
+    self.assertEqual(len(index.Lookup(["rare_keyword"])), 11)
+
 
 class AsyncKeywordIndexTest(KeywordIndexTest):
 
@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+"""A time ordered index of the MAC times of a client's files.
+
+Whenever a StatEntry is written to a VFS object of a client, its modification,
+access and metadata change times are added to the MAC time index of that
+client. The index is split into buckets, one per directory and BUCKET_SIZE of
+MAC time, and a list of the existing buckets is kept on the index itself.
+
+The timeline of a folder is read day by day, newest first, from the buckets of
+the directories below the folder which overlap the requested time range. At
+most a day of the folder's MAC times is held in memory at a time, no matter
+how many files the rest of the client has.
+
+Like the versions of a file's StatEntry, its MAC times are kept until the file
+is deleted. Writing a StatEntry only adds to the index, the index is never read
+then. The MAC times indexed for each file are recorded on the index too, so
+they can be removed when the file is deleted. Files written before the index
+existed are added by Rebuild(), which the BuildMACTimeIndex flow runs.
+"""
+
+import posixpath
+
+
+from grr.lib import data_store
+from grr.lib import rdfvalue
+from grr.lib import utils
+from grr.lib.rdfvalues import client as rdf_client
+
+# The StatEntry fields holding MAC times and the actions they are stored as.
+MAC_TIME_FIELDS = [("m", "st_mtime"), ("a", "st_atime"), ("c", "st_ctime")]
+
+
+def _SplitURN(urn):
+  """Returns the client id and the path of a urn in a client's namespace."""
+  client_id, _, path = utils.SmartUnicode(urn.Path()).lstrip("/").partition(
+      "/")
+  if not rdf_client.ClientURN.Validate(client_id):
+    return None, None
+  return client_id, path
+
+
+def IndexStatEntries(urn, stat_entries, mutation_pool=None, token=None):
+  """Adds the MAC times of StatEntries written to urn to the client's index.
+
+  Args:
+    urn: The urn of the VFS object the StatEntries belong to. Objects outside
+      of a client's namespace are not indexed.
+    stat_entries: A list of StatEntry objects.
+    mutation_pool: An optional MutationPool object to write to. If not given,
+      the entries are written before this returns.
+    token: The data store token to write with.
+  """
+  client_id, path = _SplitURN(urn)
+  if not path:
+    return
+
+  index = MACTimeIndex(client_id, token=token)
+  if mutation_pool:
+    index.AddStatEntries(path, stat_entries, mutation_pool)
+  else:
+    with data_store.DB.GetMutationPool(token=token) as mutation_pool:
+      index.AddStatEntries(path, stat_entries, mutation_pool)
+
+
+def RemoveFromIndex(urn, deletion_pool, token=None):
+  """Removes a VFS object which is about to be deleted from the index.
+
+  Args:
+    urn: The urn of the deleted object.
+    deletion_pool: The aff4.DeletionPool deleting the object.
+    token: The data store token to write with.
+  """
+  client_id, path = _SplitURN(urn)
+  if not path:
+    return
+
+  # The whole index goes away with the client.
+  if rdf_client.ClientURN(client_id) in deletion_pool.urns_for_deletion:
+    return
+
+  index = MACTimeIndex(client_id, token=token)
+  with data_store.DB.GetMutationPool(token=token) as mutation_pool:
+    index.RemovePath(path, mutation_pool)
+
+
+class MACTimeIndex(object):
+  """The MAC time index of a single client."""
+
+  INDEX_ROOT = rdfvalue.RDFURN("aff4:/index/mactime")
+
+  BUCKET_PREFIX = "index:mactime_bucket:"
+  ENTRY_PREFIX = "index:mactime:"
+  FILE_PREFIX = "index:mactime_file:"
+  BUILT_ATTRIBUTE = "index:mactime_built"
+  BUILD_FLOW_ATTRIBUTE = "index:mactime_build_flow"
+
+  # Children of the client which are not part of its VFS.
+  NON_VFS_CHILDREN = ["flows"]
+
+  # Each bucket holds a day of MAC times, in microseconds.
+  BUCKET_SIZE = 24 * 60 * 60 * 1000000
+
+  def __init__(self, client_id, token=None):
+    self.client_id = rdf_client.ClientURN(client_id)
+    self.urn = self.INDEX_ROOT.Add(self.client_id.Basename())
+    self.token = token
+
+  def _BucketURN(self, directory, bucket):
+    return self.urn.Add("%016x" % bucket).Add(directory)
+
+  def _BucketColumn(self, directory, bucket):
+    # The bucket number is last, so the buckets of a folder and of all
+    # folders below it share a prefix.
+    return "%s%s/%016x" % (self.BUCKET_PREFIX, utils.SmartStr(directory),
+                           bucket)
+
+  def _EntryColumn(self, timestamp, action, path):
+    return "%s%016x:%s:%s" % (self.ENTRY_PREFIX, timestamp, action,
+                              utils.SmartStr(path))
+
+  def _FileColumn(self, path):
+    return self.FILE_PREFIX + utils.SmartStr(path)
+
+  def _IndexedTimes(self, path):
+    """Returns the (timestamp, action) pairs indexed for a file."""
+    times = set()
+    for _, record, _ in data_store.DB.ResolveMulti(
+        self.urn, [self._FileColumn(path)],
+        timestamp=data_store.DB.ALL_TIMESTAMPS,
+        token=self.token):
+      for item in record.split():
+        action, timestamp = item.split(":")
+        times.add((int(timestamp, 16), action))
+    return times
+
+  def _DeleteTimes(self, path, times, mutation_pool):
+    columns_by_bucket = {}
+    for timestamp, action in times:
+      columns_by_bucket.setdefault(timestamp // self.BUCKET_SIZE, []).append(
+          self._EntryColumn(timestamp, action, path))
+
+    directory = posixpath.dirname(path)
+    for bucket, columns in columns_by_bucket.iteritems():
+      mutation_pool.DeleteAttributes(
+          self._BucketURN(directory, bucket), columns)
+
+  def AddStatEntries(self, path, stat_entries, mutation_pool):
+    """Adds the MAC times of a file to the index.
+
+    MAC times indexed for earlier StatEntries of the file are kept. The index
+    is not read, all changes go to the mutation pool.
+
+    Args:
+      path: The path of the file relative to the client, e.g. "fs/os/etc".
+      stat_entries: A list of StatEntry objects of the file.
+      mutation_pool: The MutationPool to write the entries to.
+    """
+    path = utils.SmartUnicode(path)
+    times = set()
+    for stat_entry in stat_entries:
+      for action, field in MAC_TIME_FIELDS:
+        seconds = getattr(stat_entry, field)
+        if seconds is not None:
+          times.add((int(seconds) * 1000000, action))
+
+    if not times:
+      return
+
+    entries_by_bucket = {}
+    for timestamp, action in times:
+      entries = entries_by_bucket.setdefault(timestamp // self.BUCKET_SIZE,
+                                             {})
+      entries[self._EntryColumn(timestamp, action, path)] = [path]
+
+    directory = posixpath.dirname(path)
+    for bucket, entries in entries_by_bucket.iteritems():
+      mutation_pool.MultiSet(self._BucketURN(directory, bucket), entries)
+
+    mutation_pool.MultiSet(
+        self.urn,
+        dict((self._BucketColumn(directory, bucket), [""])
+             for bucket in entries_by_bucket))
+
+    # Every StatEntry adds a version to the record of the file.
+    mutation_pool.Set(
+        self.urn,
+        self._FileColumn(path),
+        " ".join("%s:%016x" % (action, timestamp)
+                 for timestamp, action in sorted(times)),
+        replace=False)
+
+  def RemovePath(self, path, mutation_pool):
+    """Removes the MAC times of a deleted file from the index.
+
+    Args:
+      path: The path of the file relative to the client.
+      mutation_pool: The MutationPool to write the deletions to.
+    """
+    path = utils.SmartUnicode(path)
+    self._DeleteTimes(path, self._IndexedTimes(path), mutation_pool)
+    mutation_pool.DeleteAttributes(self.urn, [self._FileColumn(path)])
+
+  def MarkForDeletion(self, deletion_pool):
+    """Deletes the index together with its client.
+
+    Args:
+      deletion_pool: The aff4.DeletionPool deleting the client.
+    """
+    deletion_pool.MultiMarkForDeletion([self.urn] + [
+        self._BucketURN(directory, bucket)
+        for directory, bucket in self.ListBuckets()
+    ])
+
+  def IsBuilt(self):
+    """Returns True if the index holds all files of the client."""
+    value, _ = data_store.DB.Resolve(
+        self.urn, self.BUILT_ATTRIBUTE, token=self.token)
+    return bool(value)
+
+  def GetBuildFlow(self):
+    """Returns the urn of the last flow started to build the index, or None."""
+    value, _ = data_store.DB.Resolve(
+        self.urn, self.BUILD_FLOW_ATTRIBUTE, token=self.token)
+    if value:
+      return rdfvalue.RDFURN(value)
+
+  def SetBuildFlow(self, flow_urn):
+    data_store.DB.Set(
+        self.urn,
+        self.BUILD_FLOW_ATTRIBUTE,
+        utils.SmartStr(flow_urn),
+        token=self.token)
+
+  def Rebuild(self):
+    """Indexes the StatEntries of all VFS objects of the client.
+
+    This adds the files written before the index existed. The client's VFS
+    is walked one level at a time through the data store, files which are
+    already indexed are just written again.
+    """
+    dir_prefix = "index:dir/"
+    stat_attribute = "aff4:stat"
+
+    urns = [self.client_id]
+    with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
+      while urns:
+        children = set()
+        for subject, values in data_store.DB.MultiResolvePrefix(
+            urns, [dir_prefix, stat_attribute],
+            timestamp=data_store.DB.ALL_TIMESTAMPS,
+            token=self.token):
+          subject = rdfvalue.RDFURN(subject)
+          stat_entries = []
+          for attribute, value, _ in values:
+            if attribute == stat_attribute:
+              stat_entries.append(
+                  rdf_client.StatEntry.FromSerializedString(value))
+            elif attribute.startswith(dir_prefix):
+              name = attribute[len(dir_prefix):]
+              if subject != self.client_id or name not in self.NON_VFS_CHILDREN:
+                children.add(subject.Add(name))
+
+          _, path = _SplitURN(subject)
+          if path and stat_entries:
+            self.AddStatEntries(path, stat_entries, mutation_pool)
+
+        urns = children
+
+      mutation_pool.Set(self.urn, self.BUILT_ATTRIBUTE, "1")
+
+  def ListBuckets(self, path_prefix=""):
+    """Returns the buckets of the directories below path_prefix.
+
+    Args:
+      path_prefix: Only buckets of directories whose path, followed by a
+        slash, starts with this prefix are returned.
+
+    Returns:
+      A list of (directory, bucket number) tuples.
+    """
+    buckets = []
+    prefix_length = len(self.BUCKET_PREFIX)
+    for column, _, _ in data_store.DB.ResolvePrefix(
+        self.urn,
+        self.BUCKET_PREFIX + utils.SmartStr(path_prefix),
+        timestamp=data_store.DB.NEWEST_TIMESTAMP,
+        token=self.token):
+      directory = utils.SmartUnicode(column[prefix_length:-17])
+      buckets.append((directory, int(column[-16:], 16)))
+
+    return buckets
+
+  def _ReadBucket(self, bucket, directories, start_time, end_time):
+    """Reads the entries of the given directories in one bucket.
+
+    Args:
+      bucket: The number of the bucket.
+      directories: The directories to read the bucket of.
+      start_time: The earliest MAC time to return, in microseconds.
+      end_time: The latest MAC time to return, in microseconds.
+
+    Returns:
+      A list of (timestamp, path, action) tuples, newest first.
+    """
+    entries = []
+    prefix_length = len(self.ENTRY_PREFIX)
+    for _, values in data_store.DB.MultiResolvePrefix(
+        [self._BucketURN(directory, bucket) for directory in directories],
+        self.ENTRY_PREFIX,
+        timestamp=data_store.DB.NEWEST_TIMESTAMP,
+        token=self.token):
+      for column, path, _ in values:
+        timestamp = int(column[prefix_length:prefix_length + 16], 16)
+        if start_time <= timestamp <= end_time:
+          action = column[prefix_length + 17]
+          entries.append((timestamp, utils.SmartUnicode(path), action))
+
+    return sorted(entries, reverse=True)
+
+  def ReadTimeline(self, path_prefix="", start_time=None, end_time=None):
+    """Yields the indexed MAC times, newest first.
+
+    Args:
+      path_prefix: Only files whose path starts with this prefix are returned.
+        It has to be empty or end with a slash.
+      start_time: If set, only MAC times at or after this RDFDatetime are
+        returned.
+      end_time: If set, only MAC times at or before this RDFDatetime are
+        returned.
+
+    Yields:
+      (timestamp, path, action) tuples where timestamp is an RDFDatetime, path
+      is relative to the client and action is one of "m", "a" or "c".
+    """
+    start_time = start_time.AsMicroSecondsFromEpoch() if start_time else 0
+    # Larger than any MAC time stored in a StatEntry.
+    end_time = end_time.AsMicroSecondsFromEpoch() if end_time else 2**64
+
+    path_prefix = utils.SmartUnicode(path_prefix)
+    directories_by_bucket = {}
+    for directory, bucket in self.ListBuckets(path_prefix):
+      directories_by_bucket.setdefault(bucket, []).append(directory)
+
+    for bucket in sorted(directories_by_bucket, reverse=True):
+      if bucket * self.BUCKET_SIZE > end_time:
+        continue
+      if (bucket + 1) * self.BUCKET_SIZE <= start_time:
+        break
+
+      for timestamp, path, action in self._ReadBucket(
+          bucket, directories_by_bucket[bucket], start_time, end_time):
+        yield rdfvalue.RDFDatetime(timestamp), path, action
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+"""Tests for grr.lib.mactime_index."""
+
+
+from grr.lib import aff4
+from grr.lib import data_store
+from grr.lib import flags
+from grr.lib import mactime_index
+from grr.lib import rdfvalue
+from grr.lib import test_lib
+from grr.lib import utils
+from grr.lib.aff4_objects import aff4_grr
+from grr.lib.aff4_objects import standard
+from grr.lib.rdfvalues import client as rdf_client
+
+DAY = 24 * 60 * 60
+
+
+class MACTimeIndexTest(test_lib.GRRBaseTest):
+
+  def setUp(self):
+    super(MACTimeIndexTest, self).setUp()
+    self.client_id = self.SetupClients(1)[0]
+    self.index = mactime_index.MACTimeIndex(self.client_id, token=self.token)
+
+  def _WriteStat(self, path, aff4_type=aff4_grr.VFSFile, **kwargs):
+    with aff4.FACTORY.Create(
+        self.client_id.Add(path), aff4_type, mode="w", token=self.token) as fd:
+      fd.Set(fd.Schema.STAT(rdf_client.StatEntry(**kwargs)))
+
+  def _ReadTimeline(self, **kwargs):
+    return [(timestamp.AsSecondsFromEpoch(), path, action)
+            for timestamp, path, action in self.index.ReadTimeline(**kwargs)]
+
+  def testStatEntriesAreIndexedWhenWritten(self):
+    self._WriteStat(
+        "fs/os/a/file1", st_mtime=3 * DAY, st_atime=5 * DAY, st_ctime=3 * DAY)
+    self._WriteStat("fs/os/a", aff4_type=standard.VFSDirectory, st_mtime=DAY)
+
+    self.assertEqual(self._ReadTimeline(), [(5 * DAY, "fs/os/a/file1", "a"),
+                                            (3 * DAY, "fs/os/a/file1", "m"),
+                                            (3 * DAY, "fs/os/a/file1", "c"),
+                                            (DAY, "fs/os/a", "m")])
+    self.assertEqual(
+        sorted(self.index.ListBuckets()),
+        [("fs/os", 1), ("fs/os/a", 3), ("fs/os/a", 5)])
+
+  def testObjectsOutsideClientsAreNotIndexed(self):
+    with aff4.FACTORY.Create(
+        "aff4:/tmp/file", aff4_grr.VFSFile, mode="w", token=self.token) as fd:
+      fd.Set(fd.Schema.STAT(rdf_client.StatEntry(st_mtime=DAY)))
+
+    self.assertEqual(self._ReadTimeline(), [])
+
+  def testTimelineIsFilteredByTimeAndPath(self):
+    for i in range(10):
+      self._WriteStat("fs/os/a/file%d" % i, st_mtime=i * DAY + 10)
+      self._WriteStat("fs/os/b/file%d" % i, st_mtime=i * DAY + 20)
+
+    timeline = self._ReadTimeline(
+        path_prefix="fs/os/a/",
+        start_time=rdfvalue.RDFDatetime().FromSecondsFromEpoch(3 * DAY + 10),
+        end_time=rdfvalue.RDFDatetime().FromSecondsFromEpoch(5 * DAY + 10))
+    self.assertEqual(timeline, [(5 * DAY + 10, "fs/os/a/file5", "m"),
+                                (4 * DAY + 10, "fs/os/a/file4", "m"),
+                                (3 * DAY + 10, "fs/os/a/file3", "m")])
+
+  def testOnlyBucketsInTimeRangeAreRead(self):
+    for i in range(10):
+      self._WriteStat("fs/os/file%d" % i, st_mtime=i * DAY)
+
+    read_buckets = []
+    original_read_bucket = self.index._ReadBucket
+
+    def ReadBucket(bucket, *args):
+      read_buckets.append(bucket)
+      return original_read_bucket(bucket, *args)
+
+    with utils.Stubber(self.index, "_ReadBucket", ReadBucket):
+      timeline = self._ReadTimeline(
+          start_time=rdfvalue.RDFDatetime().FromSecondsFromEpoch(2 * DAY),
+          end_time=rdfvalue.RDFDatetime().FromSecondsFromEpoch(4 * DAY))
+
+    self.assertEqual(len(timeline), 3)
+    self.assertEqual(read_buckets, [4, 3, 2])
+
+  def testFolderTimelineOnlyReadsBucketsOfItsDirectories(self):
+    self._WriteStat("fs/os/a/file", st_mtime=DAY)
+    self._WriteStat("fs/os/a/b/file", st_mtime=DAY)
+    self._WriteStat("fs/os/ab/file", st_mtime=DAY)
+    self._WriteStat("fs/os/c/file", st_mtime=DAY)
+
+    read_directories = []
+    original_read_bucket = self.index._ReadBucket
+
+    def ReadBucket(bucket, directories, *args):
+      read_directories.extend(directories)
+      return original_read_bucket(bucket, directories, *args)
+
+    with utils.Stubber(self.index, "_ReadBucket", ReadBucket):
+      timeline = self._ReadTimeline(path_prefix="fs/os/a/")
+
+    self.assertEqual(timeline, [(DAY, "fs/os/a/file", "m"),
+                                (DAY, "fs/os/a/b/file", "m")])
+    self.assertItemsEqual(read_directories, ["fs/os/a", "fs/os/a/b"])
+
+  def testStatEntriesAreWrittenToTheCallersPool(self):
+    def Resolve(*_, **__):
+      raise AssertionError("The index must not be read when writing.")
+
+    with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
+      with utils.MultiStubber((data_store.DB, "Resolve", Resolve),
+                              (data_store.DB, "ResolveMulti", Resolve)):
+        with aff4.FACTORY.Create(
+            self.client_id.Add("fs/os/file"),
+            aff4_grr.VFSFile,
+            mode="w",
+            mutation_pool=mutation_pool,
+            token=self.token) as fd:
+          fd.Set(fd.Schema.STAT(rdf_client.StatEntry(st_mtime=DAY)))
+
+      self.assertEqual(self._ReadTimeline(), [])
+
+    self.assertEqual(self._ReadTimeline(), [(DAY, "fs/os/file", "m")])
+
+  def testMACTimesOfAllStatEntriesAreKept(self):
+    self._WriteStat("fs/os/file", st_mtime=DAY, st_atime=2 * DAY)
+    self._WriteStat("fs/os/file", st_mtime=3 * DAY, st_atime=2 * DAY)
+
+    self.assertEqual(self._ReadTimeline(), [(3 * DAY, "fs/os/file", "m"),
+                                            (2 * DAY, "fs/os/file", "a"),
+                                            (DAY, "fs/os/file", "m")])
+
+  def testDeletedFilesAreRemoved(self):
+    self._WriteStat("fs/os/a", aff4_type=standard.VFSDirectory, st_mtime=DAY)
+    self._WriteStat("fs/os/a/file", st_mtime=2 * DAY)
+    self._WriteStat("fs/os/a/file", st_mtime=4 * DAY)
+    self._WriteStat("fs/os/b", st_mtime=3 * DAY)
+
+    aff4.FACTORY.Delete(self.client_id.Add("fs/os/a"), token=self.token)
+
+    self.assertEqual(self._ReadTimeline(), [(3 * DAY, "fs/os/b", "m")])
+
+  def testIndexIsDeletedWithClient(self):
+    self._WriteStat("fs/os/file", st_mtime=DAY)
+
+    aff4.FACTORY.Delete(self.client_id, token=self.token)
+
+    self.assertEqual(self.index.ListBuckets(), [])
+    self.assertEqual(self._ReadTimeline(), [])
+
+  def testRebuildIndexesExistingFiles(self):
+    # Files written before the index existed.
+    with utils.Stubber(mactime_index, "IndexStatEntries", lambda *_, **__: 0):
+      self._WriteStat("fs/os/a/file", st_mtime=2 * DAY)
+      self._WriteStat("fs/os/a/file", st_mtime=3 * DAY)
+      self._WriteStat("fs/tsk/file", st_mtime=DAY)
+
+    self.assertFalse(self.index.IsBuilt())
+    self.assertEqual(self._ReadTimeline(), [])
+
+    self.index.Rebuild()
+
+    self.assertTrue(self.index.IsBuilt())
+    self.assertEqual(self._ReadTimeline(), [(3 * DAY, "fs/os/a/file", "m"),
+                                            (2 * DAY, "fs/os/a/file", "m"),
+                                            (DAY, "fs/tsk/file", "m")])
+
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -7,6 +7,7 @@ import collections
 import os
 import random
 import socket
+import threading
 import time
 
 import logging
@@ -29,6 +30,213 @@ class MoreDataException(Error):
   """Raised when there is more data available."""
 
 
+class PendingClientWork(object):
+  """A sharded summary of the clients which have tasks queued.
+
+  QueueManager.Schedule() marks a client whenever tasks are scheduled on its
+  queue. Frontends check the summary before draining a client's queue and
+  clear the mark once they find the queue empty, so polls of idle clients never
+  touch their queue.
+
+  Marks are kept in a column per client on one of Frontend.pending_work_shards
+  subjects. Frontends cache whole shards for Frontend.pending_work_cache_ttl
+  seconds, which delays the delivery of newly scheduled tasks by at most that
+  long.
+
+  Tasks scheduled before the summary existed have no marks. Until Backfill()
+  has marked those clients, every client of a shard is treated as having
+  pending work.
+  """
+
+  ROOT = rdfvalue.RDFURN("aff4:/pending_client_work")
+  PREDICATE_PREFIX = "pending:"
+  BACKFILLED_PREDICATE = "metadata:backfilled"
+
+  def __init__(self, cache_ttl=None, store=None, token=None):
+    if cache_ttl is None:
+      cache_ttl = config_lib.CONFIG["Frontend.pending_work_cache_ttl"]
+    self.cache_ttl = cache_ttl
+    self.data_store = store or data_store.DB
+    self.token = token
+
+    # Maps shard urns to (read time, set of marked client names).
+    self.shard_cache = {}
+    self.lock = threading.RLock()
+
+  @classmethod
+  def ShardForClient(cls, client_id):
+    client_id = rdf_client.ClientURN(client_id)
+    shard = (int(client_id.Basename()[2:], 16) %
+             config_lib.CONFIG["Frontend.pending_work_shards"])
+    return cls.ROOT.Add("%d" % shard)
+
+  @classmethod
+  def GetMarks(cls, queues):
+    """Returns the marks for all client queues among queues.
+
+    Args:
+      queues: A list of queue urns. Queues which are not client queues are
+        ignored.
+
+    Returns:
+      A dict mapping shard urns to dicts of columns to write.
+    """
+    marks = {}
+    for queue in queues:
+      components = rdfvalue.RDFURN(queue).Split()
+      if (len(components) != 2 or components[1] != "tasks" or
+          not rdf_client.ClientURN.Validate(components[0])):
+        continue
+
+      client_id = rdf_client.ClientURN(components[0])
+      marks.setdefault(cls.ShardForClient(client_id), {})[
+          cls.PREDICATE_PREFIX + utils.SmartStr(client_id.Basename())] = [""]
+
+    return marks
+
+  @classmethod
+  def Shards(cls):
+    return [
+        cls.ROOT.Add("%d" % shard)
+        for shard in range(config_lib.CONFIG["Frontend.pending_work_shards"])
+    ]
+
+  def _ReadShard(self, shard):
+    """Returns the names of the marked clients, None if not backfilled."""
+    clients = set()
+    backfilled = False
+    for predicate, _, _ in self.data_store.ResolvePrefix(
+        shard, [self.BACKFILLED_PREDICATE, self.PREDICATE_PREFIX],
+        timestamp=self.data_store.NEWEST_TIMESTAMP,
+        token=self.token):
+      if predicate == self.BACKFILLED_PREDICATE:
+        backfilled = True
+      elif predicate.startswith(self.PREDICATE_PREFIX):
+        clients.add(predicate[len(self.PREDICATE_PREFIX):])
+
+    if not backfilled:
+      return None
+
+    return clients
+
+  def HasPendingWork(self, client_id):
+    """Returns False if the client is known to have no tasks queued."""
+    client_id = rdf_client.ClientURN(client_id)
+    client_name = utils.SmartStr(client_id.Basename())
+    shard = self.ShardForClient(client_id)
+
+    if not self.cache_ttl:
+      predicates = [
+          predicate
+          for predicate, _, _ in self.data_store.ResolveMulti(
+              shard,
+              [self.BACKFILLED_PREDICATE, self.PREDICATE_PREFIX + client_name],
+              timestamp=self.data_store.NEWEST_TIMESTAMP,
+              token=self.token)
+      ]
+      return predicates != [self.BACKFILLED_PREDICATE]
+
+    now = time.time()
+    with self.lock:
+      read_time, clients = self.shard_cache.get(shard, (None, None))
+    if read_time is None or not read_time <= now < read_time + self.cache_ttl:
+      clients = self._ReadShard(shard)
+      with self.lock:
+        self.shard_cache[shard] = (now, clients)
+
+    return clients is None or client_name in clients
+
+  def IsBackfilled(self):
+    """Returns True if Backfill() has completed for all shards."""
+    for shard in self.Shards():
+      if not list(
+          self.data_store.ResolveMulti(
+              shard, [self.BACKFILLED_PREDICATE],
+              timestamp=self.data_store.NEWEST_TIMESTAMP,
+              token=self.token)):
+        return False
+
+    return True
+
+  def Backfill(self, client_ids):
+    """Marks the clients which have tasks queued since before the summary.
+
+    Tasks scheduled while this runs mark their clients themselves, so the
+    shards can be used as soon as all existing queues were looked at.
+
+    Args:
+      client_ids: An iterable of all client ids.
+
+    Returns:
+      The number of clients marked.
+    """
+    marked = 0
+    for batch in utils.Grouper(client_ids, 1000):
+      queues = []
+      for client_id in batch:
+        queue = rdf_client.ClientURN(client_id).Queue()
+        if self.data_store.ResolvePrefix(
+            queue,
+            QueueManager.TASK_PREDICATE_PREFIX,
+            timestamp=self.data_store.ALL_TIMESTAMPS,
+            limit=1,
+            token=self.token):
+          queues.append(queue)
+
+      for shard, columns in self.GetMarks(queues).iteritems():
+        self.data_store.MultiSet(shard, columns, token=self.token)
+        marked += len(columns)
+
+    for shard in self.Shards():
+      self.data_store.Set(
+          shard, self.BACKFILLED_PREDICATE, "", token=self.token)
+
+    return marked
+
+  def ClearIfIdle(self, client_id, start_time):
+    """Clears a client's mark if its queue is empty.
+
+    The mark is only deleted up to start_time, which is taken from the
+    frontend's clock while marks are timestamped by the clock of the process
+    that scheduled the tasks. This relies on the clocks of the schedulers and
+    the frontends being in sync: a mark written by a scheduler whose clock is
+    behind can carry a timestamp before start_time and then be deleted
+    although the drain did not see its task.
+
+    Args:
+      client_id: The client whose queue was drained.
+      start_time: The RDFDatetime the drain started at. Marks written later
+        belong to tasks the drain might not have seen and are kept.
+
+    Returns:
+      True if the mark was cleared.
+    """
+    client_id = rdf_client.ClientURN(client_id)
+    if self.data_store.ResolvePrefix(
+        client_id.Queue(),
+        QueueManager.TASK_PREDICATE_PREFIX,
+        timestamp=self.data_store.ALL_TIMESTAMPS,
+        limit=1,
+        token=self.token):
+      return False
+
+    client_name = utils.SmartStr(client_id.Basename())
+    shard = self.ShardForClient(client_id)
+    self.data_store.DeleteAttributes(
+        shard, [self.PREDICATE_PREFIX + client_name],
+        start=0,
+        end=int(start_time),
+        sync=False,
+        token=self.token)
+
+    with self.lock:
+      _, clients = self.shard_cache.get(shard, (None, None))
+      if clients is not None:
+        clients.discard(client_name)
+
+    return True
+
+
 class QueueManager(object):
   """This class manages the representation of the flow within the data store.
 
@@ -523,8 +731,8 @@ class QueueManager(object):
     if timestamp is None:
       timestamp = self.frozen_timestamp
 
-    for queue, queued_tasks in utils.GroupBy(tasks,
-                                             lambda x: x.queue).iteritems():
+    tasks_by_queue = utils.GroupBy(tasks, lambda x: x.queue)
+    for queue, queued_tasks in tasks_by_queue.iteritems():
       if queue:
         to_schedule = dict([(self._TaskIdToColumn(task.task_id),
                              [task.SerializeToString()])
@@ -540,6 +748,17 @@ class QueueManager(object):
               sync=sync,
               token=self.token)
 
+    # Clients are marked after their tasks are written and with the time of the
+    # write, so a frontend which sees a mark also sees the tasks written before
+    # it.
+    marks = PendingClientWork.GetMarks(
+        [queue for queue in tasks_by_queue if queue])
+    for shard, columns in marks.iteritems():
+      if mutation_pool:
+        mutation_pool.MultiSet(shard, columns)
+      else:
+        self.data_store.MultiSet(shard, columns, sync=sync, token=self.token)
+
   def _SortByPriority(self, notifications, queue, output_dict=None):
     """Sort notifications by priority into output_dict."""
     if output_dict is None:
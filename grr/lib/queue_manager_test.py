@@ -641,6 +641,101 @@ class MultiShardedQueueManagerTest(QueueManagerTest):
           self.assertEqual(len(notifications), 0)
 
 
+class PendingClientWorkTest(test_lib.GRRBaseTest):
+  """Tests the summary of clients with queued tasks."""
+
+  def setUp(self):
+    super(PendingClientWorkTest, self).setUp()
+    self.client_id, self.other_client_id = self.SetupClients(2)
+    queue_manager.PendingClientWork(token=self.token).Backfill([])
+
+  def _Schedule(self, queue):
+    task = rdf_flows.GrrMessage(
+        queue=queue, session_id="aff4:/Test", generate_task_id=True)
+    queue_manager.QueueManager(token=self.token).Schedule([task])
+    return task
+
+  def testScheduleMarksClientQueues(self):
+    self._Schedule(self.client_id.Queue())
+    self._Schedule(rdfvalue.RDFURN("fooSchedule"))
+
+    pending = queue_manager.PendingClientWork(cache_ttl=0, token=self.token)
+    self.assertTrue(pending.HasPendingWork(self.client_id))
+    self.assertFalse(pending.HasPendingWork(self.other_client_id))
+
+    marked = set()
+    for shard in range(config_lib.CONFIG["Frontend.pending_work_shards"]):
+      marked.update(
+          pending._ReadShard(queue_manager.PendingClientWork.ROOT.Add(
+              str(shard))))
+    self.assertEqual(marked, set([self.client_id.Basename()]))
+
+  def testMarksAreOnlyClearedForEmptyQueues(self):
+    with test_lib.FakeTime(100):
+      task = self._Schedule(self.client_id.Queue())
+
+    pending = queue_manager.PendingClientWork(cache_ttl=0, token=self.token)
+    with test_lib.FakeTime(200):
+      self.assertFalse(
+          pending.ClearIfIdle(self.client_id, rdfvalue.RDFDatetime.Now()))
+      self.assertTrue(pending.HasPendingWork(self.client_id))
+
+      queue_manager.QueueManager(token=self.token).Delete(
+          self.client_id.Queue(), [task])
+      self.assertTrue(
+          pending.ClearIfIdle(self.client_id, rdfvalue.RDFDatetime.Now()))
+      self.assertFalse(pending.HasPendingWork(self.client_id))
+
+  def testMarksWrittenAfterTheDrainStartedAreKept(self):
+    with test_lib.FakeTime(100):
+      task = self._Schedule(self.client_id.Queue())
+      queue_manager.QueueManager(token=self.token).Delete(
+          self.client_id.Queue(), [task])
+
+    pending = queue_manager.PendingClientWork(cache_ttl=0, token=self.token)
+    self.assertTrue(
+        pending.ClearIfIdle(self.client_id,
+                            rdfvalue.RDFDatetime().FromSecondsFromEpoch(50)))
+    self.assertTrue(pending.HasPendingWork(self.client_id))
+
+  def testClientsAreDrainedUntilTheShardsAreBackfilled(self):
+    with test_lib.FakeTime(100):
+      task = self._Schedule(self.client_id.Queue())
+    # This is how the summary looks for tasks queued before it existed.
+    for shard in queue_manager.PendingClientWork.Shards():
+      data_store.DB.DeleteSubject(shard, token=self.token)
+
+    for cache_ttl in [0, 10]:
+      pending = queue_manager.PendingClientWork(
+          cache_ttl=cache_ttl, token=self.token)
+      self.assertFalse(pending.IsBackfilled())
+      self.assertTrue(pending.HasPendingWork(self.client_id))
+      self.assertTrue(pending.HasPendingWork(self.other_client_id))
+
+    pending = queue_manager.PendingClientWork(cache_ttl=0, token=self.token)
+    self.assertEqual(
+        pending.Backfill([self.client_id, self.other_client_id]), 1)
+    self.assertTrue(pending.IsBackfilled())
+    self.assertTrue(pending.HasPendingWork(self.client_id))
+    self.assertFalse(pending.HasPendingWork(self.other_client_id))
+
+    queue_manager.QueueManager(token=self.token).Delete(
+        self.client_id.Queue(), [task])
+    self.assertTrue(
+        pending.ClearIfIdle(self.client_id, rdfvalue.RDFDatetime.Now()))
+    self.assertFalse(pending.HasPendingWork(self.client_id))
+
+  def testShardsAreCached(self):
+    pending = queue_manager.PendingClientWork(cache_ttl=10, token=self.token)
+    with test_lib.FakeTime(100):
+      self.assertFalse(pending.HasPendingWork(self.client_id))
+      self._Schedule(self.client_id.Queue())
+      self.assertFalse(pending.HasPendingWork(self.client_id))
+
+    with test_lib.FakeTime(111):
+      self.assertTrue(pending.HasPendingWork(self.client_id))
+
+
 def main(argv):
   test_lib.main(argv)
 
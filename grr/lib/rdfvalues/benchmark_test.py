@@ -7,6 +7,8 @@ from grr.lib import flags
 from grr.lib import test_lib
 from grr.lib import type_info
 from grr.lib.rdfvalues import client as rdf_client
+from grr.lib.rdfvalues import flows as rdf_flows
+from grr.lib.rdfvalues import paths as rdf_paths
 from grr.lib.rdfvalues import structs as rdf_structs
 from grr.proto import jobs_pb2
 from grr.proto import knowledge_base_pb2
@@ -339,6 +341,67 @@ class RDFValueBenchmark(test_lib.AverageMicroBenchmarks):
     self.TimeIt(RDFStructDecodeEncode)
     self.TimeIt(ProtoDecodeEncode)
 
+  def testGeneratedCodecs(self):
+    """Compare the generated codecs to the generic ones on hot messages."""
+    pathspec = rdf_paths.PathSpec(path="/etc/passwd", pathtype="OS")
+    messages = [
+        (rdf_flows.GrrMessage,
+         dict(
+             session_id="aff4:/C.1000000000000000/flows/W:1234",
+             name="ListDirectory",
+             request_id=1,
+             response_id=2,
+             task_id=12345678,
+             payload=rdf_client.StatEntry(st_size=2341),
+             source="C.1000000000000000")),
+        (rdf_client.StatEntry,
+         dict(
+             st_mode=33188,
+             st_ino=1063090,
+             st_dev=64512,
+             st_nlink=1,
+             st_uid=0,
+             st_gid=0,
+             st_size=2341,
+             st_atime=1336469177,
+             st_mtime=1336129892,
+             st_ctime=1336129892,
+             pathspec=pathspec)),
+        (rdf_client.BufferReference,
+         dict(offset=1024, length=100, data="x" * 100, pathspec=pathspec)),
+    ]
+
+    for cls, kwargs in messages:
+      data = cls(**kwargs).SerializeToString()
+      name = cls.__name__
+
+      def GenericDecode():
+        value = cls()
+        rdf_structs.ReadIntoObject(data, 0, value)
+        return len(value.GetRawData())
+
+      def GeneratedDecode():
+        value = cls()
+        cls.GetDecoder()(data, 0, 0, value)
+        return len(value.GetRawData())
+
+      def GenericEncode():
+        value = cls(**kwargs)
+        return len(
+            rdf_structs.SerializeEntries(value.GetRawData().itervalues()))
+
+      def GeneratedEncode():
+        value = cls(**kwargs)
+        return len(cls.GetEncoder()(value.GetRawData()))
+
+      self.assertEqual(GenericDecode(), GeneratedDecode())
+      self.assertEqual(GenericEncode(), GeneratedEncode())
+
+      self.TimeIt(GenericDecode, "%s generic decode" % name)
+      self.TimeIt(GeneratedDecode, "%s generated decode" % name)
+      self.TimeIt(GenericEncode, "%s generic create and encode" % name)
+      self.TimeIt(GeneratedEncode, "%s generated create and encode" % name)
+
 
 def main(argv):
   # Run the full test suite
@@ -134,6 +134,11 @@ class GrrStatus(rdf_structs.RDFProtoStruct):
   protobuf = jobs_pb2.GrrStatus
 
 
+class ActionCheckpoint(rdf_structs.RDFProtoStruct):
+  """The progress of a client action which allows it to resume."""
+  protobuf = jobs_pb2.ActionCheckpoint
+
+
 class GrrNotification(rdf_structs.RDFProtoStruct):
   """A flow notification."""
   protobuf = jobs_pb2.GrrNotification
@@ -252,6 +252,306 @@ def ReadIntoObject(buff, index, value_obj, length=0):
   value_obj.SetRawData(raw_data)
 
 
+def _ReadUnknownField(buff, index, encoded_tag):
+  """Reads the field of an unknown tag, returns (wire_format, new_index)."""
+  tag_type = ORD_MAP[encoded_tag[0]] & TAG_TYPE_MASK
+  if tag_type == WIRETYPE_VARINT:
+    _, new_index = VarintReader(buff, index)
+    return (encoded_tag, "", buff[index:new_index]), new_index
+
+  elif tag_type == WIRETYPE_FIXED64:
+    return (encoded_tag, "", buff[index:index + 8]), index + 8
+
+  elif tag_type == WIRETYPE_FIXED32:
+    return (encoded_tag, "", buff[index:index + 4]), index + 4
+
+  elif tag_type == WIRETYPE_LENGTH_DELIMITED:
+    length, start = VarintReader(buff, index)
+    return (encoded_tag, buff[index:start],
+            buff[start:start + length]), start + length
+
+  raise rdfvalue.DecodeError("Unexpected Tag.")
+
+
+def _SerializeUnknownEntries(raw_data, names):
+  """Serializes the entries of raw_data whose keys are not in names."""
+  return SerializeEntries(entry for key, entry in raw_data.iteritems()
+                          if key not in names)
+
+
+def _GenerateFunction(cls, name, lines, namespace):
+  """Compiles the generated source of a codec function of cls."""
+  namespace = dict(namespace)
+  source = "\n".join(lines) + "\n"
+  filename = "<generated %s of %s>" % (name, cls.__name__)
+  # pylint: disable=exec-used
+  exec compile(source, filename, "exec") in namespace
+  # pylint: enable=exec-used
+
+  result = namespace[name]
+  result.source = source
+  return result
+
+
+def _HasTrivialIsDirty(type_descriptor):
+  is_dirty = type_descriptor.__class__.IsDirty.__func__
+  return is_dirty is ProtoType.IsDirty.__func__
+
+
+def _VarintReadLines(result, reader):
+  """Returns source lines reading a varint at index into result."""
+  # Most lengths and many integers fit into a single byte.
+  return ["if ORD_MAP_AND_0X80[buff[index]]:",
+          "  %s, index = %s(buff, index)" % (result, reader),
+          "else:",
+          "  %s = ORD_MAP[buff[index]]" % result,
+          "  index += 1"]
+
+
+def GenerateDecoder(cls):
+  """Generates a function decoding serialized protobufs into cls instances.
+
+  The generated function is equivalent to ReadIntoObject() but has the tag
+  dispatch unrolled into a chain of comparisons against the encoded tags of the
+  class's fields. It splits the buffer without intermediate tuples and stores
+  integer and bytes fields directly in their python format, other fields are
+  still decoded lazily on access.
+
+  Args:
+    cls: An RDFStruct class.
+
+  Returns:
+    A function taking (buff, index, length, value_obj).
+  """
+  namespace = dict(
+      ORD_MAP=ORD_MAP,
+      ORD_MAP_AND_0X80=ORD_MAP_AND_0X80,
+      VarintReader=VarintReader,
+      SignedVarintReader=SignedVarintReader,
+      ReadUnknownField=_ReadUnknownField,
+      DecodeError=rdfvalue.DecodeError)
+
+  lines = ["def Decode(buff, index, length, value_obj):",
+           "  raw_data = value_obj.GetRawData()",
+           "  buffer_len = length or len(buff)",
+           "  count = 0"]
+
+  fields = sorted(cls.type_infos_by_encoded_tag.itervalues(),
+                  key=lambda x: x.field_number)
+  for type_descriptor in fields:
+    if type_descriptor.__class__ is ProtoList:
+      lines.append("  list_%d = None" % type_descriptor.field_number)
+
+  lines.extend([
+      "  try:",
+      "    while index < buffer_len:",
+      "      encoded_tag = buff[index]",
+      "      index += 1",
+      "      if ORD_MAP_AND_0X80[encoded_tag]:",
+      "        tag_start = index - 1",
+      "        while ORD_MAP_AND_0X80[buff[index]]:",
+      "          index += 1",
+      "        index += 1",
+      "        encoded_tag = buff[tag_start:index]"])
+
+  keyword = "if"
+  for type_descriptor in fields:
+    number = type_descriptor.field_number
+    namespace["T_%d" % number] = type_descriptor
+    descriptor_class = type_descriptor.__class__
+    python_format = "None"
+
+    lines.append("      %s encoded_tag == %r:" % (keyword,
+                                                  type_descriptor.encoded_tag))
+    keyword = "elif"
+
+    if type_descriptor.wire_type == WIRETYPE_VARINT:
+      reader = "VarintReader"
+      if descriptor_class is ProtoUnsignedInteger:
+        python_format = "value"
+      elif descriptor_class is ProtoSignedInteger:
+        reader = "SignedVarintReader"
+        python_format = "value"
+
+      lines.append("        data_index = index")
+      lines.extend("        " + line for line in _VarintReadLines("value",
+                                                                   reader))
+      lines.append(
+          "        wire_format = (encoded_tag, '', buff[data_index:index])")
+
+    elif type_descriptor.wire_type in (WIRETYPE_FIXED64, WIRETYPE_FIXED32):
+      size = 8 if type_descriptor.wire_type == WIRETYPE_FIXED64 else 4
+      lines.extend([
+          "        wire_format = (encoded_tag, '', buff[index:index + %d])" %
+          size,
+          "        index += %d" % size])
+
+    else:
+      if descriptor_class is ProtoBinary:
+        python_format = "value"
+
+      lines.append("        data_index = index")
+      lines.extend("        " + line for line in _VarintReadLines(
+          "field_length", "VarintReader"))
+      lines.extend([
+          "        value = buff[index:index + field_length]",
+          "        wire_format = (encoded_tag, buff[data_index:index], value)",
+          "        index += field_length"])
+
+    if descriptor_class is ProtoList:
+      lines.extend([
+          "        if list_%d is None:" % number,
+          "          list_%d = value_obj.Get(%r).wrapped_list" % (
+              number, type_descriptor.name),
+          "        list_%d.append((None, wire_format))" % number])
+    else:
+      lines.append("        raw_data[%r] = (%s, wire_format, T_%d)" % (
+          type_descriptor.name, python_format, number))
+
+  # Unknown fields are kept in the raw data under unique integer keys, so
+  # they are written back when the object is serialized.
+  unknown_field = [
+      "wire_format, index = ReadUnknownField(buff, index, encoded_tag)",
+      "raw_data[count] = (None, wire_format, None)",
+      "count += 1"]
+  if fields:
+    lines.append("      else:")
+    lines.extend("        " + line for line in unknown_field)
+  else:
+    lines.extend("      " + line for line in unknown_field)
+
+  lines.extend([
+      "  except IndexError:",
+      "    raise DecodeError('Truncated protobuf.')",
+      "",
+      "  value_obj.SetRawData(raw_data)"])
+
+  return _GenerateFunction(cls, "Decode", lines, namespace)
+
+
+def _VarintExpression(value):
+  """Returns a source expression encoding the variable value as a varint."""
+  # Most lengths and many integers fit into a single byte.
+  return "(CHR_MAP[%s] if 0 <= %s < 128 else VarintEncode(%s))" % (value, value,
+                                                                   value)
+
+
+def _InlineEncoderLines(type_descriptor, value):
+  """Returns source lines appending the wire format of value to the output.
+
+  Args:
+    type_descriptor: The descriptor of the field.
+    value: The name of the variable holding the python format.
+
+  Returns:
+    A list of source lines or None if the field is not encoded inline.
+  """
+  descriptor_class = type_descriptor.__class__
+  encoded_tag = type_descriptor.encoded_tag
+
+  if descriptor_class is ProtoString:
+    return ["data = %s.encode('utf8')" % value,
+            "length = len(data)",
+            "output_extend((%r, %s, data))" % (encoded_tag,
+                                               _VarintExpression("length"))]
+
+  elif descriptor_class is ProtoBinary:
+    return ["length = len(%s)" % value,
+            "output_extend((%r, %s, %s))" % (
+                encoded_tag, _VarintExpression("length"), value)]
+
+  elif descriptor_class is ProtoUnsignedInteger:
+    return ["output_extend((%r, %s))" % (encoded_tag, _VarintExpression(value))]
+
+  elif descriptor_class is ProtoSignedInteger:
+    return ["output_extend((%r, SignedVarintEncode(%s)))" % (encoded_tag,
+                                                            value)]
+
+  elif descriptor_class is ProtoEnum or descriptor_class is ProtoBoolean:
+    return ["output_extend((%r, SignedVarintEncode(int(%s))))" % (encoded_tag,
+                                                                 value)]
+
+  elif descriptor_class is ProtoEmbedded:
+    return ["data = %s.GetEncoder()(%s.GetRawData())" % (value, value),
+            "length = len(data)",
+            "output_extend((%r, %s, data))" % (encoded_tag,
+                                               _VarintExpression("length"))]
+
+  elif descriptor_class is ProtoRDFValue:
+    lines = _InlineEncoderLines(type_descriptor.primitive_desc, "primitive")
+    if lines is not None:
+      return ["primitive = %s.SerializeToDataStore()" % value] + lines
+
+
+def GenerateEncoder(cls):
+  """Generates a function serializing the raw data of cls instances.
+
+  The generated function is equivalent to SerializeEntries() on the raw data
+  but looks up the fields of the class in field number order until all entries
+  are written, skips the dirty check for fields which can not become dirty and
+  encodes the common field types inline. Unknown fields are written after the
+  known ones.
+
+  Args:
+    cls: An RDFStruct class.
+
+  Returns:
+    A function taking the raw data dict and returning the serialized string.
+  """
+  namespace = dict(
+      CHR_MAP=CHR_MAP,
+      VarintEncode=VarintEncode,
+      SignedVarintEncode=SignedVarintEncode,
+      SerializeUnknownEntries=_SerializeUnknownEntries)
+
+  fields = sorted(cls.type_infos_by_field_number.itervalues(),
+                  key=lambda x: x.field_number)
+  namespace["NAMES"] = frozenset(x.name for x in fields)
+
+  lines = ["def Encode(raw_data):",
+           "  output = []",
+           "  output_extend = output.extend",
+           "  raw_data_get = raw_data.get",
+           "  size = len(raw_data)",
+           "  found = 0"]
+
+  for type_descriptor in fields:
+    lines.extend([
+        "  entry = raw_data_get(%r)" % type_descriptor.name,
+        "  if entry is not None:",
+        "    found += 1",
+        "    python_format, wire_format, type_descriptor = entry"])
+
+    if _HasTrivialIsDirty(type_descriptor):
+      lines.append("    if wire_format is None:")
+    elif type_descriptor.__class__ is ProtoRDFValue:
+      lines.append("    if wire_format is None or (python_format and "
+                   "python_format.dirty):")
+    else:
+      lines.append("    if wire_format is None or (python_format and "
+                   "type_descriptor.IsDirty(python_format)):")
+
+    encoder_lines = _InlineEncoderLines(type_descriptor, "python_format")
+    if encoder_lines is None:
+      encoder_lines = [
+          "output_extend(type_descriptor.ConvertToWireFormat(python_format))"]
+
+    lines.extend("      " + line for line in encoder_lines)
+    lines.extend([
+        "    else:",
+        "      output_extend(wire_format)",
+        # Stop looking up fields once all entries were written.
+        "    if found == size:",
+        "      return ''.join(output)"])
+
+  lines.extend([
+      "  if found != size:",
+      "    output.append(SerializeUnknownEntries(raw_data, NAMES))",
+      "  return ''.join(output)"])
+
+  return _GenerateFunction(cls, "Encode", lines, namespace)
+
+
 # pylint: disable=invalid-name
 if _semantic:
   VarintEncode = _semantic.varint_encode
@@ -851,13 +1151,13 @@ class ProtoEmbedded(ProtoType):
   def ConvertFromWireFormat(self, value, container=None):
     """The wire format is simply a string."""
     result = self.type()
-    ReadIntoObject(value[2], 0, result)
+    self.type.GetDecoder()(value[2], 0, 0, result)
 
     return result
 
   def ConvertToWireFormat(self, value):
     """Encode the nested protobuf into wire format."""
-    output = SerializeEntries(value.GetRawData().itervalues())
+    output = value.GetEncoder()(value.GetRawData())
     return (self.encoded_tag, VarintEncode(len(output)), output)
 
   def LateBind(self, target=None):
@@ -999,7 +1299,7 @@ class ProtoDynamicAnyValueEmbedded(ProtoDynamicEmbedded):
   def ConvertFromWireFormat(self, value, container=None):
     """The wire format is an AnyValue message."""
     result = AnyValue()
-    ReadIntoObject(value[2], 0, result)
+    AnyValue.GetDecoder()(value[2], 0, 0, result)
 
     converted_value = self._type(container)
     # If one of the protobuf library wrapper classes is used, unwrap the value.
@@ -1040,7 +1340,7 @@ class ProtoDynamicAnyValueEmbedded(ProtoDynamicEmbedded):
                        value)
 
     any_value = AnyValue(type_url=type_name, value=data)
-    output = SerializeEntries(any_value.GetRawData().itervalues())
+    output = AnyValue.GetEncoder()(any_value.GetRawData())
 
     return (self.encoded_tag, VarintEncode(len(output)), output)
 
@@ -1478,6 +1778,10 @@ class RDFStructMetaclass(rdfvalue.RDFValueMetaclass):
     cls.type_infos_by_field_number = {}
     cls.type_infos_by_encoded_tag = {}
 
+    # The generated codec functions, see GetDecoder() and GetEncoder().
+    cls._decoder = None
+    cls._encoder = None
+
     # Build the class by parsing an existing protobuf class.
     if cls.protobuf is not None:
       proto2.DefineFromProtobuf(cls, cls.protobuf)
@@ -1672,11 +1976,28 @@ class RDFStruct(rdfvalue.RDFValue):
     self._data = data
     self.dirty = True
 
+  @classmethod
+  def GetDecoder(cls):
+    """Returns the generated decoder of this class, see GenerateDecoder()."""
+    if cls._decoder is None:
+      # Stored as a staticmethod so it is not bound to instances.
+      cls._decoder = staticmethod(GenerateDecoder(cls))
+
+    return cls._decoder
+
+  @classmethod
+  def GetEncoder(cls):
+    """Returns the generated encoder of this class, see GenerateEncoder()."""
+    if cls._encoder is None:
+      cls._encoder = staticmethod(GenerateEncoder(cls))
+
+    return cls._encoder
+
   def SerializeToString(self):
-    return SerializeEntries(self._data.itervalues())
+    return self.GetEncoder()(self._data)
 
   def ParseFromString(self, string):
-    ReadIntoObject(string, 0, self)
+    self.GetDecoder()(string, 0, 0, self)
     self.dirty = True
 
   def __eq__(self, other):
@@ -1853,6 +2174,9 @@ class RDFStruct(rdfvalue.RDFValue):
     cls.type_infos_by_field_number[field_desc.field_number] = field_desc
     cls.type_infos.Append(field_desc)
 
+    # The codecs are generated again on next use.
+    cls._decoder = cls._encoder = None
+
 
 class EnumContainer(object):
   """A data class to hold enum objects."""
@@ -2178,6 +2502,10 @@ class RDFProtoStruct(RDFStruct):
     cls.type_infos.Append(field_desc)
     cls.late_bound_type_infos.pop(field_desc.name, None)
 
+    # Fields may be added after the class was created when they are late
+    # bound, so the codecs are generated again on next use.
+    cls._decoder = cls._encoder = None
+
     # Add direct accessors only if the class does not already have them.
     if not hasattr(cls, field_desc.name):
       # This lambda is a class method so pylint: disable=protected-access
@@ -359,6 +359,39 @@ class RDFStructsTest(test_base.RDFValueTestCase):
     # Check that nested fields are also preserved.
     self.assertEqual(decoded_tested.nested.foobar, "goodbye")
 
+  def testGeneratedCodecsMatchGenericCodecs(self):
+    tested = TestStruct(
+        foobar=u"\u4e2d\u56fd", int=2**40, urn="aff4:/foo", type=2, float=2.5)
+    tested.repeated = ["a", "b"]
+    tested.nested.int = 7
+    tested.repeat_nested.Append(foobar="x")
+
+    data = tested.SerializeToString()
+    generic_data = structs.SerializeEntries(tested.GetRawData().itervalues())
+    self.assertEqual(len(data), len(generic_data))
+
+    for serialized in [data, generic_data]:
+      decoded = TestStruct()
+      structs.ReadIntoObject(serialized, 0, decoded)
+      self.assertEqual(decoded, tested)
+
+      decoded = TestStruct.FromSerializedString(serialized)
+      self.assertEqual(decoded, tested)
+      self.assertEqual(decoded.repeat_nested[0].foobar, "x")
+
+  def testFieldsAreSerializedInFieldNumberOrder(self):
+    tested = TestStruct(float=2.5, type=2, foobar="hello", int=3)
+    tested.nested.int = 7
+
+    tags = [encoded_tag for encoded_tag, _, _ in structs.SplitBuffer(
+        tested.SerializeToString())]
+    self.assertEqual(tags, ["\x0a", "\x10", "\x22", "\x38", "\x45"])
+
+  def testTruncatedDataRaises(self):
+    # The varint of field 2 is missing its last byte.
+    self.assertRaises(rdfvalue.DecodeError, TestStruct.FromSerializedString,
+                      "\x10\x80")
+
   def testRDFStruct(self):
     tested = TestStruct()
 
@@ -480,6 +513,11 @@ class RDFStructsTest(test_base.RDFValueTestCase):
 
     self.assertTrue("UndefinedYet" in rdfvalue._LATE_BINDING_STORE)
 
+    # The nested field is an unknown field for now.
+    serialized = "\x0a\x08\x0a\x06nested"
+    tested = LateBindingTest.FromSerializedString(serialized)
+    self.assertEqual(tested.SerializeToString(), serialized)
+
     # We can still use this protobuf
     tested = LateBindingTest()
 
@@ -499,6 +537,10 @@ class RDFStructsTest(test_base.RDFValueTestCase):
     nested_field = LateBindingTest.type_infos["nested"]
     self.assertEqual(nested_field.name, "nested")
 
+    # Data is now decoded with the new field.
+    tested = LateBindingTest.FromSerializedString(serialized)
+    self.assertEqual(tested.nested.foobar, "nested")
+
     # We can now use the protobuf as normal.
     tested = LateBindingTest()
     tested.nested.foobar = "foobar string"
@@ -1511,6 +1511,9 @@ class MockWorker(worker.GRRWorker):
                                 runner.context.backtrace)
               raise RuntimeError(runner.context.backtrace)
 
+    # Like the real worker, write out the events published by the flows.
+    events.Events.FlushBufferedEvents()
+
     return run_sessions
 
 
@@ -26,6 +26,7 @@ from grr.lib import email_alerts_test
 from grr.lib import events_test
 from grr.lib import export_test
 from grr.lib import export_utils_test
+from grr.lib import file_store_test
 from grr.lib import flow_test
 from grr.lib import flow_utils_test
 from grr.lib import front_end_test
@@ -35,6 +36,7 @@ from grr.lib import instant_output_plugin_test
 from grr.lib import ipv6_utils_test
 from grr.lib import lexer_test
 from grr.lib import log_test
+from grr.lib import mactime_index_test
 from grr.lib import multi_type_collection_test
 from grr.lib import objectfilter_test
 from grr.lib import output_plugin_test
@@ -51,6 +53,8 @@ from grr.lib import throttle_test
 from grr.lib import type_info_test
 from grr.lib import uploads_test
 from grr.lib import utils_test
+from grr.lib import worker_affinity_test
+from grr.lib import worker_scheduler_test
 
 from grr.lib.aff4_objects import tests
 from grr.lib.authorization import tests
@@ -63,5 +67,7 @@ from grr.lib.local import tests
 from grr.lib.output_plugins import tests
 from grr.lib.rdfvalues import tests
 
+from grr.tools import frontend_benchmark_test
 from grr.tools import http_server_test
+from grr.tools import import_nsrl_hashes_test
 # pylint: enable=unused-import,g-import-not-at-top
@@ -1,9 +1,22 @@
 #!/usr/bin/env python
-"""Throttle user calls to flows."""
+"""Throttle user calls to flows.
 
-from grr.lib import aff4
-from grr.lib import flow
+The throttler does not open any flow objects. Instead, every top level flow
+started on a client is recorded in a small per client index holding one entry
+per (user, flow) for the request counters and one entry per distinct (flow
+name, args digest) for the duplicate check. Entries are stored at the flow's
+creation time, so both checks are served by reads restricted to the throttling
+window, and entries older than a day are expired as new flows are recorded.
+"""
+
+import hashlib
+
+from grr.lib import data_store
 from grr.lib import rdfvalue
+from grr.lib import utils
+
+# Flows are only counted and checked for duplicates within this window.
+THROTTLE_WINDOW = rdfvalue.Duration("1d")
 
 
 class Error(Exception):
@@ -25,6 +38,149 @@ class ErrorFlowDuplicate(Error):
     self.flow_urn = flow_urn
 
 
+def FlowArgsDigest(flow_args):
+  """Returns a digest identifying flow args for the duplicate check.
+
+  Args are compared by type and value, as with ==. No args are equivalent to
+  EmptyFlowArgs.
+
+  Args:
+    flow_args: A flow args RDFProtoStruct or None.
+
+  Returns:
+    A hex digest string.
+  """
+  if flow_args is None:
+    name, data = "EmptyFlowArgs", ""
+  else:
+    name = flow_args.__class__.__name__
+    # The struct serializes fields in the order they were set, the primitive
+    # protobuf always serializes them ordered by their tag.
+    primitive = flow_args.AsPrimitiveProto()
+    if primitive is None:
+      data = flow_args.SerializeToString()
+    else:
+      data = primitive.SerializeToString()
+
+  return hashlib.sha256("%s:%s" % (name, data)).hexdigest()
+
+
+class FlowThrottleIndex(object):
+  """The recently started flows of a single client."""
+
+  INDEX_ROOT = rdfvalue.RDFURN("aff4:/index/flow_throttle")
+
+  INDEX_PREFIX = "index:flow_throttle_"
+  # USER_PREFIX + "<user>:<flow id>", stored at the flow's creation time.
+  USER_PREFIX = INDEX_PREFIX + "user:"
+  # FLOW_PREFIX + "<flow name>:<args digest>", holding the newest flow urn.
+  FLOW_PREFIX = INDEX_PREFIX + "flow:"
+
+  def __init__(self, client_id, token=None):
+    self.client_id = rdfvalue.RDFURN(client_id)
+    self.urn = self.INDEX_ROOT.Add(self.client_id.Basename())
+    self.token = token
+
+  def _UserPrefix(self, user):
+    return "%s%s:" % (self.USER_PREFIX, utils.SmartStr(user))
+
+  def _FlowColumn(self, flow_name, flow_args):
+    return "%s%s:%s" % (self.FLOW_PREFIX, utils.SmartStr(flow_name),
+                        FlowArgsDigest(flow_args))
+
+  def AddFlow(self, flow_urn, user, flow_name, flow_args, create_time):
+    """Records a started flow and expires entries older than the window.
+
+    Args:
+      flow_urn: The urn of the started flow.
+      user: The user the flow was started by.
+      flow_name: The name of the flow.
+      flow_args: The args of the flow.
+      create_time: The RDFDatetime the flow was created at.
+    """
+    timestamp = create_time.AsMicroSecondsFromEpoch()
+    with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
+      mutation_pool.MultiSet(
+          self.urn, {
+              self._UserPrefix(user) + rdfvalue.RDFURN(flow_urn).Basename():
+                  [""],
+              self._FlowColumn(flow_name, flow_args): [
+                  utils.SmartStr(flow_urn)
+              ]
+          },
+          timestamp=timestamp)
+
+      expired = (create_time - THROTTLE_WINDOW).AsMicroSecondsFromEpoch()
+      self.Expire(expired, mutation_pool)
+
+  def Expire(self, timestamp, mutation_pool):
+    """Deletes all entries stored before timestamp."""
+    columns = [
+        column
+        for column, _, _ in data_store.DB.ResolvePrefix(
+            self.urn,
+            self.INDEX_PREFIX,
+            timestamp=(0, timestamp - 1),
+            token=self.token)
+    ]
+    if columns:
+      mutation_pool.DeleteAttributes(self.urn, columns, end=timestamp - 1)
+
+  def CountUserFlows(self, user, start_time, end_time):
+    """Counts flows started by user after start_time until end_time."""
+    return len(
+        data_store.DB.ResolvePrefix(
+            self.urn,
+            self._UserPrefix(user),
+            timestamp=(start_time.AsMicroSecondsFromEpoch() + 1,
+                       end_time.AsMicroSecondsFromEpoch()),
+            token=self.token))
+
+  def FindFlow(self, flow_name, flow_args, start_time, end_time):
+    """Returns a flow with these args started in the time range, or None.
+
+    Args:
+      flow_name: The name of the flow.
+      flow_args: The args of the flow.
+      start_time: Only flows started after this RDFDatetime are returned.
+      end_time: Only flows started up to this RDFDatetime are returned.
+
+    Returns:
+      A tuple of the flow's urn and creation time, or None.
+    """
+    for _, value, timestamp in data_store.DB.ResolvePrefix(
+        self.urn,
+        self._FlowColumn(flow_name, flow_args),
+        timestamp=(start_time.AsMicroSecondsFromEpoch() + 1,
+                   end_time.AsMicroSecondsFromEpoch()),
+        token=self.token):
+      return rdfvalue.RDFURN(value), rdfvalue.RDFDatetime(timestamp)
+
+    return None
+
+
+def RecordFlowStart(flow_obj, token=None):
+  """Adds a flow to its client's FlowThrottleIndex.
+
+  Only top level flows stored in the client's flows directory are recorded,
+  flows started by hunts or other flows are not throttled.
+
+  Args:
+    flow_obj: The started flow object.
+    token: The data store token to write with.
+  """
+  client_id = flow_obj.runner_args.client_id
+  if not client_id:
+    return
+
+  if flow_obj.urn.Dirname() != client_id.Add("flows").Path():
+    return
+
+  FlowThrottleIndex(client_id, token=token).AddFlow(
+      flow_obj.urn, flow_obj.context.creator, flow_obj.runner_args.flow_name,
+      flow_obj.args, flow_obj.context.create_time)
+
+
 class FlowThrottler(object):
   """Checks for excessive or repetitive flow requests."""
 
@@ -42,9 +198,9 @@ class FlowThrottler(object):
   def EnforceLimits(self, client_id, user, flow_name, flow_args, token=None):
     """Enforce DailyFlowRequestLimit and FlowDuplicateInterval.
 
-    Look at the flows that have run on this client within the last day and check
-    we aren't exceeding our limits. Raises if limits will be exceeded by running
-    the specified flow.
+    Look at the flows that have run on this client within the last day, as
+    recorded in the client's FlowThrottleIndex, and check we aren't exceeding
+    our limits. Raises if limits will be exceeded by running the specified flow.
 
     Args:
       client_id: client URN
@@ -62,41 +218,27 @@ class FlowThrottler(object):
     if not self.dup_interval and not self.daily_req_limit:
       return
 
-    flows_dir = aff4.FACTORY.Open(client_id.Add("flows"), token=token)
+    index = FlowThrottleIndex(client_id, token=token)
     now = rdfvalue.RDFDatetime.Now()
-    earlier = now - rdfvalue.Duration("1d")
-    dup_boundary = now - self.dup_interval
-
-    flow_count = 0
-    flow_list = flows_dir.ListChildren(age=(earlier.AsMicroSecondsFromEpoch(),
-                                            now.AsMicroSecondsFromEpoch()))
-
-    # Save DB roundtrips by checking both conditions at once. This means the dup
-    # interval has a maximum of 1 day.
-    for flow_obj in aff4.FACTORY.MultiOpen(flow_list, token=token):
-      flow_context = flow_obj.context
-
-      # If dup_interval is set, check for identical flows run within the
-      # duplicate interval.
-      if self.dup_interval and flow_context.create_time > dup_boundary:
-        if flow_obj.runner_args.flow_name == flow_name:
-
-          # Raise if either the args are the same, or the args were empty, to
-          # which None is the equivalent.
-          if flow_obj.args == flow_args or (
-              isinstance(flow_obj.args, flow.EmptyFlowArgs) and
-              flow_args is None):
-            raise ErrorFlowDuplicate(
-                "Identical %s already run on %s at %s" %
-                (flow_name, client_id, flow_context.create_time),
-                flow_urn=flow_obj.urn)
-
-      # Filter for flows started by user within the 1 day window.
-      if flow_context.creator == user and flow_context.create_time > earlier:
-        flow_count += 1
+    earlier = now - THROTTLE_WINDOW
+
+    # If dup_interval is set, check for identical flows run within the
+    # duplicate interval. The index only covers the throttling window, so the
+    # dup interval has a maximum of 1 day.
+    if self.dup_interval:
+      dup_boundary = max(now - self.dup_interval, earlier)
+      duplicate = index.FindFlow(flow_name, flow_args, dup_boundary, now)
+      if duplicate:
+        flow_urn, create_time = duplicate
+        raise ErrorFlowDuplicate(
+            "Identical %s already run on %s at %s" % (flow_name, client_id,
+                                                      create_time),
+            flow_urn=flow_urn)
 
     # If limit is set, enforce it.
-    if self.daily_req_limit and flow_count >= self.daily_req_limit:
-      raise ErrorDailyFlowRequestLimitExceeded(
-          "%s flows run since %s, limit: %s" % (flow_count, earlier,
-                                                self.daily_req_limit))
+    if self.daily_req_limit:
+      flow_count = index.CountUserFlows(user, earlier, now)
+      if flow_count >= self.daily_req_limit:
+        raise ErrorDailyFlowRequestLimitExceeded(
+            "%s flows run since %s, limit: %s" % (flow_count, earlier,
+                                                  self.daily_req_limit))
@@ -1,7 +1,11 @@
 #!/usr/bin/env python
 """Tests for grr.lib.throttle."""
 
+import random
+
 from grr.lib import access_control
+from grr.lib import aff4
+from grr.lib import data_store
 from grr.lib import flags
 from grr.lib import flow
 from grr.lib import rdfvalue
@@ -153,6 +157,121 @@ class ThrottleTest(test_lib.GRRBaseTest):
           args,
           token=self.token)
 
+  def _EnforceLimitsFromFlowObjects(self, throttler, user, flow_name,
+                                    flow_args):
+    """Decides like EnforceLimits by opening all the client's flows."""
+    now = rdfvalue.RDFDatetime.Now()
+    earlier = now - rdfvalue.Duration("1d")
+    dup_boundary = now - throttler.dup_interval
+
+    flow_list = aff4.FACTORY.Open(
+        self.client_id.Add("flows"), token=self.token).ListChildren(
+            age=(earlier.AsMicroSecondsFromEpoch(),
+                 now.AsMicroSecondsFromEpoch()))
+
+    flow_count = 0
+    for flow_obj in aff4.FACTORY.MultiOpen(flow_list, token=self.token):
+      flow_context = flow_obj.context
+      if (throttler.dup_interval and
+          flow_context.create_time > dup_boundary and
+          flow_obj.runner_args.flow_name == flow_name):
+        if flow_obj.args == flow_args or (
+            isinstance(flow_obj.args, flow.EmptyFlowArgs) and
+            flow_args is None):
+          return throttle.ErrorFlowDuplicate
+
+      if flow_context.creator == user and flow_context.create_time > earlier:
+        flow_count += 1
+
+    if throttler.daily_req_limit and flow_count >= throttler.daily_req_limit:
+      return throttle.ErrorDailyFlowRequestLimitExceeded
+
+  def testDecisionsMatchFlowObjectsForRandomHistories(self):
+    rng = random.Random(42)
+    throttler = throttle.FlowThrottler(
+        daily_req_limit=4, dup_interval=rdfvalue.Duration("3h"))
+    tokens = [
+        access_control.ACLToken(username=username, reason="Running tests")
+        for username in ["test", "test2"]
+    ]
+
+    now = self.BASE_TIME
+    for _ in range(60):
+      now += rng.choice([0, 1, 60, 3600, 6 * 3600, 12 * 3600])
+      token = rng.choice(tokens)
+      message_count = rng.choice([None, 0, 1])
+      if message_count is None:
+        flow_name, flow_args = "DummyLogFlow", None
+      else:
+        flow_name = "SendingFlow"
+        flow_args = test_lib.SendingFlowArgs(message_count=message_count)
+
+      with test_lib.FakeTime(now):
+        expected = self._EnforceLimitsFromFlowObjects(
+            throttler, token.username, flow_name, flow_args)
+        try:
+          throttler.EnforceLimits(
+              self.client_id,
+              token.username,
+              flow_name,
+              flow_args,
+              token=self.token)
+          decision = None
+        except (throttle.ErrorFlowDuplicate,
+                throttle.ErrorDailyFlowRequestLimitExceeded) as e:
+          decision = e.__class__
+
+        self.assertEqual(decision, expected)
+
+        # Flows are started regardless of the throttler, so the history also
+        # contains duplicates and flows over the limit.
+        flow.GRRFlow.StartFlow(
+            client_id=self.client_id,
+            flow_name=flow_name,
+            args=flow_args,
+            token=token)
+
+  def testFlowsStartedByOtherFlowsAreNotRecorded(self):
+    throttler = throttle.FlowThrottler(
+        daily_req_limit=0, dup_interval=rdfvalue.Duration("1h"))
+
+    with test_lib.FakeTime(self.BASE_TIME):
+      flow.GRRFlow.StartFlow(
+          client_id=self.client_id, flow_name="DummyLogFlow", token=self.token)
+
+      # DummyLogFlow starts a DummyLogFlowChild.
+      throttler.EnforceLimits(
+          self.client_id,
+          self.token.username,
+          "DummyLogFlowChild",
+          None,
+          token=self.token)
+
+  def testExpiredEntriesAreDeleted(self):
+    index = throttle.FlowThrottleIndex(self.client_id, token=self.token)
+
+    with test_lib.FakeTime(self.BASE_TIME):
+      flow.GRRFlow.StartFlow(
+          client_id=self.client_id, flow_name="DummyLogFlow", token=self.token)
+
+    with test_lib.FakeTime(self.BASE_TIME + 86400 + 1):
+      flow.GRRFlow.StartFlow(
+          client_id=self.client_id,
+          flow_name="SendingFlow",
+          message_count=0,
+          token=self.token)
+
+    columns = [
+        column
+        for column, _, _ in data_store.DB.ResolvePrefix(
+            index.urn,
+            index.INDEX_PREFIX,
+            timestamp=data_store.DB.ALL_TIMESTAMPS,
+            token=self.token)
+    ]
+    self.assertEqual(len(columns), 2)
+    self.assertFalse([column for column in columns if "DummyLogFlow" in column])
+
 
 def main(argv):
   # Run the full test suite
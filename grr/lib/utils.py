@@ -902,6 +902,45 @@ class ArchiveAlreadyClosedError(Error):
   pass
 
 
+# A final, empty deflate block. Appended to a sequence of independently
+# compressed blocks, it terminates the deflate stream they form.
+DEFLATE_END_BLOCK = "\x03\x00"
+
+
+def DeflateBlock(data):
+  """Compresses data into raw deflate blocks ending on a byte boundary.
+
+  Blocks compressed by this function can be concatenated in any number and
+  terminated with DEFLATE_END_BLOCK to form a single valid deflate stream, so
+  the chunks of a file can be compressed independently of each other.
+
+  Args:
+    data: The data to compress.
+
+  Returns:
+    The compressed data.
+  """
+  compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+  return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def GzipBlock(data):
+  """Compresses data into a complete gzip member.
+
+  A gzip file may consist of several concatenated members, so a stream can be
+  compressed block by block.
+
+  Args:
+    data: The data to compress.
+
+  Returns:
+    The gzip member.
+  """
+  # A window size of 16 + 15 makes zlib write the gzip header and trailer.
+  compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, 31)
+  return compressor.compress(data) + compressor.flush()
+
+
 class StreamingZipGenerator(object):
   """A streaming zip generator that can archive file-like objects."""
 
@@ -921,6 +960,7 @@ class StreamingZipGenerator(object):
     self.cur_compress_size = 0
     self.cur_cmpr = None
     self.cur_crc = 0
+    self.cur_precompressed = False
 
   def __enter__(self):
     return self
@@ -1011,8 +1051,28 @@ class StreamingZipGenerator(object):
 
     return self._stream.GetValueAndReset()
 
-  def WriteFileHeader(self, arcname=None, compress_type=None, st=None):
-    """Writes a file header."""
+  def WriteFileHeader(self,
+                      arcname=None,
+                      compress_type=None,
+                      st=None,
+                      precompressed=False):
+    """Writes a file header.
+
+    Args:
+      arcname: The name in the archive this should take.
+      compress_type: Compression type (zipfile.ZIP_DEFLATED, or ZIP_STORED)
+      st: An optional stat object to be used for setting headers.
+      precompressed: If True, the chunks of this deflated member are
+        compressed by the caller with DeflateBlock() and passed to
+        WriteFileChunk() along with the original data.
+
+    Returns:
+      The header data.
+
+    Raises:
+      ArchiveAlreadyClosedError: If the zip if already closed.
+      ValueError: If precompressed is set for a member which is not deflated.
+    """
 
     if not self._stream:
       raise ArchiveAlreadyClosedError(
@@ -1022,8 +1082,13 @@ class StreamingZipGenerator(object):
         arcname=arcname, compress_type=compress_type, st=st)
     self.cur_file_size = 0
     self.cur_compress_size = 0
+    self.cur_precompressed = precompressed
 
-    if self.cur_zinfo.compress_type == zipfile.ZIP_DEFLATED:
+    if precompressed:
+      if self.cur_zinfo.compress_type != zipfile.ZIP_DEFLATED:
+        raise ValueError("Only deflated members can be precompressed.")
+      self.cur_cmpr = None
+    elif self.cur_zinfo.compress_type == zipfile.ZIP_DEFLATED:
       self.cur_cmpr = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
                                        zlib.DEFLATED, -15)
     else:
@@ -1049,8 +1114,21 @@ class StreamingZipGenerator(object):
 
     return self._stream.GetValueAndReset()
 
-  def WriteFileChunk(self, chunk):
-    """Writes file chunk."""
+  def WriteFileChunk(self, chunk, compressed_chunk=None):
+    """Writes file chunk.
+
+    Args:
+      chunk: The file data.
+      compressed_chunk: For precompressed members, the result of
+        DeflateBlock(chunk).
+
+    Returns:
+      The data to write to the archive.
+
+    Raises:
+      ArchiveAlreadyClosedError: If the zip if already closed.
+      ValueError: If compressed_chunk is missing for a precompressed member.
+    """
 
     if not self._stream:
       raise ArchiveAlreadyClosedError(
@@ -1059,7 +1137,12 @@ class StreamingZipGenerator(object):
     self.cur_file_size += len(chunk)
     self.cur_crc = zipfile.crc32(chunk, self.cur_crc) & 0xffffffff
 
-    if self.cur_cmpr:
+    if self.cur_precompressed:
+      if compressed_chunk is None:
+        raise ValueError("Precompressed members need compressed chunks.")
+      chunk = compressed_chunk
+      self.cur_compress_size += len(chunk)
+    elif self.cur_cmpr:
       chunk = self.cur_cmpr.compress(chunk)
       self.cur_compress_size += len(chunk)
 
@@ -1073,8 +1156,11 @@ class StreamingZipGenerator(object):
       raise ArchiveAlreadyClosedError(
           "Attempting to write to a ZIP archive that was already closed.")
 
-    if self.cur_cmpr:
-      buf = self.cur_cmpr.flush()
+    if self.cur_cmpr or self.cur_precompressed:
+      if self.cur_precompressed:
+        buf = DEFLATE_END_BLOCK
+      else:
+        buf = self.cur_cmpr.flush()
       self.cur_compress_size += len(buf)
       self.cur_zinfo.compress_size = self.cur_compress_size
 
@@ -1216,12 +1302,20 @@ class StreamingTarGenerator(object):
 
   FILE_CHUNK_SIZE = 1024 * 1024 * 4
 
-  def __init__(self):
+  def __init__(self, compress=True):
+    """Constructor.
+
+    Args:
+      compress: If False, a plain tar stream is generated. This is used when
+        the output is compressed by the caller, e.g. with GzipBlock().
+    """
     super(StreamingTarGenerator, self).__init__()
 
     self._stream = RollingMemoryStream()
     self._tar_fd = tarfile.open(
-        mode="w:gz", fileobj=self._stream, encoding="utf-8")
+        mode="w:gz" if compress else "w:",
+        fileobj=self._stream,
+        encoding="utf-8")
 
     self._ResetState()
 
@@ -2,6 +2,7 @@
 """Tests for utility classes."""
 
 
+import gzip
 import os
 import StringIO
 import tarfile
@@ -429,6 +430,41 @@ class StreamingZipWriterTest(test_lib.GRRBaseTest):
         self.assertEqual(link_contents, "subdir/test2.txt")
 
 
+class StreamingZipGeneratorTest(test_lib.GRRBaseTest):
+  """Tests for StreamingZipGenerator."""
+
+  def testPrecompressedChunksFormOneMember(self):
+    chunks = ["chunk %d " % i * 1000 for i in range(5)]
+
+    generator = utils.StreamingZipGenerator(compression=zipfile.ZIP_DEFLATED)
+    data = [generator.WriteFileHeader("test.txt", precompressed=True)]
+    for chunk in chunks:
+      data.append(
+          generator.WriteFileChunk(
+              chunk, compressed_chunk=utils.DeflateBlock(chunk)))
+    data.append(generator.WriteFileFooter())
+    data.append(generator.Close())
+
+    test_zip = zipfile.ZipFile(StringIO.StringIO("".join(data)), "r")
+    self.assertIsNone(test_zip.testzip())
+    self.assertEqual(test_zip.read("test.txt"), "".join(chunks))
+    self.assertEqual(
+        test_zip.getinfo("test.txt").compress_type, zipfile.ZIP_DEFLATED)
+
+  def testPrecompressedMemberRequiresCompressedChunks(self):
+    generator = utils.StreamingZipGenerator(compression=zipfile.ZIP_DEFLATED)
+    generator.WriteFileHeader("test.txt", precompressed=True)
+    with self.assertRaises(ValueError):
+      generator.WriteFileChunk("data")
+
+  def testGzipBlocksCanBeConcatenated(self):
+    blocks = ["block %d" % i * 100 for i in range(3)]
+    data = "".join(utils.GzipBlock(block) for block in blocks)
+
+    with gzip.GzipFile(fileobj=StringIO.StringIO(data)) as fd:
+      self.assertEqual(fd.read(), "".join(blocks))
+
+
 class StreamingTarWriterTest(test_lib.GRRBaseTest):
   """Tests for StreamingTarWriter."""
 
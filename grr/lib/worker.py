@@ -11,6 +11,7 @@ import logging
 
 from grr.lib import aff4
 from grr.lib import config_lib
+from grr.lib import events
 from grr.lib import flags
 from grr.lib import flow
 from grr.lib import master
@@ -23,6 +24,8 @@ from grr.lib import server_stubs
 from grr.lib import stats
 from grr.lib import threadpool
 from grr.lib import utils
+from grr.lib import worker_affinity
+from grr.lib import worker_scheduler
 from grr.lib.rdfvalues import flows as rdf_flows
 
 
@@ -81,8 +84,12 @@ class GRRWorker(object):
       if threadpool_size is None:
         threadpool_size = config_lib.CONFIG["Threadpool.size"]
 
+      # The flow scheduler counts on every thread being there, so the pool is
+      # started at its full size instead of growing on demand.
       GRRWorker.thread_pool = threadpool.ThreadPool.Factory(
-          threadpool_prefix, min_threads=2, max_threads=threadpool_size)
+          threadpool_prefix,
+          min_threads=threadpool_size,
+          max_threads=threadpool_size)
 
       GRRWorker.thread_pool.Start()
 
@@ -95,8 +102,26 @@ class GRRWorker(object):
     self.well_known_flow_lease_time = config_lib.CONFIG[
         "Worker.well_known_flow_lease_time"]
 
+    # Notifications are only processed by the workers their flow hashes to.
+    self.membership = worker_affinity.WorkerMembership(
+        queues=queues, token=token)
+
+    # Recently processed flows, reused if nobody else changed them since.
+    self.flow_cache = utils.TimeBasedCache(
+        max_size=config_lib.CONFIG["Worker.flow_cache_size"],
+        max_age=config_lib.CONFIG["Worker.flow_cache_age"])
+
+    # Notified flows share the thread pool fairly between analysts and hunts.
+    self.scheduler = worker_scheduler.FlowScheduler(
+        self._StartProcessing,
+        self.thread_pool.min_threads,
+        system_flows=self.well_known_flows,
+        token=self.token)
+
   def Run(self):
     """Event loop."""
+    # Only the worker loop flushes the event buffer regularly.
+    events.Events.BUFFER.enabled = True
     try:
       while 1:
         if master.MASTER_WATCHER.IsMaster():
@@ -104,6 +129,10 @@ class GRRWorker(object):
         else:
           processed = 0
 
+        # Events published by the flows processed so far are written out
+        # together.
+        events.Events.FlushBufferedEvents()
+
         if processed == 0:
           logger = logging.getLogger()
           for h in logger.handlers:
@@ -122,6 +151,11 @@ class GRRWorker(object):
       logging.info("Caught interrupt, exiting.")
       self.thread_pool.Join()
 
+    finally:
+      self.membership.Leave()
+      events.Events.BUFFER.enabled = False
+      events.Events.FlushBufferedEvents()
+
   def RunOnce(self):
     """Processes one set of messages from Task Scheduler.
 
@@ -134,6 +168,8 @@ class GRRWorker(object):
     start_time = time.time()
     processed = 0
 
+    self.membership.Refresh()
+
     queue_manager = queue_manager_lib.QueueManager(token=self.token)
     for queue in self.queues:
       # Freezeing the timestamp used by queue manager to query/delete
@@ -156,8 +192,10 @@ class GRRWorker(object):
       notifications_available = []
       for priority in sorted(notifications_by_priority, reverse=True):
         for notification in notifications_by_priority[priority]:
-          # Filter out session ids we already tried to lock but failed.
-          if notification.session_id not in self.queued_flows:
+          # Filter out session ids we already tried to lock but failed and
+          # flows routed to other workers.
+          if (notification.session_id not in self.queued_flows and
+              self._IsRoutedHere(notification.session_id)):
             notifications_available.append(notification)
 
       try:
@@ -189,6 +227,14 @@ class GRRWorker(object):
         return processed
     return processed
 
+  def _IsRoutedHere(self, session_id):
+    # Well known flows only hold their lock briefly and are meant to be
+    # processed by all workers at once.
+    if session_id.FlowName() in self.well_known_flows:
+      return True
+
+    return self.membership.IsOwner(session_id)
+
   def ProcessStuckFlows(self, stuck_flows, queue_manager):
     stats.STATS.IncrementCounter("grr_flows_stuck", len(stuck_flows))
 
@@ -224,7 +270,7 @@ class GRRWorker(object):
         time_limit: If set return as soon as possible after this many seconds.
 
     Returns:
-        The number of processed flows.
+        The number of flows queued for processing.
     """
     now = time.time()
     processed = 0
@@ -233,15 +279,19 @@ class GRRWorker(object):
         if time_limit and time.time() - now > time_limit:
           break
 
-        processed += 1
-        self.queued_flows.Put(notification.session_id, 1)
-        self.thread_pool.AddTask(
-            target=self._ProcessMessages,
-            args=(notification, queue_manager.Copy()),
-            name=self.__class__.__name__)
+        # The scheduler hands the flow to the thread pool when it is its turn.
+        if self.scheduler.Add(notification, queue_manager.Copy()):
+          processed += 1
+          self.queued_flows.Put(notification.session_id, 1)
 
     return processed
 
+  def _StartProcessing(self, notification, queue_manager):
+    self.thread_pool.AddTask(
+        target=self._ProcessMessages,
+        args=(notification, queue_manager),
+        name=self.__class__.__name__)
+
   def _ProcessRegularFlowMessages(self, flow_obj, notification):
     """Processes messages for a given flow."""
     session_id = notification.session_id
@@ -263,6 +313,40 @@ class GRRWorker(object):
       logging.error("Flow %s: %s", flow_obj, e)
       raise FlowProcessingError(e)
 
+  def _OpenFlowWithLock(self, session_id):
+    """Locks a flow, reusing the copy in the flow cache if it is current."""
+    try:
+      flow_obj = self.flow_cache.Get(session_id)
+    except KeyError:
+      flow_obj = None
+
+    if flow_obj is None:
+      return aff4.FACTORY.OpenWithLock(
+          session_id,
+          lease_time=self.flow_lease_time,
+          blocking=False,
+          token=self.token)
+
+    # The cached copy is only valid until it is locked and checked again.
+    self.flow_cache.ExpireObject(session_id)
+    flow_obj = aff4.FACTORY.RelockObject(
+        flow_obj, lease_time=self.flow_lease_time, blocking=False)
+
+    try:
+      if flow_obj.Revalidate():
+        stats.STATS.IncrementCounter("worker_flow_cache_hits")
+        return flow_obj
+    except Exception:  # pylint: disable=broad-except
+      flow_obj.transaction.Release()
+      raise
+
+    return aff4.FACTORY.Open(
+        session_id,
+        mode="rw",
+        follow_symlinks=False,
+        transaction=flow_obj.transaction,
+        token=self.token)
+
   def _ProcessMessages(self, notification, queue_manager):
     """Does the real work with a single flow."""
     flow_obj = None
@@ -282,11 +366,7 @@ class GRRWorker(object):
             blocking=False,
             token=self.token)
       else:
-        flow_obj = aff4.FACTORY.OpenWithLock(
-            session_id,
-            lease_time=self.flow_lease_time,
-            blocking=False,
-            token=self.token)
+        flow_obj = self._OpenFlowWithLock(session_id)
 
       now = time.time()
       logging.debug("Got lock on %s", session_id)
@@ -314,6 +394,13 @@ class GRRWorker(object):
         with flow_obj:
           self._ProcessRegularFlowMessages(flow_obj, notification)
 
+        # Later notifications of this flow are queued for its creator.
+        self.scheduler.SetCreator(session_id, flow_obj.context.creator)
+
+        # Only flows routed to this worker are likely to come back here.
+        if self.membership.IsOwner(session_id):
+          self.flow_cache.Put(session_id, flow_obj)
+
       elapsed = time.time() - now
       logging.debug("Done processing %s: %s sec", session_id, elapsed)
       stats.STATS.RecordEvent(
@@ -345,6 +432,9 @@ class GRRWorker(object):
           "worker_session_errors", fields=[str(type(e))])
       queue_manager.DeleteNotification(session_id)
 
+    finally:
+      self.scheduler.Done(session_id)
+
 
 class WorkerInit(registry.InitHook):
   """Registers worker stats variables."""
@@ -356,6 +446,7 @@ class WorkerInit(registry.InitHook):
         "worker_bad_flow_objects", fields=[("type", str)])
     stats.STATS.RegisterCounterMetric(
         "worker_session_errors", fields=[("type", str)])
+    stats.STATS.RegisterCounterMetric("worker_flow_cache_hits")
     stats.STATS.RegisterCounterMetric(
         "worker_flow_lock_error",
         docstring=("Worker lock failures. We expect "
@@ -364,3 +455,5 @@ class WorkerInit(registry.InitHook):
     stats.STATS.RegisterEventMetric(
         "worker_flow_processing_time", fields=[("flow", str)])
     stats.STATS.RegisterEventMetric("worker_time_to_retrieve_notifications")
+    stats.STATS.RegisterEventMetric(
+        "worker_flow_queueing_delay", fields=[("class", str)])
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""Routing of flow notifications to workers by consistent hashing.
+
+Every worker holds a membership lease in the data store which it renews while
+it is running. The live members are placed on a hash ring and the
+notifications of a flow are only processed by the Worker.affinity_group_size
+workers its session id hashes to. Workers therefore rarely compete for the
+lock of the same flow.
+
+When workers join or leave, the ring is rebuilt from the current members and
+only the flows hashed to the changed workers move.
+
+Only workers polling the same queues share a ring. A worker started on a
+private queue, like the console's debugging worker, therefore neither takes
+flows away from the regular workers nor waits for flows hashed to them.
+"""
+
+
+import bisect
+import hashlib
+import os
+import random
+import socket
+import time
+
+import logging
+
+from grr.lib import config_lib
+from grr.lib import data_store
+from grr.lib import queues as queues_config
+from grr.lib import rdfvalue
+from grr.lib import utils
+
+
+class HashRing(object):
+  """A consistent hash ring of members."""
+
+  # Each member is placed on the ring this many times, which spreads the keys
+  # evenly even when there are only a few members.
+  VIRTUAL_NODES = 64
+
+  def __init__(self, members):
+    self.members = frozenset(members)
+    self.points = []
+    self.owners = []
+    for point, member in sorted(
+        (self._Hash("%s#%d" % (member, i)), member)
+        for member in self.members for i in range(self.VIRTUAL_NODES)):
+      self.points.append(point)
+      self.owners.append(member)
+
+  @staticmethod
+  def _Hash(value):
+    return int(hashlib.md5(utils.SmartStr(value)).hexdigest()[:16], 16)
+
+  def GetOwners(self, key, count=1):
+    """Returns the count members following key on the ring."""
+    result = []
+    if not self.points:
+      return result
+
+    count = min(count, len(self.members))
+    start = bisect.bisect(self.points, self._Hash(key))
+    for i in xrange(len(self.points)):
+      member = self.owners[(start + i) % len(self.points)]
+      if member not in result:
+        result.append(member)
+        if len(result) == count:
+          break
+
+    return result
+
+
+class WorkerMembership(object):
+  """The membership of a worker in the group of running workers."""
+
+  MEMBERS_URN = rdfvalue.RDFURN("aff4:/worker_membership")
+  MEMBER_PREFIX = "worker:"
+
+  def __init__(self,
+               worker_id=None,
+               queues=queues_config.WORKER_LIST,
+               lease_time=None,
+               group_size=None,
+               token=None):
+    """Constructor.
+
+    Args:
+      worker_id: A unique id of the worker. Defaults to one made from the host
+        name and process id.
+      queues: The queues the worker polls. Only workers polling the same
+        queues are members of the same group.
+      lease_time: Seconds a lease is valid without being renewed.
+      group_size: The number of workers processing each flow.
+      token: The token to use for the data store.
+    """
+    if worker_id is None:
+      worker_id = "%s:%d:%08x" % (socket.gethostname(), os.getpid(),
+                                  random.randint(0, 2**32 - 1))
+    if lease_time is None:
+      lease_time = config_lib.CONFIG["Worker.membership_lease_time"]
+    if group_size is None:
+      group_size = config_lib.CONFIG["Worker.affinity_group_size"]
+
+    self.worker_id = worker_id
+    self.members_urn = self.MEMBERS_URN.Add(",".join(
+        sorted(utils.SmartStr(rdfvalue.RDFURN(queue).Basename())
+               for queue in queues)))
+    self.lease_time = lease_time
+    self.group_size = group_size
+    self.token = token
+
+    self.last_refresh = None
+    self.ring = HashRing([worker_id])
+
+  def _ReadMembers(self, now):
+    """Returns the live members and deletes expired ones."""
+    members = set([self.worker_id])
+    expired = []
+    min_timestamp = (now - self.lease_time) * 1000000
+    for predicate, _, timestamp in data_store.DB.ResolvePrefix(
+        self.members_urn,
+        self.MEMBER_PREFIX,
+        timestamp=data_store.DB.NEWEST_TIMESTAMP,
+        token=self.token):
+      if timestamp >= min_timestamp:
+        members.add(predicate[len(self.MEMBER_PREFIX):])
+      else:
+        expired.append(predicate)
+
+    if expired:
+      # Only leases which were not renewed in the meantime are deleted.
+      data_store.DB.DeleteAttributes(
+          self.members_urn,
+          expired,
+          start=0,
+          end=int(min_timestamp),
+          sync=False,
+          token=self.token)
+
+    return members
+
+  def Refresh(self):
+    """Renews the lease and rebuilds the ring if the membership changed.
+
+    This is cheap to call often, the data store is only accessed every third
+    of the lease time.
+    """
+    now = time.time()
+    if (self.last_refresh is not None and
+        self.last_refresh <= now < self.last_refresh + self.lease_time / 3.0):
+      return
+
+    data_store.DB.Set(
+        self.members_urn,
+        self.MEMBER_PREFIX + self.worker_id,
+        "",
+        token=self.token)
+    self.last_refresh = now
+
+    members = self._ReadMembers(now)
+    if members != self.ring.members:
+      logging.info("Worker membership changed, rebalancing over %d workers.",
+                   len(members))
+      self.ring = HashRing(members)
+
+  def Leave(self):
+    """Gives up the lease so other workers take over immediately."""
+    data_store.DB.DeleteAttributes(
+        self.members_urn, [self.MEMBER_PREFIX + self.worker_id],
+        sync=True,
+        token=self.token)
+    self.last_refresh = None
+
+  def IsOwner(self, session_id):
+    """Returns True if this worker should process the given session."""
+    return self.worker_id in self.ring.GetOwners(session_id, self.group_size)
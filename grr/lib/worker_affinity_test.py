@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""Tests for grr.lib.worker_affinity."""
+
+
+from grr.lib import flags
+from grr.lib import rdfvalue
+from grr.lib import test_lib
+from grr.lib import worker_affinity
+
+
+class HashRingTest(test_lib.GRRBaseTest):
+
+  def testKeysAreSpreadOverAllMembers(self):
+    ring = worker_affinity.HashRing(["w1", "w2", "w3"])
+    owners = [ring.GetOwners("aff4:/flows/W:%d" % i)[0] for i in range(300)]
+
+    for member in ["w1", "w2", "w3"]:
+      self.assertGreater(owners.count(member), 50)
+
+  def testAddingAMemberOnlyMovesKeysToIt(self):
+    keys = ["aff4:/flows/W:%d" % i for i in range(300)]
+    old_ring = worker_affinity.HashRing(["w1", "w2", "w3"])
+    new_ring = worker_affinity.HashRing(["w1", "w2", "w3", "w4"])
+
+    moved = 0
+    for key in keys:
+      old_owner = old_ring.GetOwners(key)[0]
+      new_owner = new_ring.GetOwners(key)[0]
+      if old_owner != new_owner:
+        self.assertEqual(new_owner, "w4")
+        moved += 1
+
+    self.assertGreater(moved, 0)
+    self.assertLess(moved, 150)
+
+  def testGetOwnersReturnsDistinctMembers(self):
+    ring = worker_affinity.HashRing(["w1", "w2", "w3"])
+
+    owners = ring.GetOwners("aff4:/flows/W:1", count=2)
+    self.assertEqual(len(owners), 2)
+    self.assertEqual(len(set(owners)), 2)
+    self.assertEqual(owners[0], ring.GetOwners("aff4:/flows/W:1")[0])
+
+    self.assertEqual(
+        sorted(ring.GetOwners("aff4:/flows/W:1", count=5)), ["w1", "w2", "w3"])
+    self.assertEqual(worker_affinity.HashRing([]).GetOwners("key"), [])
+
+
+class WorkerMembershipTest(test_lib.GRRBaseTest):
+
+  def _Membership(self, worker_id, **kwargs):
+    return worker_affinity.WorkerMembership(
+        worker_id=worker_id, lease_time=60, token=self.token, **kwargs)
+
+  def _Owners(self, memberships, session_id):
+    return [m.worker_id for m in memberships if m.IsOwner(session_id)]
+
+  def testLiveWorkersShareTheFlows(self):
+    with test_lib.FakeTime(1000):
+      w1 = self._Membership("w1")
+      w1.Refresh()
+      w2 = self._Membership("w2")
+      w2.Refresh()
+
+    with test_lib.FakeTime(1030):
+      w1.Refresh()
+
+    self.assertEqual(w1.ring.members, set(["w1", "w2"]))
+    self.assertEqual(w2.ring.members, set(["w1", "w2"]))
+
+    counts = {"w1": 0, "w2": 0}
+    for i in range(100):
+      owners = self._Owners([w1, w2], "aff4:/flows/W:%d" % i)
+      self.assertEqual(len(owners), 1)
+      counts[owners[0]] += 1
+
+    self.assertGreater(counts["w1"], 0)
+    self.assertGreater(counts["w2"], 0)
+
+  def testRefreshIsRateLimited(self):
+    with test_lib.FakeTime(1000):
+      w1 = self._Membership("w1")
+      w1.Refresh()
+      self._Membership("w2").Refresh()
+
+    with test_lib.FakeTime(1010):
+      w1.Refresh()
+    self.assertEqual(w1.ring.members, set(["w1"]))
+
+    with test_lib.FakeTime(1020):
+      w1.Refresh()
+    self.assertEqual(w1.ring.members, set(["w1", "w2"]))
+
+  def testExpiredWorkersAreRemoved(self):
+    with test_lib.FakeTime(1000):
+      w1 = self._Membership("w1")
+      w1.Refresh()
+      self._Membership("w2").Refresh()
+
+    with test_lib.FakeTime(1030):
+      w1.Refresh()
+    self.assertEqual(w1.ring.members, set(["w1", "w2"]))
+
+    # w2 stopped renewing its lease.
+    with test_lib.FakeTime(1070):
+      w1.Refresh()
+    self.assertEqual(w1.ring.members, set(["w1"]))
+
+    # The expired lease is gone from the data store.
+    with test_lib.FakeTime(1071):
+      w3 = self._Membership("w3")
+      w3.Refresh()
+    self.assertEqual(w3.ring.members, set(["w1", "w3"]))
+
+  def testLeavingWorkersAreRemovedImmediately(self):
+    with test_lib.FakeTime(1000):
+      w1 = self._Membership("w1")
+      w1.Refresh()
+      w2 = self._Membership("w2")
+      w2.Refresh()
+      w2.Leave()
+
+    with test_lib.FakeTime(1030):
+      w1.Refresh()
+    self.assertEqual(w1.ring.members, set(["w1"]))
+
+  def testOnlyWorkersOfTheSameQueuesShareTheFlows(self):
+    with test_lib.FakeTime(1000):
+      w1 = self._Membership("w1")
+      w1.Refresh()
+      debug = self._Membership(
+          "debug", queues=[rdfvalue.RDFURN("DEBUG-analyst-")])
+      debug.Refresh()
+
+    with test_lib.FakeTime(1030):
+      w1.Refresh()
+      debug.Refresh()
+
+    self.assertEqual(w1.ring.members, set(["w1"]))
+    self.assertEqual(debug.ring.members, set(["debug"]))
+    for i in range(20):
+      self.assertTrue(w1.IsOwner("aff4:/flows/W:%d" % i))
+      self.assertTrue(debug.IsOwner("aff4:/flows/W:%d" % i))
+
+  def testGroupSize(self):
+    memberships = []
+    with test_lib.FakeTime(1000):
+      for worker_id in ["w1", "w2", "w3"]:
+        memberships.append(self._Membership(worker_id, group_size=2))
+        memberships[-1].Refresh()
+
+    with test_lib.FakeTime(1030):
+      for membership in memberships:
+        membership.Refresh()
+
+    for i in range(20):
+      self.assertEqual(
+          len(self._Owners(memberships, "aff4:/flows/W:%d" % i)), 2)
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
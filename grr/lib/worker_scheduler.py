@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+"""Fair scheduling of the flows a worker processes.
+
+Notified flows are not handed to the worker's thread pool in the order they
+were fetched. They are queued per analyst, per hunt and for system flows, and
+the queues share the worker threads according to their weights. This keeps a
+big hunt from delaying the flows analysts are waiting for.
+
+The queues are served by self-clocked fair queueing: every queued flow is
+tagged with the virtual time at which it would be done if each queue got
+exactly its share, and the flow with the earliest tag runs first. On top of
+that a share of the threads is reserved for interactive flows.
+"""
+
+
+import heapq
+import itertools
+import math
+import threading
+import time
+
+from grr.lib import config_lib
+from grr.lib import data_store
+from grr.lib import flow
+from grr.lib import stats
+from grr.lib import utils
+
+# Flows started by analysts.
+INTERACTIVE = "interactive"
+
+# Flows started by hunts, the hunts themselves included.
+HUNT = "hunt"
+
+# Cron jobs and well known flows.
+SYSTEM = "system"
+
+
+class QueuedFlow(object):
+  """A notified flow waiting for a worker thread."""
+
+  def __init__(self, notification, queue_manager, flow_class, key):
+    self.notification = notification
+    self.queue_manager = queue_manager
+    self.flow_class = flow_class
+    self.key = key
+    self.queued_time = time.time()
+
+
+class FlowScheduler(object):
+  """Decides in which order notified flows are processed."""
+
+  def __init__(self,
+               dispatch,
+               capacity,
+               system_flows=(),
+               weights=None,
+               reserved_share=None,
+               token=None):
+    """Constructor.
+
+    Args:
+      dispatch: Called with a notification and its queue manager when the
+        flow should be processed. Done() has to be called once it was.
+      capacity: The number of flows processed at the same time.
+      system_flows: Names of well known flows.
+      weights: A dict with the weight of a single queue of each class.
+        Defaults to the Worker.*_flow_weight options.
+      reserved_share: The share of the capacity only interactive flows may
+        use. Defaults to Worker.interactive_reserved_share.
+      token: The token to read the creators of flows with.
+    """
+    if weights is None:
+      weights = {
+          INTERACTIVE: config_lib.CONFIG["Worker.interactive_flow_weight"],
+          HUNT: config_lib.CONFIG["Worker.hunt_flow_weight"],
+          SYSTEM: config_lib.CONFIG["Worker.system_flow_weight"]
+      }
+    if reserved_share is None:
+      reserved_share = config_lib.CONFIG["Worker.interactive_reserved_share"]
+
+    self.dispatch = dispatch
+    self.capacity = capacity
+    self.system_flows = set(system_flows)
+    self.weights = weights
+    self.token = token
+
+    # Hunts and system flows can use this many of the slots, but always at
+    # least one so they are not blocked entirely.
+    self.shared_capacity = max(
+        1, capacity - int(math.ceil(capacity * reserved_share)))
+
+    # The creators of recently queued flows.
+    self.creators = utils.TimeBasedCache(max_size=10000, max_age=3600)
+
+    self.lock = threading.Lock()
+    self.virtual_time = 0.0
+    self.last_finish = {}
+    self.sequence = itertools.count()
+
+    # Heaps of (finish tag, sequence number, QueuedFlow) tuples.
+    self.interactive_heap = []
+    self.shared_heap = []
+
+    # Queued and running flows by session id.
+    self.queued = {}
+    self.running = {}
+    self.running_shared = 0
+
+  def SetCreator(self, session_id, creator):
+    """Records who started a flow, this is not part of its session id."""
+    # Hunts have many flows and are queued by their session ids anyway.
+    flow_class, _ = self.Classify(session_id)
+    if flow_class == INTERACTIVE:
+      self.creators.Put(session_id, creator)
+
+  def Classify(self, session_id):
+    """Returns the class of a flow and the queue it goes to."""
+    namespace, name, _ = session_id.Split(3)
+    if namespace == "hunts":
+      # Hunts and all flows they started are stored below the hunt.
+      return HUNT, "hunt:%s" % name
+
+    if namespace == "cron" or session_id.FlowName() in self.system_flows:
+      return SYSTEM, SYSTEM
+
+    try:
+      creator = self.creators.Get(session_id)
+    except KeyError:
+      creator = "unknown"
+
+    return INTERACTIVE, "user:%s" % creator
+
+  def _ReadCreator(self, session_id):
+    """Reads the creator of a flow which was not seen yet from its context."""
+    try:
+      self.creators.Get(session_id)
+      return
+    except KeyError:
+      pass
+
+    context_attribute = flow.GRRFlow.SchemaCls.FLOW_CONTEXT
+    value, _ = data_store.DB.Resolve(
+        session_id, context_attribute.predicate, token=self.token)
+    if value is not None:
+      context = context_attribute.attribute_type.FromDatastoreValue(value)
+      if context.creator:
+        self.creators.Put(session_id, context.creator)
+
+  def Add(self, notification, queue_manager):
+    """Queues a notified flow.
+
+    Args:
+      notification: The GrrNotification of the flow.
+      queue_manager: The QueueManager to process the flow with.
+
+    Returns:
+      True if the flow was queued, False if it already is queued or running.
+    """
+    session_id = notification.session_id
+    # The creator is not part of the session id, so it is read from the flow
+    # before its first notification is queued.
+    if self.Classify(session_id)[0] == INTERACTIVE:
+      self._ReadCreator(session_id)
+
+    with self.lock:
+      if session_id in self.running:
+        return False
+
+      queued_flow = self.queued.get(session_id)
+      if queued_flow is not None:
+        # The flow keeps its place but is processed up to the newest
+        # notification.
+        queued_flow.notification = notification
+        queued_flow.queue_manager = queue_manager
+        return False
+
+      flow_class, key = self.Classify(session_id)
+      start = max(self.virtual_time, self.last_finish.get(key, 0))
+      finish = start + 1.0 / self.weights[flow_class]
+      self.last_finish[key] = finish
+
+      queued_flow = QueuedFlow(notification, queue_manager, flow_class, key)
+      self.queued[session_id] = queued_flow
+      if flow_class == INTERACTIVE:
+        heap = self.interactive_heap
+      else:
+        heap = self.shared_heap
+      heapq.heappush(heap, (finish, next(self.sequence), queued_flow))
+
+    self._Dispatch()
+    return True
+
+  def Done(self, session_id):
+    """Frees the slot of a processed flow and starts the next ones."""
+    with self.lock:
+      flow_class = self.running.pop(session_id, None)
+      if flow_class is not None and flow_class != INTERACTIVE:
+        self.running_shared -= 1
+
+    self._Dispatch()
+
+  def _PopNext(self):
+    heaps = []
+    if self.interactive_heap:
+      heaps.append(self.interactive_heap)
+    if self.shared_heap and self.running_shared < self.shared_capacity:
+      heaps.append(self.shared_heap)
+
+    if not heaps:
+      return None
+
+    finish, _, queued_flow = heapq.heappop(min(heaps, key=lambda h: h[0]))
+    self.virtual_time = max(self.virtual_time, finish)
+
+    # Flows queued later start from the virtual time anyway.
+    if self.last_finish.get(queued_flow.key) == finish:
+      del self.last_finish[queued_flow.key]
+
+    return queued_flow
+
+  def _Dispatch(self):
+    """Starts queued flows while there are free slots."""
+    started = []
+    with self.lock:
+      while len(self.running) < self.capacity:
+        queued_flow = self._PopNext()
+        if queued_flow is None:
+          break
+
+        session_id = queued_flow.notification.session_id
+        del self.queued[session_id]
+        self.running[session_id] = queued_flow.flow_class
+        if queued_flow.flow_class != INTERACTIVE:
+          self.running_shared += 1
+
+        started.append(queued_flow)
+
+    # The dispatch callback may block, so it is called without the lock.
+    now = time.time()
+    for queued_flow in started:
+      stats.STATS.RecordEvent(
+          "worker_flow_queueing_delay",
+          now - queued_flow.queued_time,
+          fields=[queued_flow.flow_class])
+      self.dispatch(queued_flow.notification, queued_flow.queue_manager)
+
+  def QueuedFlows(self):
+    """Returns the number of flows waiting for a slot."""
+    with self.lock:
+      return len(self.queued)
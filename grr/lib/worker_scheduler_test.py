@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""Tests for grr.lib.worker_scheduler."""
+
+
+from grr.lib import flags
+from grr.lib import flow
+from grr.lib import rdfvalue
+from grr.lib import stats
+from grr.lib import test_lib
+from grr.lib import worker_scheduler
+from grr.lib.rdfvalues import flows as rdf_flows
+
+
+class FlowSchedulerTest(test_lib.GRRBaseTest):
+
+  def setUp(self):
+    super(FlowSchedulerTest, self).setUp()
+    self.started = []
+
+  def _Scheduler(self, capacity, reserved_share=0):
+    return worker_scheduler.FlowScheduler(
+        lambda notification, _: self.started.append(notification.session_id),
+        capacity,
+        system_flows=["TransferStore"],
+        weights={
+            worker_scheduler.INTERACTIVE: 4,
+            worker_scheduler.HUNT: 1,
+            worker_scheduler.SYSTEM: 2
+        },
+        reserved_share=reserved_share,
+        token=self.token)
+
+  def _Notification(self, session_id):
+    return rdf_flows.GrrNotification(session_id=rdfvalue.SessionID(session_id))
+
+  def _HuntFlow(self, hunt, i):
+    return "aff4:/hunts/H:%d/C.1000000000000000/W:%d" % (hunt, i)
+
+  def _ClientFlow(self, i):
+    return "aff4:/C.1000000000000000/flows/W:%d" % i
+
+  def testClassify(self):
+    scheduler = self._Scheduler(1)
+    for session_id, expected in [
+        (self._HuntFlow(1, 2), (worker_scheduler.HUNT, "hunt:H:1")),
+        ("aff4:/hunts/H:1", (worker_scheduler.HUNT, "hunt:H:1")),
+        ("aff4:/cron/OSBreakDown/W:1", (worker_scheduler.SYSTEM,
+                                        worker_scheduler.SYSTEM)),
+        ("aff4:/flows/W:TransferStore", (worker_scheduler.SYSTEM,
+                                         worker_scheduler.SYSTEM)),
+        (self._ClientFlow(1), (worker_scheduler.INTERACTIVE, "user:unknown"))
+    ]:
+      self.assertEqual(
+          scheduler.Classify(rdfvalue.SessionID(session_id)), expected)
+
+    scheduler.SetCreator(rdfvalue.SessionID(self._ClientFlow(1)), "analyst")
+    self.assertEqual(
+        scheduler.Classify(rdfvalue.SessionID(self._ClientFlow(1))),
+        (worker_scheduler.INTERACTIVE, "user:analyst"))
+
+  def testCreatorIsReadFromTheFlowWhenItIsQueued(self):
+    client_id = self.SetupClients(1)[0]
+    session_id = flow.GRRFlow.StartFlow(
+        client_id=client_id,
+        flow_name=test_lib.FlowOrderTest.__name__,
+        token=self.token)
+
+    scheduler = self._Scheduler(1)
+    scheduler.Add(rdf_flows.GrrNotification(session_id=session_id), None)
+    self.assertEqual(
+        scheduler.Classify(session_id),
+        (worker_scheduler.INTERACTIVE, "user:%s" % self.token.username))
+
+  def testHuntsCanNotUseReservedCapacity(self):
+    scheduler = self._Scheduler(4, reserved_share=0.25)
+    for i in range(100):
+      scheduler.Add(self._Notification(self._HuntFlow(1, i)), None)
+
+    self.assertEqual(len(self.started), 3)
+
+    # The interactive flow starts right away.
+    scheduler.Add(self._Notification(self._ClientFlow(1)), None)
+    self.assertEqual(len(self.started), 4)
+    self.assertEqual(self.started[-1], self._ClientFlow(1))
+
+    # Another hunt flow only starts when a hunt flow is done.
+    scheduler.Done(self.started[-1])
+    self.assertEqual(len(self.started), 4)
+    scheduler.Done(self.started[0])
+    self.assertEqual(len(self.started), 5)
+    self.assertEqual(self.started[-1], self._HuntFlow(1, 3))
+
+  def testQueuesShareCapacityByWeight(self):
+    scheduler = self._Scheduler(1)
+    # Keeps the only slot busy until all flows are queued.
+    scheduler.Add(self._Notification(self._ClientFlow(1000)), None)
+
+    for i in range(30):
+      scheduler.Add(self._Notification(self._HuntFlow(1, i)), None)
+      scheduler.Add(self._Notification(self._HuntFlow(2, i)), None)
+      scheduler.Add(self._Notification(self._ClientFlow(i)), None)
+
+    for _ in range(30):
+      scheduler.Done(self.started[-1])
+
+    classes = [
+        scheduler.Classify(rdfvalue.SessionID(session_id))[1]
+        for session_id in self.started[1:]
+    ]
+    self.assertEqual(classes.count("user:unknown"), 20)
+    self.assertEqual(classes.count("hunt:H:1"), 5)
+    self.assertEqual(classes.count("hunt:H:2"), 5)
+
+  def testLateInteractiveFlowsGoFirst(self):
+    scheduler = self._Scheduler(1)
+    for i in range(50):
+      scheduler.Add(self._Notification(self._HuntFlow(1, i)), None)
+
+    scheduler.SetCreator(rdfvalue.SessionID(self._ClientFlow(1)), "analyst")
+    scheduler.Add(self._Notification(self._ClientFlow(1)), None)
+
+    scheduler.Done(self.started[-1])
+    self.assertEqual(self.started[-1], self._ClientFlow(1))
+
+  def testFlowsAreOnlyQueuedOnce(self):
+    scheduler = self._Scheduler(1)
+    self.assertTrue(
+        scheduler.Add(self._Notification(self._ClientFlow(1)), None))
+    self.assertTrue(
+        scheduler.Add(self._Notification(self._ClientFlow(2)), None))
+
+    # Running and queued flows are not queued again.
+    self.assertFalse(
+        scheduler.Add(self._Notification(self._ClientFlow(1)), None))
+    self.assertFalse(
+        scheduler.Add(self._Notification(self._ClientFlow(2)), None))
+    self.assertEqual(scheduler.QueuedFlows(), 1)
+
+    scheduler.Done(self._ClientFlow(1))
+    scheduler.Done(self._ClientFlow(2))
+    self.assertEqual(self.started, [self._ClientFlow(1), self._ClientFlow(2)])
+    self.assertEqual(scheduler.QueuedFlows(), 0)
+
+  def testQueueingDelayIsRecordedPerClass(self):
+    before = stats.STATS.GetMetricValue(
+        "worker_flow_queueing_delay", fields=[worker_scheduler.HUNT]).count
+
+    scheduler = self._Scheduler(1)
+    with test_lib.FakeTime(100):
+      scheduler.Add(self._Notification(self._HuntFlow(1, 1)), None)
+      scheduler.Add(self._Notification(self._HuntFlow(1, 2)), None)
+
+    with test_lib.FakeTime(105):
+      scheduler.Done(self._HuntFlow(1, 1))
+
+    metric = stats.STATS.GetMetricValue(
+        "worker_flow_queueing_delay", fields=[worker_scheduler.HUNT])
+    self.assertEqual(metric.count, before + 2)
+    self.assertEqual(metric.bins_heights[5], 1)
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
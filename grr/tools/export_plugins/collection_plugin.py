@@ -45,6 +45,20 @@ class CollectionExportPlugin(plugin.OutputPluginBasedExportPlugin):
         help="Flush the results every time after processing "
         "this number of values.")
 
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        default=False,
+        help="Only export results added since the last incremental export "
+        "of this collection with the same output plugin.")
+
+    parser.add_argument(
+        "--max_output_size",
+        type=int,
+        default=0,
+        help="Start new output streams once the output grew larger than this "
+        "number of bytes. The size is checked at every checkpoint.")
+
     parser.add_argument(
         "--no_legacy_warning_pause",
         action="store_true",
@@ -62,6 +76,21 @@ class CollectionExportPlugin(plugin.OutputPluginBasedExportPlugin):
     return results.HuntResultCollection(
         args.path, token=data_store.default_token)
 
+  def GetNewValuesForExport(self, args, cursor):
+    collection = results.HuntResultCollection(
+        args.path, token=data_store.default_token)
+
+    # Results written very recently are left to the next run, since a late
+    # write could still add results before them.
+    max_timestamp = (rdfvalue.RDFDatetime.Now() - collection.INDEX_WRITE_DELAY
+                    ).AsMicroSecondsFromEpoch()
+    for value_cursor, value in collection.Scan(
+        after_timestamp=cursor, include_suffix=True):
+      if value_cursor[0] > max_timestamp:
+        break
+
+      yield value_cursor, value
+
   def Run(self, args):
     base_url = config_lib.CONFIG.Get("AdminUI.url", context=["AdminUI Context"])
 
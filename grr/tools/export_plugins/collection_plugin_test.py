@@ -15,6 +15,7 @@ from grr.lib import rdfvalue
 from grr.lib import test_lib
 from grr.lib import utils
 from grr.lib.hunts import results
+from grr.lib.output_plugins import csv_plugin
 from grr.lib.output_plugins import email_plugin
 from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import flows as rdf_flows
@@ -88,6 +89,80 @@ class CollectionExportPluginTest(test_lib.GRRBaseTest):
           "GRR got a new result in aff4:/testcoll" in msg["message"])
       self.assertTrue("(Host-0)" in msg["message"])
 
+  def _AddResults(self, collection_urn, count):
+    fd = results.HuntResultCollection(collection_urn, token=self.token)
+    for i in range(count):
+      fd.Add(
+          rdf_flows.GrrMessage(
+              payload=rdf_client.StatEntry(pathspec=rdf_paths.PathSpec(
+                  path="testfile%d" % i, pathtype="OS")),
+              source=self.client_id))
+
+  def _RunIncrementalExport(self, plugin, *extra_args):
+    parser = argparse.ArgumentParser()
+    plugin.ConfigureArgParser(parser)
+
+    exported = []
+
+    def ProcessResponses(_, responses):
+      exported.extend(
+          utils.SmartUnicode(response.payload.pathspec.path)
+          for response in responses)
+
+    with utils.Stubber(csv_plugin.CSVOutputPlugin, "ProcessResponses",
+                       ProcessResponses):
+      plugin.Run(
+          parser.parse_args(args=[
+              "--no_legacy_warning_pause", "--incremental", "--path",
+              "aff4:/testcoll"
+          ] + list(extra_args) + [csv_plugin.CSVOutputPlugin.name]))
+
+    return sorted(exported)
+
+  def testIncrementalExportOnlyExportsNewResults(self):
+    plugin = collection_plugin.CollectionExportPlugin()
+
+    with test_lib.FakeTime(100):
+      self._AddResults("aff4:/testcoll", 2)
+
+    with test_lib.FakeTime(1000):
+      self.assertEqual(
+          self._RunIncrementalExport(plugin), ["testfile0", "testfile1"])
+      self.assertEqual(self._RunIncrementalExport(plugin), [])
+
+      # Results which are too recent are left to the next run.
+      self._AddResults("aff4:/testcoll", 1)
+      self.assertEqual(self._RunIncrementalExport(plugin), [])
+
+    with test_lib.FakeTime(2000):
+      self.assertEqual(self._RunIncrementalExport(plugin), ["testfile0"])
+
+    cursor = plugin.ReadCursor("aff4:/testcoll",
+                               csv_plugin.CSVOutputPlugin.name)
+    self.assertEqual(cursor[0], 1000 * 1000000)
+    self.assertIsNone(plugin.ReadCursor("aff4:/testcoll", "email"))
+
+  def testIncrementalExportRotatesOutput(self):
+    plugin = collection_plugin.CollectionExportPlugin()
+    with test_lib.FakeTime(100):
+      self._AddResults("aff4:/testcoll", 3)
+
+    parser = argparse.ArgumentParser()
+    plugin.ConfigureArgParser(parser)
+    with test_lib.FakeTime(1000):
+      plugin.Run(
+          parser.parse_args(args=[
+              "--no_legacy_warning_pause", "--incremental", "--path",
+              "aff4:/testcoll", "--checkpoint_every", "1", "--max_output_size",
+              "1", csv_plugin.CSVOutputPlugin.name
+          ]))
+
+    # Every checkpoint writes more than a byte, so the output is rotated after
+    # each of them.
+    self.assertEqual(plugin.output_parts, 3)
+    self.assertIsNotNone(
+        plugin.ReadCursor("aff4:/testcoll", csv_plugin.CSVOutputPlugin.name))
+
 
 def main(argv):
   test_lib.main(argv)
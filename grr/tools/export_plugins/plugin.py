@@ -73,7 +73,22 @@ class OutputPluginBatchConverter(threadpool.BatchConverter):
 
 
 class OutputPluginBasedExportPlugin(ExportPlugin):
-  """Base class for ExportPlugins that use OutputPlugins."""
+  """Base class for ExportPlugins that use OutputPlugins.
+
+  In incremental mode (--incremental) only values added since the last
+  incremental export of the same source with the same output plugin are
+  exported. The position of the last exported value is stored as a cursor in
+  the data store after every checkpoint, so an interrupted export is resumed
+  by the next run.
+  """
+
+  # Cursors of incremental exports are stored on a subject per exported source
+  # with an attribute per output plugin.
+  CURSORS_ROOT = rdfvalue.RDFURN("aff4:/export/cursors")
+  CURSOR_PREFIX = "export:cursor:"
+
+  # The number of times the output was rotated to new output streams.
+  output_parts = 0
 
   def _ConfigureArgParserForRdfValue(self, parser, value_class):
     """Configures arguments parser with fields of the rdf value class.
@@ -134,7 +149,7 @@ class OutputPluginBasedExportPlugin(ExportPlugin):
 
     raise KeyError(plugin_name)
 
-  def _CreateOutputPluginFromArgs(self, collection_urn, args):
+  def _CreateOutputPluginFromArgs(self, collection_urn, args, part=0):
     """Creates OutputPlugin using given args as constructor arguments.
 
     If OutputPlugin args has "export_options" attribute, we add
@@ -144,6 +159,8 @@ class OutputPluginBasedExportPlugin(ExportPlugin):
       collection_urn: Urn of the collection with the values to process.
       args: argparse.Namespace-compatible object with parsed command
             line arguments.
+      part: Number of the output part, greater than 0 if the output of the
+            export was rotated.
     Returns:
       OutputPlugin instance.
     """
@@ -159,27 +176,102 @@ class OutputPluginBasedExportPlugin(ExportPlugin):
     else:
       output_plugin_args = None
 
+    output_base_urn = "aff4:/export/%s" % time.time()
+    if part:
+      output_base_urn += "_%d" % part
+
     return output_plugin_class(
         source_urn=collection_urn,
-        output_base_urn=rdfvalue.RDFURN("aff4:/export/%s" % time.time()),
+        output_base_urn=rdfvalue.RDFURN(output_base_urn),
         args=output_plugin_args,
         token=data_store.default_token)
 
+  def _GetOutputSize(self, output_plugin):
+    """Returns the number of bytes written to the plugin's output streams."""
+    streams = getattr(output_plugin, "stream_objects", {})
+    return sum(stream.size for stream in streams.itervalues())
+
+  def _ProcessCheckpoint(self, index, values, output_plugin, args):
+    """Processes a checkpoint worth of values and flushes the output plugin.
+
+    Args:
+      index: The number of the checkpoint.
+      values: The values to process.
+      output_plugin: The OutputPlugin to process the values with.
+      args: argparse.Namespace-compatible object with parsed command
+            line arguments.
+
+    Returns:
+      The OutputPlugin to process the next checkpoint with. This is a new
+      plugin writing to new output streams if the output of the given one
+      grew larger than --max_output_size.
+    """
+    logging.info("Starting checkpoint %d.", index)
+    batch_converter = OutputPluginBatchConverter(
+        batch_size=args.batch,
+        threadpool_size=args.threads,
+        output_plugin=output_plugin)
+    batch_converter.Convert(values)
+
+    logging.info("Checkpointing (checkpoint %d)...", index)
+    output_plugin.Flush()
+    logging.info("Checkpoint %d done.", index)
+
+    max_output_size = getattr(args, "max_output_size", 0)
+    if (max_output_size and
+        self._GetOutputSize(output_plugin) >= max_output_size):
+      self.output_parts += 1
+      output_plugin = self._CreateOutputPluginFromArgs(
+          output_plugin.state.source_urn, args, part=self.output_parts)
+      logging.info("Rotating output to %s.",
+                   output_plugin.state.output_base_urn)
+
+    return output_plugin
+
   def _ProcessValuesWithOutputPlugin(self, values, output_plugin, args):
     """Processes given values with given output plugin."""
 
     checkpoints = utils.Grouper(values, args.checkpoint_every)
     for index, checkpoint in enumerate(checkpoints):
-      logging.info("Starting checkpoint %d.", index)
-      batch_converter = OutputPluginBatchConverter(
-          batch_size=args.batch,
-          threadpool_size=args.threads,
-          output_plugin=output_plugin)
-      batch_converter.Convert(checkpoint)
+      output_plugin = self._ProcessCheckpoint(index, checkpoint, output_plugin,
+                                              args)
+
+  def _CursorURN(self, source_urn):
+    return self.CURSORS_ROOT.Add(rdfvalue.RDFURN(source_urn).Path())
 
-      logging.info("Checkpointing (checkpoint %d)...", index)
-      output_plugin.Flush()
-      logging.info("Checkpoint %d done.", index)
+  def ReadCursor(self, source_urn, plugin_name):
+    """Returns the cursor of the last incremental export or None."""
+    value, _ = data_store.DB.Resolve(
+        self._CursorURN(source_urn),
+        self.CURSOR_PREFIX + plugin_name,
+        token=data_store.default_token)
+    if not value:
+      return None
+
+    timestamp, suffix = utils.SmartStr(value).split(":")
+    return int(timestamp), int(suffix)
+
+  def WriteCursor(self, source_urn, plugin_name, cursor):
+    """Stores the cursor of the last exported value."""
+    data_store.DB.Set(
+        self._CursorURN(source_urn),
+        self.CURSOR_PREFIX + plugin_name,
+        "%d:%d" % cursor,
+        token=data_store.default_token)
+
+  def _ProcessNewValuesWithOutputPlugin(self, output_plugin, args):
+    """Processes values added since the last incremental export."""
+    source_urn = self.GetValuesSourceURN(args)
+    cursor = self.ReadCursor(source_urn, args.plugin)
+    if cursor:
+      logging.info("Resuming export after %d:%d.", *cursor)
+
+    checkpoints = utils.Grouper(
+        self.GetNewValuesForExport(args, cursor), args.checkpoint_every)
+    for index, checkpoint in enumerate(checkpoints):
+      output_plugin = self._ProcessCheckpoint(
+          index, [value for _, value in checkpoint], output_plugin, args)
+      self.WriteCursor(source_urn, args.plugin, checkpoint[-1][0])
 
   def GetValuesSourceURN(self, args):
     """Returns URN describing where exported values are coming from."""
@@ -191,6 +283,22 @@ class OutputPluginBasedExportPlugin(ExportPlugin):
     _ = args
     raise NotImplementedError()
 
+  def GetNewValuesForExport(self, args, cursor):
+    """Returns values added after the given cursor.
+
+    Args:
+      args: argparse.Namespace-compatible object with parsed command
+            line arguments.
+      cursor: The cursor of the last exported value or None if nothing was
+            exported yet.
+
+    Returns:
+      An iterable of (cursor, value) pairs in the order the values were
+      added. Cursors are (timestamp, suffix) tuples.
+    """
+    _ = args, cursor
+    raise NotImplementedError()
+
   def ConfigureArgParser(self, parser):
     """Configures args parser based on plugin's args RDFValue."""
 
@@ -214,5 +322,8 @@ class OutputPluginBasedExportPlugin(ExportPlugin):
     logging.info("Initialized plugin '%s' with the state:", output_plugin.name)
     logging.info(utils.SmartUnicode(output_plugin.state))
 
-    collection = self.GetValuesForExport(args)
-    self._ProcessValuesWithOutputPlugin(collection, output_plugin, args)
+    if getattr(args, "incremental", False):
+      self._ProcessNewValuesWithOutputPlugin(output_plugin, args)
+    else:
+      collection = self.GetValuesForExport(args)
+      self._ProcessValuesWithOutputPlugin(collection, output_plugin, args)
@@ -0,0 +1,469 @@
+#!/usr/bin/env python
+"""End to end load benchmark of the frontend and the workers.
+
+This starts an HTTP frontend and workers in this process, using the data store
+configured by Datastore.implementation. It then drives a pool of simulated
+clients (see poolclient.py) through a number of workloads. Each workload
+measures the full path:
+
+client poll -> frontend -> queues -> worker -> flow completion
+
+For every workload this reports the throughput, latency percentiles and the
+number of data store operations. Example:
+
+python grr/tools/frontend_benchmark.py --config grr-server.yaml \
+  -p Datastore.implementation=SqliteDataStore --nrclients 50 \
+  --workloads enrollment,Interrogate,ListDirectory,hunt,file_transfer
+"""
+
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+
+# pylint: disable=unused-import,g-bad-import-order
+from grr.lib import server_plugins
+# pylint: enable=unused-import,g-bad-import-order
+
+import logging
+
+from grr.client import poolclient
+from grr.lib import aff4
+from grr.lib import config_lib
+from grr.lib import data_store
+from grr.lib import flags
+from grr.lib import flow
+from grr.lib import hunts
+from grr.lib import server_startup
+from grr.lib import worker
+from grr.lib.rdfvalues import crypto as rdf_crypto
+from grr.lib.rdfvalues import flows as rdf_flows
+from grr.lib.rdfvalues import paths as rdf_paths
+from grr.tools import http_server
+
+# The nrclients flag is defined by the poolclient.
+flags.DEFINE_list("workloads", ["enrollment", "Interrogate", "ListDirectory",
+                                "hunt", "file_transfer"],
+                  "The workloads to run, in this order. Enrollment always "
+                  "runs first.")
+
+flags.DEFINE_integer("workers", 1, "Number of worker threads to run.")
+
+flags.DEFINE_integer("workload_timeout", 600,
+                     "Maximum number of seconds a single workload may run.")
+
+flags.DEFINE_integer("transfer_size", 1024 * 1024,
+                     "Size of the file transferred by the file_transfer "
+                     "workload.")
+
+flags.DEFINE_float("benchmark_poll_max", 1,
+                   "Maximum number of seconds the simulated clients wait "
+                   "between polls.")
+
+
+class Error(Exception):
+  pass
+
+
+class WorkloadTimeoutError(Error):
+  """Raised when a workload did not finish in time."""
+
+
+class DataStoreOperationCounter(object):
+  """Counts the calls to the data store.
+
+  Only the outermost call is counted, e.g. a Set() implemented in terms of
+  MultiSet() counts as a single operation.
+  """
+
+  OPERATIONS = [
+      "DBSubjectLock", "DeleteAttributes", "DeleteSubject", "DeleteSubjects",
+      "MultiDeleteAttributes", "MultiResolvePrefix", "MultiSet", "ReadBlob",
+      "ReadBlobs", "Resolve", "ResolveMulti", "ResolvePrefix", "ResolveRow",
+      "ScanAttribute", "ScanAttributes", "Set", "StoreBlob", "StoreBlobs"
+  ]
+
+  def __init__(self, store=None):
+    self.store = store or data_store.DB
+    self.lock = threading.Lock()
+    self.counts = dict.fromkeys(self.OPERATIONS, 0)
+    self._local = threading.local()
+
+  def _Wrap(self, name, method):
+
+    def Counted(*args, **kwargs):
+      depth = getattr(self._local, "depth", 0)
+      if not depth:
+        with self.lock:
+          self.counts[name] += 1
+
+      self._local.depth = depth + 1
+      try:
+        return method(*args, **kwargs)
+      finally:
+        self._local.depth = depth
+
+    return Counted
+
+  def Start(self):
+    for name in self.OPERATIONS:
+      setattr(self.store, name, self._Wrap(name, getattr(self.store, name)))
+
+  def Stop(self):
+    for name in self.OPERATIONS:
+      # This removes the instance attribute, revealing the original method.
+      delattr(self.store, name)
+
+  def Snapshot(self):
+    with self.lock:
+      return dict(self.counts)
+
+
+class WorkloadResult(object):
+  """The measurements of a single workload."""
+
+  def __init__(self, name):
+    self.name = name
+    self.latencies = []
+    self.timeouts = 0
+    self.operations = {}
+    self.start_time = None
+    self.end_time = None
+
+  @property
+  def duration(self):
+    return (self.end_time or time.time()) - self.start_time
+
+  @property
+  def throughput(self):
+    """Completed work items per second."""
+    if not self.duration:
+      return 0
+    return len(self.latencies) / self.duration
+
+  def Percentile(self, percentile):
+    if not self.latencies:
+      return 0
+
+    latencies = sorted(self.latencies)
+    index = int(round(percentile / 100.0 * (len(latencies) - 1)))
+    return latencies[index]
+
+  @property
+  def total_operations(self):
+    return sum(self.operations.itervalues())
+
+  def Summary(self):
+    """Returns a one line summary of the results."""
+    return ("%-15s %6d done %4d timeouts %8.2fs %8.2f/s "
+            "p50 %7.3fs p90 %7.3fs p99 %7.3fs %8d ops" %
+            (self.name, len(self.latencies), self.timeouts, self.duration,
+             self.throughput, self.Percentile(50), self.Percentile(90),
+             self.Percentile(99), self.total_operations))
+
+
+class FrontendBenchmark(object):
+  """Runs workloads against an in process frontend and workers."""
+
+  # How often the completion of the workloads is checked.
+  CHECK_INTERVAL = 0.2
+
+  def __init__(self,
+               nrclients,
+               workers=1,
+               workload_timeout=600,
+               transfer_size=1024 * 1024,
+               poll_max=1,
+               token=None):
+    """Constructor.
+
+    Args:
+      nrclients: The number of simulated clients.
+      workers: The number of worker threads.
+      workload_timeout: Maximum number of seconds a single workload may run.
+      transfer_size: Size of the file used by the file_transfer workload.
+      poll_max: Maximum time the clients wait between polls.
+      token: The token to start flows and hunts with.
+    """
+    self.nrclients = nrclients
+    self.workers = workers
+    self.workload_timeout = workload_timeout
+    self.transfer_size = transfer_size
+    self.poll_max = poll_max
+    self.token = token or aff4.FACTORY.root_token
+
+    self.httpd = None
+    self.base_url = None
+    self.clients = []
+    self.client_ids = []
+    self.results = []
+    self.operation_counter = DataStoreOperationCounter()
+
+    self._threads = []
+    self._stop = threading.Event()
+    self.temp_dir = None
+
+  def Start(self):
+    """Starts the frontend and the workers."""
+    self.temp_dir = tempfile.mkdtemp(prefix="grr_benchmark")
+
+    self.httpd = http_server.GRRHTTPServer(
+        ("127.0.0.1", 0), http_server.GRRHTTPServerHandler)
+    self.base_url = "http://127.0.0.1:%d/" % self.httpd.socket.getsockname()[1]
+    self._StartThread(self.httpd.serve_forever, "BenchmarkFrontend")
+
+    for i in range(self.workers):
+      worker_obj = worker.GRRWorker(token=self.token)
+      self._StartThread(self._RunWorker, "BenchmarkWorker%d" % i, worker_obj)
+
+    self.operation_counter.Start()
+
+  def Stop(self):
+    """Stops all clients, workers and the frontend."""
+    self._stop.set()
+    for client in self.clients:
+      client.Stop()
+
+    if self.httpd:
+      self.httpd.shutdown()
+
+    for thread in self._threads:
+      thread.join()
+
+    self.operation_counter.Stop()
+    if self.temp_dir:
+      shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+  def _StartThread(self, target, name, *args):
+    thread = threading.Thread(target=target, name=name, args=args)
+    thread.daemon = True
+    thread.start()
+    self._threads.append(thread)
+
+  def _RunWorker(self, worker_obj):
+    while not self._stop.is_set():
+      try:
+        processed = worker_obj.RunOnce()
+      except Exception as e:  # pylint: disable=broad-except
+        logging.exception("Benchmark worker failed: %s", e)
+        processed = 0
+
+      if not processed:
+        self._stop.wait(self.CHECK_INTERVAL)
+
+  def _CreateClient(self):
+    """Creates a simulated client talking to our frontend."""
+    key = rdf_crypto.RSAPrivateKey.GenerateKey(
+        bits=config_lib.CONFIG["Client.rsa_key_length"])
+
+    client = poolclient.PoolGRRClient(
+        private_key=key,
+        ca_cert=config_lib.CONFIG["CA.certificate"],
+        fast_poll=True)
+
+    # Talk to our frontend directly.
+    for http_manager in (client.client.http_manager,
+                         client.client.client_worker.http_manager):
+      http_manager.base_urls = [self.base_url]
+      http_manager.proxies = [""]
+
+    client.client.timer.poll_max = self.poll_max
+    return client
+
+  def _RunWorkload(self, name, start_cb, done_cb):
+    """Runs a workload.
+
+    Args:
+      name: The name of the workload.
+      start_cb: Called with no arguments to start the work. Returns a dict
+        mapping work items to the time they were started.
+      done_cb: Called with the list of pending work items, returns the ones
+        which are done.
+
+    Returns:
+      The WorkloadResult.
+    """
+    result = WorkloadResult(name)
+    operations_before = self.operation_counter.Snapshot()
+    result.start_time = time.time()
+
+    pending = start_cb()
+    deadline = result.start_time + self.workload_timeout
+    while pending and time.time() < deadline:
+      time.sleep(self.CHECK_INTERVAL)
+      now = time.time()
+      for item in done_cb(list(pending)):
+        result.latencies.append(now - pending.pop(item))
+
+    result.timeouts = len(pending)
+    result.end_time = time.time()
+
+    operations_after = self.operation_counter.Snapshot()
+    result.operations = dict((op, operations_after[op] - operations_before[op])
+                             for op in operations_after
+                             if operations_after[op] != operations_before[op])
+
+    logging.info("Workload %s", result.Summary())
+    self.results.append(result)
+    return result
+
+  def RunEnrollment(self):
+    """Creates the clients and waits for them to enroll."""
+
+    def Start():
+      pending = {}
+      for _ in range(self.nrclients - len(self.clients)):
+        client = self._CreateClient()
+        self.clients.append(client)
+        pending[client] = time.time()
+        client.start()
+      return pending
+
+    def Done(clients):
+      return [client for client in clients if client.enrolled]
+
+    result = self._RunWorkload("enrollment", Start, Done)
+    self.client_ids = [
+        client.client.communicator.common_name
+        for client in self.clients
+        if client.enrolled
+    ]
+    return result
+
+  def _IsFlowDone(self, session_ids):
+    done = []
+    for flow_obj in aff4.FACTORY.MultiOpen(session_ids, token=self.token):
+      if not flow_obj.GetRunner().IsRunning():
+        done.append(flow_obj.urn)
+    return done
+
+  def RunFlow(self, flow_name, workload_name=None, **kwargs):
+    """Runs the flow on every client and waits for all of them to finish."""
+
+    def Start():
+      pending = {}
+      for client_id in self.client_ids:
+        session_id = flow.GRRFlow.StartFlow(
+            client_id=client_id, flow_name=flow_name, token=self.token,
+            **kwargs)
+        pending[session_id] = time.time()
+      return pending
+
+    return self._RunWorkload(workload_name or flow_name, Start,
+                             self._IsFlowDone)
+
+  def RunListDirectory(self):
+    directory = os.path.join(self.temp_dir, "listing")
+    if not os.path.exists(directory):
+      os.mkdir(directory)
+      for i in range(100):
+        with open(os.path.join(directory, "file%d" % i), "wb") as fd:
+          fd.write("file %d" % i)
+
+    return self.RunFlow(
+        "ListDirectory",
+        pathspec=rdf_paths.PathSpec(
+            path=directory, pathtype=rdf_paths.PathSpec.PathType.OS))
+
+  def RunFileTransfer(self):
+    filename = os.path.join(self.temp_dir, "transfer")
+    with open(filename, "wb") as fd:
+      fd.write(os.urandom(self.transfer_size))
+
+    return self.RunFlow(
+        "GetFile",
+        workload_name="file_transfer",
+        pathspec=rdf_paths.PathSpec(
+            path=filename, pathtype=rdf_paths.PathSpec.PathType.OS))
+
+  def RunHunt(self):
+    """Runs a small hunt on all clients."""
+    hunt_urn = []
+
+    def Start():
+      with hunts.GRRHunt.StartHunt(
+          hunt_name="GenericHunt",
+          flow_runner_args=rdf_flows.FlowRunnerArgs(flow_name="ListDirectory"),
+          flow_args=rdf_paths.PathSpec(
+              path=self.temp_dir, pathtype=rdf_paths.PathSpec.PathType.OS),
+          client_rate=0,
+          token=self.token) as hunt:
+        hunt.Run()
+      hunt_urn.append(hunt.urn)
+
+      # Schedule the clients directly, the same way the foreman would.
+      hunts.GRRHunt.StartClients(hunt.urn, self.client_ids, token=self.token)
+      now = time.time()
+      return dict((client_id, now) for client_id in self.client_ids)
+
+    def Done(client_ids):
+      hunt = aff4.FACTORY.Open(hunt_urn[0], token=self.token)
+      completed = hunt.GetCompletedClients()
+      return [client_id for client_id in client_ids if client_id in completed]
+
+    return self._RunWorkload("hunt", Start, Done)
+
+  def Run(self, workloads):
+    """Runs the named workloads and returns their results."""
+    runners = {
+        "enrollment": self.RunEnrollment,
+        "Interrogate": lambda: self.RunFlow("Interrogate"),
+        "ListDirectory": self.RunListDirectory,
+        "hunt": self.RunHunt,
+        "file_transfer": self.RunFileTransfer,
+    }
+
+    for workload in workloads:
+      if workload not in runners:
+        raise ValueError("Unknown workload %s, known workloads are %s" %
+                         (workload, ", ".join(sorted(runners))))
+
+    # All other workloads need enrolled clients.
+    workloads = ["enrollment"] + [w for w in workloads if w != "enrollment"]
+    for workload in workloads:
+      result = runners[workload]()
+      if workload == "enrollment" and not self.client_ids:
+        raise WorkloadTimeoutError("No client enrolled in %d seconds." %
+                                   self.workload_timeout)
+
+      if result.timeouts:
+        logging.warning("%d work items of %s did not finish in time.",
+                        result.timeouts, workload)
+
+    return self.results
+
+  def Report(self):
+    """Returns the results as printable text."""
+    lines = []
+    for result in self.results:
+      lines.append(result.Summary())
+      for op, count in sorted(result.operations.iteritems()):
+        lines.append("    %-25s %d" % (op, count))
+
+    return "\n".join(lines)
+
+
+def main(unused_argv):
+  """Main."""
+  server_startup.Init()
+
+  benchmark = FrontendBenchmark(
+      flags.FLAGS.nrclients,
+      workers=flags.FLAGS.workers,
+      workload_timeout=flags.FLAGS.workload_timeout,
+      transfer_size=flags.FLAGS.transfer_size,
+      poll_max=flags.FLAGS.benchmark_poll_max)
+  benchmark.Start()
+  try:
+    benchmark.Run(flags.FLAGS.workloads)
+  finally:
+    benchmark.Stop()
+
+  print benchmark.Report()
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
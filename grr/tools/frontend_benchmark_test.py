@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""Tests for the end to end frontend benchmark."""
+
+
+from grr.lib import aff4
+from grr.lib import flags
+from grr.lib import front_end
+from grr.lib import test_lib
+from grr.lib.aff4_objects import aff4_grr
+from grr.tools import frontend_benchmark
+
+
+class FrontendBenchmarkTest(test_lib.GRRBaseTest):
+  """Runs the benchmark with a few clients."""
+
+  @classmethod
+  def setUpClass(cls):
+    super(FrontendBenchmarkTest, cls).setUpClass()
+    # Frontend must be initialized to register all the stats counters.
+    front_end.FrontendInit().RunOnce()
+
+  def setUp(self):
+    super(FrontendBenchmarkTest, self).setUp()
+    # The clients store the server serial number in the config.
+    self.config_stubber = test_lib.PreserveConfig()
+    self.config_stubber.Start()
+
+  def tearDown(self):
+    self.config_stubber.Stop()
+    super(FrontendBenchmarkTest, self).tearDown()
+
+  def testEnrollmentAndListDirectory(self):
+    benchmark = frontend_benchmark.FrontendBenchmark(
+        2, workload_timeout=60, poll_max=0.5, token=self.token)
+    benchmark.Start()
+    try:
+      enrollment, list_directory = benchmark.Run(["ListDirectory"])
+    finally:
+      benchmark.Stop()
+
+    self.assertEqual(enrollment.name, "enrollment")
+    self.assertEqual(len(enrollment.latencies), 2)
+    self.assertEqual(enrollment.timeouts, 0)
+    for client_id in benchmark.client_ids:
+      client = aff4.FACTORY.Open(client_id, token=self.token)
+      self.assertTrue(isinstance(client, aff4_grr.VFSGRRClient))
+      self.assertTrue(client.Get(client.Schema.CERT))
+
+    self.assertEqual(list_directory.name, "ListDirectory")
+    self.assertEqual(len(list_directory.latencies), 2)
+    self.assertEqual(list_directory.timeouts, 0)
+    self.assertGreater(list_directory.throughput, 0)
+    self.assertGreater(list_directory.operations["MultiSet"], 0)
+    self.assertGreaterEqual(
+        list_directory.Percentile(99), list_directory.Percentile(50))
+
+    report = benchmark.Report()
+    self.assertIn("enrollment", report)
+    self.assertIn("ListDirectory", report)
+
+  def testResultPercentiles(self):
+    result = frontend_benchmark.WorkloadResult("test")
+    result.latencies = range(1, 101)
+    self.assertEqual(result.Percentile(50), 51)
+    self.assertEqual(result.Percentile(90), 90)
+    self.assertEqual(result.Percentile(99), 99)
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
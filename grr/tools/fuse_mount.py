@@ -4,8 +4,10 @@
 import datetime
 import errno
 import getpass
+import itertools
 import stat
 import sys
+import threading
 
 
 # pylint: disable=unused-import,g-bad-import-order
@@ -79,6 +81,21 @@ flags.DEFINE_integer("sparse_image_threshold", 1024 * 1024 * 1024,
                      "If a client side file that's not in the datastore yet"
                      " is >= than this size, then store it as a sparse image.")
 
+flags.DEFINE_integer("handle_cache_size", 1024,
+                     "How many open AFF4 objects to keep per mount.")
+
+flags.DEFINE_integer("handle_cache_max_age", 60,
+                     "Measured in seconds. How long an open AFF4 object is"
+                     " reused before it is reopened from the data store.")
+
+flags.DEFINE_integer("chunk_cache_size", 1024,
+                     "How many decoded file chunks to keep in memory per"
+                     " mount.")
+
+flags.DEFINE_integer("read_ahead_chunks", 8,
+                     "How many chunks to prefetch when a file is being read"
+                     " sequentially.")
+
 flags.DEFINE_string("username", None,
                     "Username to use for client authorization check.")
 
@@ -92,6 +109,199 @@ _DEFAULT_MODE_FILE = 33188
 # Taken from /etc/passwd
 _DEFAULT_MODE_DIRECTORY = 16877
 
+# Objects that are not stored in chunks (e.g. memory streams) are cached in
+# chunks of this size.
+_DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class FuseCache(object):
+  """A per mount cache of open AFF4 objects and decoded file chunks.
+
+  Open objects are keyed by (urn, fh), so every FUSE file handle keeps its own
+  object while callbacks that come without a handle share one. Chunks are keyed
+  by urn, content version and chunk number, so a newer version of a file never
+  gets served from chunks cached for an older one.
+
+  Objects opened while the cache is invalidated are not kept, so a refresh
+  never leaves an object read before it in the cache.
+  """
+
+  def __init__(self,
+               max_handles=1024,
+               max_handle_age=60,
+               max_chunks=1024,
+               read_ahead=8):
+    """Constructor.
+
+    Args:
+      max_handles: The maximum number of open AFF4 objects to keep.
+      max_handle_age: How many seconds an open AFF4 object is reused before
+        it is reopened from the data store.
+      max_chunks: The maximum number of decoded chunks to keep.
+      read_ahead: How many chunks to prefetch on sequential reads.
+    """
+    self.handles = utils.AgeBasedCache(
+        max_size=max_handles, max_age=max_handle_age)
+    self.chunks = utils.FastStore(max_size=max_chunks)
+    # Offset right after the last read for every (urn, fh), used to detect
+    # sequential access.
+    self.read_positions = utils.FastStore(max_size=max_handles)
+    self.read_ahead = read_ahead
+
+    # Bumped by every invalidation, see Open.
+    self.generation = 0
+    self.lock = threading.RLock()
+
+    self.chunk_hits = 0
+    self.chunk_misses = 0
+    self.chunk_fetches = 0
+
+  def _UrnKey(self, urn):
+    return utils.SmartUnicode(rdfvalue.RDFURN(urn))
+
+  def Open(self, urn, fh=None, token=None):
+    """Returns an open AFF4 object for urn, reusing a cached one if possible."""
+    key = (self._UrnKey(urn), fh)
+    try:
+      return self.handles.Get(key)
+    except KeyError:
+      pass
+
+    generation = self.generation
+    fd = aff4.FACTORY.Open(urn, token=token)
+    with self.lock:
+      # The object may predate a refresh which finished while it was opened.
+      if generation == self.generation:
+        self.handles.Put(key, fd)
+    return fd
+
+  def Release(self, urn, fh):
+    """Drops the object cached for the given file handle."""
+    key = (self._UrnKey(urn), fh)
+    self.handles.ExpireObject(key)
+    self.read_positions.ExpireObject(key)
+
+  def Invalidate(self, urn):
+    """Drops everything cached for urn and all objects below it."""
+    urn = self._UrnKey(urn)
+    prefix = urn.rstrip("/") + "/"
+
+    with self.lock:
+      self.generation += 1
+      for store in [self.handles, self.chunks, self.read_positions]:
+        for key, _ in store:
+          if key[0] == urn or key[0].startswith(prefix):
+            store.ExpireObject(key)
+
+  def Flush(self):
+    """Drops everything from the cache."""
+    with self.lock:
+      self.generation += 1
+      for store in [self.handles, self.chunks, self.read_positions]:
+        store.Flush()
+
+  def _GetVersion(self, fd):
+    """Returns a key identifying the version of the object's content."""
+    content_last = getattr(fd, "content_last", None)
+    return (int(fd.Get(fd.Schema.LAST) or 0), int(content_last or 0))
+
+  def _GetChunks(self, fd, chunk_numbers, chunksize):
+    """Returns a dict of chunk number to data, reading missing chunks.
+
+    Contiguous runs of missing chunks are read with a single call to the
+    object so AFF4 images can fetch them from the data store in one round
+    trip.
+
+    Args:
+      fd: The AFF4 stream to read from.
+      chunk_numbers: A sorted list of chunk numbers to return.
+      chunksize: The size of each chunk.
+
+    Returns:
+      A dict mapping chunk numbers to their contents.
+    """
+    urn = self._UrnKey(fd.urn)
+    version = self._GetVersion(fd)
+
+    result = {}
+    missing = []
+    for chunk_number in chunk_numbers:
+      try:
+        result[chunk_number] = self.chunks.Get((urn, version, chunk_number))
+        self.chunk_hits += 1
+      except KeyError:
+        missing.append(chunk_number)
+        self.chunk_misses += 1
+
+    runs = []
+    for chunk_number in missing:
+      if runs and runs[-1][-1] == chunk_number - 1:
+        runs[-1].append(chunk_number)
+      else:
+        runs.append([chunk_number])
+
+    for run in runs:
+      self.chunk_fetches += 1
+      # Callbacks without a file handle share the object, so the seek and the
+      # read have to happen together.
+      with fd.lock:
+        fd.Seek(run[0] * chunksize)
+        data = fd.Read(len(run) * chunksize)
+      for i, chunk_number in enumerate(run):
+        chunk = data[i * chunksize:(i + 1) * chunksize]
+        self.chunks.Put((urn, version, chunk_number), chunk)
+        result[chunk_number] = chunk
+
+    return result
+
+  def Read(self, fd, length, offset, fh=None):
+    """Reads from an open AFF4 stream through the chunk cache.
+
+    Args:
+      fd: The AFF4 stream to read from.
+      length: How many bytes to read.
+      offset: Offset in bytes from which reading should start.
+      fh: The FUSE file handle the read was issued on.
+
+    Returns:
+      A string with the requested data.
+    """
+    if length <= 0:
+      return ""
+
+    chunksize = getattr(fd, "chunksize", _DEFAULT_CHUNK_SIZE)
+    first_chunk = offset // chunksize
+    last_chunk = (offset + length - 1) // chunksize
+    chunk_numbers = range(first_chunk, last_chunk + 1)
+
+    urn = self._UrnKey(fd.urn)
+    key = (urn, fh)
+    try:
+      sequential = self.read_positions.Get(key) == offset
+    except KeyError:
+      sequential = False
+
+    # When reading sequentially runs past the prefetched data, fetch the next
+    # read_ahead chunks together with the requested ones. Sparse images only
+    # hold what was explicitly fetched from the client, so prefetching makes
+    # no sense for them.
+    if (sequential and self.read_ahead and
+        not isinstance(fd, standard.AFF4SparseImage) and
+        (urn, self._GetVersion(fd), last_chunk + 1) not in self.chunks):
+      size = int(fd.Get(fd.Schema.SIZE) or 0)
+      chunk_numbers.extend(
+          i for i in xrange(last_chunk + 1, last_chunk + 1 + self.read_ahead)
+          if i * chunksize < size)
+
+    chunks = self._GetChunks(fd, chunk_numbers, chunksize)
+    data = "".join(chunks[i] for i in xrange(first_chunk, last_chunk + 1))
+    start = offset - first_chunk * chunksize
+    result = data[start:start + length]
+
+    self.read_positions.Put(key, offset + len(result))
+
+    return result
+
 
 class GRRFuseDatastoreOnly(object):
   """We implement the FUSE methods in this class."""
@@ -102,11 +312,13 @@ class GRRFuseDatastoreOnly(object):
       "/index/client"
   ]
 
-  def __init__(self, root="/", token=None):
+  def __init__(self, root="/", token=None, cache=None):
     self.root = rdfvalue.RDFURN(root)
     self.token = token
     self.default_file_mode = _DEFAULT_MODE_FILE
     self.default_dir_mode = _DEFAULT_MODE_DIRECTORY
+    self.cache = cache or FuseCache()
+    self._fh_counter = itertools.count(1)
 
     try:
       logging.info("Making sure supplied aff4path actually exists....")
@@ -147,9 +359,32 @@ class GRRFuseDatastoreOnly(object):
         "st_uid": 0
     }
 
-  def _IsDir(self, path):
+  def _Open(self, path, fh=None):
+    """Opens the object at path relative to the root through the cache."""
+    return self.cache.Open(self.root.Add(path), fh=fh, token=self.token)
+
+  def _IsDir(self, path, fh=None):
     """True if and only if the path has the directory bit set in its mode."""
-    return stat.S_ISDIR(int(self.getattr(path)["st_mode"]))
+    return stat.S_ISDIR(int(self.Getattr(path, fh=fh)["st_mode"]))
+
+  def Open(self, path, flags=None):
+    """Opens a file, returning a new file handle.
+
+    Args:
+      path: The path to the file to open.
+      flags: The open flags. Not used, the file system is read-only.
+
+    Returns:
+      An integer file handle which FUSE passes to subsequent calls.
+    """
+    fh = next(self._fh_counter)
+    self._Open(path, fh=fh)
+    return fh
+
+  def Release(self, path, fh):
+    """Closes a file handle returned by Open."""
+    self.cache.Release(self.root.Add(path), fh)
+    return 0
 
   # pylint: disable=unused-argument
   def Readdir(self, path, fh=None):
@@ -170,7 +405,7 @@ class GRRFuseDatastoreOnly(object):
     if not self._IsDir(path):
       raise fuse.FuseOSError(errno.ENOTDIR)
 
-    fd = aff4.FACTORY.Open(self.root.Add(path), token=self.token)
+    fd = self._Open(path)
 
     children = fd.ListChildren()
 
@@ -211,14 +446,13 @@ class GRRFuseDatastoreOnly(object):
     else:
       full_path = path
 
-    fd = aff4.FACTORY.Open(full_path, token=self.token)
+    fd = self.cache.Open(full_path, fh=fh, token=self.token)
 
     # The root aff4 path technically doesn't exist in the data store, so
     # it is a special case.
     if full_path == "/":
       return self.MakePartialStat(fd)
 
-    fd = aff4.FACTORY.Open(full_path, token=self.token)
     # Grab the stat according to aff4.
     aff4_stat = fd.Get(fd.Schema.STAT)
 
@@ -254,7 +488,7 @@ class GRRFuseDatastoreOnly(object):
       path: The path to the file to read.
       length: How many bytes to read.
       offset: Offset in bytes from which reading should start.
-      fh: A file handler. Not used.
+      fh: The file handle returned by Open, if any.
 
     Returns:
       A string containing the file contents requested.
@@ -264,10 +498,10 @@ class GRRFuseDatastoreOnly(object):
       object that doesn't support reading.
 
     """
-    if self._IsDir(path):
+    if self._IsDir(path, fh=fh):
       raise fuse.FuseOSError(errno.EISDIR)
 
-    fd = aff4.FACTORY.Open(self.root.Add(path), token=self.token)
+    fd = self._Open(path, fh=fh)
 
     # If the object has Read() and Seek() methods, let's use them.
     if all((hasattr(fd, "Read"), hasattr(fd, "Seek"), callable(fd.Read),
@@ -276,8 +510,7 @@ class GRRFuseDatastoreOnly(object):
       if length is None:
         length = fd.Get(fd.Schema.SIZE)
 
-      fd.Seek(offset)
-      return fd.Read(length)
+      return self.cache.Read(fd, int(length), offset, fh=fh)
     else:
       # If we don't have Read/Seek methods, we probably can't read this object.
       raise fuse.FuseOSError(errno.EIO)
@@ -323,6 +556,8 @@ class GRRFuseDatastoreOnly(object):
   read = utils.Proxy("Read")
   readdir = utils.Proxy("Readdir")
   getattr = utils.Proxy("Getattr")
+  open = utils.Proxy("Open")
+  release = utils.Proxy("Release")
 
 
 class GRRFuse(GRRFuseDatastoreOnly):
@@ -335,7 +570,8 @@ class GRRFuse(GRRFuseDatastoreOnly):
                ignore_cache=False,
                force_sparse_image=False,
                sparse_image_threshold=1024**3,
-               timeout=flow_utils.DEFAULT_TIMEOUT):
+               timeout=flow_utils.DEFAULT_TIMEOUT,
+               cache=None):
     """Create a new FUSE layer at the specified aff4 path.
 
     Args:
@@ -359,6 +595,8 @@ class GRRFuse(GRRFuseDatastoreOnly):
 
       timeout: How long to wait for a client to finish running a flow, maximum.
 
+      cache: The FuseCache to use. A new one is created if not given.
+
     """
 
     self.size_threshold = sparse_image_threshold
@@ -376,7 +614,7 @@ class GRRFuse(GRRFuseDatastoreOnly):
     else:
       self.max_age_before_refresh = max_age_before_refresh
 
-    super(GRRFuse, self).__init__(root, token)
+    super(GRRFuse, self).__init__(root, token, cache=cache)
 
   def DataRefreshRequired(self, path=None, last=None):
     """True if we need to update this path from the client.
@@ -403,7 +641,7 @@ class GRRFuse(GRRFuseDatastoreOnly):
         raise type_info.TypeValueError("Either 'path' or 'last' must"
                                        " be supplied as an argument.")
       else:
-        fd = aff4.FACTORY.Open(self.root.Add(path), token=self.token)
+        fd = self._Open(path)
         # We really care about the last time the stat was updated, so we use
         # this instead of the LAST attribute, which is the last time anything
         # was updated about the object.
@@ -452,6 +690,8 @@ class GRRFuse(GRRFuseDatastoreOnly):
     """
     if self.DataRefreshRequired(path):
       self._RunAndWaitForVFSFileUpdate(path)
+      # The refresh updates both the directory and the stats of its children.
+      self.cache.Invalidate(self.root.Add(path))
 
     return super(GRRFuse, self).Readdir(path, fh=None)
 
@@ -493,9 +733,10 @@ class GRRFuse(GRRFuseDatastoreOnly):
         flow_name="UpdateSparseImageChunks",
         file_urn=fd.urn,
         chunks_to_fetch=missing_chunks)
+    self.cache.Invalidate(fd.urn)
 
   def Read(self, path, length=None, offset=0, fh=None):
-    fd = aff4.FACTORY.Open(self.root.Add(path), token=self.token)
+    fd = self._Open(path, fh=fh)
     last = fd.Get(fd.Schema.CONTENT_LAST)
     client_id = rdf_client.GetClientURNFromPath(path)
 
@@ -519,7 +760,8 @@ class GRRFuse(GRRFuseDatastoreOnly):
             size_threshold=self.size_threshold)
 
         # Reopen the fd in case it's changed to be an AFF4SparseImage
-        fd = aff4.FACTORY.Open(self.root.Add(path), token=self.token)
+        self.cache.Invalidate(self.root.Add(path))
+        fd = self._Open(path, fh=fh)
         # If we are now a sparse image, just download the part we requested
         # from the client.
         if isinstance(fd, standard.AFF4SparseImage):
@@ -530,11 +772,13 @@ class GRRFuse(GRRFuseDatastoreOnly):
               file_urn=self.root.Add(path),
               length=length,
               offset=offset)
+          self.cache.Invalidate(self.root.Add(path))
       else:
         # This was a file we'd seen before that wasn't a sparse image, so update
         # it the usual way.
         if self.DataRefreshRequired(last=last):
           self._RunAndWaitForVFSFileUpdate(path)
+          self.cache.Invalidate(self.root.Add(path))
 
     # Read the file from the datastore as usual.
     return super(GRRFuse, self).Read(path, length, offset, fh)
@@ -607,7 +851,12 @@ inside your virtualenv.
       ignore_cache=flags.FLAGS.ignore_cache,
       force_sparse_image=flags.FLAGS.force_sparse_image,
       sparse_image_threshold=flags.FLAGS.sparse_image_threshold,
-      timeout=flags.FLAGS.timeout)
+      timeout=flags.FLAGS.timeout,
+      cache=FuseCache(
+          max_handles=flags.FLAGS.handle_cache_size,
+          max_handle_age=flags.FLAGS.handle_cache_max_age,
+          max_chunks=flags.FLAGS.chunk_cache_size,
+          read_ahead=flags.FLAGS.read_ahead_chunks))
 
   fuse.FUSE(
       fuse_operation,
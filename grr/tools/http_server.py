@@ -41,7 +41,8 @@ class GRRHTTPServerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
       200: "200 OK",
       404: "404 Not Found",
       406: "406 Not Acceptable",
-      500: "500 Internal Server Error"
+      500: "500 Internal Server Error",
+      503: "503 Service Unavailable"
   }
 
   active_counter_lock = threading.Lock()
@@ -236,6 +237,10 @@ class GRRHTTPServerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
       # client appropriately.
       self.Send("Enrollment required", status=406)
 
+    except front_end.FrontEndOverloadedError:
+      # The client keeps the messages it sent and tries again later.
+      self.Send("Try again later", status=503)
+
     finally:
       with GRRHTTPServerHandler.active_counter_lock:
         GRRHTTPServerHandler.active_counter -= 1
@@ -323,6 +328,9 @@ def main(unused_argv):
     httpd.serve_forever()
   except KeyboardInterrupt:
     print "Caught keyboard interrupt, stopping"
+  finally:
+    # Clients were already answered for the queued well known flow messages.
+    httpd.frontend.Stop()
 
 
 if __name__ == "__main__":
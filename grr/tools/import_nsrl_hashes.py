@@ -1,81 +1,296 @@
 #!/usr/bin/env python
-"""Script for importing NSRL files."""
+"""Script for importing NSRL files.
+
+The NSRL file is parsed as a stream and handed in batches to a pool of writer
+threads, each writing its batch through a single mutation pool. The byte
+offset up to which all batches have been written is saved to a checkpoint
+file, so an interrupted import can be restarted and resumes where it stopped.
+"""
 
 
 import csv
 import os
+import threading
+import time
 
 # pylint: disable=unused-import,g-bad-import-order
 from grr.lib import server_plugins
 # pylint: enable=unused-import,g-bad-import-order
 
+import logging
+
 from grr.lib import aff4
 from grr.lib import data_store
 from grr.lib import flags
 from grr.lib import server_startup
+from grr.lib import threadpool
 from grr.lib import utils
 
 from grr.lib.aff4_objects import filestore
 
 flags.DEFINE_string("filename", "", "File with hashes.")
-flags.DEFINE_integer("start", None, "Start row in the file.")
 
+flags.DEFINE_string("checkpoint_file", None,
+                    "File to keep the import progress in. Defaults to the "
+                    "hashes file name with a .checkpoint suffix. If this file "
+                    "exists, the import resumes from the offset stored in it.")
+
+flags.DEFINE_integer("batch_size", 1000,
+                     "Number of hashes written to the data store at once.")
+
+flags.DEFINE_integer("writers", 10,
+                     "Number of threads writing hashes to the data store.")
+
+
+class Error(Exception):
+  pass
+
+
+class NSRLImportError(Error):
+  """Raised when some hashes could not be written to the data store."""
+
+
+class NSRLParser(object):
+  """Streams hash records from an NSRL file.
+
+  The NSRL file contains one row per (hash, product, operating system) so rows
+  for the same file are consecutive. The parser merges them into a single
+  record with lists of product and operating system codes.
+  """
+
+  # Number of columns in a NSRLFile.txt row.
+  NUM_COLUMNS = 8
+
+  def __init__(self, fd, start_offset=0):
+    """Constructor.
 
-def _ImportRow(store, row, product_code_list, op_system_code_list):
-  sha1 = row[0].lower()
-  md5 = row[1].lower()
-  crc = int(row[2].lower(), 16)
-  file_name = utils.SmartUnicode(row[3])
-  file_size = int(row[4])
-  special_code = row[7]
-  store.AddHash(sha1, md5, crc, file_name, file_size, product_code_list,
-                op_system_code_list, special_code)
+    Args:
+      fd: A file like object open for reading the NSRL file.
+      start_offset: The offset to start parsing at. This has to be the start of
+        a row. Offset 0 means that the header row is skipped.
+    """
+    self.fd = fd
+    self.start_offset = start_offset
 
+    self.rows_parsed = 0
+    self.rows_skipped = 0
+
+  def _ParseRow(self, line):
+    row = next(csv.reader([line], delimiter=",", quotechar="\""), None)
+    if not row or len(row) != self.NUM_COLUMNS:
+      return None
+
+    return row
+
+  def __iter__(self):
+    """Yields (end_offset, record) tuples.
+
+    end_offset is the offset right after the last row of the record, which is a
+    safe point to resume parsing from. record is a tuple with the arguments of
+    NSRLFileStore.AddHash.
+    """
+    self.fd.seek(self.start_offset)
+    if self.start_offset == 0:
+      # Skip the header row.
+      self.fd.readline()
 
-def ImportFile(store, filename, start):
-  """Import hashes from 'filename' into 'store'."""
-  with open(filename, "rb") as fp:
-    reader = csv.reader(fp, delimiter=",", quotechar="\"")
-    i = 0
     current_row = None
     product_code_list = []
     op_system_code_list = []
-    for row in reader:
-      # Skip first row.
-      i += 1
-      if i and i % 5000 == 0:
-        data_store.DB.Flush()
-        print "Imported %d hashes" % i
-      if i > 1:
-        if len(row) != 8:
-          continue
-        try:
-          if i < start:
-            continue
-          if current_row:
-            if current_row[0] == row[0]:
-              # Same hash, add product/system
-              product_code_list.append(int(row[5]))
-              op_system_code_list.append(row[6])
-              continue
-            # Fall through and add current row.
-          else:
-            # First row.
-            current_row = row
-            product_code_list = [int(row[5])]
-            op_system_code_list = [row[6]]
-            continue
-          _ImportRow(store, current_row, product_code_list, op_system_code_list)
-          # Set new hash.
-          current_row = row
-          product_code_list = [int(row[5])]
-          op_system_code_list = [row[6]]
-        except Exception as e:  # pylint: disable=broad-except
-          print "Failed at %d with %s" % (i, str(e))
-          return i - 1
+    offset = self.fd.tell()
+
+    while True:
+      line = self.fd.readline()
+      if not line:
+        break
+
+      row_offset = offset
+      offset = self.fd.tell()
+
+      row = self._ParseRow(line)
+      if row is None:
+        self.rows_skipped += 1
+        continue
+      self.rows_parsed += 1
+
+      if current_row and current_row[0] == row[0]:
+        # Same hash, add product/system.
+        product_code_list.append(int(row[5]))
+        op_system_code_list.append(row[6])
+        continue
+
+      if current_row:
+        yield row_offset, self._MakeRecord(current_row, product_code_list,
+                                           op_system_code_list)
+
+      current_row = row
+      product_code_list = [int(row[5])]
+      op_system_code_list = [row[6]]
+
     if current_row:
-      _ImportRow(store, current_row, product_code_list, op_system_code_list)
-    return i
+      yield offset, self._MakeRecord(current_row, product_code_list,
+                                     op_system_code_list)
+
+  def _MakeRecord(self, row, product_code_list, op_system_code_list):
+    sha1 = row[0].lower()
+    md5 = row[1].lower()
+    crc = int(row[2].lower(), 16)
+    file_name = utils.SmartUnicode(row[3])
+    file_size = int(row[4])
+    special_code = row[7]
+    return (sha1, md5, crc, file_name, file_size, product_code_list,
+            op_system_code_list, special_code)
+
+
+class NSRLImporter(object):
+  """Imports an NSRL file into the NSRLFileStore using a pool of writers."""
+
+  def __init__(self,
+               store,
+               filename,
+               checkpoint_file=None,
+               batch_size=1000,
+               writers=10,
+               token=None):
+    """Constructor.
+
+    Args:
+      store: The NSRLFileStore to import into.
+      filename: The NSRL file to import.
+      checkpoint_file: The file progress is saved to. Defaults to filename
+        with a .checkpoint suffix.
+      batch_size: Number of hashes written through one mutation pool.
+      writers: Number of writer threads.
+      token: The data store token to write with.
+    """
+    self.store = store
+    self.filename = filename
+    self.checkpoint_file = checkpoint_file or filename + ".checkpoint"
+    self.batch_size = batch_size
+    self.writers = writers
+    self.token = token
+
+    self.lock = threading.Lock()
+    # Maps batch numbers of written batches to their end offsets, for batches
+    # that can not be checkpointed yet because an earlier one is still pending.
+    self._written_batches = {}
+    self._next_batch_to_checkpoint = 0
+    self.checkpoint = 0
+    self.errors = []
+
+    self.hashes_written = 0
+    self.batches_written = 0
+    self.start_time = None
+
+  def LoadCheckpoint(self):
+    """Returns the offset stored in the checkpoint file, or 0."""
+    try:
+      with open(self.checkpoint_file, "rb") as fd:
+        return int(fd.read().strip() or 0)
+    except (IOError, ValueError):
+      return 0
+
+  def _SaveCheckpoint(self, offset):
+    tmp_filename = self.checkpoint_file + ".tmp"
+    with open(tmp_filename, "wb") as fd:
+      fd.write(str(offset))
+    os.rename(tmp_filename, self.checkpoint_file)
+
+  def _Batches(self, parser):
+    batch = []
+    end_offset = None
+    for end_offset, record in parser:
+      batch.append(record)
+      if len(batch) >= self.batch_size:
+        yield batch, end_offset
+        batch = []
+
+    if batch:
+      yield batch, end_offset
+
+  def _WriteBatch(self, batch_number, records, end_offset):
+    """Writes a batch of records and advances the checkpoint."""
+    try:
+      with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
+        for record in records:
+          self.store.AddHash(*record, mutation_pool=mutation_pool)
+    except Exception as e:  # pylint: disable=broad-except
+      logging.exception("Failed to write NSRL batch %d: %s", batch_number, e)
+      with self.lock:
+        self.errors.append(e)
+      return
+
+    with self.lock:
+      self.hashes_written += len(records)
+      self.batches_written += 1
+
+      # The checkpoint can only move past batches that have all been written.
+      self._written_batches[batch_number] = end_offset
+      checkpoint = None
+      while self._next_batch_to_checkpoint in self._written_batches:
+        checkpoint = self._written_batches.pop(self._next_batch_to_checkpoint)
+        self._next_batch_to_checkpoint += 1
+
+      if checkpoint is not None:
+        self.checkpoint = checkpoint
+        self._SaveCheckpoint(checkpoint)
+
+  @property
+  def hashes_per_second(self):
+    if not self.start_time:
+      return 0
+    elapsed = time.time() - self.start_time
+    return self.hashes_written / elapsed if elapsed else 0
+
+  def Run(self):
+    """Imports the file, resuming from the checkpoint if there is one.
+
+    Returns:
+      The number of hashes written.
+
+    Raises:
+      NSRLImportError: If some batches could not be written. The checkpoint is
+        left at the last offset up to which everything was written.
+    """
+    self.start_time = time.time()
+    self.checkpoint = start_offset = self.LoadCheckpoint()
+    if start_offset:
+      logging.info("Resuming NSRL import at offset %d", start_offset)
+
+    # Factory() would hand out the pool of an earlier import in this process,
+    # which might have a different number of writers.
+    pool = threadpool.ThreadPool("NSRLImporter", self.writers)
+    pool.Start()
+    try:
+      with open(self.filename, "rb") as fd:
+        parser = NSRLParser(fd, start_offset=start_offset)
+        for batch_number, (batch, end_offset) in enumerate(
+            self._Batches(parser)):
+          if self.errors:
+            break
+
+          pool.AddTask(
+              target=self._WriteBatch,
+              args=(batch_number, batch, end_offset),
+              name="nsrl_batch_%d" % batch_number,
+              inline=False)
+
+          if batch_number and batch_number % 100 == 0:
+            print "Imported %d hashes (%d hashes/s)" % (self.hashes_written,
+                                                        self.hashes_per_second)
+    finally:
+      pool.Stop()
+
+    if self.errors:
+      raise NSRLImportError(
+          "%d batches failed, import stopped at offset %d: %s" %
+          (len(self.errors), self.checkpoint, self.errors[0]))
+
+    # The whole file made it into the data store.
+    if os.path.exists(self.checkpoint_file):
+      os.unlink(self.checkpoint_file)
+
+    return self.hashes_written
 
 
 def main(unused_argv):
@@ -92,9 +307,16 @@ def main(unused_argv):
       filestore.NSRLFileStore,
       mode="rw",
       token=aff4.FACTORY.root_token) as store:
-    imported = ImportFile(store, filename, flags.FLAGS.start)
-    data_store.DB.Flush()
-    print "Imported %d hashes" % imported
+    importer = NSRLImporter(
+        store,
+        filename,
+        checkpoint_file=flags.FLAGS.checkpoint_file,
+        batch_size=flags.FLAGS.batch_size,
+        writers=flags.FLAGS.writers,
+        token=aff4.FACTORY.root_token)
+    imported = importer.Run()
+    print "Imported %d hashes (%d hashes/s)" % (imported,
+                                                importer.hashes_per_second)
 
 
 if __name__ == "__main__":
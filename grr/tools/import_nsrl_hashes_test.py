@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""Tests for the NSRL hash importer."""
+
+
+import hashlib
+import os
+import time
+
+import logging
+
+from grr.lib import aff4
+from grr.lib import flags
+from grr.lib import test_lib
+from grr.lib import utils
+from grr.lib.aff4_objects import filestore
+from grr.tools import import_nsrl_hashes
+
+_HEADER = ("\"SHA-1\",\"MD5\",\"CRC32\",\"FileName\",\"FileSize\","
+           "\"ProductCode\",\"OpSystemCode\",\"SpecialCode\"\r\n")
+
+
+class NSRLImporterTest(test_lib.GRRBaseTest):
+  """Tests importing a synthetic NSRL file."""
+
+  NUM_HASHES = 500
+
+  def setUp(self):
+    super(NSRLImporterTest, self).setUp()
+    self.filename = os.path.join(self.temp_dir, "NSRLFile.txt")
+    self.expected = self._WriteNSRLFile(self.filename, self.NUM_HASHES)
+
+    self.store = aff4.FACTORY.Create(
+        filestore.NSRLFileStore.PATH,
+        filestore.NSRLFileStore,
+        mode="rw",
+        token=self.token)
+
+  def _WriteNSRLFile(self, filename, num_hashes):
+    """Writes an NSRL formatted file, returns {sha1: product codes}."""
+    expected = {}
+    with open(filename, "wb") as fd:
+      fd.write(_HEADER)
+      for i in range(num_hashes):
+        sha1 = hashlib.sha1(str(i)).hexdigest().upper()
+        md5 = hashlib.md5(str(i)).hexdigest().upper()
+        # Every third file is part of several products.
+        product_codes = range(1, 2 + i % 3)
+        for product_code in product_codes:
+          fd.write("\"%s\",\"%s\",\"%08X\",\"file%d.exe\",%d,%d,\"358\",\"\""
+                   "\r\n" % (sha1, md5, i, i, i * 10, product_code))
+        expected[sha1.lower()] = product_codes
+      # Malformed rows are skipped.
+      fd.write("\"not\",\"a\",\"valid row\"\r\n")
+
+    return expected
+
+  def _CheckImported(self):
+    infos = self.store.NSRLInfoForSHA1s(self.expected.keys())
+    self.assertEqual(len(infos), len(self.expected))
+    for sha1, fd in infos.iteritems():
+      nsrl = fd.Get(fd.Schema.NSRL)
+      self.assertEqual(list(nsrl.product_code), self.expected[sha1])
+
+  def testParserMergesRows(self):
+    with open(self.filename, "rb") as fd:
+      parser = import_nsrl_hashes.NSRLParser(fd)
+      records = [record for _, record in parser]
+
+    self.assertEqual(len(records), self.NUM_HASHES)
+    self.assertEqual(parser.rows_skipped, 1)
+    for record in records:
+      self.assertEqual(record[5], self.expected[record[0]])
+
+  def testParserResumesAtRecordOffsets(self):
+    with open(self.filename, "rb") as fd:
+      records = list(import_nsrl_hashes.NSRLParser(fd))
+
+      offset, _ = records[100]
+      resumed = list(import_nsrl_hashes.NSRLParser(fd, start_offset=offset))
+
+    self.assertEqual([r for _, r in resumed], [r for _, r in records[101:]])
+
+  def testImport(self):
+    importer = import_nsrl_hashes.NSRLImporter(
+        self.store, self.filename, batch_size=17, writers=4, token=self.token)
+
+    start = time.time()
+    self.assertEqual(importer.Run(), self.NUM_HASHES)
+    logging.info("Imported %d hashes at %d hashes/s.", self.NUM_HASHES,
+                 self.NUM_HASHES / (time.time() - start))
+
+    self._CheckImported()
+    self.assertEqual(importer.batches_written, self.NUM_HASHES / 17 + 1)
+    self.assertGreater(importer.hashes_per_second, 0)
+    # A finished import leaves no checkpoint behind.
+    self.assertFalse(os.path.exists(importer.checkpoint_file))
+
+  def testInterruptedImportResumes(self):
+    written = []
+    original_add_hash = filestore.NSRLFileStore.AddHash
+
+    def FailingAddHash(store, sha1, *args, **kwargs):
+      if len(written) >= 250:
+        raise IOError("Data store is gone.")
+      written.append(sha1)
+      return original_add_hash(store, sha1, *args, **kwargs)
+
+    importer = import_nsrl_hashes.NSRLImporter(
+        self.store, self.filename, batch_size=10, writers=1, token=self.token)
+    with utils.Stubber(filestore.NSRLFileStore, "AddHash", FailingAddHash):
+      with self.assertRaises(import_nsrl_hashes.NSRLImportError):
+        importer.Run()
+
+    self.assertEqual(len(written), 250)
+    self.assertEqual(importer.LoadCheckpoint(), importer.checkpoint)
+
+    importer = import_nsrl_hashes.NSRLImporter(
+        self.store, self.filename, batch_size=10, writers=4, token=self.token)
+    # Only the hashes after the checkpoint are imported again.
+    self.assertEqual(importer.Run(), self.NUM_HASHES - 250)
+    self._CheckImported()
+
+
+def main(argv):
+  test_lib.GrrTestProgram(argv=argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -17,7 +17,9 @@ from grr.lib import hunts
 from grr.lib import queue_manager
 from grr.lib import queues
 from grr.lib import rdfvalue
+from grr.lib import stats
 from grr.lib import test_lib
+from grr.lib import threadpool
 from grr.lib import utils
 from grr.lib import worker
 from grr.lib.flows.general import administrative
@@ -717,6 +719,9 @@ class GrrWorkerTest(test_lib.FlowTestsBaseclass):
     # Process all messages
     worker_obj.RunOnce()
     worker_obj.thread_pool.Join()
+    # Otherwise the next worker shares the flows with this one until its
+    # membership expires.
+    worker_obj.membership.Leave()
 
     notifications = manager.GetNotificationsByPriority(queues.FLOWS).get(
         notification.priority, [])
@@ -985,6 +990,186 @@ class GrrWorkerTest(test_lib.FlowTestsBaseclass):
       self.assertEqual(notification.first_queued, notification.timestamp)
       self.assertEqual(notification.last_status, 10)
 
+  def _RunWorkersConcurrently(self, session_ids, route=True):
+    """Processes responses for all sessions with three workers at once."""
+    for session_id in session_ids:
+      self.SendResponse(session_id, "Hello")
+
+    workers = [worker.GRRWorker(token=self.token) for _ in range(3)]
+    # Let every worker see all the others before processing anything.
+    for _ in range(2):
+      for worker_obj in workers:
+        worker_obj.membership.last_refresh = None
+        worker_obj.membership.Refresh()
+
+    lock_errors = stats.STATS.GetMetricValue("worker_flow_lock_error")
+    threads = []
+    try:
+      for worker_obj in workers:
+        if not route:
+          worker_obj._IsRoutedHere = lambda _: True
+        threads.append(threading.Thread(target=worker_obj.RunOnce))
+
+      for thread in threads:
+        thread.start()
+      for thread in threads:
+        thread.join()
+      worker.GRRWorker.thread_pool.Join()
+    finally:
+      for worker_obj in workers:
+        worker_obj.membership.Leave()
+
+    return (stats.STATS.GetMetricValue("worker_flow_lock_error") - lock_errors)
+
+  def testAffinityRoutingAvoidsLockContention(self):
+    session_ids = [
+        flow.GRRFlow.StartFlow(
+            client_id=self.client_id,
+            flow_name="WorkerSendingTestFlow2",
+            token=self.token) for _ in range(10)
+    ]
+    unrouted_errors = self._RunWorkersConcurrently(
+        session_ids[:5], route=False)
+    routed_errors = self._RunWorkersConcurrently(session_ids[5:])
+
+    # Every flow was processed exactly once in both cases.
+    self.assertEqual(RESULTS, ["Hello"] * 10)
+    # With routing, each flow is only ever locked by the worker owning it.
+    self.assertEqual(routed_errors, 0)
+    self.assertLessEqual(routed_errors, unrouted_errors)
+
+  def _WaitFor(self, condition):
+    deadline = time.time() + 10
+    while not condition():
+      self.assertLess(time.time(), deadline)
+      time.sleep(0.01)
+
+  def testInteractiveFlowsGetReservedThreadsOfTheWorkerPool(self):
+    running = []
+    release = threading.Event()
+
+    def ProcessMessages(notification, unused_queue_manager):
+      running.append(notification.session_id)
+      release.wait(10)
+      worker_obj.scheduler.Done(notification.session_id)
+
+    with utils.Stubber(worker.GRRWorker, "thread_pool", None):
+      worker_obj = worker.GRRWorker(
+          threadpool_prefix="scheduler-test",
+          threadpool_size=4,
+          token=self.token)
+      pool = worker_obj.thread_pool
+      try:
+        # All the threads the scheduler hands flows to exist up front.
+        self.assertEqual(len(pool), 4)
+        self.assertEqual(worker_obj.scheduler.capacity, 4)
+
+        worker_obj._ProcessMessages = ProcessMessages
+        for i in range(8):
+          worker_obj.scheduler.Add(
+              rdf_flows.GrrNotification(session_id=rdfvalue.SessionID(
+                  "aff4:/hunts/H:1/C.1000000000000000/W:%d" % i)), None)
+
+        # The hunt only gets the threads which are not reserved.
+        self._WaitFor(lambda: len(running) == 3)
+
+        client_flow = rdfvalue.SessionID("aff4:/C.1000000000000000/flows/W:1")
+        worker_obj.scheduler.Add(
+            rdf_flows.GrrNotification(session_id=client_flow), None)
+
+        # The interactive flow runs right away on a reserved thread.
+        self._WaitFor(lambda: len(running) == 4)
+        self.assertEqual(running[-1], client_flow)
+
+        release.set()
+        self._WaitFor(lambda: len(running) == 9)
+        pool.Join()
+      finally:
+        release.set()
+        pool.Stop()
+        threadpool.ThreadPool.POOLS.pop(pool.name, None)
+
+
+  def _ProcessResponse(self, worker_obj, session_id, request_id):
+    self.SendResponse(session_id, "Hello%d" % request_id, request_id=request_id)
+    worker_obj.RunOnce()
+    worker_obj.thread_pool.Join()
+
+  def _CountOpens(self, session_id):
+    opened = []
+    original_open = aff4.FACTORY.Open
+
+    def Open(urn, *args, **kwargs):
+      if urn == session_id:
+        opened.append(urn)
+      return original_open(urn, *args, **kwargs)
+
+    return opened, utils.Stubber(aff4.FACTORY, "Open", Open)
+
+  def testFlowsAreKeptInMemoryBetweenRounds(self):
+    session_id = flow.GRRFlow.StartFlow(
+        client_id=self.client_id,
+        flow_name="WorkerSendingTestFlow",
+        token=self.token)
+    worker_obj = worker.GRRWorker(token=self.token)
+    try:
+      self._ProcessResponse(worker_obj, session_id, 1)
+
+      opened, stubber = self._CountOpens(session_id)
+      with stubber:
+        self._ProcessResponse(worker_obj, session_id, 2)
+        self._ProcessResponse(worker_obj, session_id, 3)
+    finally:
+      worker_obj.membership.Leave()
+
+    self.assertEqual(opened, [])
+    self.assertEqual(RESULTS, ["Hello1", "Hello2", "Hello3"])
+
+    flow_obj = aff4.FACTORY.Open(session_id, token=self.token)
+    self.assertEqual(flow_obj.context.next_processed_request, 4)
+
+  def testFlowsChangedByOthersAreReadAgain(self):
+    session_id = flow.GRRFlow.StartFlow(
+        client_id=self.client_id,
+        flow_name="WorkerSendingTestFlow",
+        token=self.token)
+    worker_obj = worker.GRRWorker(token=self.token)
+    try:
+      self._ProcessResponse(worker_obj, session_id, 1)
+
+      with aff4.FACTORY.OpenWithLock(session_id, token=self.token) as flow_obj:
+        flow_obj.state.changed = True
+
+      opened, stubber = self._CountOpens(session_id)
+      with stubber:
+        self._ProcessResponse(worker_obj, session_id, 2)
+    finally:
+      worker_obj.membership.Leave()
+
+    self.assertEqual(len(opened), 1)
+    flow_obj = aff4.FACTORY.Open(session_id, token=self.token)
+    self.assertTrue(flow_obj.state.changed)
+    self.assertEqual(flow_obj.context.next_processed_request, 3)
+
+  def testKeptFlowsSeeTerminationRequests(self):
+    session_id = flow.GRRFlow.StartFlow(
+        client_id=self.client_id,
+        flow_name="WorkerSendingTestFlow",
+        token=self.token)
+    worker_obj = worker.GRRWorker(token=self.token)
+    try:
+      self._ProcessResponse(worker_obj, session_id, 1)
+
+      flow.GRRFlow.MarkForTermination(
+          session_id, reason="Terminated", sync=True, token=self.token)
+      self._ProcessResponse(worker_obj, session_id, 2)
+    finally:
+      worker_obj.membership.Leave()
+
+    self.assertEqual(RESULTS, ["Hello1"])
+    flow_obj = aff4.FACTORY.Open(session_id, token=self.token)
+    self.assertEqual(flow_obj.context.state, rdf_flows.FlowContext.State.ERROR)
+
 
 def main(_):
   test_lib.main()